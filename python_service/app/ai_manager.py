@@ -1,12 +1,19 @@
 import json
 import os
+import threading
 import time
-import urllib.error
-import urllib.request
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.http_client import HttpStatusError, UpstreamUnavailable, get_http_client
+
+
+class StreamTruncated(RuntimeError):
+    """The upstream ended the event stream without its [DONE] terminator."""
 
 
 class AIModelManager:
+    """Process-wide chat-completions client; requests share the pooled keep-alive HTTP client."""
+
     def __init__(self) -> None:
         self.provider = os.environ.get("AI_PROVIDER", "openai").strip().lower()
         self.api_key = os.environ.get("AI_API_KEY", "")
@@ -14,6 +21,18 @@ class AIModelManager:
         self.model = os.environ.get("AI_MODEL", "gpt-4.1-mini")
         self.timeout = self._get_env_int("AI_TIMEOUT_SECONDS", 20)
         self.temperature = self._get_env_float("AI_TEMPERATURE", 0.2)
+        self.connect_timeout = max(0.1, self._get_env_float("AI_CONNECT_TIMEOUT_SECONDS", 5.0))
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "streams": 0,
+            "errors": 0,
+            "truncated": 0,
+            "ttft_ms_total": 0,
+            "response_ms_total": 0,
+            "last_ttft_ms": None,
+            "last_response_ms": None,
+        }
 
     def _get_env_int(self, name: str, default: int) -> int:
         raw = os.environ.get(name)
@@ -51,16 +70,15 @@ class AIModelManager:
         messages.append({"role": "user", "content": user_prompt})
         return messages
 
-    def generate(
+    def _payload(
         self,
         user_prompt: str,
-        system_prompt: Optional[str] = None,
-        history: Optional[List[Dict[str, Any]]] = None,
-        extra: Optional[Dict[str, Any]] = None,
+        system_prompt: Optional[str],
+        history: Optional[List[Dict[str, Any]]],
+        extra: Optional[Dict[str, Any]],
     ) -> Dict[str, Any]:
         if not self.api_key:
             raise RuntimeError("AI_API_KEY is not configured")
-
         payload: Dict[str, Any] = {
             "model": self.model,
             "messages": self.build_messages(system_prompt, user_prompt, history),
@@ -68,16 +86,95 @@ class AIModelManager:
         }
         if extra:
             payload.update(extra)
+        return payload
+
+    def _record(self, streamed: bool, ttft_ms: Optional[int], response_ms: Optional[int]) -> None:
+        with self._lock:
+            self._stats["streams" if streamed else "requests"] += 1
+            if response_ms is None:
+                self._stats["errors"] += 1
+                return
+            self._stats["ttft_ms_total"] += ttft_ms or 0
+            self._stats["response_ms_total"] += response_ms
+            self._stats["last_ttft_ms"] = ttft_ms
+            self._stats["last_response_ms"] = response_ms
+
+    def generate(
+        self,
+        user_prompt: str,
+        system_prompt: Optional[str] = None,
+        history: Optional[List[Dict[str, Any]]] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        payload = self._payload(user_prompt, system_prompt, history, extra)
+        payload.pop("stream", None)
 
-        start = time.time()
-        response_text = self._request(payload)
-        elapsed_ms = int((time.time() - start) * 1000)
+        start = time.perf_counter()
+        try:
+            response_text = self._request(payload)
+        except Exception:
+            self._record(False, None, None)
+            raise
+        elapsed_ms = int((time.perf_counter() - start) * 1000)
+        self._record(False, elapsed_ms, elapsed_ms)
 
         return {
             "provider": self.provider,
             "model": self.model,
             "content": response_text,
             "response_ms": elapsed_ms,
+            "ttft_ms": elapsed_ms,
+        }
+
+    def stream(
+        self,
+        user_prompt: str,
+        system_prompt: Optional[str] = None,
+        history: Optional[List[Dict[str, Any]]] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Yields {"type": "delta", "content"} per token chunk, then one {"type": "done", ...} summary.
+
+        The summary has truncated=True when the upstream closed the stream without sending [DONE].
+        """
+        payload = self._payload(user_prompt, system_prompt, history, extra)
+        payload["stream"] = True
+
+        start = time.perf_counter()
+        ttft_ms: Optional[int] = None
+        parts: List[str] = []
+        truncated = False
+        try:
+            for delta in self._stream_openai(payload):
+                if ttft_ms is None:
+                    ttft_ms = int((time.perf_counter() - start) * 1000)
+                parts.append(delta)
+                yield {"type": "delta", "content": delta}
+        except StreamTruncated:
+            truncated = True
+            with self._lock:
+                self._stats["truncated"] += 1
+        except BaseException:
+            self._record(True, None, None)
+            raise
+        elapsed_ms = int((time.perf_counter() - start) * 1000)
+        self._record(True, ttft_ms, elapsed_ms)
+
+        yield {
+            "type": "done",
+            "provider": self.provider,
+            "model": self.model,
+            "content": "".join(parts),
+            "response_ms": elapsed_ms,
+            "ttft_ms": ttft_ms if ttft_ms is not None else elapsed_ms,
+            "truncated": truncated,
+        }
+
+    def _headers(self, accept: str) -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            "Accept": accept,
+            "Authorization": f"Bearer {self.api_key}",
         }
 
     def _request(self, payload: Dict[str, Any]) -> str:
@@ -86,23 +183,20 @@ class AIModelManager:
         return self._request_openai(payload)
 
     def _request_openai(self, payload: Dict[str, Any]) -> str:
-        url = f"{self.base_url}/chat/completions"
-        body = json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(
-            url,
-            data=body,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}",
-            },
-            method="POST",
-        )
         try:
-            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
-                data = json.loads(resp.read().decode("utf-8"))
-        except urllib.error.HTTPError as e:
-            raw = e.read().decode("utf-8") if hasattr(e, "read") else ""
-            raise RuntimeError(raw or f"AI request failed: {e.code}")
+            resp = get_http_client().request(
+                "POST",
+                f"{self.base_url}/chat/completions",
+                headers=self._headers("application/json"),
+                body=json.dumps(payload).encode("utf-8"),
+                connect_timeout=self.connect_timeout,
+                read_timeout=self.timeout,
+            )
+            resp.raise_for_status()
+            data = resp.json()
+        except HttpStatusError as e:
+            raw = e.body.decode("utf-8", errors="replace")
+            raise RuntimeError(raw or f"AI request failed: {e.status}")
         except Exception:
             raise RuntimeError("AI request failed")
 
@@ -112,3 +206,75 @@ class AIModelManager:
         msg = choices[0].get("message") if isinstance(choices[0], dict) else None
         content = msg.get("content") if isinstance(msg, dict) else None
         return content or ""
+
+    def _stream_openai(self, payload: Dict[str, Any]) -> Iterator[str]:
+        try:
+            with get_http_client().stream(
+                "POST",
+                f"{self.base_url}/chat/completions",
+                headers=self._headers("text/event-stream"),
+                body=json.dumps(payload).encode("utf-8"),
+                connect_timeout=self.connect_timeout,
+                read_timeout=self.timeout,
+            ) as resp:
+                if resp.status >= 400:
+                    raw = resp.read().decode("utf-8", errors="replace")
+                    raise RuntimeError(raw or f"AI request failed: {resp.status}")
+                data_lines: List[str] = []
+                for line in resp.iter_lines():
+                    if line.startswith("data:"):
+                        data_lines.append(line[5:].lstrip())
+                        continue
+                    if line or not data_lines:
+                        continue
+                    data = "\n".join(data_lines)
+                    data_lines = []
+                    if data == "[DONE]":
+                        resp.read()
+                        return
+                    delta = self._stream_delta(data)
+                    if delta:
+                        yield delta
+                # EOF may also end the last event without its blank separator line.
+                data = "\n".join(data_lines)
+                if data == "[DONE]":
+                    return
+                delta = self._stream_delta(data) if data else ""
+                if delta:
+                    yield delta
+        except UpstreamUnavailable:
+            raise RuntimeError("AI request failed")
+        raise StreamTruncated("AI stream ended before [DONE]")
+
+    def _stream_delta(self, data: str) -> str:
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            return ""
+        choices = chunk.get("choices") if isinstance(chunk, dict) else None
+        if not choices or not isinstance(choices[0], dict):
+            return ""
+        delta = choices[0].get("delta")
+        content = delta.get("content") if isinstance(delta, dict) else None
+        return content or ""
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        completed = stats["requests"] + stats["streams"] - stats["errors"]
+        return {
+            "provider": self.provider,
+            "model": self.model,
+            "base_url": self.base_url,
+            "configured": bool(self.api_key),
+            **stats,
+            "ttft_ms_avg": round(stats["ttft_ms_total"] / completed, 1) if completed else None,
+            "response_ms_avg": round(stats["response_ms_total"] / completed, 1) if completed else None,
+        }
+
+
+_ai_model_manager = AIModelManager()
+
+
+def get_ai_model_manager() -> AIModelManager:
+    return _ai_model_manager
@@ -1,4 +1,7 @@
+import asyncio
 import base64
+import hashlib
+import heapq
 import json
 import hmac
 import math
@@ -7,36 +10,71 @@ import random
 import re
 import threading
 import time
-import urllib.error
 import urllib.parse
-import urllib.request
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional, Set, Tuple
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
 
-from fastapi import APIRouter, File, Form, Header, HTTPException, Query, Request, UploadFile
-from sqlalchemy import create_engine, text
+from fastapi import APIRouter, Depends, File, Form, Header, HTTPException, Query, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import bindparam, text
 from sqlalchemy.engine import Engine
 from sqlalchemy.exc import ProgrammingError
 
-from app.ai_manager import AIModelManager
+from app.ai_manager import get_ai_model_manager
+from app.cache import cached, get_cache
+from app.catalogue import CatalogueSnapshot, get_catalogue_store
+from app.database import (
+    compiled_cache_size,
+    create_database_engine,
+    get_async_database,
+    get_statement_shapes,
+    offload,
+    pool_metrics,
+)
+from app.dormitory_geo import DormitoryGeoSnapshot, get_dormitory_geo_registry, parse_lat_lng
+from app.event_rollups import get_behavior_rollups
+from app.event_stream import get_behavior_event_stream
+from app.exchange_index import get_exchange_match_index
+from app.feed_cache import get_hybrid_feed_cache
+from app.http_client import HttpStatusError, UpstreamUnavailable, get_http_client
+from app.job_scheduler import get_job_scheduler
 from app.recommendation_engine import (
     build_hybrid_recommendations,
     get_related_products,
+    get_scoped_trending_products,
     get_trending_products,
     run_trending_batch_update,
     safe_recommendation_call,
     track_behavior_event,
 )
+from app.product_hydrator import get_product_hydrator
+from app.recommendation_scoring import (
+    columns_from_catalogue,
+    columns_from_rows,
+    rank_candidate_ids,
+    seen_weight,
+    vectorized_scoring_available,
+)
+from app.sanctum import TokenRejected, get_sanctum_validator
+from app.seen_filters import get_seen_item_filters
+from app.similarity_index import get_similarity_index
+from app.user_profiles import event_weight, get_user_profile_store, recency_multiplier, time_decay
 from app.visual_search import VisualSearchEngine
 
-router = APIRouter()
-py_router = APIRouter()
+
+
+async def _label_statement_route(request: Request) -> None:
+    route = request.scope.get("route")
+    get_statement_shapes().set_route(getattr(route, "path", None) or request.url.path)
+
+
+router = APIRouter(dependencies=[Depends(_label_statement_route)])
+py_router = APIRouter(dependencies=[Depends(_label_statement_route)])
 
 _engine: Optional[Engine] = None
 _visual_search_engine: Optional[VisualSearchEngine] = None
-_user_cache_lock = threading.Lock()
-_user_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
-_user_cache_ttl_seconds = 5
 _category_cache_lock = threading.Lock()
 _category_cache_ttl_seconds = 3
 _category_cache: Dict[str, Any] = {
@@ -56,8 +94,10 @@ def _get_env_int(name: str, default: int) -> int:
         return default
 
 
-_user_cache_ttl_seconds = max(1, _get_env_int("PY_USER_CACHE_TTL_SECONDS", _user_cache_ttl_seconds))
 _category_cache_ttl_seconds = max(1, _get_env_int("PY_CATEGORY_CACHE_TTL_SECONDS", _category_cache_ttl_seconds))
+_ai_search_cache_ttl_seconds = max(1, _get_env_int("AI_SEARCH_CACHE_TTL_SECONDS", 60))
+_recommendation_ranking_ttl_seconds = max(1, _get_env_int("RECOMMEND_RANKING_CACHE_TTL_SECONDS", 300))
+_similar_total_ttl_seconds = max(1, _get_env_int("SIMILAR_TOTAL_CACHE_TTL_SECONDS", 300))
 
 
 def _get_db_engine() -> Engine:
@@ -65,22 +105,36 @@ def _get_db_engine() -> Engine:
     if _engine is not None:
         return _engine
 
-    host = os.environ.get("DB_HOST", "127.0.0.1")
-    port = _get_env_int("DB_PORT", 3306)
-    database = os.environ.get("DB_DATABASE", "XiaoWu")
-    username = os.environ.get("DB_USERNAME", "root")
-    password = os.environ.get("DB_PASSWORD", "")
-
-    url = f"mysql+pymysql://{username}:{password}@{host}:{port}/{database}"
-    _engine = create_engine(
-        url,
-        pool_pre_ping=True,
-        pool_recycle=3600,
-        future=True,
-    )
+    _engine = create_database_engine("mysql+pymysql")
     return _engine
 
 
+def _run_with_sync_connection(func, *args, **kwargs):
+    try:
+        conn = _get_db_engine().connect()
+    except Exception:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    with conn:
+        return func(conn, *args, **kwargs)
+
+
+async def _run_db_call(func, *args, **kwargs):
+    # With DB_ASYNC_ENABLED=1 the handler runs under AsyncConnection.run_sync: every query is awaited on the
+    # event loop, and the numpy ranking and Redis round trips inside it go through offload() to the thread
+    # pool. Otherwise the whole handler runs in the thread pool on a pymysql connection.
+    async_engine = get_async_database().engine()
+    if async_engine is None:
+        return await run_in_threadpool(_run_with_sync_connection, func, *args, **kwargs)
+    try:
+        conn = await async_engine.connect().start()
+    except Exception:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    try:
+        return await conn.run_sync(func, *args, **kwargs)
+    finally:
+        await conn.close()
+
+
 def _get_visual_search_engine() -> VisualSearchEngine:
     global _visual_search_engine
     if _visual_search_engine is not None:
@@ -89,65 +143,63 @@ def _get_visual_search_engine() -> VisualSearchEngine:
     return _visual_search_engine
 
 
-def _laravel_get_json(authorization: str, path: str) -> Dict[str, Any]:
-    configured = (os.environ.get("LARAVEL_BASE_URL") or "").strip().rstrip("/")
-    base_candidates = [configured, "http://127.0.0.1:8000", "http://localhost:8000"]
-    tried = set()
-    last_error: Optional[Exception] = None
+def _register_visual_search_jobs(scheduler, engine: Engine) -> None:
+    try:
+        VisualSearchEngine._ensure_dependencies_for_search()
+    except RuntimeError:
+        return
 
-    for base_url in base_candidates:
-        if not base_url or base_url in tried:
-            continue
-        tried.add(base_url)
-        url = f"{base_url}{path}"
-        req = urllib.request.Request(
-            url,
+    def _refresh_snapshot() -> Dict[str, Any]:
+        with engine.connect() as conn:
+            return _get_visual_search_engine().refresh_snapshot(conn)
+
+    scheduler.register(
+        "visual_search_snapshot_refresh",
+        _refresh_snapshot,
+        interval_seconds=max(30, _get_env_int("VISUAL_SEARCH_SNAPSHOT_REFRESH_SECONDS", 300)),
+        timeout_seconds=120,
+        cluster_wide=False,
+        run_on_start=False,
+    )
+
+
+def _laravel_get_json(authorization: str, path: str) -> Dict[str, Any]:
+    try:
+        resp = get_http_client().laravel_request(
+            "GET",
+            path,
             headers={
                 "Accept": "application/json",
                 "Authorization": authorization,
             },
-            method="GET",
         )
-        try:
-            with urllib.request.urlopen(req, timeout=8) as resp:
-                body = resp.read().decode("utf-8")
-                data = json.loads(body) if body else {}
-                return data if isinstance(data, dict) else {}
-        except urllib.error.HTTPError as e:
-            body = e.read().decode("utf-8") if hasattr(e, "read") else ""
-            try:
-                data = json.loads(body) if body else {}
-            except Exception:
-                data = {}
-            raise HTTPException(status_code=e.code, detail=data or {"message": "Laravel request failed"})
-        except Exception as e:
-            last_error = e
-            continue
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=502, detail=f"Could not reach Laravel: {e}")
+    try:
+        data = resp.json()
+    except Exception:
+        data = {}
+    if resp.status >= 400:
+        raise HTTPException(status_code=resp.status, detail=data or {"message": "Laravel request failed"})
+    return data if isinstance(data, dict) else {}
+
 
-    detail = "Could not reach Laravel"
-    if last_error is not None:
-        detail = f"Could not reach Laravel: {type(last_error).__name__}"
-    raise HTTPException(status_code=502, detail=detail)
+def _laravel_user(authorization: str) -> Dict[str, Any]:
+    me = _laravel_get_json(authorization, "/api/user/me")
+    user = me.get("user") if isinstance(me, dict) else None
+    if not isinstance(user, dict) or not user.get("id"):
+        raise HTTPException(status_code=401, detail="Invalid user")
+    return dict(user)
 
 
 def _read_user_from_authorization(authorization: str) -> Dict[str, Any]:
     token = (authorization or "").strip()
     if not token:
         raise HTTPException(status_code=401, detail="Missing Authorization header")
-    now_monotonic = time.monotonic()
-    with _user_cache_lock:
-        cached = _user_cache.get(token)
-        if cached is not None and cached[0] > now_monotonic:
-            return dict(cached[1])
-
-    me = _laravel_get_json(token, "/api/user/me")
-    user = me.get("user") if isinstance(me, dict) else None
-    if not isinstance(user, dict) or not user.get("id"):
-        raise HTTPException(status_code=401, detail="Invalid user")
-    normalized = dict(user)
-    with _user_cache_lock:
-        _user_cache[token] = (now_monotonic + max(1, _user_cache_ttl_seconds), normalized)
-    return normalized
+    try:
+        return get_sanctum_validator().authenticate(token, _get_db_engine, _laravel_user)
+    except TokenRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
 
 def _request_laravel_base_url(request: Optional[Request]) -> Optional[str]:
@@ -159,6 +211,7 @@ def _request_laravel_base_url(request: Optional[Request]) -> Optional[str]:
     return header.strip()
 
 
+@lru_cache(maxsize=8192)
 def _resolve_image_url(image_url: Optional[str], base_url: Optional[str] = None) -> Optional[str]:
     if not isinstance(image_url, str) or image_url.strip() == "":
         return None
@@ -183,48 +236,6 @@ def _resolve_image_url(image_url: Optional[str], base_url: Optional[str] = None)
     return f"{base_url}{normalized}"
 
 
-def _parse_lat_lng_from_location(location: Any) -> Optional[Tuple[float, float]]:
-    if not isinstance(location, str) or not location:
-        return None
-
-    s = location.strip()
-    at = s.find("@")
-    if at != -1:
-        after = s[at + 1 :]
-        parts = after.split(",")
-        if len(parts) >= 2:
-            try:
-                return float(parts[0]), float(parts[1])
-            except Exception:
-                pass
-
-    markers = ["q=", "query=", "ll="]
-    for m in markers:
-        idx = s.find(m)
-        if idx != -1:
-            after = s[idx + len(m) :]
-            after = after.split("&", 1)[0]
-            parts = after.split(",")
-            if len(parts) >= 2:
-                try:
-                    return float(parts[0]), float(parts[1])
-                except Exception:
-                    pass
-
-    return None
-
-
-def _parse_lat_lng(lat: Any, lng: Any, location: Any = None) -> Optional[Tuple[float, float]]:
-    if lat is not None and lng is not None:
-        try:
-            return float(lat), float(lng)
-        except Exception:
-            pass
-    if location is not None:
-        return _parse_lat_lng_from_location(location)
-    return None
-
-
 def _haversine_km(a: Tuple[float, float], b: Tuple[float, float]) -> float:
     lat1, lon1 = a
     lat2, lon2 = b
@@ -241,34 +252,160 @@ def _now_utc_naive() -> datetime:
     return datetime.utcnow()
 
 
-def _event_weight(event_type: str) -> float:
-    t = (event_type or "").strip().lower()
-    if t in {"favorite", "favourite"}:
-        return 3.0
-    if t in {"offer", "make_offer"}:
-        return 4.0
-    if t in {"message", "chat"}:
-        return 2.0
-    if t in {"purchase", "buy", "transaction"}:
-        return 5.0
-    if t in {"view", "click", "search"}:
-        return 1.0
-    return 0.5
+def _empty_behavior_profile() -> Dict[str, Any]:
+    return {
+        "category_scores": {},
+        "seller_scores": {},
+        "category_counts": {},
+        "seen_product_ids": set(),
+        "event_count": 0,
+        "last_event_id": 0,
+        "last_event_at": None,
+    }
+
 
+def _load_behavior_profile(conn, user_id: int, lookback_days: int, now: datetime) -> Dict[str, Any]:
+    profile_store = get_user_profile_store()
+    try:
+        if lookback_days == profile_store.window_days:
+            profile = profile_store.snapshot(conn, user_id, now)
+            profile["seen_product_ids"] = get_seen_item_filters().view(conn, user_id, now)
+            return profile
+        since = now - timedelta(days=lookback_days)
+        history = get_behavior_rollups().user_history(conn, user_id, since, now)
+        raw_since = max(since, history["boundary"]) if history is not None else since
+        events = conn.execute(
+            text(
+                """
+                SELECT id, event_type, product_id, category_id, seller_id, occurred_at
+                FROM behavioral_events
+                WHERE user_id = :user_id AND occurred_at >= :since
+                ORDER BY occurred_at DESC, id DESC
+                LIMIT 500
+                """
+            ),
+            {"user_id": user_id, "since": raw_since},
+        ).mappings().all()
+    except ProgrammingError as e:
+        if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
+            return _empty_behavior_profile()
+        raise
+
+    profile = _empty_behavior_profile()
+    profile["event_count"] = len(events)
+    if len(events) > 0:
+        try:
+            profile["last_event_id"] = int(events[0].get("id") or 0)
+        except Exception:
+            profile["last_event_id"] = 0
+        occurred_at0 = events[0].get("occurred_at")
+        if isinstance(occurred_at0, datetime):
+            profile["last_event_at"] = occurred_at0.isoformat()
+        elif isinstance(occurred_at0, str):
+            profile["last_event_at"] = occurred_at0
+
+    category_scores: Dict[int, float] = profile["category_scores"]
+    seller_scores: Dict[int, float] = profile["seller_scores"]
+    for idx, e in enumerate(events):
+        occurred_at = e.get("occurred_at")
+        if isinstance(occurred_at, str):
+            try:
+                occurred_at = datetime.fromisoformat(occurred_at.replace("Z", "+00:00")).replace(tzinfo=None)
+            except Exception:
+                occurred_at = now
+        if not isinstance(occurred_at, datetime):
+            occurred_at = now
 
-def _time_decay(occurred_at: datetime, now: datetime) -> float:
-    age_days = max(0.0, (now - occurred_at).total_seconds() / 86400.0)
-    return math.exp(-age_days / 14.0)
+        w = event_weight(str(e.get("event_type") or ""))
+        w *= time_decay(occurred_at, now)
+        w *= recency_multiplier(idx)
 
+        cid = e.get("category_id")
+        if cid is not None:
+            try:
+                category_scores[int(cid)] = category_scores.get(int(cid), 0.0) + w
+            except Exception:
+                pass
 
-def _group_by_key(rows: List[Dict[str, Any]], key: str) -> Dict[Any, List[Dict[str, Any]]]:
-    out: Dict[Any, List[Dict[str, Any]]] = {}
-    for r in rows:
-        k = r.get(key)
-        if k is None:
-            continue
-        out.setdefault(k, []).append(r)
-    return out
+        sid = e.get("seller_id")
+        if sid is not None:
+            try:
+                seller_scores[int(sid)] = seller_scores.get(int(sid), 0.0) + w
+            except Exception:
+                pass
+
+    if history is not None:
+        for cid, day, weighted_count in history["category_weights"]:
+            w = weighted_count * time_decay(datetime(day.year, day.month, day.day, 12), now)
+            category_scores[cid] = category_scores.get(cid, 0.0) + w
+        for sid, day, weighted_count in history["seller_weights"]:
+            w = weighted_count * time_decay(datetime(day.year, day.month, day.day, 12), now)
+            seller_scores[sid] = seller_scores.get(sid, 0.0) + w
+        profile["event_count"] += history["event_count"]
+        if not events and history["last_event_id"]:
+            profile["last_event_id"] = history["last_event_id"]
+            last_event_at = history["last_event_at"]
+            profile["last_event_at"] = last_event_at.isoformat() if last_event_at is not None else None
+    profile["seen_product_ids"] = get_seen_item_filters().view(conn, user_id, now)
+    return profile
+
+
+def _expanding_text(sql: str, params: Dict[str, Any]):
+    return text(sql).bindparams(*[bindparam(k, expanding=True) for k, v in params.items() if isinstance(v, list)])
+
+
+def _product_card_payload(
+    card: Dict[str, Any],
+    base_url: Optional[str],
+    with_seller: bool = True,
+    with_images: bool = False,
+    resolve_urls: bool = True,
+) -> Dict[str, Any]:
+    def resolve(url: Optional[str]) -> Optional[str]:
+        return _resolve_image_url(url, base_url) if resolve_urls else url
+
+    imgs = card.get("images") or []
+    first = imgs[0] if imgs else {}
+    payload: Dict[str, Any] = {
+        "id": int(card["id"]),
+        "title": card.get("title"),
+        "price": float(card["price"]) if card.get("price") is not None else None,
+        "currency": (str(card.get("currency") or "CNY")).strip().upper(),
+        "status": card.get("status"),
+        "created_at": card.get("created_at"),
+        "category_id": card.get("category_id"),
+        "condition_level_id": card.get("condition_level_id"),
+        "is_promoted": int(card.get("is_promoted") or 0),
+    }
+    if with_seller:
+        payload["seller"] = {
+            "id": card.get("seller__id"),
+            "username": card.get("seller__username"),
+            "profile_picture": _resolve_image_url(card.get("seller__profile_picture"), base_url),
+        }
+    payload["dormitory"] = {
+        "latitude": card.get("dormitory__latitude"),
+        "longitude": card.get("dormitory__longitude"),
+    }
+    payload["condition_level"] = {
+        "id": card.get("condition_level__id"),
+        "name": card.get("condition_level__name"),
+        "level": card.get("condition_level__level"),
+    }
+    if with_images:
+        payload["image_url"] = resolve(first.get("image_url"))
+    payload["image_thumbnail_url"] = resolve(first.get("image_thumbnail_url"))
+    if with_images:
+        payload["images"] = [
+            {
+                "image_url": resolve(img.get("image_url")),
+                "image_thumbnail_url": resolve(img.get("image_thumbnail_url")),
+                "is_primary": img.get("is_primary"),
+            }
+            for img in imgs
+        ]
+    payload["tags"] = [{"id": t.get("id"), "name": t.get("name")} for t in card.get("tags") or []]
+    return payload
 
 
 def _missing_table_name_from_programming_error(e: ProgrammingError) -> Optional[str]:
@@ -508,34 +645,22 @@ def _serialize_product_row(row: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-def _fetch_tags_for_products(conn, product_ids: List[int]) -> Dict[int, List[str]]:
-    if not product_ids:
-        return {}
-    placeholders = ", ".join([f":pid_{i}" for i in range(len(product_ids))])
-    params = {f"pid_{i}": v for i, v in enumerate(product_ids)}
-    rows = conn.execute(
-        text(
-            f"""
-            SELECT pt.product_id, t.name
-            FROM product_tags pt
-            JOIN tags t ON t.id = pt.tag_id
-            WHERE pt.product_id IN ({placeholders})
-            ORDER BY t.name ASC
-            """
-        ),
-        params,
-    ).mappings().all()
-    tags_by_product: Dict[int, List[str]] = {}
-    for row in rows:
-        pid = row.get("product_id")
-        name = row.get("name")
-        if pid is None or not isinstance(name, str):
-            continue
-        pid_int = int(pid)
-        tags_by_product.setdefault(pid_int, []).append(name)
-    return tags_by_product
+def _search_row_from_card(card: Dict[str, Any]) -> Dict[str, Any]:
+    images = card.get("images") or []
+    return {
+        **card,
+        "condition_level_name": card.get("condition_level__name"),
+        "image_thumbnail_url": images[0].get("image_thumbnail_url") if images else None,
+        "tags": sorted(t["name"] for t in card.get("tags") or [] if isinstance(t.get("name"), str)),
+    }
+
+
+def _hydrate_search_results(conn, product_ids: List[int]) -> List[Dict[str, Any]]:
+    cards = get_product_hydrator().cards(conn, product_ids)
+    return [_serialize_product_row(_search_row_from_card(cards[pid])) for pid in product_ids if pid in cards]
 
 
+@cached("ai_search", ttl_seconds=_ai_search_cache_ttl_seconds, tags=("catalogue",))
 def _search_products(
     conn,
     keyword: str,
@@ -547,20 +672,9 @@ def _search_products(
     rows = conn.execute(
         text(
             f"""
-            SELECT
-                p.id, p.title, p.description, p.price, p.currency, p.status, p.created_at,
-                c.name AS category_name,
-                cl.name AS condition_level_name,
-                (
-                    SELECT pi.image_thumbnail_url
-                    FROM product_images pi
-                    WHERE pi.product_id = p.id
-                    ORDER BY pi.is_primary DESC, pi.id ASC
-                    LIMIT 1
-                ) AS image_thumbnail_url
+            SELECT p.id
             FROM products p
             LEFT JOIN categories c ON c.id = p.category_id
-            LEFT JOIN condition_levels cl ON cl.id = p.condition_level_id
             WHERE p.status = 'available'
               AND p.deleted_at IS NULL
               AND {visibility_sql}
@@ -580,14 +694,10 @@ def _search_products(
             "offset": int(offset),
         },
     ).mappings().all()
-    products = [dict(row) for row in rows]
-    tags_by_product = _fetch_tags_for_products(conn, [int(p["id"]) for p in products])
-    for product in products:
-        pid = int(product["id"])
-        product["tags"] = tags_by_product.get(pid, [])
-    return [_serialize_product_row(product) for product in products]
+    return _hydrate_search_results(conn, [int(row["id"]) for row in rows])
 
 
+@cached("ai_search_price", ttl_seconds=_ai_search_cache_ttl_seconds, tags=("catalogue",))
 def _search_by_price(
     conn,
     max_price: float,
@@ -624,17 +734,7 @@ def _search_by_price(
     rows = conn.execute(
         text(
             f"""
-            SELECT
-                p.id, p.title, p.description, p.price, p.currency, p.status, p.created_at,
-                c.name AS category_name,
-                cl.name AS condition_level_name,
-                (
-                    SELECT pi.image_thumbnail_url
-                    FROM product_images pi
-                    WHERE pi.product_id = p.id
-                    ORDER BY pi.is_primary DESC, pi.id ASC
-                    LIMIT 1
-                ) AS image_thumbnail_url
+            SELECT p.id
             FROM products p
             LEFT JOIN categories c ON c.id = p.category_id
             LEFT JOIN condition_levels cl ON cl.id = p.condition_level_id
@@ -651,14 +751,10 @@ def _search_by_price(
         ),
         params,
     ).mappings().all()
-    products = [dict(row) for row in rows]
-    tags_by_product = _fetch_tags_for_products(conn, [int(p["id"]) for p in products])
-    for product in products:
-        pid = int(product["id"])
-        product["tags"] = tags_by_product.get(pid, [])
-    return [_serialize_product_row(product) for product in products]
+    return _hydrate_search_results(conn, [int(row["id"]) for row in rows])
 
 
+@cached("ai_search_category", ttl_seconds=_ai_search_cache_ttl_seconds, tags=("catalogue",))
 def _search_by_category(
     conn,
     category_name: str,
@@ -669,20 +765,9 @@ def _search_by_category(
     rows = conn.execute(
         text(
             f"""
-            SELECT
-                p.id, p.title, p.description, p.price, p.currency, p.status, p.created_at,
-                c.name AS category_name,
-                cl.name AS condition_level_name,
-                (
-                    SELECT pi.image_thumbnail_url
-                    FROM product_images pi
-                    WHERE pi.product_id = p.id
-                    ORDER BY pi.is_primary DESC, pi.id ASC
-                    LIMIT 1
-                ) AS image_thumbnail_url
+            SELECT p.id
             FROM products p
             JOIN categories c ON c.id = p.category_id
-            LEFT JOIN condition_levels cl ON cl.id = p.condition_level_id
             WHERE p.status = 'available'
               AND p.deleted_at IS NULL
               AND {visibility_sql}
@@ -697,12 +782,7 @@ def _search_by_category(
             "limit": int(limit),
         },
     ).mappings().all()
-    products = [dict(row) for row in rows]
-    tags_by_product = _fetch_tags_for_products(conn, [int(p["id"]) for p in products])
-    for product in products:
-        pid = int(product["id"])
-        product["tags"] = tags_by_product.get(pid, [])
-    return [_serialize_product_row(product) for product in products]
+    return _hydrate_search_results(conn, [int(row["id"]) for row in rows])
 
 
 def _get_product(
@@ -714,20 +794,8 @@ def _get_product(
     row = conn.execute(
         text(
             f"""
-            SELECT
-                p.id, p.title, p.description, p.price, p.currency, p.status, p.created_at,
-                c.name AS category_name,
-                cl.name AS condition_level_name,
-                (
-                    SELECT pi.image_thumbnail_url
-                    FROM product_images pi
-                    WHERE pi.product_id = p.id
-                    ORDER BY pi.is_primary DESC, pi.id ASC
-                    LIMIT 1
-                ) AS image_thumbnail_url
+            SELECT p.id
             FROM products p
-            LEFT JOIN categories c ON c.id = p.category_id
-            LEFT JOIN condition_levels cl ON cl.id = p.condition_level_id
             WHERE p.id = :product_id
               AND p.status = 'available'
               AND p.deleted_at IS NULL
@@ -742,12 +810,23 @@ def _get_product(
     ).mappings().first()
     if row is None:
         return []
-    product = dict(row)
-    tags_by_product = _fetch_tags_for_products(conn, [int(product["id"])])
-    product["tags"] = tags_by_product.get(int(product["id"]), [])
-    return [_serialize_product_row(product)]
+    return _hydrate_search_results(conn, [int(row["id"])])
 
 
+def _indexed_similar_product_ids(product_id: int, user_dormitory_id: Optional[int], limit: int) -> List[int]:
+    neighbour_ids = get_similarity_index().neighbours(product_id)
+    catalogue = get_catalogue_store().snapshot()
+    if not neighbour_ids or catalogue is None:
+        return []
+    positions = catalogue.positions_for_ids(neighbour_ids)
+    dormitory_ids = catalogue.dormitory_ids[positions]
+    visible = dormitory_ids < 0
+    if user_dormitory_id is not None:
+        visible |= dormitory_ids == int(user_dormitory_id)
+    return catalogue.ids[positions[visible]][:limit].tolist()
+
+
+@cached("ai_similar", ttl_seconds=_ai_search_cache_ttl_seconds, tags=("catalogue",))
 def _get_similar_products(
     conn,
     product_id: int,
@@ -755,6 +834,25 @@ def _get_similar_products(
     limit: int = 10,
 ) -> List[Dict[str, Any]]:
     visibility_sql, visibility_params = _visibility_clause(user_dormitory_id)
+    indexed_ids = _indexed_similar_product_ids(product_id, user_dormitory_id, limit)
+    if indexed_ids:
+        rows = conn.execute(
+            text(
+                f"""
+                SELECT p.id
+                FROM products p
+                WHERE p.id IN :product_ids
+                  AND p.status = 'available'
+                  AND p.deleted_at IS NULL
+                  AND {visibility_sql}
+                """
+            ).bindparams(bindparam("product_ids", expanding=True)),
+            {**visibility_params, "product_ids": indexed_ids},
+        ).mappings().all()
+        visible_ids = {int(row["id"]) for row in rows}
+        if len(visible_ids) >= limit:
+            return _hydrate_search_results(conn, [pid for pid in indexed_ids if pid in visible_ids])
+
     target = conn.execute(
         text(
             """
@@ -773,24 +871,13 @@ def _get_similar_products(
         text(
             f"""
             SELECT
-                p.id, p.title, p.description, p.price, p.currency, p.status, p.created_at,
-                c.name AS category_name,
-                cl.name AS condition_level_name,
-                (
-                    SELECT pi.image_thumbnail_url
-                    FROM product_images pi
-                    WHERE pi.product_id = p.id
-                    ORDER BY pi.is_primary DESC, pi.id ASC
-                    LIMIT 1
-                ) AS image_thumbnail_url,
+                p.id,
                 CASE
                     WHEN p.category_id = :target_category_id THEN 3
                     WHEN ABS(p.price - :target_price) <= (:target_price * 0.3) THEN 2
                     ELSE 1
                 END AS similarity_score
             FROM products p
-            LEFT JOIN categories c ON c.id = p.category_id
-            LEFT JOIN condition_levels cl ON cl.id = p.condition_level_id
             WHERE p.id <> :product_id
               AND p.status = 'available'
               AND p.deleted_at IS NULL
@@ -807,12 +894,7 @@ def _get_similar_products(
             "limit": int(limit),
         },
     ).mappings().all()
-    products = [dict(row) for row in rows]
-    tags_by_product = _fetch_tags_for_products(conn, [int(p["id"]) for p in products])
-    for product in products:
-        pid = int(product["id"])
-        product["tags"] = tags_by_product.get(pid, [])
-    return [_serialize_product_row(product) for product in products]
+    return _hydrate_search_results(conn, [int(row["id"]) for row in rows])
 
 
 def _infer_function(
@@ -977,13 +1059,12 @@ def _is_loopback_request(request: Request) -> bool:
     return host in {"127.0.0.1", "::1", "localhost"}
 
 
-@router.post("/ai/respond")
-def ai_respond(
+def _ai_request_context(
     request: Request,
     payload: Dict[str, Any],
-    authorization: Optional[str] = Header(default=None),
-    x_internal_token: Optional[str] = Header(default=None),
-) -> dict:
+    authorization: Optional[str],
+    x_internal_token: Optional[str],
+) -> Tuple[str, str, str, int, Optional[int]]:
     if not authorization:
         raise HTTPException(status_code=401, detail="Missing Authorization header")
 
@@ -1016,7 +1097,10 @@ def ai_respond(
         user_id = int(user["id"])
         user_dormitory_id = user.get("dormitory_id")
         user_dormitory_id = int(user_dormitory_id) if user_dormitory_id else None
+    return message, message_type, interaction_mode, user_id, user_dormitory_id
+
 
+def _ai_function_result(message: str, user_dormitory_id: Optional[int]) -> Tuple[str, Dict[str, Any], List[Dict[str, Any]]]:
     engine = _get_db_engine()
     try:
         conn = engine.connect()
@@ -1025,7 +1109,7 @@ def ai_respond(
 
     with conn:
         try:
-            function_name, function_arguments, products = _infer_function(message, conn, user_dormitory_id)
+            return _infer_function(message, conn, user_dormitory_id)
         except ProgrammingError as e:
             if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
                 table = _missing_table_name_from_programming_error(e) or "unknown"
@@ -1035,6 +1119,68 @@ def ai_respond(
                 )
             raise
 
+
+def _ai_prompts(
+    message: str,
+    function_name: str,
+    function_arguments: Dict[str, Any],
+    products: List[Dict[str, Any]],
+    interaction_mode: str,
+) -> Tuple[str, str]:
+    if function_name == "general_chat" and interaction_mode == "voice_call":
+        return message, (
+            "You are XiaoWu assistant in a real-time voice call. "
+            "Respond in short, clear, natural spoken sentences. "
+            "If user asks for products, ask one focused follow-up question when needed."
+        )
+    if function_name == "general_chat":
+        return message, (
+            "You are XiaoWu assistant. "
+            "Answer normal questions clearly and concisely. "
+            "If the user asks to find products, ask for product details like budget, category, or keywords."
+        )
+    return (
+        f"User request: {message}\n"
+        f"Function executed: {function_name}\n"
+        f"Function arguments: {json.dumps(function_arguments, ensure_ascii=False)}\n"
+        f"Result JSON: {json.dumps(products[:10], ensure_ascii=False)}"
+    ), (
+        "You are a shopping assistant for XiaoWu. "
+        "Use only the provided function result. "
+        "Be concise and helpful."
+        if interaction_mode != "voice_call"
+        else "You are a shopping assistant for XiaoWu in a voice call. "
+        "Use only the provided function result. "
+        "Speak naturally, keep it concise, and mention at most two product highlights."
+    )
+
+
+def _ai_usage(message: str, response_text: str) -> Dict[str, int]:
+    prompt_tokens = max(1, len(message.split()))
+    completion_tokens = max(1, len(response_text.split()))
+    return {
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+    }
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+@router.post("/ai/respond")
+def ai_respond(
+    request: Request,
+    payload: Dict[str, Any],
+    authorization: Optional[str] = Header(default=None),
+    x_internal_token: Optional[str] = Header(default=None),
+) -> dict:
+    message, message_type, interaction_mode, user_id, user_dormitory_id = _ai_request_context(
+        request, payload, authorization, x_internal_token
+    )
+    function_name, function_arguments, products = _ai_function_result(message, user_dormitory_id)
+
     function_calls = [
         {
             "name": function_name,
@@ -1044,46 +1190,11 @@ def ai_respond(
     ]
 
     response_text = _fallback_response_text(message, function_name, products)
-    ai_key = os.environ.get("AI_API_KEY", "").strip()
-    if ai_key:
+    manager = get_ai_model_manager()
+    if manager.api_key.strip():
         try:
-            manager = AIModelManager()
-            if function_name == "general_chat" and interaction_mode == "voice_call":
-                ai_result = manager.generate(
-                    user_prompt=message,
-                    system_prompt=(
-                        "You are XiaoWu assistant in a real-time voice call. "
-                        "Respond in short, clear, natural spoken sentences. "
-                        "If user asks for products, ask one focused follow-up question when needed."
-                    ),
-                )
-            elif function_name == "general_chat":
-                ai_result = manager.generate(
-                    user_prompt=message,
-                    system_prompt=(
-                        "You are XiaoWu assistant. "
-                        "Answer normal questions clearly and concisely. "
-                        "If the user asks to find products, ask for product details like budget, category, or keywords."
-                    ),
-                )
-            else:
-                ai_result = manager.generate(
-                    user_prompt=(
-                        f"User request: {message}\n"
-                        f"Function executed: {function_name}\n"
-                        f"Function arguments: {json.dumps(function_arguments, ensure_ascii=False)}\n"
-                        f"Result JSON: {json.dumps(products[:10], ensure_ascii=False)}"
-                    ),
-                    system_prompt=(
-                        "You are a shopping assistant for XiaoWu. "
-                        "Use only the provided function result. "
-                        "Be concise and helpful."
-                        if interaction_mode != "voice_call"
-                        else "You are a shopping assistant for XiaoWu in a voice call. "
-                        "Use only the provided function result. "
-                        "Speak naturally, keep it concise, and mention at most two product highlights."
-                    ),
-                )
+            user_prompt, system_prompt = _ai_prompts(message, function_name, function_arguments, products, interaction_mode)
+            ai_result = manager.generate(user_prompt=user_prompt, system_prompt=system_prompt)
             ai_content = ai_result.get("content")
             if isinstance(ai_content, str) and ai_content.strip():
                 response_text = ai_content.strip()
@@ -1092,9 +1203,6 @@ def ai_respond(
     elif function_name == "general_chat":
         response_text = "I can help with general questions and product search. Tell me what you need."
 
-    prompt_tokens = max(1, len(message.split()))
-    completion_tokens = max(1, len(response_text.split()))
-    total_tokens = prompt_tokens + completion_tokens
     display_payload = _build_display_payload(function_name, products)
     should_display_products = display_payload is not None
     should_speak = interaction_mode == "voice_call" or message_type == "voice"
@@ -1104,11 +1212,7 @@ def ai_respond(
         "response": response_text,
         "function_calls": function_calls,
         "products": products,
-        "usage": {
-            "total_tokens": total_tokens,
-            "prompt_tokens": prompt_tokens,
-            "completion_tokens": completion_tokens,
-        },
+        "usage": _ai_usage(message, response_text),
         "message_type": message_type,
         "interaction_mode": interaction_mode,
         "voice_response": {
@@ -1121,6 +1225,106 @@ def ai_respond(
     }
 
 
+@router.post("/ai/respond/stream")
+def ai_respond_stream(
+    request: Request,
+    payload: Dict[str, Any],
+    authorization: Optional[str] = Header(default=None),
+    x_internal_token: Optional[str] = Header(default=None),
+) -> StreamingResponse:
+    """Server-sent events: `products` once the function result exists, `response` token deltas, then `usage`."""
+    started = time.perf_counter()
+    message, message_type, interaction_mode, user_id, user_dormitory_id = _ai_request_context(
+        request, payload, authorization, x_internal_token
+    )
+    context_ms = round((time.perf_counter() - started) * 1000, 2)
+    function_name, function_arguments, products = _ai_function_result(message, user_dormitory_id)
+    function_ms = round((time.perf_counter() - started) * 1000 - context_ms, 2)
+
+    def events():
+        display_payload = _build_display_payload(function_name, products)
+        yield _sse_event(
+            "products",
+            {
+                "function_calls": [
+                    {
+                        "name": function_name,
+                        "arguments": function_arguments,
+                        "result_count": len(products),
+                    }
+                ],
+                "products": products,
+                "should_display_products": display_payload is not None,
+                "display_payload": display_payload,
+                "message_type": message_type,
+                "interaction_mode": interaction_mode,
+                "user_id": user_id,
+                "timings": {"context_ms": context_ms, "function_ms": function_ms},
+            },
+        )
+
+        llm_started = time.perf_counter()
+        first_token_ms = None
+        parts: List[str] = []
+        truncated = False
+        manager = get_ai_model_manager()
+        if manager.api_key.strip():
+            try:
+                user_prompt, system_prompt = _ai_prompts(message, function_name, function_arguments, products, interaction_mode)
+                for event in manager.stream(user_prompt=user_prompt, system_prompt=system_prompt):
+                    if event["type"] != "delta":
+                        truncated = bool(event.get("truncated"))
+                        continue
+                    if first_token_ms is None:
+                        first_token_ms = round((time.perf_counter() - started) * 1000, 2)
+                    parts.append(event["content"])
+                    yield _sse_event("response", {"delta": event["content"]})
+            except Exception:
+                truncated = True
+
+        response_text = "".join(parts).strip()
+        used_fallback = not response_text
+        # Deltas already sent cannot be withdrawn; a partial answer is kept but flagged so clients can retry.
+        truncated = truncated and not used_fallback
+        if used_fallback:
+            if manager.api_key.strip() or function_name != "general_chat":
+                response_text = _fallback_response_text(message, function_name, products)
+            else:
+                response_text = "I can help with general questions and product search. Tell me what you need."
+            first_token_ms = round((time.perf_counter() - started) * 1000, 2)
+            yield _sse_event("response", {"delta": response_text})
+
+        should_speak = interaction_mode == "voice_call" or message_type == "voice"
+        voice_text = _build_voice_response_text(response_text, function_name, products) if should_speak else response_text
+        yield _sse_event(
+            "usage",
+            {
+                "response": response_text,
+                "usage": _ai_usage(message, response_text),
+                "voice_response": {
+                    "text": voice_text,
+                    "should_speak": should_speak,
+                },
+                "fallback": used_fallback,
+                "truncated": truncated,
+                "error": "AI response was interrupted" if truncated else None,
+                "timings": {
+                    "context_ms": context_ms,
+                    "function_ms": function_ms,
+                    "first_token_ms": first_token_ms,
+                    "llm_ms": round((time.perf_counter() - llm_started) * 1000, 2),
+                    "total_ms": round((time.perf_counter() - started) * 1000, 2),
+                },
+            },
+        )
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 
 @router.get("/ping")
 def ping() -> dict:
@@ -1180,7 +1384,7 @@ def track_event(payload: Dict[str, Any]) -> dict:
     engine = _get_db_engine()
     try:
         with engine.begin() as conn:
-            event_payload = safe_recommendation_call(
+            event_payload, stream_event = safe_recommendation_call(
                 track_behavior_event,
                 conn,
                 user_id=user_id,
@@ -1188,13 +1392,21 @@ def track_event(payload: Dict[str, Any]) -> dict:
                 event_type=event_type_raw,
                 event_at=event_at,
             )
-            updated_feed = safe_recommendation_call(
+        # Listeners (profiles, co-occurrence, feed cache, seen filters) only see committed events.
+        get_behavior_event_stream().publish(stream_event)
+        updated_feed = get_hybrid_feed_cache().get_or_build(
+            engine,
+            user_id,
+            product_id,
+            30,
+            lambda feed_conn: safe_recommendation_call(
                 build_hybrid_recommendations,
-                conn,
+                feed_conn,
                 user_id=user_id,
                 last_interacted_product_id=product_id,
                 limit=30,
-            )
+            ),
+        )
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except RuntimeError as e:
@@ -1210,11 +1422,31 @@ def track_event(payload: Dict[str, Any]) -> dict:
 
 
 @router.get("/trending-products")
-def trending_products(limit: int = Query(default=20, ge=1, le=100)) -> dict:
-    engine = _get_db_engine()
+async def trending_products(
+    limit: int = Query(default=20, ge=1, le=100),
+    dormitory_id: Optional[int] = Query(default=None, ge=1),
+    university_id: Optional[int] = Query(default=None, ge=1),
+    category_id: Optional[int] = Query(default=None, ge=1),
+) -> dict:
+    scopes = [
+        (scope, scope_id)
+        for scope, scope_id in (("dormitory", dormitory_id), ("university", university_id), ("category", category_id))
+        if scope_id is not None
+    ]
+    if len(scopes) > 1:
+        raise HTTPException(status_code=422, detail="Only one of dormitory_id, university_id or category_id may be given")
+
     try:
-        with engine.connect() as conn:
-            products = safe_recommendation_call(get_trending_products, conn, limit=limit)
+        if scopes:
+            products = await _run_db_call(
+                lambda conn: safe_recommendation_call(
+                    get_scoped_trending_products, conn, scope=scopes[0][0], scope_id=scopes[0][1], limit=limit
+                )
+            )
+        else:
+            products = await _run_db_call(
+                lambda conn: safe_recommendation_call(get_trending_products, conn, limit=limit)
+            )
     except RuntimeError as e:
         raise HTTPException(status_code=503, detail=str(e))
     except Exception:
@@ -1222,16 +1454,17 @@ def trending_products(limit: int = Query(default=20, ge=1, le=100)) -> dict:
 
     return {
         "message": "Trending products retrieved successfully",
+        "scope": {"type": scopes[0][0], "id": scopes[0][1]} if scopes else None,
         "products": products,
     }
 
 
 @router.get("/related-products/{product_id}")
-def related_products(product_id: int, limit: int = Query(default=20, ge=1, le=100)) -> dict:
-    engine = _get_db_engine()
+async def related_products(product_id: int, limit: int = Query(default=20, ge=1, le=100)) -> dict:
     try:
-        with engine.connect() as conn:
-            products = safe_recommendation_call(get_related_products, conn, product_id=product_id, limit=limit)
+        products = await _run_db_call(
+            lambda conn: safe_recommendation_call(get_related_products, conn, product_id=product_id, limit=limit)
+        )
     except RuntimeError as e:
         raise HTTPException(status_code=503, detail=str(e))
     except Exception:
@@ -1245,20 +1478,26 @@ def related_products(product_id: int, limit: int = Query(default=20, ge=1, le=10
 
 
 @router.get("/recommendations/{user_id}")
-def hybrid_recommendations(
+async def hybrid_recommendations(
     user_id: int,
     limit: int = Query(default=30, ge=3, le=100),
     last_product_id: Optional[int] = Query(default=None),
 ) -> dict:
-    engine = _get_db_engine()
+    def _build(conn) -> Dict[str, Any]:
+        return safe_recommendation_call(
+            build_hybrid_recommendations,
+            conn,
+            user_id=user_id,
+            last_interacted_product_id=last_product_id,
+            limit=limit,
+        )
+
+    feed_cache = get_hybrid_feed_cache()
     try:
-        with engine.connect() as conn:
-            feed = safe_recommendation_call(
-                build_hybrid_recommendations,
-                conn,
-                user_id=user_id,
-                last_interacted_product_id=last_product_id,
-                limit=limit,
+        feed = feed_cache.peek(user_id, last_product_id, limit)
+        if feed is None:
+            feed = await _run_db_call(
+                lambda conn: feed_cache.get_or_build(_get_db_engine(), user_id, last_product_id, limit, _build, conn=conn)
             )
     except RuntimeError as e:
         raise HTTPException(status_code=503, detail=str(e))
@@ -1278,77 +1517,185 @@ def recompute_trending_scores() -> dict:
     return {"message": "Trending scores recomputed"}
 
 
-@py_router.post("/py/api/internal/visual-search/index")
-async def internal_visual_search_index(
+@py_router.get("/py/api/internal/jobs")
+def internal_list_jobs(
     request: Request,
-    payload: Dict[str, Any],
     x_internal_token: Optional[str] = Header(default=None),
 ) -> dict:
     if not (_has_valid_internal_token(x_internal_token) or _is_loopback_request(request)):
         raise HTTPException(status_code=401, detail="Unauthorized internal request")
 
-    product_id_raw = payload.get("product_id")
-    product_image_id_raw = payload.get("product_image_id")
-    image_url_raw = payload.get("image_url")
-    image_bytes_base64_raw = payload.get("image_bytes_base64")
-    has_image_url = isinstance(image_url_raw, str) and image_url_raw.strip() != ""
-    has_image_bytes = isinstance(image_bytes_base64_raw, str) and image_bytes_base64_raw.strip() != ""
-    if product_id_raw is None or product_image_id_raw is None or (not has_image_url and not has_image_bytes):
-        raise HTTPException(status_code=422, detail="product_id, product_image_id, and image_url or image_bytes_base64 are required")
-
-    try:
-        product_id = int(product_id_raw)
-        product_image_id = int(product_image_id_raw)
-    except Exception:
-        raise HTTPException(status_code=422, detail="product_id and product_image_id must be integers")
-
-    engine = _get_db_engine()
-    try:
-        conn = engine.connect()
-    except Exception:
-        raise HTTPException(status_code=503, detail="Database unavailable")
-
-    visual_engine = _get_visual_search_engine()
-    with conn:
-        try:
-            if has_image_bytes:
-                try:
-                    image_bytes = base64.b64decode(str(image_bytes_base64_raw), validate=True)
-                except Exception:
-                    raise HTTPException(status_code=422, detail="Invalid image_bytes_base64")
-                if len(image_bytes) == 0:
-                    raise HTTPException(status_code=422, detail="image_bytes_base64 is empty")
-                result = visual_engine.index_single_image_bytes(conn, product_id, product_image_id, image_bytes)
-            else:
-                result = visual_engine.index_single_image(conn, product_id, product_image_id, str(image_url_raw).strip())
-            conn.commit()
-        except ProgrammingError as e:
-            if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
-                table = visual_engine.missing_table_name_from_programming_error(e) or "unknown"
-                raise HTTPException(
-                    status_code=503,
-                    detail=f"Database '{os.environ.get('DB_DATABASE', 'XiaoWu')}' missing table: {table}. Check DB_* env or run Laravel migrations.",
-                )
-            raise
-        except ValueError as e:
-            raise HTTPException(status_code=422, detail=str(e))
-        except RuntimeError as e:
-            raise HTTPException(status_code=503, detail=str(e))
-        except urllib.error.HTTPError as e:
-            body = e.read().decode("utf-8") if hasattr(e, "read") else ""
-            raise HTTPException(status_code=422, detail=body or "Could not fetch image")
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Indexing failed: {type(e).__name__}")
-
     return {
-        "message": "Image embedding indexed successfully",
-        "indexed": result,
+        "message": "Scheduled jobs retrieved successfully",
+        "scheduler": get_job_scheduler().status(),
     }
 
 
-@py_router.post("/py/api/internal/visual-search/refresh")
+@py_router.post("/py/api/internal/jobs/{job_name}/run")
+async def internal_run_job(
+    job_name: str,
+    request: Request,
+    wait_seconds: float = Query(default=0.0, ge=0.0, le=300.0),
+    x_internal_token: Optional[str] = Header(default=None),
+) -> dict:
+    if not (_has_valid_internal_token(x_internal_token) or _is_loopback_request(request)):
+        raise HTTPException(status_code=401, detail="Unauthorized internal request")
+
+    scheduler = get_job_scheduler()
+    try:
+        job = scheduler.trigger(job_name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not job.get("launched"):
+        raise HTTPException(status_code=409, detail="Job is already running")
+
+    # The job runs on its own thread; poll on the event loop rather than parking a threadpool thread.
+    deadline = time.monotonic() + min(wait_seconds, float(job["timeout_seconds"]))
+    while job["running"] and time.monotonic() < deadline:
+        await asyncio.sleep(min(0.2, max(0.0, deadline - time.monotonic())))
+        job = {**scheduler.job_status(job_name), "launched": True}
+
+    return {
+        "message": "Job triggered successfully",
+        "job": job,
+    }
+
+
+@py_router.get("/py/api/internal/feed-cache")
+def internal_feed_cache_stats(
+    request: Request,
+    x_internal_token: Optional[str] = Header(default=None),
+) -> dict:
+    if not (_has_valid_internal_token(x_internal_token) or _is_loopback_request(request)):
+        raise HTTPException(status_code=401, detail="Unauthorized internal request")
+
+    return {
+        "message": "Feed cache stats retrieved successfully",
+        "feed_cache": get_hybrid_feed_cache().stats(),
+        "seen_filters": get_seen_item_filters().stats(),
+    }
+
+
+@py_router.get("/py/api/internal/db-pool")
+def internal_db_pool_stats(
+    request: Request,
+    x_internal_token: Optional[str] = Header(default=None),
+) -> dict:
+    if not (_has_valid_internal_token(x_internal_token) or _is_loopback_request(request)):
+        raise HTTPException(status_code=401, detail="Unauthorized internal request")
+
+    return {
+        "message": "Database pool metrics retrieved successfully",
+        "pools": pool_metrics(),
+        "async_database": get_async_database().stats(),
+        "compiled_cache_size": compiled_cache_size(),
+        "statement_shapes": get_statement_shapes().stats(),
+    }
+
+
+@py_router.get("/py/api/internal/http-client")
+def internal_http_client_stats(
+    request: Request,
+    x_internal_token: Optional[str] = Header(default=None),
+) -> dict:
+    if not (_has_valid_internal_token(x_internal_token) or _is_loopback_request(request)):
+        raise HTTPException(status_code=401, detail="Unauthorized internal request")
+
+    return {
+        "message": "HTTP client stats retrieved successfully",
+        "http_client": get_http_client().stats(),
+        "ai_model": get_ai_model_manager().stats(),
+    }
+
+
+@py_router.get("/py/api/internal/cache")
+def internal_cache_stats(
+    request: Request,
+    x_internal_token: Optional[str] = Header(default=None),
+) -> dict:
+    if not (_has_valid_internal_token(x_internal_token) or _is_loopback_request(request)):
+        raise HTTPException(status_code=401, detail="Unauthorized internal request")
+
+    return {
+        "message": "Cache stats retrieved successfully",
+        "cache": get_cache().stats(),
+        "product_cards": get_product_hydrator().stats(),
+        "auth": get_sanctum_validator().stats(),
+    }
+
+
+@py_router.post("/py/api/internal/visual-search/index")
+async def internal_visual_search_index(
+    request: Request,
+    payload: Dict[str, Any],
+    x_internal_token: Optional[str] = Header(default=None),
+) -> dict:
+    if not (_has_valid_internal_token(x_internal_token) or _is_loopback_request(request)):
+        raise HTTPException(status_code=401, detail="Unauthorized internal request")
+
+    product_id_raw = payload.get("product_id")
+    product_image_id_raw = payload.get("product_image_id")
+    image_url_raw = payload.get("image_url")
+    image_bytes_base64_raw = payload.get("image_bytes_base64")
+    has_image_url = isinstance(image_url_raw, str) and image_url_raw.strip() != ""
+    has_image_bytes = isinstance(image_bytes_base64_raw, str) and image_bytes_base64_raw.strip() != ""
+    if product_id_raw is None or product_image_id_raw is None or (not has_image_url and not has_image_bytes):
+        raise HTTPException(status_code=422, detail="product_id, product_image_id, and image_url or image_bytes_base64 are required")
+
+    try:
+        product_id = int(product_id_raw)
+        product_image_id = int(product_image_id_raw)
+    except Exception:
+        raise HTTPException(status_code=422, detail="product_id and product_image_id must be integers")
+
+    engine = _get_db_engine()
+    try:
+        conn = engine.connect()
+    except Exception:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+
+    visual_engine = _get_visual_search_engine()
+    with conn:
+        try:
+            if has_image_bytes:
+                try:
+                    image_bytes = base64.b64decode(str(image_bytes_base64_raw), validate=True)
+                except Exception:
+                    raise HTTPException(status_code=422, detail="Invalid image_bytes_base64")
+                if len(image_bytes) == 0:
+                    raise HTTPException(status_code=422, detail="image_bytes_base64 is empty")
+                result = visual_engine.index_single_image_bytes(conn, product_id, product_image_id, image_bytes)
+            else:
+                result = visual_engine.index_single_image(conn, product_id, product_image_id, str(image_url_raw).strip())
+            conn.commit()
+        except ProgrammingError as e:
+            if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
+                table = visual_engine.missing_table_name_from_programming_error(e) or "unknown"
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"Database '{os.environ.get('DB_DATABASE', 'XiaoWu')}' missing table: {table}. Check DB_* env or run Laravel migrations.",
+                )
+            raise
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except RuntimeError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except HttpStatusError as e:
+            raise HTTPException(status_code=422, detail=e.body.decode("utf-8", errors="replace") or "Could not fetch image")
+        except UpstreamUnavailable as e:
+            raise HTTPException(status_code=502, detail=f"Could not fetch image: {e}")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Indexing failed: {type(e).__name__}")
+
+    return {
+        "message": "Image embedding indexed successfully",
+        "indexed": result,
+    }
+
+
+@py_router.post("/py/api/internal/visual-search/refresh")
 async def internal_visual_search_refresh(
     request: Request,
     x_internal_token: Optional[str] = Header(default=None),
@@ -1469,8 +1816,240 @@ async def visual_search(
     }
 
 
+def _recommendation_ranking_token(*parts: Any) -> str:
+    raw = ":".join("" if part is None else str(part) for part in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def _recommendation_versions(user_id: int) -> Tuple[Optional[int], Optional[str]]:
+    # In-memory markers that every worker derives from the same rows, so a continuation page can be
+    # validated without re-reading the behaviour profile or the catalogue.
+    return get_behavior_event_stream().user_head(user_id), get_hybrid_feed_cache().catalogue_marker
+
+
+def _cached_recommendation_ranking(
+    namespace: str, token: str, continuation_token: Optional[str]
+) -> Optional[Dict[str, Any]]:
+    if not continuation_token or not hmac.compare_digest(continuation_token, token):
+        return None
+    found, value = get_cache().get(namespace, token)
+    if not found or not isinstance(value, dict) or not isinstance(value.get("ranked_ids"), list):
+        return None
+    return {**value, "ranked_ids": [int(pid) for pid in value["ranked_ids"]]}
+
+
+def _store_recommendation_ranking(namespace: str, token: str, ranking: Dict[str, Any]) -> None:
+    # Untagged: the token already covers the catalogue marker, so the periodic catalogue bump must not evict it.
+    get_cache().set(namespace, token, ranking, _recommendation_ranking_ttl_seconds)
+
+
+def _fill_recommendation_page(
+    page_ids: List[int],
+    ranked_ids: List[int],
+    page_size: int,
+    load: Callable[[List[int]], Dict[int, Any]],
+) -> Tuple[List[int], Dict[int, Any]]:
+    """Hydrates the page, backfilling ids that were sold or deleted since ranking from the ranked tail."""
+    loaded = load(page_ids)
+    kept = [pid for pid in page_ids if pid in loaded]
+    taken = set(page_ids)
+    spare = [pid for pid in ranked_ids if pid not in taken]
+    position = 0
+    for _ in range(3):
+        missing = page_size - len(kept)
+        if missing <= 0 or position >= len(spare):
+            break
+        batch = spare[position : position + missing * 2]
+        position += len(batch)
+        more = load(batch)
+        loaded.update(more)
+        kept.extend([pid for pid in batch if pid in more][:missing])
+    return kept, loaded
+
+
+def _load_buyer_dormitory(
+    conn,
+    geo: Optional[DormitoryGeoSnapshot],
+    buyer_dormitory_id: Optional[int],
+) -> Tuple[Optional[int], Optional[Tuple[float, float]]]:
+    if buyer_dormitory_id is None:
+        return None, None
+    if geo is not None and geo.contains(buyer_dormitory_id):
+        return geo.university_id(buyer_dormitory_id), geo.coords(buyer_dormitory_id)
+
+    try:
+        buyer_dorm = conn.execute(
+            text(
+                """
+                SELECT id, latitude, longitude, location, university_id
+                FROM dormitories
+                WHERE id = :id
+                LIMIT 1
+                """
+            ),
+            {"id": buyer_dormitory_id},
+        ).mappings().first()
+    except ProgrammingError as e:
+        if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
+            table = _missing_table_name_from_programming_error(e) or "unknown"
+            raise HTTPException(
+                status_code=503,
+                detail=f"Database '{os.environ.get('DB_DATABASE', 'XiaoWu')}' missing table: {table}. Check DB_* env or run Laravel migrations.",
+            )
+        raise
+    if buyer_dorm is None:
+        return None, None
+    buyer_university_id = buyer_dorm.get("university_id")
+    buyer_university_id = int(buyer_university_id) if buyer_university_id is not None else None
+    return buyer_university_id, parse_lat_lng(
+        buyer_dorm.get("latitude"),
+        buyer_dorm.get("longitude"),
+        buyer_dorm.get("location"),
+    )
+
+
+def _catalogue_candidate_positions(
+    catalogue: CatalogueSnapshot,
+    top_categories: List[int],
+    top_sellers: List[int],
+    buyer_dormitory_id: Optional[int],
+    buyer_university_id: Optional[int],
+    limit: int = 600,
+    min_matches: int = 200,
+    nearby_dormitory_ids: Optional[List[int]] = None,
+) -> List[int]:
+    nearby = None
+    if nearby_dormitory_ids is not None:
+        nearby = catalogue.mask_in("dormitory_ids", nearby_dormitory_ids)
+        nearby |= catalogue.mask_in("seller_dormitory_ids", nearby_dormitory_ids)
+
+    promoted = catalogue.promoted_mask()
+    if top_categories or top_sellers:
+        mask = catalogue.mask_in("category_ids", top_categories) | catalogue.mask_in("seller_ids", top_sellers) | promoted
+        mask |= catalogue.mask_equal("dormitory_ids", buyer_dormitory_id)
+        mask |= catalogue.mask_equal("university_ids", buyer_university_id)
+        if nearby is not None:
+            mask &= nearby
+        positions = catalogue.recent_positions(mask, limit).tolist()
+    else:
+        positions = catalogue.recent_positions(nearby, limit).tolist()
+
+    if len(positions) < min_matches:
+        known = set(positions)
+        for pos in catalogue.recent_positions(nearby, limit).tolist():
+            if pos not in known:
+                positions.append(pos)
+                known.add(pos)
+            if len(positions) >= limit:
+                break
+
+    return positions
+
+
+def _rank_candidate_rows_reference(
+    rows: List[Dict[str, Any]],
+    category_scores: Dict[int, float],
+    seller_scores: Dict[int, float],
+    seen_product_ids: Any,
+    now: datetime,
+    low_behavior: bool,
+    buyer_dormitory_id: Optional[int],
+    buyer_university_id: Optional[int],
+    buyer_coords: Optional[Tuple[float, float]],
+) -> List[Dict[str, Any]]:
+    scored: List[Tuple[float, Dict[str, Any]]] = []
+    for r in rows:
+        score = 0.0
+
+        cid = r.get("category_id")
+        if cid is not None:
+            try:
+                score += 1.5 * category_scores.get(int(cid), 0.0)
+            except Exception:
+                pass
+
+        sid = r.get("seller_id")
+        if sid is not None:
+            try:
+                score += 1.0 * seller_scores.get(int(sid), 0.0)
+            except Exception:
+                pass
+
+        score += 6.0 * seen_weight(seen_product_ids, r.get("id"))
+
+        if int(r.get("is_promoted") or 0) == 1:
+            score += 3.0
+
+        created_at = r.get("created_at")
+        if isinstance(created_at, str):
+            try:
+                created_at = datetime.fromisoformat(created_at.replace("Z", "+00:00")).replace(tzinfo=None)
+            except Exception:
+                created_at = None
+        if isinstance(created_at, datetime):
+            age_days = max(0.0, (now - created_at).total_seconds() / 86400.0)
+            score += 5.0 * math.exp(-age_days / 7.0)
+
+        if buyer_dormitory_id is not None:
+            if int(r.get("dormitory_id") or 0) == buyer_dormitory_id:
+                score += 50.0
+            else:
+                uni = r.get("dormitory__university_id")
+                uni = int(uni) if uni is not None else None
+                if buyer_university_id is not None and uni == buyer_university_id:
+                    score += 20.0
+
+        product_coords = parse_lat_lng(
+            r.get("dormitory__latitude"),
+            r.get("dormitory__longitude"),
+            r.get("dormitory__location"),
+        )
+        distance_km: Optional[float] = None
+        if buyer_coords is not None and product_coords is not None:
+            distance_km = _haversine_km(buyer_coords, product_coords)
+            score += 30.0 * math.exp(-distance_km / 2.0)
+
+        r_dict = dict(r)
+        r_dict["_distance_km"] = distance_km
+        r_dict["_score"] = score
+        scored.append((score, r_dict))
+
+    if low_behavior:
+        def _local_rank_key(item: Tuple[float, Dict[str, Any]]) -> Tuple[int, float, float]:
+            r = item[1]
+            priority = 2
+            if buyer_dormitory_id is not None and int(r.get("dormitory_id") or 0) == buyer_dormitory_id:
+                priority = 0
+            else:
+                uni = r.get("dormitory__university_id")
+                uni = int(uni) if uni is not None else None
+                if buyer_university_id is not None and uni == buyer_university_id:
+                    priority = 1
+
+            distance = r.get("_distance_km")
+            distance_sort = float(distance) if distance is not None else 1.0e9
+
+            created_at = r.get("created_at")
+            created_ts = 0.0
+            if isinstance(created_at, str):
+                try:
+                    created_at = datetime.fromisoformat(created_at.replace("Z", "+00:00")).replace(tzinfo=None)
+                except Exception:
+                    created_at = None
+            if isinstance(created_at, datetime):
+                created_ts = created_at.timestamp()
+
+            return priority, distance_sort, -created_ts
+
+        ranked = [r for _, r in sorted(scored, key=_local_rank_key)]
+    else:
+        scored.sort(key=lambda x: (x[0], x[1].get("created_at") or ""), reverse=True)
+        ranked = [r for _, r in scored]
+    return ranked
+
+
 @py_router.get("/py/api/user/recommendations/products")
-def recommend_products(
+async def recommend_products(
     request: Request,
     authorization: Optional[str] = Header(default=None),
     page: int = Query(default=1, ge=1),
@@ -1478,220 +2057,154 @@ def recommend_products(
     random_count: int = Query(default=3, ge=0, le=50),
     lookback_days: int = Query(default=30, ge=1, le=365),
     seed: Optional[int] = Query(default=None),
+    max_distance_km: Optional[float] = Query(default=None, gt=0, le=100),
+    continuation_token: Optional[str] = Query(default=None, max_length=64),
 ) -> dict:
     if random_count > page_size:
         random_count = page_size
 
-    user = _read_user_from_authorization(authorization or "")
+    user = await run_in_threadpool(_read_user_from_authorization, authorization or "")
     role = user.get("role")
     if role is not None and str(role).lower() != "user":
         raise HTTPException(status_code=403, detail="Only users can access this endpoint")
 
-    user_id = int(user["id"])
-    buyer_dormitory_id = user.get("dormitory_id")
-    buyer_dormitory_id = int(buyer_dormitory_id) if buyer_dormitory_id else None
+    return await _run_db_call(
+        _recommend_products_response,
+        request,
+        user,
+        page,
+        page_size,
+        random_count,
+        lookback_days,
+        seed,
+        max_distance_km,
+        continuation_token,
+    )
 
-    engine = _get_db_engine()
-    now = _now_utc_naive()
-    since = now - timedelta(days=lookback_days)
 
+def _rank_recommended_products(
+    conn,
+    user_id: int,
+    buyer_dormitory_id: Optional[int],
+    lookback_days: int,
+    max_distance_km: Optional[float],
+    now: datetime,
+) -> Dict[str, Any]:
+    geo = get_dormitory_geo_registry().snapshot()
+    buyer_university_id, buyer_coords = _load_buyer_dormitory(conn, geo, buyer_dormitory_id)
+    nearby_dormitory_ids = None
+    if max_distance_km is not None and geo is not None and buyer_coords is not None:
+        nearby_dormitory_ids = geo.nearby_dormitories(buyer_dormitory_id, max_distance_km)
+
+    behavior = _load_behavior_profile(conn, user_id, lookback_days, now)
+    low_behavior = behavior["event_count"] < 5
+    last_event_id = behavior["last_event_id"]
+    last_event_at = behavior["last_event_at"]
+
+    last_product_id = 0
+    last_product_at: Optional[str] = None
     try:
-        conn = engine.connect()
-    except Exception:
-        raise HTTPException(status_code=503, detail="Database unavailable")
-
-    with conn:
-        buyer_dorm = None
-        buyer_university_id = None
-        if buyer_dormitory_id is not None:
-            try:
-                buyer_dorm = conn.execute(
-                    text(
-                        """
-                        SELECT id, dormitory_name, domain, latitude, longitude, is_active, university_id
-                        FROM dormitories
-                        WHERE id = :id
-                        LIMIT 1
-                        """
-                    ),
-                    {"id": buyer_dormitory_id},
-                ).mappings().first()
-            except ProgrammingError as e:
-                if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
-                    table = _missing_table_name_from_programming_error(e) or "unknown"
-                    raise HTTPException(
-                        status_code=503,
-                        detail=f"Database '{os.environ.get('DB_DATABASE', 'XiaoWu')}' missing table: {table}. Check DB_* env or run Laravel migrations.",
-                    )
-                raise
-            if buyer_dorm is not None:
-                buyer_university_id = buyer_dorm.get("university_id")
-                buyer_university_id = int(buyer_university_id) if buyer_university_id is not None else None
-
-        try:
-            events = conn.execute(
-                text(
-                    """
-                    SELECT id, event_type, product_id, category_id, seller_id, occurred_at
-                    FROM behavioral_events
-                    WHERE user_id = :user_id AND occurred_at >= :since
-                    ORDER BY occurred_at DESC, id DESC
-                    LIMIT 500
-                    """
-                ),
-                {"user_id": user_id, "since": since},
-            ).mappings().all()
-        except ProgrammingError as e:
-            if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
-                events = []
-            else:
-                raise
-        low_behavior = len(events) < 5
-
-        last_event_id = 0
-        last_event_at: Optional[str] = None
-        if len(events) > 0:
+        last_product_row = conn.execute(
+            text(
+                """
+                SELECT MAX(id) AS last_product_id, MAX(created_at) AS last_product_created_at
+                FROM products
+                WHERE status = 'available' AND deleted_at IS NULL
+                """
+            )
+        ).mappings().first()
+        if last_product_row is not None:
             try:
-                last_event_id = int(events[0].get("id") or 0)
+                last_product_id = int(last_product_row.get("last_product_id") or 0)
             except Exception:
-                last_event_id = 0
+                last_product_id = 0
             try:
-                occurred_at0 = events[0].get("occurred_at")
-                if isinstance(occurred_at0, datetime):
-                    last_event_at = occurred_at0.isoformat()
-                elif isinstance(occurred_at0, str):
-                    last_event_at = occurred_at0
+                ca = last_product_row.get("last_product_created_at")
+                if isinstance(ca, datetime):
+                    last_product_at = ca.isoformat()
+                elif isinstance(ca, str):
+                    last_product_at = ca
             except Exception:
-                last_event_at = None
-
-        last_product_id = 0
-        last_product_at: Optional[str] = None
-        try:
-            last_product_row = conn.execute(
-                text(
-                    """
-                    SELECT MAX(id) AS last_product_id, MAX(created_at) AS last_product_created_at
-                    FROM products
-                    WHERE status = 'available' AND deleted_at IS NULL
-                    """
-                )
-            ).mappings().first()
-            if last_product_row is not None:
-                try:
-                    last_product_id = int(last_product_row.get("last_product_id") or 0)
-                except Exception:
-                    last_product_id = 0
-                try:
-                    ca = last_product_row.get("last_product_created_at")
-                    if isinstance(ca, datetime):
-                        last_product_at = ca.isoformat()
-                    elif isinstance(ca, str):
-                        last_product_at = ca
-                except Exception:
-                    last_product_at = None
-        except ProgrammingError as e:
-            if not (getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146):
-                raise
-
-        seen_product_ids: Set[int] = set()
-        category_scores: Dict[int, float] = {}
-        seller_scores: Dict[int, float] = {}
-
-        for idx, e in enumerate(events):
-            occurred_at = e.get("occurred_at")
-            if isinstance(occurred_at, str):
-                try:
-                    occurred_at = datetime.fromisoformat(occurred_at.replace("Z", "+00:00")).replace(tzinfo=None)
-                except Exception:
-                    occurred_at = now
-            if not isinstance(occurred_at, datetime):
-                occurred_at = now
-
-            w = _event_weight(str(e.get("event_type") or ""))
-            w *= _time_decay(occurred_at, now)
-            if idx == 0:
-                w *= 6.0
-            elif idx < 3:
-                w *= 4.0
-            elif idx < 10:
-                w *= 2.0
-
-            pid = e.get("product_id")
-            if pid is not None:
-                try:
-                    seen_product_ids.add(int(pid))
-                except Exception:
-                    pass
-
-            cid = e.get("category_id")
-            if cid is not None:
-                try:
-                    category_scores[int(cid)] = category_scores.get(int(cid), 0.0) + w
-                except Exception:
-                    pass
-
-            sid = e.get("seller_id")
-            if sid is not None:
-                try:
-                    seller_scores[int(sid)] = seller_scores.get(int(sid), 0.0) + w
-                except Exception:
-                    pass
-
-        top_categories = [k for k, _ in sorted(category_scores.items(), key=lambda kv: kv[1], reverse=True)[:10]]
-        top_sellers = [k for k, _ in sorted(seller_scores.items(), key=lambda kv: kv[1], reverse=True)[:10]]
-
-        base_query = """
-            SELECT
-                p.id, p.seller_id, p.dormitory_id, p.category_id, p.condition_level_id,
-                p.title, p.price, p.currency, p.status, p.created_at,
-                COALESCE(d_user.latitude, d_product.latitude) AS dormitory__latitude,
-                COALESCE(d_user.longitude, d_product.longitude) AS dormitory__longitude,
-                COALESCE(d_user.university_id, d_product.university_id) AS dormitory__university_id,
-                cl.id AS condition_level__id, cl.name AS condition_level__name,
-                cl.level AS condition_level__level,
-                u.id AS seller__id, u.username AS seller__username, u.profile_picture AS seller__profile_picture,
-                CASE WHEN pl.id IS NULL THEN 0 ELSE 1 END AS is_promoted
-            FROM products p
-            JOIN users u ON u.id = p.seller_id
-            LEFT JOIN dormitories d_user ON d_user.id = u.dormitory_id
-            LEFT JOIN dormitories d_product ON d_product.id = p.dormitory_id
-            LEFT JOIN condition_levels cl ON cl.id = p.condition_level_id
-            LEFT JOIN promoted_listings pl ON pl.product_id = p.id AND pl.promoted_until > NOW()
-            WHERE p.status = 'available' AND p.deleted_at IS NULL
-        """
+                last_product_at = None
+    except ProgrammingError as e:
+        if not (getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146):
+            raise
 
-        params: Dict[str, Any] = {}
-        where_parts: List[str] = []
-
-        if top_categories or top_sellers:
-            or_parts: List[str] = []
-            if top_categories:
-                placeholders = ", ".join([f":cat_{i}" for i in range(len(top_categories))])
-                or_parts.append(f"p.category_id IN ({placeholders})")
-                for i, v in enumerate(top_categories):
-                    params[f"cat_{i}"] = v
-            if top_sellers:
-                placeholders = ", ".join([f":sel_{i}" for i in range(len(top_sellers))])
-                or_parts.append(f"p.seller_id IN ({placeholders})")
-                for i, v in enumerate(top_sellers):
-                    params[f"sel_{i}"] = v
-
-            if buyer_dormitory_id is not None:
-                or_parts.append("p.dormitory_id = :buyer_dormitory_id")
-                params["buyer_dormitory_id"] = buyer_dormitory_id
-            if buyer_university_id is not None:
-                or_parts.append("COALESCE(d_user.university_id, d_product.university_id) = :buyer_university_id")
-                params["buyer_university_id"] = buyer_university_id
-
-            where_parts.append("(" + " OR ".join(or_parts) + " OR pl.id IS NOT NULL" + ")")
-
-        where_sql = ""
-        if where_parts:
-            where_sql = " AND " + " AND ".join(where_parts)
+    seen_product_ids = behavior["seen_product_ids"]
+    category_scores = behavior["category_scores"]
+    seller_scores = behavior["seller_scores"]
+
+    top_categories = [k for k, _ in sorted(category_scores.items(), key=lambda kv: kv[1], reverse=True)[:10]]
+    top_sellers = [k for k, _ in sorted(seller_scores.items(), key=lambda kv: kv[1], reverse=True)[:10]]
+
+    base_query = """
+        SELECT
+            p.id, p.seller_id, p.dormitory_id, p.category_id, p.condition_level_id,
+            p.title, p.price, p.currency, p.status, p.created_at,
+            COALESCE(d_user.latitude, d_product.latitude) AS dormitory__latitude,
+            COALESCE(d_user.longitude, d_product.longitude) AS dormitory__longitude,
+            COALESCE(d_user.university_id, d_product.university_id) AS dormitory__university_id,
+            cl.id AS condition_level__id, cl.name AS condition_level__name,
+            cl.level AS condition_level__level,
+            u.id AS seller__id, u.username AS seller__username, u.profile_picture AS seller__profile_picture,
+            u.dormitory_id AS seller__dormitory_id,
+            CASE WHEN pl.id IS NULL THEN 0 ELSE 1 END AS is_promoted
+        FROM products p
+        JOIN users u ON u.id = p.seller_id
+        LEFT JOIN dormitories d_user ON d_user.id = u.dormitory_id
+        LEFT JOIN dormitories d_product ON d_product.id = p.dormitory_id
+        LEFT JOIN condition_levels cl ON cl.id = p.condition_level_id
+        LEFT JOIN promoted_listings pl ON pl.product_id = p.id AND pl.promoted_until > NOW()
+        WHERE p.status = 'available' AND p.deleted_at IS NULL
+    """
+
+    params: Dict[str, Any] = {}
+    where_parts: List[str] = []
+
+    if top_categories or top_sellers:
+        or_parts: List[str] = []
+        if top_categories:
+            or_parts.append("p.category_id IN :top_categories")
+            params["top_categories"] = list(top_categories)
+        if top_sellers:
+            or_parts.append("p.seller_id IN :top_sellers")
+            params["top_sellers"] = list(top_sellers)
 
+        if buyer_dormitory_id is not None:
+            or_parts.append("p.dormitory_id = :buyer_dormitory_id")
+            params["buyer_dormitory_id"] = buyer_dormitory_id
+        if buyer_university_id is not None:
+            or_parts.append("COALESCE(d_user.university_id, d_product.university_id) = :buyer_university_id")
+            params["buyer_university_id"] = buyer_university_id
+
+        where_parts.append("(" + " OR ".join(or_parts) + " OR pl.id IS NOT NULL" + ")")
+
+    where_sql = ""
+    if where_parts:
+        where_sql = " AND " + " AND ".join(where_parts)
+
+    nearby_sql = ""
+    nearby_params: Dict[str, Any] = {}
+    if nearby_dormitory_ids:
+        nearby_sql = " AND (p.dormitory_id IN :nearby_dormitory_ids OR u.dormitory_id IN :nearby_dormitory_ids)"
+        nearby_params = {"nearby_dormitory_ids": list(nearby_dormitory_ids)}
+        params.update(nearby_params)
+
+    catalogue = get_catalogue_store().snapshot()
+    if catalogue is not None:
+        candidate_positions = offload(
+            _catalogue_candidate_positions,
+            catalogue,
+            top_categories,
+            top_sellers,
+            buyer_dormitory_id,
+            buyer_university_id,
+            nearby_dormitory_ids=nearby_dormitory_ids,
+        )
+    else:
         try:
             rows = conn.execute(
-                text(base_query + where_sql + " ORDER BY p.created_at DESC LIMIT 600"),
+                _expanding_text(base_query + nearby_sql + where_sql + " ORDER BY p.created_at DESC LIMIT 600", params),
                 params,
             ).mappings().all()
         except ProgrammingError as e:
@@ -1706,8 +2219,8 @@ def recommend_products(
         if len(rows) < 200:
             try:
                 rows_more = conn.execute(
-                    text(base_query + " ORDER BY p.created_at DESC LIMIT 600"),
-                    {},
+                    _expanding_text(base_query + nearby_sql + " ORDER BY p.created_at DESC LIMIT 600", nearby_params),
+                    nearby_params,
                 ).mappings().all()
             except ProgrammingError as e:
                 if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
@@ -1726,222 +2239,131 @@ def recommend_products(
                 if len(rows) >= 600:
                     break
 
-        buyer_coords = _parse_lat_lng(
-            buyer_dorm.get("latitude") if buyer_dorm else None,
-            buyer_dorm.get("longitude") if buyer_dorm else None,
-            buyer_dorm.get("location") if buyer_dorm else None,
-        )
-
-        scored: List[Tuple[float, Dict[str, Any]]] = []
-        for r in rows:
-            score = 0.0
-
-            cid = r.get("category_id")
-            if cid is not None:
-                try:
-                    score += 1.5 * category_scores.get(int(cid), 0.0)
-                except Exception:
-                    pass
-
-            sid = r.get("seller_id")
-            if sid is not None:
-                try:
-                    score += 1.0 * seller_scores.get(int(sid), 0.0)
-                except Exception:
-                    pass
-
-            try:
-                if int(r.get("id") or 0) in seen_product_ids:
-                    score += 6.0
-            except Exception:
-                pass
-
-            if int(r.get("is_promoted") or 0) == 1:
-                score += 3.0
-
-            created_at = r.get("created_at")
-            if isinstance(created_at, str):
-                try:
-                    created_at = datetime.fromisoformat(created_at.replace("Z", "+00:00")).replace(tzinfo=None)
-                except Exception:
-                    created_at = None
-            if isinstance(created_at, datetime):
-                age_days = max(0.0, (now - created_at).total_seconds() / 86400.0)
-                score += 5.0 * math.exp(-age_days / 7.0)
-
-            if buyer_dormitory_id is not None:
-                if int(r.get("dormitory_id") or 0) == buyer_dormitory_id:
-                    score += 50.0
-                else:
-                    uni = r.get("dormitory__university_id")
-                    uni = int(uni) if uni is not None else None
-                    if buyer_university_id is not None and uni == buyer_university_id:
-                        score += 20.0
-
-            product_coords = _parse_lat_lng(
-                r.get("dormitory__latitude"),
-                r.get("dormitory__longitude"),
-                r.get("dormitory__location"),
+    def _rank() -> List[int]:
+        if catalogue is not None or vectorized_scoring_available():
+            if catalogue is not None:
+                candidate_columns = columns_from_catalogue(catalogue, candidate_positions)
+            else:
+                candidate_columns = columns_from_rows([dict(r) for r in rows])
+            candidate_distances = None
+            if geo is not None and geo.contains(buyer_dormitory_id):
+                candidate_distances = geo.candidate_distances(
+                    buyer_dormitory_id,
+                    candidate_columns["seller_dormitory_ids"],
+                    candidate_columns["dormitory_ids"],
+                )
+            return rank_candidate_ids(
+                candidate_columns,
+                category_scores,
+                seller_scores,
+                seen_product_ids,
+                now,
+                low_behavior,
+                buyer_dormitory_id,
+                buyer_university_id,
+                buyer_coords,
+                candidate_distances,
+                max_distance_km if nearby_dormitory_ids is not None else None,
             )
-            distance_km: Optional[float] = None
-            if buyer_coords is not None and product_coords is not None:
-                distance_km = _haversine_km(buyer_coords, product_coords)
-                score += 30.0 * math.exp(-distance_km / 2.0)
-
-            r_dict = dict(r)
-            r_dict["_distance_km"] = distance_km
-            scored.append((score, r_dict))
-
-        if low_behavior:
-            def _local_rank_key(item: Tuple[float, Dict[str, Any]]) -> Tuple[int, float, float]:
-                r = item[1]
-                priority = 2
-                if buyer_dormitory_id is not None and int(r.get("dormitory_id") or 0) == buyer_dormitory_id:
-                    priority = 0
-                else:
-                    uni = r.get("dormitory__university_id")
-                    uni = int(uni) if uni is not None else None
-                    if buyer_university_id is not None and uni == buyer_university_id:
-                        priority = 1
-
-                distance = r.get("_distance_km")
-                distance_sort = float(distance) if distance is not None else 1.0e9
-
-                created_at = r.get("created_at")
-                created_ts = 0.0
-                if isinstance(created_at, str):
-                    try:
-                        created_at = datetime.fromisoformat(created_at.replace("Z", "+00:00")).replace(tzinfo=None)
-                    except Exception:
-                        created_at = None
-                if isinstance(created_at, datetime):
-                    created_ts = created_at.timestamp()
-
-                return priority, distance_sort, -created_ts
-
-            ranked = [r for _, r in sorted(scored, key=_local_rank_key)]
-        else:
-            scored.sort(key=lambda x: (x[0], x[1].get("created_at") or ""), reverse=True)
-            ranked = [r for _, r in scored]
-
-        deterministic_count = max(0, page_size - random_count)
-        start = (page - 1) * deterministic_count if deterministic_count > 0 else 0
-        base_items = ranked[start : start + deterministic_count] if deterministic_count > 0 else []
+        ranked = _rank_candidate_rows_reference(
+            rows,
+            category_scores,
+            seller_scores,
+            seen_product_ids,
+            now,
+            low_behavior,
+            buyer_dormitory_id,
+            buyer_university_id,
+            buyer_coords,
+        )
+        return [int(r["id"]) for r in ranked]
 
-        base_ids = {int(p["id"]) for p in base_items}
-        pool = [p for p in ranked if int(p["id"]) not in base_ids]
+    ranked_ids = offload(_rank)
 
-        if seed is None:
-            seed_value = (
-                user_id * 1000003 + page * 9176 + last_event_id * 1013 + last_product_id * 7919
-            ) % (2**31 - 1)
-            if seed_value <= 0:
-                seed_value = 1
-        else:
-            seed_value = seed
-        rng = random.Random(seed_value)
-
-        random_items = pool[:]
-        rng.shuffle(random_items)
-        random_items = random_items[:random_count]
-
-        combined = base_items + random_items
-        if len(combined) < page_size:
-            existing_ids = {int(p["id"]) for p in combined}
-            for candidate in ranked:
-                pid = int(candidate["id"])
-                if pid in existing_ids:
-                    continue
-                combined.append(candidate)
-                existing_ids.add(pid)
-                if len(combined) >= page_size:
-                    break
-        combined_ids = [int(p["id"]) for p in combined]
+    return {
+        "ranked_ids": ranked_ids,
+        "last_event_id": last_event_id,
+        "last_event_at": last_event_at,
+        "last_product_id": last_product_id,
+        "last_product_at": last_product_at,
+    }
 
-        images = []
-        tags = []
-        if combined_ids:
-            placeholders = ", ".join([f":pid_{i}" for i in range(len(combined_ids))])
-            pid_params = {f"pid_{i}": v for i, v in enumerate(combined_ids)}
 
-            try:
-                images = conn.execute(
-                    text(
-                        f"""
-                        SELECT product_id, image_url, image_thumbnail_url, is_primary
-                        FROM product_images
-                        WHERE product_id IN ({placeholders})
-                        ORDER BY is_primary DESC, id ASC
-                        """
-                    ),
-                    pid_params,
-                ).mappings().all()
-            except ProgrammingError as e:
-                if not (getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146):
-                    raise
-                images = []
+def _recommend_products_response(
+    conn,
+    request: Request,
+    user: Dict[str, Any],
+    page: int,
+    page_size: int,
+    random_count: int,
+    lookback_days: int,
+    seed: Optional[int],
+    max_distance_km: Optional[float],
+    continuation_token: Optional[str],
+) -> dict:
+    user_id = int(user["id"])
+    buyer_dormitory_id = user.get("dormitory_id")
+    buyer_dormitory_id = int(buyer_dormitory_id) if buyer_dormitory_id else None
+    now = _now_utc_naive()
 
-            try:
-                tags = conn.execute(
-                    text(
-                        f"""
-                        SELECT pt.product_id, t.id, t.name
-                        FROM product_tags pt
-                        JOIN tags t ON t.id = pt.tag_id
-                        WHERE pt.product_id IN ({placeholders})
-                        ORDER BY t.id ASC
-                        """
-                    ),
-                    pid_params,
-                ).mappings().all()
-            except ProgrammingError as e:
-                if not (getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146):
-                    raise
-                tags = []
+    ranking_token = _recommendation_ranking_token(
+        "products", user_id, buyer_dormitory_id, lookback_days, max_distance_km, *_recommendation_versions(user_id)
+    )
+    ranking = _cached_recommendation_ranking("recommend_products", ranking_token, continuation_token)
+    if ranking is None:
+        ranking = _rank_recommended_products(conn, user_id, buyer_dormitory_id, lookback_days, max_distance_km, now)
+        _store_recommendation_ranking("recommend_products", ranking_token, ranking)
+    ranked_ids = ranking["ranked_ids"]
+    last_event_id, last_event_at = ranking["last_event_id"], ranking["last_event_at"]
+    last_product_id, last_product_at = ranking["last_product_id"], ranking["last_product_at"]
+
+    deterministic_count = max(0, page_size - random_count)
+    start = (page - 1) * deterministic_count if deterministic_count > 0 else 0
+    base_ids = ranked_ids[start : start + deterministic_count] if deterministic_count > 0 else []
+
+    base_id_set = set(base_ids)
+    pool = [pid for pid in ranked_ids if pid not in base_id_set]
+
+    if seed is None:
+        seed_value = (
+            user_id * 1000003 + page * 9176 + last_event_id * 1013 + last_product_id * 7919
+        ) % (2**31 - 1)
+        if seed_value <= 0:
+            seed_value = 1
+    else:
+        seed_value = seed
+    rng = random.Random(seed_value)
+
+    random_ids = pool[:]
+    rng.shuffle(random_ids)
+    random_ids = random_ids[:random_count]
+
+    combined_ids = base_ids + random_ids
+    if len(combined_ids) < page_size:
+        existing_ids = set(combined_ids)
+        for pid in ranked_ids:
+            if pid in existing_ids:
+                continue
+            combined_ids.append(pid)
+            existing_ids.add(pid)
+            if len(combined_ids) >= page_size:
+                break
 
-    images_by_product = _group_by_key([dict(x) for x in images], "product_id")
-    tag_rows_by_product = _group_by_key([dict(x) for x in tags], "product_id")
+    try:
+        combined_ids, cards = _fill_recommendation_page(
+            combined_ids, ranked_ids, page_size, lambda ids: get_product_hydrator().cards(conn, ids)
+        )
+    except ProgrammingError as e:
+        if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
+            table = _missing_table_name_from_programming_error(e) or "unknown"
+            raise HTTPException(
+                status_code=503,
+                detail=f"Database '{os.environ.get('DB_DATABASE', 'XiaoWu')}' missing table: {table}. Check DB_* env or run Laravel migrations.",
+            )
+        raise
 
     base_url = _request_laravel_base_url(request)
-    payload_products = []
-    for p in combined:
-        pid = int(p["id"])
-        imgs = images_by_product.get(pid, [])
-        image_thumbnail_url = None
-        if imgs:
-            first = imgs[0]
-            image_thumbnail_url = _resolve_image_url(first.get("image_thumbnail_url"), base_url)
-        seller_profile_picture = _resolve_image_url(p.get("seller__profile_picture"), base_url)
-        prod: Dict[str, Any] = {
-            "id": pid,
-            "title": p.get("title"),
-            "price": float(p["price"]) if p.get("price") is not None else None,
-            "currency": (str(p.get("currency") or "CNY")).strip().upper(),
-            "status": p.get("status"),
-            "created_at": p.get("created_at"),
-            "category_id": p.get("category_id"),
-            "condition_level_id": p.get("condition_level_id"),
-            "is_promoted": int(p.get("is_promoted") or 0),
-            "seller": {
-                "id": p.get("seller__id"),
-                "username": p.get("seller__username"),
-                "profile_picture": seller_profile_picture,
-            },
-            "dormitory": {
-                "latitude": p.get("dormitory__latitude"),
-                "longitude": p.get("dormitory__longitude"),
-            },
-            "condition_level": {
-                "id": p.get("condition_level__id"),
-                "name": p.get("condition_level__name"),
-                "level": p.get("condition_level__level"),
-            },
-            "image_thumbnail_url": image_thumbnail_url,
-            "tags": [
-                {"id": t.get("id"), "name": t.get("name")} for t in tag_rows_by_product.get(pid, [])
-            ],
-        }
-        payload_products.append(prod)
+    payload_products = [_product_card_payload(cards[pid], base_url) for pid in combined_ids if pid in cards]
 
     return {
         "message": "Recommended products retrieved successfully",
@@ -1952,12 +2374,49 @@ def recommend_products(
         "last_event_at": last_event_at,
         "last_product_id": last_product_id,
         "last_product_at": last_product_at,
+        "continuation_token": ranking_token,
         "products": payload_products[:page_size],
     }
 
 
+def _load_last_exchange_product(conn) -> Tuple[int, Optional[str]]:
+    last_exchange_product_id = 0
+    last_exchange_product_at: Optional[str] = None
+    try:
+        last_exchange_row = conn.execute(
+            text(
+                """
+                SELECT MAX(ep.id) AS last_exchange_product_id, MAX(ep.created_at) AS last_exchange_product_created_at
+                FROM exchange_products ep
+                JOIN products p ON p.id = ep.product_id
+                WHERE ep.exchange_status = 'open'
+                  AND (ep.expiration_date IS NULL OR ep.expiration_date > NOW())
+                  AND p.status = 'available'
+                  AND p.deleted_at IS NULL
+                """
+            )
+        ).mappings().first()
+        if last_exchange_row is not None:
+            try:
+                last_exchange_product_id = int(last_exchange_row.get("last_exchange_product_id") or 0)
+            except Exception:
+                last_exchange_product_id = 0
+            try:
+                ca = last_exchange_row.get("last_exchange_product_created_at")
+                if isinstance(ca, datetime):
+                    last_exchange_product_at = ca.isoformat()
+                elif isinstance(ca, str):
+                    last_exchange_product_at = ca
+            except Exception:
+                last_exchange_product_at = None
+    except ProgrammingError as e:
+        if not (getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146):
+            raise
+    return last_exchange_product_id, last_exchange_product_at
+
+
 @py_router.get("/py/api/user/recommendations/exchange-products")
-def recommend_exchange_products(
+async def recommend_exchange_products(
     request: Request,
     authorization: Optional[str] = Header(default=None),
     page: int = Query(default=1, ge=1),
@@ -1966,6 +2425,8 @@ def recommend_exchange_products(
     lookback_days: int = Query(default=30, ge=1, le=365),
     seed: Optional[int] = Query(default=None),
     exchange_type: Optional[str] = Query(default=None),
+    max_distance_km: Optional[float] = Query(default=None, gt=0, le=100),
+    continuation_token: Optional[str] = Query(default=None, max_length=64),
 ) -> dict:
     if random_count > page_size:
         random_count = page_size
@@ -1978,234 +2439,161 @@ def recommend_exchange_products(
     if exchange_type_value is not None and exchange_type_value not in {"exchange_only", "exchange_or_purchase"}:
         raise HTTPException(status_code=422, detail="Invalid exchange_type")
 
-    user = _read_user_from_authorization(authorization or "")
+    user = await run_in_threadpool(_read_user_from_authorization, authorization or "")
     role = user.get("role")
     if role is not None and str(role).lower() != "user":
         raise HTTPException(status_code=403, detail="Only users can access this endpoint")
 
-    user_id = int(user["id"])
-    buyer_dormitory_id = user.get("dormitory_id")
-    buyer_dormitory_id = int(buyer_dormitory_id) if buyer_dormitory_id else None
-
-    engine = _get_db_engine()
-    now = _now_utc_naive()
-    since = now - timedelta(days=lookback_days)
-
-    try:
-        conn = engine.connect()
-    except Exception:
-        raise HTTPException(status_code=503, detail="Database unavailable")
-
-    with conn:
-        buyer_dorm = None
-        buyer_university_id = None
-        if buyer_dormitory_id is not None:
-            try:
-                buyer_dorm = conn.execute(
-                    text(
-                        """
-                        SELECT id, dormitory_name, domain, latitude, longitude, is_active, university_id
-                        FROM dormitories
-                        WHERE id = :id
-                        LIMIT 1
-                        """
-                    ),
-                    {"id": buyer_dormitory_id},
-                ).mappings().first()
-            except ProgrammingError as e:
-                if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
-                    table = _missing_table_name_from_programming_error(e) or "unknown"
-                    raise HTTPException(
-                        status_code=503,
-                        detail=f"Database '{os.environ.get('DB_DATABASE', 'XiaoWu')}' missing table: {table}. Check DB_* env or run Laravel migrations.",
-                    )
-                raise
-            if buyer_dorm is not None:
-                buyer_university_id = buyer_dorm.get("university_id")
-                buyer_university_id = int(buyer_university_id) if buyer_university_id is not None else None
-
-        try:
-            events = conn.execute(
-                text(
-                    """
-                    SELECT id, event_type, product_id, category_id, seller_id, occurred_at
-                    FROM behavioral_events
-                    WHERE user_id = :user_id AND occurred_at >= :since
-                    ORDER BY occurred_at DESC, id DESC
-                    LIMIT 500
-                    """
-                ),
-                {"user_id": user_id, "since": since},
-            ).mappings().all()
-        except ProgrammingError as e:
-            if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
-                events = []
-            else:
-                raise
-        low_behavior = len(events) < 5
-
-        last_event_id = 0
-        last_event_at: Optional[str] = None
-        if len(events) > 0:
-            try:
-                last_event_id = int(events[0].get("id") or 0)
-            except Exception:
-                last_event_id = 0
-            try:
-                occurred_at0 = events[0].get("occurred_at")
-                if isinstance(occurred_at0, datetime):
-                    last_event_at = occurred_at0.isoformat()
-                elif isinstance(occurred_at0, str):
-                    last_event_at = occurred_at0
-            except Exception:
-                last_event_at = None
-
-        last_exchange_product_id = 0
-        last_exchange_product_at: Optional[str] = None
-        try:
-            last_exchange_row = conn.execute(
-                text(
-                    """
-                    SELECT MAX(ep.id) AS last_exchange_product_id, MAX(ep.created_at) AS last_exchange_product_created_at
-                    FROM exchange_products ep
-                    JOIN products p ON p.id = ep.product_id
-                    WHERE ep.exchange_status = 'open'
-                      AND (ep.expiration_date IS NULL OR ep.expiration_date > NOW())
-                      AND p.status = 'available'
-                      AND p.deleted_at IS NULL
-                    """
-                )
-            ).mappings().first()
-            if last_exchange_row is not None:
-                try:
-                    last_exchange_product_id = int(last_exchange_row.get("last_exchange_product_id") or 0)
-                except Exception:
-                    last_exchange_product_id = 0
-                try:
-                    ca = last_exchange_row.get("last_exchange_product_created_at")
-                    if isinstance(ca, datetime):
-                        last_exchange_product_at = ca.isoformat()
-                    elif isinstance(ca, str):
-                        last_exchange_product_at = ca
-                except Exception:
-                    last_exchange_product_at = None
-        except ProgrammingError as e:
-            if not (getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146):
-                raise
+    return await _run_db_call(
+        _recommend_exchange_products_response,
+        request,
+        user,
+        page,
+        page_size,
+        random_count,
+        lookback_days,
+        seed,
+        exchange_type_value,
+        max_distance_km,
+        continuation_token,
+    )
 
-        seen_product_ids: Set[int] = set()
-        category_scores: Dict[int, float] = {}
-        seller_scores: Dict[int, float] = {}
 
-        for idx, e in enumerate(events):
-            occurred_at = e.get("occurred_at")
-            if isinstance(occurred_at, str):
-                try:
-                    occurred_at = datetime.fromisoformat(occurred_at.replace("Z", "+00:00")).replace(tzinfo=None)
-                except Exception:
-                    occurred_at = now
-            if not isinstance(occurred_at, datetime):
-                occurred_at = now
+_RECOMMEND_EXCHANGE_BASE_QUERY = """
+    SELECT
+        p.id, p.seller_id, p.dormitory_id, p.category_id, p.condition_level_id,
+        p.title, p.price, p.currency, p.status, p.created_at,
+        ep.id AS exchange_product_id, ep.exchange_type, ep.exchange_status, ep.expiration_date,
+        ep.target_product_category_id, ep.target_product_condition_id, ep.target_product_title,
+        COALESCE(d_user.latitude, d_product.latitude) AS dormitory__latitude,
+        COALESCE(d_user.longitude, d_product.longitude) AS dormitory__longitude,
+        COALESCE(d_user.university_id, d_product.university_id) AS dormitory__university_id,
+        cl.id AS condition_level__id, cl.name AS condition_level__name,
+        cl.level AS condition_level__level,
+        u.id AS seller__id, u.username AS seller__username, u.profile_picture AS seller__profile_picture,
+        u.dormitory_id AS seller__dormitory_id,
+        tcat.id AS target_category__id, tcat.name AS target_category__name,
+        tcond.id AS target_condition__id, tcond.name AS target_condition__name,
+        tcond.level AS target_condition__level,
+        CASE WHEN pl.id IS NULL THEN 0 ELSE 1 END AS is_promoted
+    FROM exchange_products ep
+    JOIN products p ON p.id = ep.product_id
+    JOIN users u ON u.id = p.seller_id
+    LEFT JOIN dormitories d_user ON d_user.id = u.dormitory_id
+    LEFT JOIN dormitories d_product ON d_product.id = p.dormitory_id
+    LEFT JOIN condition_levels cl ON cl.id = p.condition_level_id
+    LEFT JOIN categories tcat ON tcat.id = ep.target_product_category_id
+    LEFT JOIN condition_levels tcond ON tcond.id = ep.target_product_condition_id
+    LEFT JOIN promoted_listings pl ON pl.product_id = p.id AND pl.promoted_until > NOW()
+    WHERE ep.exchange_status = 'open'
+      AND (ep.expiration_date IS NULL OR ep.expiration_date > NOW())
+      AND p.status = 'available' AND p.deleted_at IS NULL
+"""
+
+
+def _rank_recommended_exchange_products(
+    conn,
+    user_id: int,
+    buyer_dormitory_id: Optional[int],
+    lookback_days: int,
+    exchange_type_value: Optional[str],
+    max_distance_km: Optional[float],
+    now: datetime,
+    catalogue: Optional[CatalogueSnapshot],
+    matches: Any,
+) -> Tuple[Dict[str, Any], Dict[int, Any]]:
+    geo = get_dormitory_geo_registry().snapshot()
+    buyer_university_id, buyer_coords = _load_buyer_dormitory(conn, geo, buyer_dormitory_id)
+    nearby_dormitory_ids = None
+    if max_distance_km is not None and geo is not None and buyer_coords is not None:
+        nearby_dormitory_ids = geo.nearby_dormitories(buyer_dormitory_id, max_distance_km)
+
+    behavior = _load_behavior_profile(conn, user_id, lookback_days, now)
+    low_behavior = behavior["event_count"] < 5
+    last_event_id = behavior["last_event_id"]
+    last_event_at = behavior["last_event_at"]
+
+    exchange_index = get_exchange_match_index()
+    if matches is not None:
+        last_exchange_product_id, latest_created_at = exchange_index.latest_listing()
+        last_exchange_product_at = latest_created_at.isoformat() if latest_created_at is not None else None
+    else:
+        last_exchange_product_id, last_exchange_product_at = _load_last_exchange_product(conn)
 
-            w = _event_weight(str(e.get("event_type") or ""))
-            w *= _time_decay(occurred_at, now)
-            if idx == 0:
-                w *= 6.0
-            elif idx < 3:
-                w *= 4.0
-            elif idx < 10:
-                w *= 2.0
-
-            pid = e.get("product_id")
-            if pid is not None:
-                try:
-                    seen_product_ids.add(int(pid))
-                except Exception:
-                    pass
+    seen_product_ids = behavior["seen_product_ids"]
+    category_scores = behavior["category_scores"]
+    seller_scores = behavior["seller_scores"]
 
-            cid = e.get("category_id")
-            if cid is not None:
-                try:
-                    category_scores[int(cid)] = category_scores.get(int(cid), 0.0) + w
-                except Exception:
-                    pass
+    top_categories = [k for k, _ in sorted(category_scores.items(), key=lambda kv: kv[1], reverse=True)[:10]]
+    top_sellers = [k for k, _ in sorted(seller_scores.items(), key=lambda kv: kv[1], reverse=True)[:10]]
 
-            sid = e.get("seller_id")
-            if sid is not None:
-                try:
-                    seller_scores[int(sid)] = seller_scores.get(int(sid), 0.0) + w
-                except Exception:
-                    pass
+    base_query = _RECOMMEND_EXCHANGE_BASE_QUERY
 
-        top_categories = [k for k, _ in sorted(category_scores.items(), key=lambda kv: kv[1], reverse=True)[:10]]
-        top_sellers = [k for k, _ in sorted(seller_scores.items(), key=lambda kv: kv[1], reverse=True)[:10]]
+    params: Dict[str, Any] = {"current_user_id": user_id}
+    where_parts: List[str] = ["p.seller_id <> :current_user_id"]
 
-        base_query = """
-            SELECT
-                p.id, p.seller_id, p.dormitory_id, p.category_id, p.condition_level_id,
-                p.title, p.price, p.currency, p.status, p.created_at,
-                ep.id AS exchange_product_id, ep.exchange_type, ep.exchange_status, ep.expiration_date,
-                ep.target_product_category_id, ep.target_product_condition_id, ep.target_product_title,
-                COALESCE(d_user.latitude, d_product.latitude) AS dormitory__latitude,
-                COALESCE(d_user.longitude, d_product.longitude) AS dormitory__longitude,
-                COALESCE(d_user.university_id, d_product.university_id) AS dormitory__university_id,
-                cl.id AS condition_level__id, cl.name AS condition_level__name,
-                cl.level AS condition_level__level,
-                u.id AS seller__id, u.username AS seller__username, u.profile_picture AS seller__profile_picture,
-                tcat.id AS target_category__id, tcat.name AS target_category__name,
-                tcond.id AS target_condition__id, tcond.name AS target_condition__name,
-                tcond.level AS target_condition__level,
-                CASE WHEN pl.id IS NULL THEN 0 ELSE 1 END AS is_promoted
-            FROM exchange_products ep
-            JOIN products p ON p.id = ep.product_id
-            JOIN users u ON u.id = p.seller_id
-            LEFT JOIN dormitories d_user ON d_user.id = u.dormitory_id
-            LEFT JOIN dormitories d_product ON d_product.id = p.dormitory_id
-            LEFT JOIN condition_levels cl ON cl.id = p.condition_level_id
-            LEFT JOIN categories tcat ON tcat.id = ep.target_product_category_id
-            LEFT JOIN condition_levels tcond ON tcond.id = ep.target_product_condition_id
-            LEFT JOIN promoted_listings pl ON pl.product_id = p.id AND pl.promoted_until > NOW()
-            WHERE ep.exchange_status = 'open'
-              AND (ep.expiration_date IS NULL OR ep.expiration_date > NOW())
-              AND p.status = 'available' AND p.deleted_at IS NULL
-        """
+    if exchange_type_value is not None:
+        where_parts.append("ep.exchange_type = :exchange_type")
+        params["exchange_type"] = exchange_type_value
 
-        params: Dict[str, Any] = {"current_user_id": user_id}
-        where_parts: List[str] = ["p.seller_id <> :current_user_id"]
-
-        if exchange_type_value is not None:
-            where_parts.append("ep.exchange_type = :exchange_type")
-            params["exchange_type"] = exchange_type_value
-
-        if top_categories or top_sellers:
-            or_parts: List[str] = []
-            if top_categories:
-                placeholders = ", ".join([f":cat_{i}" for i in range(len(top_categories))])
-                or_parts.append(f"p.category_id IN ({placeholders})")
-                for i, v in enumerate(top_categories):
-                    params[f"cat_{i}"] = v
-            if top_sellers:
-                placeholders = ", ".join([f":sel_{i}" for i in range(len(top_sellers))])
-                or_parts.append(f"p.seller_id IN ({placeholders})")
-                for i, v in enumerate(top_sellers):
-                    params[f"sel_{i}"] = v
-
-            if buyer_dormitory_id is not None:
-                or_parts.append("p.dormitory_id = :buyer_dormitory_id")
-                params["buyer_dormitory_id"] = buyer_dormitory_id
-            if buyer_university_id is not None:
-                or_parts.append("COALESCE(d_user.university_id, d_product.university_id) = :buyer_university_id")
-                params["buyer_university_id"] = buyer_university_id
-
-            where_parts.append("(" + " OR ".join(or_parts) + " OR pl.id IS NOT NULL" + ")")
-
-        where_sql = ""
-        if where_parts:
-            where_sql = " AND " + " AND ".join(where_parts)
+    if top_categories or top_sellers:
+        or_parts: List[str] = []
+        if top_categories:
+            or_parts.append("p.category_id IN :top_categories")
+            params["top_categories"] = list(top_categories)
+        if top_sellers:
+            or_parts.append("p.seller_id IN :top_sellers")
+            params["top_sellers"] = list(top_sellers)
 
+        if buyer_dormitory_id is not None:
+            or_parts.append("p.dormitory_id = :buyer_dormitory_id")
+            params["buyer_dormitory_id"] = buyer_dormitory_id
+        if buyer_university_id is not None:
+            or_parts.append("COALESCE(d_user.university_id, d_product.university_id) = :buyer_university_id")
+            params["buyer_university_id"] = buyer_university_id
+
+        where_parts.append("(" + " OR ".join(or_parts) + " OR pl.id IS NOT NULL" + ")")
+
+    nearby_sql = ""
+    nearby_params: Dict[str, Any] = {}
+    if nearby_dormitory_ids:
+        nearby_sql = " AND (p.dormitory_id IN :nearby_dormitory_ids OR u.dormitory_id IN :nearby_dormitory_ids)"
+        nearby_params = {"nearby_dormitory_ids": list(nearby_dormitory_ids)}
+        params.update(nearby_params)
+
+    where_sql = ""
+    if where_parts:
+        where_sql = " AND " + " AND ".join(where_parts)
+
+    rows_by_id: Dict[int, Any] = {}
+    if matches is not None:
+        candidate_columns = columns_from_catalogue(catalogue, matches.positions)
+        candidate_distances = None
+        if geo is not None and geo.contains(buyer_dormitory_id):
+            candidate_distances = geo.candidate_distances(
+                buyer_dormitory_id,
+                candidate_columns["seller_dormitory_ids"],
+                candidate_columns["dormitory_ids"],
+            )
+        ranked_ids = offload(
+            rank_candidate_ids,
+            candidate_columns,
+            category_scores,
+            seller_scores,
+            seen_product_ids,
+            now,
+            low_behavior,
+            buyer_dormitory_id,
+            buyer_university_id,
+            buyer_coords,
+            candidate_distances,
+            max_distance_km if nearby_dormitory_ids is not None else None,
+            matches.boosts,
+        )
+    else:
         try:
             rows = conn.execute(
-                text(base_query + where_sql + " ORDER BY p.created_at DESC LIMIT 600"),
+                _expanding_text(base_query + nearby_sql + where_sql + " ORDER BY p.created_at DESC LIMIT 600", params),
                 params,
             ).mappings().all()
         except ProgrammingError as e:
@@ -2220,8 +2608,8 @@ def recommend_exchange_products(
         if len(rows) < 200:
             try:
                 rows_more = conn.execute(
-                    text(base_query + " ORDER BY p.created_at DESC LIMIT 600"),
-                    {},
+                    _expanding_text(base_query + nearby_sql + " ORDER BY p.created_at DESC LIMIT 600", nearby_params),
+                    nearby_params,
                 ).mappings().all()
             except ProgrammingError as e:
                 if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
@@ -2240,202 +2628,237 @@ def recommend_exchange_products(
                 if len(rows) >= 600:
                     break
 
-        buyer_coords = _parse_lat_lng(
-            buyer_dorm.get("latitude") if buyer_dorm else None,
-            buyer_dorm.get("longitude") if buyer_dorm else None,
-            buyer_dorm.get("location") if buyer_dorm else None,
-        )
-
-        scored: List[Tuple[float, Dict[str, Any]]] = []
-        for r in rows:
-            score = 0.0
-
-            cid = r.get("category_id")
-            if cid is not None:
-                try:
-                    score += 1.5 * category_scores.get(int(cid), 0.0)
-                except Exception:
-                    pass
-
-            sid = r.get("seller_id")
-            if sid is not None:
-                try:
-                    score += 1.0 * seller_scores.get(int(sid), 0.0)
-                except Exception:
-                    pass
-
-            try:
-                if int(r.get("id") or 0) in seen_product_ids:
-                    score += 6.0
-            except Exception:
-                pass
-
-            if int(r.get("is_promoted") or 0) == 1:
-                score += 3.0
+        def _score_rows() -> List[Dict[str, Any]]:
+            candidate_distances = None
+            if geo is not None and geo.contains(buyer_dormitory_id):
+                candidate_distances = geo.candidate_distances(
+                    buyer_dormitory_id,
+                    [r.get("seller__dormitory_id") for r in rows],
+                    [r.get("dormitory_id") for r in rows],
+                ).tolist()
+
+            scored: List[Tuple[float, Dict[str, Any]]] = []
+            for idx, r in enumerate(rows):
+                score = 0.0
+
+                cid = r.get("category_id")
+                if cid is not None:
+                    try:
+                        score += 1.5 * category_scores.get(int(cid), 0.0)
+                    except Exception:
+                        pass
 
-            created_at = r.get("created_at")
-            if isinstance(created_at, str):
-                try:
-                    created_at = datetime.fromisoformat(created_at.replace("Z", "+00:00")).replace(tzinfo=None)
-                except Exception:
-                    created_at = None
-            if isinstance(created_at, datetime):
-                age_days = max(0.0, (now - created_at).total_seconds() / 86400.0)
-                score += 5.0 * math.exp(-age_days / 7.0)
+                sid = r.get("seller_id")
+                if sid is not None:
+                    try:
+                        score += 1.0 * seller_scores.get(int(sid), 0.0)
+                    except Exception:
+                        pass
 
-            if buyer_dormitory_id is not None:
-                if int(r.get("dormitory_id") or 0) == buyer_dormitory_id:
-                    score += 50.0
-                else:
-                    uni = r.get("dormitory__university_id")
-                    uni = int(uni) if uni is not None else None
-                    if buyer_university_id is not None and uni == buyer_university_id:
-                        score += 20.0
-
-            product_coords = _parse_lat_lng(
-                r.get("dormitory__latitude"),
-                r.get("dormitory__longitude"),
-                r.get("dormitory__location"),
-            )
-            distance_km: Optional[float] = None
-            if buyer_coords is not None and product_coords is not None:
-                distance_km = _haversine_km(buyer_coords, product_coords)
-                score += 30.0 * math.exp(-distance_km / 2.0)
-
-            r_dict = dict(r)
-            r_dict["_distance_km"] = distance_km
-            scored.append((score, r_dict))
-
-        if low_behavior:
-            def _local_rank_key(item: Tuple[float, Dict[str, Any]]) -> Tuple[int, float, float]:
-                r = item[1]
-                priority = 2
-                if buyer_dormitory_id is not None and int(r.get("dormitory_id") or 0) == buyer_dormitory_id:
-                    priority = 0
-                else:
-                    uni = r.get("dormitory__university_id")
-                    uni = int(uni) if uni is not None else None
-                    if buyer_university_id is not None and uni == buyer_university_id:
-                        priority = 1
+                score += 6.0 * seen_weight(seen_product_ids, r.get("id"))
 
-                distance = r.get("_distance_km")
-                distance_sort = float(distance) if distance is not None else 1.0e9
+                if int(r.get("is_promoted") or 0) == 1:
+                    score += 3.0
 
                 created_at = r.get("created_at")
-                created_ts = 0.0
                 if isinstance(created_at, str):
                     try:
                         created_at = datetime.fromisoformat(created_at.replace("Z", "+00:00")).replace(tzinfo=None)
                     except Exception:
                         created_at = None
                 if isinstance(created_at, datetime):
-                    created_ts = created_at.timestamp()
-
-                return priority, distance_sort, -created_ts
+                    age_days = max(0.0, (now - created_at).total_seconds() / 86400.0)
+                    score += 5.0 * math.exp(-age_days / 7.0)
+
+                if buyer_dormitory_id is not None:
+                    if int(r.get("dormitory_id") or 0) == buyer_dormitory_id:
+                        score += 50.0
+                    else:
+                        uni = r.get("dormitory__university_id")
+                        uni = int(uni) if uni is not None else None
+                        if buyer_university_id is not None and uni == buyer_university_id:
+                            score += 20.0
+
+                distance_km: Optional[float] = None
+                if candidate_distances is not None:
+                    if not math.isnan(candidate_distances[idx]):
+                        distance_km = candidate_distances[idx]
+                else:
+                    product_coords = parse_lat_lng(
+                        r.get("dormitory__latitude"),
+                        r.get("dormitory__longitude"),
+                        r.get("dormitory__location"),
+                    )
+                    if buyer_coords is not None and product_coords is not None:
+                        distance_km = _haversine_km(buyer_coords, product_coords)
+                if distance_km is not None:
+                    score += 30.0 * math.exp(-distance_km / 2.0)
+                elif nearby_dormitory_ids is not None:
+                    continue
+                if nearby_dormitory_ids is not None and distance_km > max_distance_km:
+                    continue
 
-            ranked = [r for _, r in sorted(scored, key=_local_rank_key)]
-        else:
+                r_dict = dict(r)
+                r_dict["_distance_km"] = distance_km
+                scored.append((score, r_dict))
+
+            if low_behavior:
+                def _local_rank_key(item: Tuple[float, Dict[str, Any]]) -> Tuple[int, float, float]:
+                    r = item[1]
+                    priority = 2
+                    if buyer_dormitory_id is not None and int(r.get("dormitory_id") or 0) == buyer_dormitory_id:
+                        priority = 0
+                    else:
+                        uni = r.get("dormitory__university_id")
+                        uni = int(uni) if uni is not None else None
+                        if buyer_university_id is not None and uni == buyer_university_id:
+                            priority = 1
+
+                    distance = r.get("_distance_km")
+                    distance_sort = float(distance) if distance is not None else 1.0e9
+
+                    created_at = r.get("created_at")
+                    created_ts = 0.0
+                    if isinstance(created_at, str):
+                        try:
+                            created_at = datetime.fromisoformat(created_at.replace("Z", "+00:00")).replace(tzinfo=None)
+                        except Exception:
+                            created_at = None
+                    if isinstance(created_at, datetime):
+                        created_ts = created_at.timestamp()
+
+                    return priority, distance_sort, -created_ts
+
+                return [r for _, r in sorted(scored, key=_local_rank_key)]
             scored.sort(key=lambda x: (x[0], x[1].get("created_at") or ""), reverse=True)
-            ranked = [r for _, r in scored]
+            return [r for _, r in scored]
 
-        deterministic_count = max(0, page_size - random_count)
-        start = (page - 1) * deterministic_count if deterministic_count > 0 else 0
-        base_items = ranked[start : start + deterministic_count] if deterministic_count > 0 else []
+        ranked = offload(_score_rows)
+        ranked_ids = [int(r["id"]) for r in ranked]
+        rows_by_id = {int(r["id"]): r for r in ranked}
 
-        base_ids = {int(p["id"]) for p in base_items}
-        pool = [p for p in ranked if int(p["id"]) not in base_ids]
-
-        if seed is None:
-            seed_value = (
-                user_id * 1000003 + page * 9176 + last_event_id * 1013 + last_exchange_product_id * 7919
-            ) % (2**31 - 1)
-            if seed_value <= 0:
-                seed_value = 1
-        else:
-            seed_value = seed
-        rng = random.Random(seed_value)
-
-        random_items = pool[:]
-        rng.shuffle(random_items)
-        random_items = random_items[:random_count]
-
-        combined = base_items + random_items
-        if len(combined) < page_size:
-            existing_ids = {int(p["id"]) for p in combined}
-            for candidate in ranked:
-                pid = int(candidate["id"])
-                if pid in existing_ids:
-                    continue
-                combined.append(candidate)
-                existing_ids.add(pid)
-                if len(combined) >= page_size:
-                    break
-        combined_ids = [int(p["id"]) for p in combined]
+    ranking = {
+        "ranked_ids": ranked_ids,
+        "last_event_id": last_event_id,
+        "last_event_at": last_event_at,
+        "last_exchange_product_id": last_exchange_product_id,
+        "last_exchange_product_at": last_exchange_product_at,
+    }
+    return ranking, rows_by_id
 
-        images = []
-        tags = []
-        if combined_ids:
-            placeholders = ", ".join([f":pid_{i}" for i in range(len(combined_ids))])
-            pid_params = {f"pid_{i}": v for i, v in enumerate(combined_ids)}
 
-            try:
-                images = conn.execute(
-                    text(
-                        f"""
-                        SELECT product_id, image_url, image_thumbnail_url, is_primary
-                        FROM product_images
-                        WHERE product_id IN ({placeholders})
-                        ORDER BY is_primary DESC, id ASC
-                        """
-                    ),
-                    pid_params,
-                ).mappings().all()
-            except ProgrammingError as e:
-                if not (getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146):
-                    raise
-                images = []
+def _recommend_exchange_products_response(
+    conn,
+    request: Request,
+    user: Dict[str, Any],
+    page: int,
+    page_size: int,
+    random_count: int,
+    lookback_days: int,
+    seed: Optional[int],
+    exchange_type_value: Optional[str],
+    max_distance_km: Optional[float],
+    continuation_token: Optional[str],
+) -> dict:
+    user_id = int(user["id"])
+    buyer_dormitory_id = user.get("dormitory_id")
+    buyer_dormitory_id = int(buyer_dormitory_id) if buyer_dormitory_id else None
+    now = _now_utc_naive()
 
-            try:
-                tags = conn.execute(
-                    text(
-                        f"""
-                        SELECT pt.product_id, t.id, t.name
-                        FROM product_tags pt
-                        JOIN tags t ON t.id = pt.tag_id
-                        WHERE pt.product_id IN ({placeholders})
-                        ORDER BY t.id ASC
-                        """
-                    ),
-                    pid_params,
-                ).mappings().all()
-            except ProgrammingError as e:
-                if not (getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146):
-                    raise
-                tags = []
+    exchange_index = get_exchange_match_index()
+    catalogue = get_catalogue_store().snapshot()
+    matches = None
+    if exchange_index.ready and catalogue is not None:
+        matches = offload(exchange_index.match, user_id, catalogue, exchange_type=exchange_type_value)
+
+    ranking_token = _recommendation_ranking_token(
+        "exchange_products",
+        user_id,
+        buyer_dormitory_id,
+        lookback_days,
+        max_distance_km,
+        exchange_type_value,
+        *_recommendation_versions(user_id),
+        exchange_index.marker if matches is not None else None,
+    )
+    ranking = _cached_recommendation_ranking("recommend_exchange_products", ranking_token, continuation_token)
+    rows_by_id: Dict[int, Any] = {}
+    if ranking is None:
+        ranking, rows_by_id = _rank_recommended_exchange_products(
+            conn,
+            user_id,
+            buyer_dormitory_id,
+            lookback_days,
+            exchange_type_value,
+            max_distance_km,
+            now,
+            catalogue,
+            matches,
+        )
+        _store_recommendation_ranking("recommend_exchange_products", ranking_token, ranking)
+    ranked_ids = ranking["ranked_ids"]
+    last_event_id, last_event_at = ranking["last_event_id"], ranking["last_event_at"]
+    last_exchange_product_id = ranking["last_exchange_product_id"]
+    last_exchange_product_at = ranking["last_exchange_product_at"]
+
+    deterministic_count = max(0, page_size - random_count)
+    start = (page - 1) * deterministic_count if deterministic_count > 0 else 0
+    base_ids = ranked_ids[start : start + deterministic_count] if deterministic_count > 0 else []
+
+    base_id_set = set(base_ids)
+    pool = [pid for pid in ranked_ids if pid not in base_id_set]
+
+    if seed is None:
+        seed_value = (
+            user_id * 1000003 + page * 9176 + last_event_id * 1013 + last_exchange_product_id * 7919
+        ) % (2**31 - 1)
+        if seed_value <= 0:
+            seed_value = 1
+    else:
+        seed_value = seed
+    rng = random.Random(seed_value)
+
+    random_ids = pool[:]
+    rng.shuffle(random_ids)
+    random_ids = random_ids[:random_count]
+
+    combined_ids = base_ids + random_ids
+    if len(combined_ids) < page_size:
+        existing_ids = set(combined_ids)
+        for pid in ranked_ids:
+            if pid in existing_ids:
+                continue
+            combined_ids.append(pid)
+            existing_ids.add(pid)
+            if len(combined_ids) >= page_size:
+                break
+
+    def _load_exchange_cards(ids: List[int]) -> Dict[int, Any]:
+        missing_ids = [pid for pid in ids if pid not in rows_by_id]
+        if missing_ids:
+            hydrated_rows = conn.execute(
+                text(_RECOMMEND_EXCHANGE_BASE_QUERY + " AND p.id IN :product_ids").bindparams(bindparam("product_ids", expanding=True)),
+                {"product_ids": missing_ids},
+            ).mappings().all()
+            rows_by_id.update({int(r["id"]): r for r in hydrated_rows})
+        return get_product_hydrator().cards(conn, [pid for pid in ids if pid in rows_by_id])
 
-    images_by_product = _group_by_key([dict(x) for x in images], "product_id")
-    tag_rows_by_product = _group_by_key([dict(x) for x in tags], "product_id")
+    try:
+        combined_ids, cards = _fill_recommendation_page(combined_ids, ranked_ids, page_size, _load_exchange_cards)
+    except ProgrammingError as e:
+        if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
+            table = _missing_table_name_from_programming_error(e) or "unknown"
+            raise HTTPException(
+                status_code=503,
+                detail=f"Database '{os.environ.get('DB_DATABASE', 'XiaoWu')}' missing table: {table}. Check DB_* env or run Laravel migrations.",
+            )
+        raise
+    combined = [rows_by_id[pid] for pid in combined_ids if pid in cards]
 
     base_url = _request_laravel_base_url(request)
     payload_exchange_products = []
     for p in combined:
         pid = int(p["id"])
-        imgs = images_by_product.get(pid, [])
-        image_url = None
-        image_thumbnail_url = None
-        if imgs:
-            first = imgs[0]
-            image_url = _resolve_image_url(first.get("image_url"), base_url)
-            image_thumbnail_url = _resolve_image_url(first.get("image_thumbnail_url"), base_url)
-        product_images = [
-            {
-                "image_url": _resolve_image_url(img.get("image_url"), base_url),
-                "image_thumbnail_url": _resolve_image_url(img.get("image_thumbnail_url"), base_url),
-                "is_primary": bool(img.get("is_primary")),
-            }
-            for img in imgs
-        ]
-        seller_profile_picture = _resolve_image_url(p.get("seller__profile_picture"), base_url)
 
         expiration_date = p.get("expiration_date")
         if isinstance(expiration_date, datetime):
@@ -2461,6 +2884,13 @@ def recommend_exchange_products(
             except Exception:
                 pass
 
+        match = None
+        if matches is not None:
+            match = {
+                "wants_my_product_ids": matches.wants_mine.get(pid, []),
+                "wanted_by_me": pid in matches.wanted_by_me,
+            }
+
         exchange_product = {
             "id": exchange_product_id,
             "exchange_type": p.get("exchange_type"),
@@ -2476,42 +2906,12 @@ def recommend_exchange_products(
                 "name": p.get("target_condition__name"),
                 "level": p.get("target_condition__level"),
             } if target_condition_id is not None else None,
+            "match": match,
         }
 
-        prod: Dict[str, Any] = {
-            "id": pid,
-            "title": p.get("title"),
-            "price": float(p["price"]) if p.get("price") is not None else None,
-            "currency": (str(p.get("currency") or "CNY")).strip().upper(),
-            "status": p.get("status"),
-            "created_at": p.get("created_at"),
-            "category_id": p.get("category_id"),
-            "condition_level_id": p.get("condition_level_id"),
-            "is_promoted": int(p.get("is_promoted") or 0),
-            "seller": {
-                "id": p.get("seller__id"),
-                "username": p.get("seller__username"),
-                "profile_picture": seller_profile_picture,
-            },
-            "dormitory": {
-                "latitude": p.get("dormitory__latitude"),
-                "longitude": p.get("dormitory__longitude"),
-            },
-            "condition_level": {
-                "id": p.get("condition_level__id"),
-                "name": p.get("condition_level__name"),
-                "level": p.get("condition_level__level"),
-            },
-            "image_url": image_url,
-            "image_thumbnail_url": image_thumbnail_url,
-            "images": product_images,
-            "tags": [
-                {"id": t.get("id"), "name": t.get("name")} for t in tag_rows_by_product.get(pid, [])
-            ],
-        }
         payload_exchange_products.append({
             "exchange_product": exchange_product,
-            "product": prod,
+            "product": _product_card_payload(cards[pid], base_url, with_images=True),
         })
 
     return {
@@ -2523,207 +2923,266 @@ def recommend_exchange_products(
         "last_event_at": last_event_at,
         "last_exchange_product_id": last_exchange_product_id,
         "last_exchange_product_at": last_exchange_product_at,
+        "continuation_token": ranking_token,
         "exchange_products": payload_exchange_products[:page_size],
     }
 
 
-@py_router.get("/py/api/user/products/{product_id}/similar")
-def similar_products(
-    product_id: int,
-    authorization: Optional[str] = Header(default=None),
-    page: int = Query(default=1, ge=1),
-    page_size: int = Query(default=10, ge=1, le=50),
-) -> dict:
-    user = _read_user_from_authorization(authorization or "")
-    role = user.get("role")
-    if role is not None and str(role).lower() != "user":
-        raise HTTPException(status_code=403, detail="Only users can access this endpoint")
+_SIMILAR_CRITERIA = ("category_id", "condition_level_id", "dormitory_id", "seller_id")
 
-    engine = _get_db_engine()
+def _encode_similar_cursor(created_at: Any, product_id: int) -> str:
+    created_raw = created_at.isoformat() if isinstance(created_at, datetime) else str(created_at)
+    raw = json.dumps({"c": created_raw, "i": int(product_id)}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
 
-    try:
-        conn = engine.connect()
-    except Exception:
-        raise HTTPException(status_code=503, detail="Database unavailable")
 
-    with conn:
-        try:
-            base_product = conn.execute(
-                text(
-                    """
-                    SELECT p.id, p.category_id, p.condition_level_id, p.dormitory_id, p.seller_id
-                    FROM products p
-                    WHERE p.id = :product_id AND p.deleted_at IS NULL
-                    LIMIT 1
-                    """
-                ),
-                {"product_id": product_id},
-            ).mappings().first()
-        except ProgrammingError as e:
-            if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
-                table = _missing_table_name_from_programming_error(e) or "unknown"
-                raise HTTPException(
-                    status_code=503,
-                    detail=f"Database '{os.environ.get('DB_DATABASE', 'XiaoWu')}' missing table: {table}. Check DB_* env or run Laravel migrations.",
-                )
-            raise
+def _encode_similar_index_cursor(remaining_ids: List[int], total: int) -> str:
+    # Carries the rest of the page-1 neighbour list, so any worker continues the same list whether or not
+    # its own index is ready or has drifted since.
+    raw = json.dumps({"r": [int(pid) for pid in remaining_ids], "n": int(total)}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
 
-        if not base_product:
-            raise HTTPException(status_code=404, detail="Product not found")
 
-        category_id = base_product.get("category_id")
-        condition_level_id = base_product.get("condition_level_id")
-        dormitory_id = base_product.get("dormitory_id")
-        seller_id = base_product.get("seller_id")
+def _decode_similar_cursor(cursor: str) -> Any:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+        if "r" in payload:
+            remaining = [int(pid) for pid in payload["r"]]
+            if not remaining:
+                raise ValueError("empty neighbour list")
+            return remaining, int(payload["n"])
+        created_at = datetime.fromisoformat(str(payload["c"]).replace("Z", "+00:00")).replace(tzinfo=None)
+        return created_at, int(payload["i"])
+    except Exception:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
 
-        filters: List[str] = []
-        params: Dict[str, Any] = {"product_id": product_id}
 
-        if category_id is not None:
-            filters.append("p.category_id = :category_id")
-            params["category_id"] = category_id
-        if condition_level_id is not None:
-            filters.append("p.condition_level_id = :condition_level_id")
-            params["condition_level_id"] = condition_level_id
-        if dormitory_id is not None:
-            filters.append("p.dormitory_id = :dormitory_id")
-            params["dormitory_id"] = dormitory_id
-        if seller_id is not None:
-            filters.append("p.seller_id = :seller_id")
-            params["seller_id"] = seller_id
+def _similar_sort_key(row: Any) -> Tuple[datetime, int]:
+    created_at = row.get("created_at")
+    if isinstance(created_at, str):
+        try:
+            created_at = datetime.fromisoformat(created_at.replace("Z", "+00:00")).replace(tzinfo=None)
+        except Exception:
+            created_at = None
+    if not isinstance(created_at, datetime):
+        created_at = datetime.min
+    return created_at, int(row["id"])
 
-        if not filters:
-            filters.append("1 = 1")
 
-        filter_sql = " OR ".join(filters)
+def _similar_criterion_rows(
+    conn,
+    product_id: int,
+    column: str,
+    value: Any,
+    chunk_size: int,
+    after: Optional[Tuple[datetime, int]],
+) -> Iterator[Any]:
+    # Walks one criterion in keyset chunks, so deep pages read only the rows the merge actually consumes.
+    while True:
+        keyset_sql = ""
+        params: Dict[str, Any] = {"product_id": product_id, "criterion_value": value, "limit": chunk_size}
+        if after is not None:
+            keyset_sql = " AND (p.created_at < :after_created_at OR (p.created_at = :after_created_at AND p.id < :after_id))"
+            params["after_created_at"], params["after_id"] = after
+        rows = conn.execute(
+            text(
+                f"""
+                SELECT p.id, p.created_at
+                FROM products p
+                JOIN users u ON u.id = p.seller_id
+                WHERE p.status = 'available' AND p.deleted_at IS NULL
+                  AND p.id <> :product_id AND p.{column} = :criterion_value{keyset_sql}
+                ORDER BY p.created_at DESC, p.id DESC
+                LIMIT :limit
+                """
+            ),
+            params,
+        ).mappings().all()
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        after = _similar_sort_key(rows[-1])
+        chunk_size = min(chunk_size * 2, 500)
+
+
+def _similar_candidate_keys(
+    conn,
+    product_id: int,
+    criteria: Dict[str, Any],
+    offset: int,
+    limit: int,
+    after: Optional[Tuple[datetime, int]],
+) -> List[Any]:
+    lookups = [(column, value) for column, value in criteria.items() if value is not None]
+    streams = [_similar_criterion_rows(conn, product_id, column, value, limit, after) for column, value in lookups]
+
+    merged: List[Any] = []
+    seen: Set[int] = set()
+    for row in heapq.merge(*streams, key=_similar_sort_key, reverse=True):
+        pid = int(row["id"])
+        if pid in seen:
+            continue
+        seen.add(pid)
+        if len(seen) <= offset:
+            continue
+        merged.append(row)
+        if len(merged) >= limit:
+            break
+    return merged
+
+
+def _similar_total(conn, product_id: int, criteria: Dict[str, Any]) -> int:
+    filters = [f"p.{column} = :{column}" for column, value in criteria.items() if value is not None]
+    params = {column: value for column, value in criteria.items() if value is not None}
+    if not filters:
+        return 0
+
+    def _count() -> int:
+        row = conn.execute(
+            text(
+                f"""
+                SELECT COUNT(*) AS total
+                FROM products p
+                JOIN users u ON u.id = p.seller_id
+                WHERE p.status = 'available' AND p.deleted_at IS NULL
+                  AND p.id <> :product_id
+                  AND ({" OR ".join(filters)})
+                """
+            ),
+            {**params, "product_id": product_id},
+        ).mappings().first()
+        return int((row or {}).get("total") or 0)
+
+    key = ":".join([str(product_id)] + [str(criteria.get(column)) for column in _SIMILAR_CRITERIA])
+    return int(get_cache().get_or_load("similar_total", key, _count, _similar_total_ttl_seconds, tags=("catalogue",)))
 
-        offset = (page - 1) * page_size
 
-        try:
-            rows = conn.execute(
-                text(
-                    f"""
-                    SELECT
-                        p.id, p.seller_id, p.dormitory_id, p.category_id, p.condition_level_id,
-                        p.title, p.price, p.currency, p.status, p.created_at,
-                        COALESCE(d_user.latitude, d_product.latitude) AS dormitory__latitude,
-                        COALESCE(d_user.longitude, d_product.longitude) AS dormitory__longitude,
-                        cl.id AS condition_level__id, cl.name AS condition_level__name,
-                        cl.level AS condition_level__level,
-                        CASE WHEN pl.id IS NULL THEN 0 ELSE 1 END AS is_promoted,
-                        COUNT(*) OVER() AS total_count
-                    FROM products p
-                    JOIN users u ON u.id = p.seller_id
-                    LEFT JOIN dormitories d_user ON d_user.id = u.dormitory_id
-                    LEFT JOIN dormitories d_product ON d_product.id = p.dormitory_id
-                    LEFT JOIN condition_levels cl ON cl.id = p.condition_level_id
-                    LEFT JOIN promoted_listings pl ON pl.product_id = p.id AND pl.promoted_until > NOW()
-                    WHERE p.status = 'available' AND p.deleted_at IS NULL
-                      AND p.id <> :product_id
-                      AND ({filter_sql})
-                    ORDER BY p.created_at DESC, p.id DESC
-                    LIMIT :limit OFFSET :offset
-                    """
-                ),
-                {**params, "limit": page_size, "offset": offset},
-            ).mappings().all()
-        except ProgrammingError as e:
-            if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
-                table = _missing_table_name_from_programming_error(e) or "unknown"
-                raise HTTPException(
-                    status_code=503,
-                    detail=f"Database '{os.environ.get('DB_DATABASE', 'XiaoWu')}' missing table: {table}. Check DB_* env or run Laravel migrations.",
-                )
-            raise
+@py_router.get("/py/api/user/products/{product_id}/similar")
+async def similar_products(
+    product_id: int,
+    authorization: Optional[str] = Header(default=None),
+    page: Optional[int] = Query(default=None, ge=1),
+    page_size: int = Query(default=10, ge=1, le=50),
+    cursor: Optional[str] = Query(default=None, max_length=4096),
+    include_total: Optional[bool] = Query(default=None),
+) -> dict:
+    user = await run_in_threadpool(_read_user_from_authorization, authorization or "")
+    role = user.get("role")
+    if role is not None and str(role).lower() != "user":
+        raise HTTPException(status_code=403, detail="Only users can access this endpoint")
 
-        total = int(rows[0].get("total_count") or 0) if rows else 0
-        total_pages = max(1, math.ceil(total / page_size)) if page_size > 0 else 1
+    decoded_cursor = _decode_similar_cursor(cursor) if cursor else None
+    index_page = decoded_cursor if isinstance(decoded_cursor, tuple) and isinstance(decoded_cursor[0], list) else None
+    after = decoded_cursor if isinstance(decoded_cursor, tuple) and index_page is None else None
+    if include_total is None:
+        include_total = decoded_cursor is None
+
+    return await _run_db_call(
+        _similar_products_response,
+        product_id,
+        page,
+        page_size,
+        decoded_cursor,
+        index_page,
+        after,
+        include_total,
+    )
 
-        product_ids = [int(r["id"]) for r in rows]
-        images = []
-        tags = []
-        if product_ids:
-            placeholders = ", ".join([f":pid_{i}" for i in range(len(product_ids))])
-            pid_params = {f"pid_{i}": v for i, v in enumerate(product_ids)}
 
-            try:
-                images = conn.execute(
-                    text(
-                        f"""
-                        SELECT product_id, image_url, image_thumbnail_url, is_primary
-                        FROM product_images
-                        WHERE product_id IN ({placeholders})
-                        ORDER BY is_primary DESC, id ASC
-                        """
-                    ),
-                    pid_params,
-                ).mappings().all()
-            except ProgrammingError as e:
-                if not (getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146):
-                    raise
-                images = []
+def _similar_products_response(
+    conn,
+    product_id: int,
+    page: Optional[int],
+    page_size: int,
+    decoded_cursor: Any,
+    index_page: Optional[Tuple[List[int], int]],
+    after: Optional[Tuple[datetime, int]],
+    include_total: bool,
+) -> dict:
+    try:
+        base_product = conn.execute(
+            text(
+                """
+                SELECT p.id, p.category_id, p.condition_level_id, p.dormitory_id, p.seller_id
+                FROM products p
+                WHERE p.id = :product_id AND p.deleted_at IS NULL
+                LIMIT 1
+                """
+            ),
+            {"product_id": product_id},
+        ).mappings().first()
+    except ProgrammingError as e:
+        if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
+            table = _missing_table_name_from_programming_error(e) or "unknown"
+            raise HTTPException(
+                status_code=503,
+                detail=f"Database '{os.environ.get('DB_DATABASE', 'XiaoWu')}' missing table: {table}. Check DB_* env or run Laravel migrations.",
+            )
+        raise
+
+    if not base_product:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    criteria = {column: base_product.get(column) for column in _SIMILAR_CRITERIA}
+    # The source is fixed by the request, never by this worker's index state: cursor paging starts from the
+    # neighbour list and carries it in the cursor, keyset cursors and page numbers always read SQL.
+    offset = (page - 1) * page_size if page is not None and decoded_cursor is None else 0
+    if index_page is not None:
+        neighbour_ids, neighbour_total = index_page
+    elif page is None and decoded_cursor is None:
+        neighbour_ids = get_similarity_index().neighbours(product_id)
+        neighbour_total = len(neighbour_ids or [])
+    else:
+        neighbour_ids, neighbour_total = None, 0
+    source = "similarity_index" if neighbour_ids else "sql"
 
-            try:
-                tags = conn.execute(
-                    text(
-                        f"""
-                        SELECT pt.product_id, t.id, t.name
-                        FROM product_tags pt
-                        JOIN tags t ON t.id = pt.tag_id
-                        WHERE pt.product_id IN ({placeholders})
-                        ORDER BY t.id ASC
-                        """
-                    ),
-                    pid_params,
-                ).mappings().all()
-            except ProgrammingError as e:
-                if not (getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146):
-                    raise
-                tags = []
+    try:
+        if neighbour_ids:
+            page_ids = neighbour_ids[:page_size]
+            has_more = len(neighbour_ids) > page_size
+            keys = []
+        else:
+            keys = _similar_candidate_keys(conn, product_id, criteria, offset, page_size + 1, after)
+            has_more = len(keys) > page_size
+            keys = keys[:page_size]
+            page_ids = [int(k["id"]) for k in keys]
+        cards = get_product_hydrator().cards(conn, page_ids)
+        if not include_total:
+            total = None
+        elif neighbour_ids:
+            total = neighbour_total
+        else:
+            total = _similar_total(conn, product_id, criteria)
+    except ProgrammingError as e:
+        if getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146:
+            table = _missing_table_name_from_programming_error(e) or "unknown"
+            raise HTTPException(
+                status_code=503,
+                detail=f"Database '{os.environ.get('DB_DATABASE', 'XiaoWu')}' missing table: {table}. Check DB_* env or run Laravel migrations.",
+            )
+        raise
 
-    images_by_product = _group_by_key([dict(x) for x in images], "product_id")
-    tag_rows_by_product = _group_by_key([dict(x) for x in tags], "product_id")
+    total_pages = max(1, math.ceil(total / page_size)) if total is not None else None
+    next_cursor = None
+    if has_more and neighbour_ids:
+        next_cursor = _encode_similar_index_cursor(neighbour_ids[page_size:], neighbour_total)
+    elif has_more and keys:
+        next_cursor = _encode_similar_cursor(keys[-1]["created_at"], int(keys[-1]["id"]))
 
-    payload_products = []
-    for p in rows:
-        pid = int(p["id"])
-        imgs = images_by_product.get(pid, [])
-        image_thumbnail_url = None
-        if imgs:
-            first = imgs[0]
-            image_thumbnail_url = first.get("image_thumbnail_url")
-        prod: Dict[str, Any] = {
-            "id": pid,
-            "title": p.get("title"),
-            "price": float(p["price"]) if p.get("price") is not None else None,
-            "currency": (str(p.get("currency") or "CNY")).strip().upper(),
-            "status": p.get("status"),
-            "created_at": p.get("created_at"),
-            "category_id": p.get("category_id"),
-            "condition_level_id": p.get("condition_level_id"),
-            "is_promoted": int(p.get("is_promoted") or 0),
-            "dormitory": {
-                "latitude": p.get("dormitory__latitude"),
-                "longitude": p.get("dormitory__longitude"),
-            },
-            "condition_level": {
-                "id": p.get("condition_level__id"),
-                "name": p.get("condition_level__name"),
-                "level": p.get("condition_level__level"),
-            },
-            "image_thumbnail_url": image_thumbnail_url,
-            "tags": [
-                {"id": t.get("id"), "name": t.get("name")} for t in tag_rows_by_product.get(pid, [])
-            ],
-        }
-        payload_products.append(prod)
+    payload_products = [
+        _product_card_payload(cards[pid], None, with_seller=False, resolve_urls=False) for pid in page_ids if pid in cards
+    ]
 
     return {
         "message": "Similar products retrieved successfully",
         "product_id": product_id,
-        "page": page,
+        "page": (page or 1) if decoded_cursor is None else None,
         "page_size": page_size,
         "total": total,
         "total_pages": total_pages,
+        "has_more": has_more,
+        "next_cursor": next_cursor,
+        "source": source,
         "products": payload_products,
     }
@@ -0,0 +1,461 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.database import offload
+
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+def _safe_env_float(name: str, default: float) -> float:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return float(raw)
+    except Exception:
+        return default
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, default=str)
+    return json.dumps(value, default=str, separators=(",", ":")).encode("utf-8")
+
+
+def loads(raw: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    if isinstance(raw, (bytes, bytearray)):
+        raw = raw.decode("utf-8")
+    return json.loads(raw)
+
+
+class CacheUnavailable(RuntimeError):
+    pass
+
+
+def _read_only(self, *args: Any, **kwargs: Any) -> Any:
+    raise TypeError("Cached values are shared and read-only; copy before modifying")
+
+
+class FrozenDict(dict):
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class FrozenList(list):
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = clear = _read_only
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def freeze(value: Any) -> Any:
+    """Read-only copy of a decoded value, so L1 can hand the same object to every hit."""
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    return value
+
+
+_MISSING = object()
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class TieredCache:
+    def __init__(self) -> None:
+        self.l1_max_entries = max(100, _safe_env_int("CACHE_L1_MAX_ENTRIES", 10000))
+        self.l1_max_ttl_seconds = max(1, _safe_env_int("CACHE_L1_MAX_TTL_SECONDS", 30))
+        self.coalesce_wait_seconds = max(0.1, _safe_env_float("CACHE_COALESCE_WAIT_SECONDS", 10.0))
+        self.blob_chunk_bytes = max(64 * 1024, _safe_env_int("CACHE_BLOB_CHUNK_BYTES", 512 * 1024))
+        # Tagged L1 entries re-read their tag versions from Redis at most this often, so an invalidation on
+        # another worker is seen within this delay instead of after the L1 TTL.
+        self.tag_check_seconds = max(0.05, _safe_env_int("CACHE_TAG_CHECK_MS", 1000) / 1000.0)
+        self._lock = threading.Lock()
+        self._l1: "OrderedDict[str, Tuple[float, Any, Dict[str, int]]]" = OrderedDict()
+        self._tag_versions: Dict[str, int] = {}
+        self._tag_checked: Dict[str, float] = {}
+        self._inflight: Dict[str, _Flight] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._redis = None
+        url = (os.environ.get("REDIS_URL") or "").strip()
+        if url and redis is not None:
+            try:
+                pool = redis.ConnectionPool.from_url(
+                    url,
+                    max_connections=max(1, _safe_env_int("CACHE_REDIS_MAX_CONNECTIONS", 20)),
+                    socket_timeout=max(0.05, _safe_env_float("CACHE_REDIS_SOCKET_TIMEOUT_SECONDS", 0.25)),
+                    socket_connect_timeout=max(0.05, _safe_env_float("CACHE_REDIS_CONNECT_TIMEOUT_SECONDS", 0.5)),
+                )
+                self._redis = redis.Redis(connection_pool=pool)
+                self._redis.ping()
+            except Exception:
+                self._redis = None
+
+    def _full_key(self, namespace: str, key: str) -> str:
+        return f"cache:{namespace}:{key}"
+
+    def _tag_key(self, tag: str) -> str:
+        return f"cache:tag:{tag}"
+
+    def _blob_key(self, namespace: str, key: str) -> str:
+        return f"cache:blob:{namespace}:{key}"
+
+    def _record(self, namespace: str, **deltas: float) -> None:
+        with self._lock:
+            bucket = self._stats.setdefault(
+                namespace,
+                {"l1_hits": 0, "l2_hits": 0, "misses": 0, "coalesced": 0, "loads": 0, "load_errors": 0, "load_ms": 0.0, "get_ms": 0.0},
+            )
+            for name, delta in deltas.items():
+                bucket[name] = bucket.get(name, 0) + delta
+
+    def _tags_current(self, tag_versions: Dict[str, int]) -> bool:
+        return all(self._tag_versions.get(tag, 0) == version for tag, version in tag_versions.items())
+
+    def _merge_remote_tags(self, tags: Iterable[str], values: Iterable[Any]) -> None:
+        # Caller holds self._lock.
+        for tag, value in zip(tags, values):
+            remote = int(value or 0)
+            if remote > self._tag_versions.get(tag, 0):
+                self._tag_versions[tag] = remote
+
+    def _refresh_tags(self, tags: Iterable[str]) -> None:
+        if self._redis is None:
+            return
+        now_mono = time.monotonic()
+        with self._lock:
+            due = [tag for tag in tags if now_mono - self._tag_checked.get(tag, 0.0) >= self.tag_check_seconds]
+            for tag in due:
+                self._tag_checked[tag] = now_mono
+        if not due:
+            return
+        try:
+            current = offload(self._redis.mget, [self._tag_key(tag) for tag in due])
+        except Exception:
+            return
+        with self._lock:
+            self._merge_remote_tags(due, current)
+
+    def _l1_get(self, full_key: str) -> Any:
+        now_mono = time.monotonic()
+        with self._lock:
+            entry = self._l1.get(full_key)
+        if entry is None:
+            return _MISSING
+        expires_at, value, tag_versions = entry
+        if tag_versions:
+            self._refresh_tags(tag_versions)
+        with self._lock:
+            if expires_at < now_mono or not self._tags_current(tag_versions):
+                if self._l1.get(full_key) is entry:
+                    self._l1.pop(full_key, None)
+                return _MISSING
+            if full_key in self._l1:
+                self._l1.move_to_end(full_key)
+            return value
+
+    def _l1_set(self, full_key: str, value: Any, ttl_seconds: float, tag_versions: Dict[str, int]) -> None:
+        if self._redis is not None:
+            ttl_seconds = min(float(ttl_seconds), float(self.l1_max_ttl_seconds))
+        expires_at = time.monotonic() + float(ttl_seconds)
+        with self._lock:
+            self._l1[full_key] = (expires_at, value, tag_versions)
+            self._l1.move_to_end(full_key)
+            while len(self._l1) > self.l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _l2_get(self, full_key: str) -> Optional[Tuple[Any, float, Dict[str, int]]]:
+        if self._redis is None:
+            return None
+        try:
+            raw = self._redis.get(full_key)
+            if not raw:
+                return None
+            envelope = loads(raw)
+            tag_versions = {str(k): int(v) for k, v in (envelope.get("t") or {}).items()}
+            if tag_versions:
+                current = self._redis.mget([self._tag_key(tag) for tag in tag_versions])
+                with self._lock:
+                    self._merge_remote_tags(tag_versions, current)
+                    checked = time.monotonic()
+                    for tag in tag_versions:
+                        self._tag_checked[tag] = checked
+                    if not self._tags_current(tag_versions):
+                        return None
+            return envelope.get("v"), float(envelope.get("e") or 0), tag_versions
+        except Exception:
+            return None
+
+    def _l2_set(self, full_key: str, value: Any, ttl_seconds: float, tag_versions: Dict[str, int]) -> None:
+        if self._redis is None:
+            return
+        try:
+            envelope = {"v": value, "e": time.time() + float(ttl_seconds), "t": tag_versions}
+            self._redis.set(full_key, dumps(envelope), px=max(1, int(ttl_seconds * 1000)))
+        except Exception:
+            pass
+
+    def get(self, namespace: str, key: str) -> Tuple[bool, Any]:
+        started = time.perf_counter()
+        full_key = self._full_key(namespace, key)
+        value = self._l1_get(full_key)
+        if value is not _MISSING:
+            self._record(namespace, l1_hits=1, get_ms=(time.perf_counter() - started) * 1000)
+            return True, value
+        l2 = offload(self._l2_get, full_key) if self._redis is not None else None
+        if l2 is not None:
+            value, expires_at, tag_versions = l2
+            value = freeze(value)
+            remaining = expires_at - time.time()
+            if remaining > 0:
+                self._l1_set(full_key, value, remaining, tag_versions)
+            self._record(namespace, l2_hits=1, get_ms=(time.perf_counter() - started) * 1000)
+            return True, value
+        self._record(namespace, misses=1, get_ms=(time.perf_counter() - started) * 1000)
+        return False, None
+
+    def _snapshot_tags(self, tags: Iterable[str]) -> Dict[str, int]:
+        tags = [str(tag) for tag in tags]
+        self._refresh_tags(tags)
+        with self._lock:
+            return {tag: self._tag_versions.get(tag, 0) for tag in tags}
+
+    def _store(self, full_key: str, value: Any, ttl_seconds: float, tag_versions: Dict[str, int]) -> Any:
+        # Round-trip through the codec once per store so L1 hits match what an L2 hit decodes
+        # (datetimes as strings, tuples as lists), then share one read-only copy.
+        frozen = freeze(loads(dumps(value)))
+        self._l1_set(full_key, frozen, ttl_seconds, tag_versions)
+        if self._redis is not None:
+            offload(self._l2_set, full_key, value, ttl_seconds, tag_versions)
+        return frozen
+
+    def set(self, namespace: str, key: str, value: Any, ttl_seconds: float, tags: Iterable[str] = ()) -> None:
+        self._store(self._full_key(namespace, key), value, ttl_seconds, self._snapshot_tags(tags))
+
+    def get_or_load(
+        self,
+        namespace: str,
+        key: str,
+        loader: Callable[[], Any],
+        ttl_seconds: float,
+        tags: Iterable[str] = (),
+    ) -> Any:
+        found, value = self.get(namespace, key)
+        if found:
+            return value
+
+        full_key = self._full_key(namespace, key)
+        with self._lock:
+            flight = self._inflight.get(full_key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[full_key] = flight
+        if not leader:
+            if offload(flight.done.wait, self.coalesce_wait_seconds) and flight.error is None:
+                self._record(namespace, coalesced=1)
+                return flight.value
+            return loader()
+
+        tag_versions = self._snapshot_tags(tags)
+        started = time.perf_counter()
+        try:
+            value = loader()
+            flight.value = self._store(full_key, value, ttl_seconds, tag_versions)
+            self._record(namespace, loads=1, load_ms=(time.perf_counter() - started) * 1000)
+            return value
+        except BaseException as e:
+            flight.error = e
+            self._record(namespace, load_errors=1)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(full_key, None)
+            flight.done.set()
+
+    def delete(self, namespace: str, key: str) -> None:
+        full_key = self._full_key(namespace, key)
+        with self._lock:
+            self._l1.pop(full_key, None)
+        if self._redis is not None:
+            try:
+                offload(self._redis.delete, full_key)
+            except Exception:
+                pass
+
+    def invalidate_tags(self, *tags: str) -> None:
+        if not tags:
+            return
+        remote: List[Any] = []
+        if self._redis is not None:
+            try:
+                pipe = self._redis.pipeline(transaction=False)
+                for tag in tags:
+                    pipe.incr(self._tag_key(tag))
+                remote = offload(pipe.execute)
+            except Exception:
+                remote = []
+        with self._lock:
+            for idx, tag in enumerate(tags):
+                bumped = self._tag_versions.get(tag, 0) + 1
+                if idx < len(remote):
+                    bumped = max(bumped, int(remote[idx] or 0))
+                self._tag_versions[tag] = bumped
+
+    def publish_blob(self, namespace: str, key: str, version: str, value: Any, ttl_seconds: float) -> bool:
+        """Shares a large value with the other workers: Redis only, split into chunks, and announced
+        through a small version key so readers can skip the download when nothing changed."""
+        if self._redis is None:
+            return False
+        raw = dumps(value)
+        size = self.blob_chunk_bytes
+        chunks = [raw[i : i + size] for i in range(0, len(raw), size)] or [b""]
+        base = self._blob_key(namespace, key)
+        px = max(1, int(ttl_seconds * 1000))
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            for idx, chunk in enumerate(chunks):
+                pipe.set(f"{base}:{version}:{idx}", chunk, px=px)
+            # Written last, so a reader never sees a version whose chunks are not all stored yet.
+            pipe.set(f"{base}:version", dumps({"v": version, "n": len(chunks)}), px=px)
+            offload(pipe.execute)
+        except Exception:
+            return False
+        return True
+
+    def blob_version(self, namespace: str, key: str) -> Optional[Tuple[str, int]]:
+        """(version, chunk count) of the published blob, None when nothing is published.
+
+        Raises CacheUnavailable when Redis cannot be reached, so callers can tell that apart from a miss.
+        """
+        if self._redis is None:
+            return None
+        try:
+            raw = offload(self._redis.get, f"{self._blob_key(namespace, key)}:version")
+        except Exception as e:
+            raise CacheUnavailable(f"{type(e).__name__}: {e}") from e
+        if not raw:
+            return None
+        meta = loads(raw)
+        return str(meta["v"]), int(meta["n"])
+
+    def get_blob(self, namespace: str, key: str, version: str, chunks: int) -> Tuple[bool, Any]:
+        if self._redis is None:
+            return False, None
+        base = self._blob_key(namespace, key)
+        try:
+            parts = offload(self._redis.mget, [f"{base}:{version}:{idx}" for idx in range(chunks)])
+        except Exception as e:
+            raise CacheUnavailable(f"{type(e).__name__}: {e}") from e
+        if any(part is None for part in parts):
+            return False, None
+        return True, loads(b"".join(parts))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            namespaces: Dict[str, Any] = {}
+            for namespace, bucket in self._stats.items():
+                lookups = bucket["l1_hits"] + bucket["l2_hits"] + bucket["misses"]
+                namespaces[namespace] = {
+                    "l1_hits": int(bucket["l1_hits"]),
+                    "l2_hits": int(bucket["l2_hits"]),
+                    "misses": int(bucket["misses"]),
+                    "coalesced": int(bucket["coalesced"]),
+                    "loads": int(bucket["loads"]),
+                    "load_errors": int(bucket["load_errors"]),
+                    "hit_ratio": round((bucket["l1_hits"] + bucket["l2_hits"]) / lookups, 4) if lookups else None,
+                    "avg_get_ms": round(bucket["get_ms"] / lookups, 3) if lookups else None,
+                    "avg_load_ms": round(bucket["load_ms"] / bucket["loads"], 3) if bucket["loads"] else None,
+                }
+            return {
+                "l1_entries": len(self._l1),
+                "l1_max_entries": self.l1_max_entries,
+                "l1_max_ttl_seconds": self.l1_max_ttl_seconds,
+                "tag_check_ms": int(self.tag_check_seconds * 1000),
+                "redis": self._redis is not None,
+                "serializer": "orjson" if orjson is not None else "json",
+                "tag_versions": dict(self._tag_versions),
+                "namespaces": namespaces,
+            }
+
+
+_tiered_cache = TieredCache()
+
+
+def get_cache() -> TieredCache:
+    return _tiered_cache
+
+
+def _default_key(arguments: Dict[str, Any]) -> str:
+    raw = dumps(sorted(arguments.items()))
+    if len(raw) <= 200:
+        return raw.decode("utf-8")
+    return hashlib.sha1(raw).hexdigest()
+
+
+def cached(
+    namespace: str,
+    ttl_seconds: float,
+    tags: Any = (),
+    key: Optional[Callable[..., str]] = None,
+    skip: Tuple[str, ...] = ("conn",),
+):
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = {name: value for name, value in bound.arguments.items() if name not in skip}
+            cache_key = key(**arguments) if key is not None else _default_key(arguments)
+            entry_tags = tags(**arguments) if callable(tags) else tags
+            return get_cache().get_or_load(
+                namespace,
+                cache_key,
+                lambda: func(*args, **kwargs),
+                ttl_seconds,
+                entry_tags,
+            )
+
+        wrapper.uncached = func
+        wrapper.cache_namespace = namespace
+        return wrapper
+
+    return decorator
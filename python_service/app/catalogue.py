@@ -0,0 +1,350 @@
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import text
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+def _to_ts(value: Any) -> float:
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=timezone.utc).timestamp()
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=timezone.utc).timestamp()
+        except Exception:
+            return float("nan")
+    return float("nan")
+
+
+def _to_float(value: Any) -> float:
+    if value is None:
+        return float("nan")
+    try:
+        return float(value)
+    except Exception:
+        return float("nan")
+
+
+def _to_id(value: Any) -> int:
+    if value is None:
+        return -1
+    try:
+        return int(value)
+    except Exception:
+        return -1
+
+
+_CATALOGUE_COLUMNS_SQL = """
+    SELECT
+        p.id,
+        p.seller_id,
+        u.dormitory_id AS seller_dormitory_id,
+        p.dormitory_id,
+        COALESCE(d_user.university_id, d_product.university_id) AS university_id,
+        p.category_id,
+        p.condition_level_id,
+        p.price,
+        p.created_at,
+        p.updated_at,
+        p.status,
+        p.deleted_at,
+        COALESCE(d_user.latitude, d_product.latitude) AS latitude,
+        COALESCE(d_user.longitude, d_product.longitude) AS longitude,
+        (
+            SELECT MAX(pl.promoted_until)
+            FROM promoted_listings pl
+            WHERE pl.product_id = p.id
+        ) AS promoted_until,
+        COALESCE(p.trending_score, 0) AS trending_score
+    FROM products p
+    JOIN users u ON u.id = p.seller_id
+    LEFT JOIN dormitories d_user ON d_user.id = u.dormitory_id
+    LEFT JOIN dormitories d_product ON d_product.id = p.dormitory_id
+"""
+
+# Same row set as the snapshot, so hard-deleted products and sellers show up as a count / id-sum mismatch.
+_LIVE_FINGERPRINT_SQL = """
+    SELECT COUNT(*) AS row_count, COALESCE(SUM(p.id), 0) AS id_sum
+    FROM products p
+    JOIN users u ON u.id = p.seller_id
+    WHERE p.status = 'available' AND p.deleted_at IS NULL
+"""
+
+_LIVE_IDS_SQL = """
+    SELECT p.id
+    FROM products p
+    JOIN users u ON u.id = p.seller_id
+    WHERE p.status = 'available' AND p.deleted_at IS NULL
+"""
+
+_COLUMN_NAMES = (
+    "ids",
+    "seller_ids",
+    "seller_dormitory_ids",
+    "dormitory_ids",
+    "university_ids",
+    "category_ids",
+    "condition_ids",
+    "prices",
+    "created_ts",
+    "updated_ts",
+    "latitudes",
+    "longitudes",
+    "promoted_until_ts",
+    "trending_scores",
+)
+
+
+@dataclass
+class CatalogueSnapshot:
+    ids: Any
+    seller_ids: Any
+    seller_dormitory_ids: Any
+    dormitory_ids: Any
+    university_ids: Any
+    category_ids: Any
+    condition_ids: Any
+    prices: Any
+    created_ts: Any
+    updated_ts: Any
+    latitudes: Any
+    longitudes: Any
+    promoted_until_ts: Any
+    trending_scores: Any
+    recency_order: Any
+    db_clock_offset: float
+    built_at: str
+
+    @property
+    def size(self) -> int:
+        return int(self.ids.shape[0])
+
+    def positions_for_ids(self, product_ids: Iterable[int]) -> Any:
+        wanted = np.asarray(list(product_ids), dtype=np.int64)
+        if wanted.size == 0 or self.size == 0:
+            return np.empty(0, dtype=np.int64)
+        sorted_pos = np.searchsorted(self.ids, wanted)
+        sorted_pos = np.clip(sorted_pos, 0, self.size - 1)
+        return sorted_pos[self.ids[sorted_pos] == wanted]
+
+    def mask_in(self, column: str, values: Iterable[int]) -> Any:
+        vals = np.asarray([int(v) for v in values], dtype=np.int64)
+        if vals.size == 0:
+            return np.zeros(self.size, dtype=bool)
+        return np.isin(getattr(self, column), vals)
+
+    def mask_equal(self, column: str, value: Optional[int]) -> Any:
+        if value is None:
+            return np.zeros(self.size, dtype=bool)
+        return getattr(self, column) == int(value)
+
+    def promoted_mask(self, now_ts: Optional[float] = None) -> Any:
+        db_now = (time.time() if now_ts is None else now_ts) + self.db_clock_offset
+        with np.errstate(invalid="ignore"):
+            return self.promoted_until_ts > db_now
+
+    def recent_positions(self, mask: Any = None, limit: int = 600) -> Any:
+        order = self.recency_order
+        if mask is not None:
+            order = order[mask[order]]
+        return order[: max(0, int(limit))]
+
+    def distance_km(self, positions: Any, lat: float, lng: float) -> Any:
+        lat1 = math.radians(lat)
+        lat2 = np.radians(self.latitudes[positions])
+        dphi = lat2 - lat1
+        dlambda = np.radians(self.longitudes[positions] - lng)
+        x = np.sin(dphi / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlambda / 2) ** 2
+        return 2 * 6371.0 * np.arctan2(np.sqrt(x), np.sqrt(1 - x))
+
+
+class CatalogueStore:
+    def __init__(self) -> None:
+        self.full_refresh_seconds = max(60, _safe_env_int("CATALOGUE_FULL_REFRESH_SECONDS", 900))
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._snapshot: Optional[CatalogueSnapshot] = None
+        self._watermark_updated_at: Optional[datetime] = None
+        self._watermark_id = 0
+        self._promoted_marker: Optional[str] = None
+        self._last_full_refresh = 0.0
+        self._stats = {
+            "full_builds": 0,
+            "incremental_refreshes": 0,
+            "rows_applied": 0,
+            "rows_removed": 0,
+            "last_build_ms": None,
+        }
+
+    @property
+    def ready(self) -> bool:
+        return np is not None and self._snapshot is not None
+
+    def snapshot(self) -> Optional[CatalogueSnapshot]:
+        return self._snapshot
+
+    def _read_promoted_marker(self, conn) -> str:
+        row = conn.execute(
+            text("SELECT COUNT(*) AS row_count, MAX(id) AS max_id, MAX(updated_at) AS max_updated_at FROM promoted_listings")
+        ).mappings().first() or {}
+        return f"{int(row.get('row_count') or 0)}:{int(row.get('max_id') or 0)}:{row.get('max_updated_at')}"
+
+    def _db_clock_offset(self, conn) -> float:
+        row = conn.execute(text("SELECT NOW() AS db_now")).mappings().first() or {}
+        db_now = row.get("db_now")
+        if not isinstance(db_now, datetime):
+            return 0.0
+        return _to_ts(db_now) - time.time()
+
+    def refresh(self, conn, force: bool = False) -> Dict[str, Any]:
+        if np is None:
+            raise RuntimeError("Missing dependency: numpy")
+        with self._refresh_lock:
+            promoted_marker = self._read_promoted_marker(conn)
+            stale = time.monotonic() - self._last_full_refresh >= self.full_refresh_seconds
+            if force or self._snapshot is None or stale or promoted_marker != self._promoted_marker:
+                return self._full_build(conn, promoted_marker)
+            return self._incremental(conn)
+
+    def _columns_from_rows(self, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        count = len(rows)
+        return {
+            "ids": np.fromiter((int(r["id"]) for r in rows), dtype=np.int64, count=count),
+            "seller_ids": np.fromiter((_to_id(r.get("seller_id")) for r in rows), dtype=np.int64, count=count),
+            "seller_dormitory_ids": np.fromiter((_to_id(r.get("seller_dormitory_id")) for r in rows), dtype=np.int64, count=count),
+            "dormitory_ids": np.fromiter((_to_id(r.get("dormitory_id")) for r in rows), dtype=np.int64, count=count),
+            "university_ids": np.fromiter((_to_id(r.get("university_id")) for r in rows), dtype=np.int64, count=count),
+            "category_ids": np.fromiter((_to_id(r.get("category_id")) for r in rows), dtype=np.int64, count=count),
+            "condition_ids": np.fromiter((_to_id(r.get("condition_level_id")) for r in rows), dtype=np.int64, count=count),
+            "prices": np.fromiter((_to_float(r.get("price")) for r in rows), dtype=np.float64, count=count),
+            "created_ts": np.fromiter((_to_ts(r.get("created_at")) for r in rows), dtype=np.float64, count=count),
+            "updated_ts": np.fromiter((_to_ts(r.get("updated_at")) for r in rows), dtype=np.float64, count=count),
+            "latitudes": np.fromiter((_to_float(r.get("latitude")) for r in rows), dtype=np.float64, count=count),
+            "longitudes": np.fromiter((_to_float(r.get("longitude")) for r in rows), dtype=np.float64, count=count),
+            "promoted_until_ts": np.fromiter((_to_ts(r.get("promoted_until")) for r in rows), dtype=np.float64, count=count),
+            "trending_scores": np.fromiter((_to_float(r.get("trending_score")) for r in rows), dtype=np.float64, count=count),
+        }
+
+    def _publish(self, columns: Dict[str, Any], db_clock_offset: float) -> CatalogueSnapshot:
+        order = np.argsort(columns["ids"], kind="stable")
+        columns = {name: values[order] for name, values in columns.items()}
+        created = np.where(np.isnan(columns["created_ts"]), -np.inf, columns["created_ts"])
+        recency_order = np.lexsort((-columns["ids"], -created))
+        snapshot = CatalogueSnapshot(
+            **columns,
+            recency_order=recency_order,
+            db_clock_offset=db_clock_offset,
+            built_at=datetime.utcnow().isoformat(),
+        )
+        with self._lock:
+            self._snapshot = snapshot
+        return snapshot
+
+    def _advance_watermark(self, rows: List[Dict[str, Any]]) -> None:
+        for r in rows:
+            updated_at = r.get("updated_at")
+            if isinstance(updated_at, datetime) and (self._watermark_updated_at is None or updated_at > self._watermark_updated_at):
+                self._watermark_updated_at = updated_at
+            self._watermark_id = max(self._watermark_id, int(r["id"]))
+
+    def _full_build(self, conn, promoted_marker: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        rows = [
+            dict(r)
+            for r in conn.execute(
+                text(_CATALOGUE_COLUMNS_SQL + " WHERE p.status = 'available' AND p.deleted_at IS NULL")
+            ).mappings().all()
+        ]
+        self._watermark_updated_at = None
+        self._watermark_id = 0
+        self._advance_watermark(rows)
+        snapshot = self._publish(self._columns_from_rows(rows), self._db_clock_offset(conn))
+        self._promoted_marker = promoted_marker
+        self._last_full_refresh = time.monotonic()
+        elapsed_ms = int((time.perf_counter() - started) * 1000)
+        with self._lock:
+            self._stats["full_builds"] += 1
+            self._stats["last_build_ms"] = elapsed_ms
+        return {"mode": "full", "products": snapshot.size, "build_ms": elapsed_ms}
+
+    def _incremental(self, conn) -> Dict[str, Any]:
+        params: Dict[str, Any] = {"after_id": self._watermark_id}
+        where_sql = " WHERE p.id > :after_id"
+        if self._watermark_updated_at is not None:
+            where_sql = " WHERE (p.updated_at >= :since OR p.id > :after_id)"
+            params["since"] = self._watermark_updated_at
+        rows = [dict(r) for r in conn.execute(text(_CATALOGUE_COLUMNS_SQL + where_sql), params).mappings().all()]
+        current = self._snapshot
+        if current is None:
+            return {"mode": "incremental", "rows": 0, "removed": 0, "products": 0}
+
+        keep = np.ones(current.size, dtype=bool)
+        fresh = self._columns_from_rows([])
+        if rows:
+            self._advance_watermark(rows)
+            changed_ids = np.fromiter((int(r["id"]) for r in rows), dtype=np.int64, count=len(rows))
+            keep = ~np.isin(current.ids, changed_ids)
+            live_rows = [r for r in rows if r.get("status") == "available" and r.get("deleted_at") is None]
+            fresh = self._columns_from_rows(live_rows)
+
+        # Hard deletes never match the updated_at / id watermark; compare the live id set's fingerprint instead.
+        removed = 0
+        fingerprint = conn.execute(text(_LIVE_FINGERPRINT_SQL)).mappings().first() or {}
+        expected_count = int(keep.sum()) + int(fresh["ids"].shape[0])
+        expected_sum = int(current.ids[keep].sum()) + int(fresh["ids"].sum())
+        if int(fingerprint.get("row_count") or 0) != expected_count or int(fingerprint.get("id_sum") or 0) != expected_sum:
+            live_ids = np.fromiter(
+                (int(r[0]) for r in conn.execute(text(_LIVE_IDS_SQL)).all()),
+                dtype=np.int64,
+            )
+            gone = keep & ~np.isin(current.ids, live_ids)
+            removed = int(gone.sum())
+            keep &= ~gone
+
+        if not rows and not removed:
+            return {"mode": "incremental", "rows": 0, "removed": 0, "products": current.size}
+        merged = {name: np.concatenate([getattr(current, name)[keep], fresh[name]]) for name in _COLUMN_NAMES}
+        snapshot = self._publish(merged, current.db_clock_offset)
+        with self._lock:
+            self._stats["incremental_refreshes"] += 1
+            self._stats["rows_applied"] += len(rows)
+            self._stats["rows_removed"] += removed
+        return {"mode": "incremental", "rows": len(rows), "removed": removed, "products": snapshot.size}
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        with self._lock:
+            return {
+                "ready": snapshot is not None,
+                "products": snapshot.size if snapshot is not None else 0,
+                "built_at": snapshot.built_at if snapshot is not None else None,
+                "watermark_updated_at": self._watermark_updated_at.isoformat() if self._watermark_updated_at else None,
+                "watermark_id": self._watermark_id,
+                **self._stats,
+            }
+
+
+_catalogue_store = CatalogueStore()
+
+
+def get_catalogue_store() -> CatalogueStore:
+    return _catalogue_store
@@ -0,0 +1,343 @@
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from app.cache import CacheUnavailable, get_cache
+
+COOCCURRENCE_EVENT_TYPES = ("view", "click", "like", "add_to_cart")
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+class CooccurrenceModel:
+    def __init__(self) -> None:
+        self.top_n = max(5, _safe_env_int("COOCCURRENCE_TOP_N", 50))
+        self.lookback_days = max(1, _safe_env_int("COOCCURRENCE_LOOKBACK_DAYS", 365))
+        self.max_products_per_user = max(10, _safe_env_int("COOCCURRENCE_MAX_PRODUCTS_PER_USER", 100))
+        self.max_row_entries = self.top_n * 8
+        self.rebuild_seconds = max(60, _safe_env_int("COOCCURRENCE_REBUILD_SECONDS", 3600))
+        # Ids below MAX(id) can still commit after the rebuild snapshot; ids in this trailing window
+        # that the snapshot did not include are still applied when the event stream delivers them.
+        self.reread_ids = max(0, _safe_env_int("EVENT_STREAM_REREAD_IDS", 500))
+        self._lock = threading.Lock()
+        self._counts: Dict[int, Dict[int, float]] = {}
+        self._neighbors: Dict[int, List[Tuple[int, float]]] = {}
+        self._user_products: Dict[int, "OrderedDict[int, int]"] = {}
+        self._watermark = 0
+        self._included_ids: Set[int] = set()
+        self._building = False
+        self._pending: List[Dict[str, Any]] = []
+        self._ready = False
+        self._built_at: Optional[str] = None
+        self._built_monotonic = 0.0
+        self._published_at: Optional[str] = None
+        self._build_ms: Optional[int] = None
+        self._incremental_updates = 0
+        self._adopted = 0
+        self._sync_errors = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def neighbors(self, product_id: int, limit: int) -> Optional[List[Tuple[int, float]]]:
+        if not self._ready:
+            return None
+        with self._lock:
+            return list(self._neighbors.get(int(product_id), [])[: max(1, int(limit))])
+
+    def rebuild(self, conn) -> Dict[str, Any]:
+        started = time.perf_counter()
+        with self._lock:
+            self._building = True
+            self._pending = []
+        try:
+            return self._rebuild(conn, started)
+        finally:
+            with self._lock:
+                self._building = False
+                self._pending = []
+
+    def publish(self) -> Dict[str, Any]:
+        with self._lock:
+            payload = {
+                "built_at": self._built_at,
+                "watermark": self._watermark,
+                "included_ids": sorted(self._included_ids),
+                "counts": {str(p): {str(q): w for q, w in row.items()} for p, row in self._counts.items()},
+                "user_products": {str(u): list(items.items()) for u, items in self._user_products.items()},
+            }
+            self._published_at = payload["built_at"]
+        # Replaced wholesale by the next cluster-wide rebuild; built_at is the version followers compare.
+        shared = get_cache().publish_blob(
+            "cooccurrence", "snapshot", str(payload["built_at"]), payload, self.rebuild_seconds * 2
+        )
+        return {"built_at": payload["built_at"], "products": len(payload["counts"]), "shared": shared}
+
+    def sync(self, conn) -> Dict[str, Any]:
+        cache = get_cache()
+        found, payload = False, None
+        try:
+            published = cache.blob_version("cooccurrence", "snapshot")
+            if published is not None and published[0] != self._published_at:
+                found, payload = cache.get_blob("cooccurrence", "snapshot", *published)
+        except CacheUnavailable as e:
+            with self._lock:
+                self._sync_errors += 1
+            if not self._ready:
+                return self.rebuild(conn)
+            # Redis is down, not empty: keep serving the current model instead of rebuilding it.
+            return {"adopted": False, "built_at": self._built_at, "watermark": self._watermark, "error": str(e)}
+        if found and isinstance(payload, dict):
+            started = time.perf_counter()
+            with self._lock:
+                self._building = True
+                self._pending = []
+            try:
+                return self._adopt(conn, payload, started)
+            finally:
+                with self._lock:
+                    self._building = False
+                    self._pending = []
+        current = published is not None and published[0] == self._published_at
+        if not current and (not self._ready or time.monotonic() - self._built_monotonic >= self.rebuild_seconds * 2):
+            # Nothing shared yet (leader still building, or no Redis): build locally.
+            return self.rebuild(conn)
+        return {"adopted": False, "built_at": self._built_at, "watermark": self._watermark}
+
+    def _adopt(self, conn, payload: Dict[str, Any], started: float) -> Dict[str, Any]:
+        watermark = int(payload.get("watermark") or 0)
+        counts = {int(p): {int(q): float(w) for q, w in row.items()} for p, row in (payload.get("counts") or {}).items()}
+        user_products = {
+            int(u): OrderedDict((int(p), int(c)) for p, c in items) for u, items in (payload.get("user_products") or {}).items()
+        }
+        neighbors = {pid: self._top_neighbors(row) for pid, row in counts.items()}
+        # Events committed after the published snapshot were applied locally to the state being replaced.
+        catch_up = conn.execute(
+            text(
+                """
+                SELECT id, user_id, product_id, event_type
+                FROM behavioral_events
+                WHERE id > :low_id
+                  AND product_id IS NOT NULL
+                  AND event_type IN ('view', 'click', 'like', 'add_to_cart')
+                ORDER BY id ASC
+                """
+            ),
+            {"low_id": max(0, watermark - self.reread_ids)},
+        ).mappings().all()
+
+        with self._lock:
+            self._counts = counts
+            self._neighbors = neighbors
+            self._user_products = user_products
+            self._watermark = watermark
+            self._included_ids = {int(v) for v in payload.get("included_ids") or []}
+            self._ready = True
+            self._built_at = payload.get("built_at")
+            self._built_monotonic = time.monotonic()
+            self._published_at = payload.get("built_at")
+            self._adopted += 1
+            pending, self._pending = self._pending, []
+            self._building = False
+            replayed = 0
+            for event in catch_up:
+                if self._apply_locked(dict(event)):
+                    replayed += 1
+            # The stream may still deliver caught-up ids, so move the watermark past them.
+            if catch_up:
+                self._watermark = max(watermark, max(int(r["id"]) for r in catch_up))
+                low_id = self._watermark - self.reread_ids
+                self._included_ids = {i for i in self._included_ids | {int(r["id"]) for r in catch_up} if i > low_id}
+            for event in pending:
+                if self._apply_locked(event):
+                    replayed += 1
+            self._build_ms = int((time.perf_counter() - started) * 1000)
+        return {
+            "adopted": True,
+            "products": len(neighbors),
+            "users": len(user_products),
+            "watermark": self._watermark,
+            "replayed": replayed,
+            "build_ms": self._build_ms,
+        }
+
+    def _rebuild(self, conn, started: float) -> Dict[str, Any]:
+        since = datetime.utcnow() - timedelta(days=self.lookback_days)
+        max_row = conn.execute(text("SELECT MAX(id) AS max_id FROM behavioral_events")).mappings().first()
+        watermark = int((max_row or {}).get("max_id") or 0)
+        included_ids = {
+            int(r[0])
+            for r in conn.execute(
+                text("SELECT id FROM behavioral_events WHERE id > :low_id AND id <= :watermark"),
+                {"low_id": max(0, watermark - self.reread_ids), "watermark": watermark},
+            ).all()
+        }
+
+        result = conn.execute(
+            text(
+                """
+                SELECT user_id, product_id, COUNT(*) AS event_count, MAX(id) AS last_event_id
+                FROM behavioral_events
+                WHERE id <= :watermark
+                  AND product_id IS NOT NULL
+                  AND event_type IN ('view', 'click', 'like', 'add_to_cart')
+                  AND occurred_at >= :since
+                GROUP BY user_id, product_id
+                ORDER BY user_id ASC, last_event_id ASC
+                """
+            ),
+            {"watermark": watermark, "since": since},
+        ).mappings()
+
+        counts: Dict[int, Dict[int, float]] = {}
+        user_products: Dict[int, "OrderedDict[int, int]"] = {}
+
+        def _accumulate(items: "OrderedDict[int, int]") -> None:
+            pairs = list(items.items())
+            for i, (p, cp) in enumerate(pairs):
+                row_p = counts.setdefault(p, {})
+                for q, cq in pairs[i + 1 :]:
+                    weight = float(cp * cq)
+                    row_p[q] = row_p.get(q, 0.0) + weight
+                    row_q = counts.setdefault(q, {})
+                    row_q[p] = row_q.get(p, 0.0) + weight
+
+        current_user: Optional[int] = None
+        current_items: "OrderedDict[int, int]" = OrderedDict()
+        for row in result:
+            uid = int(row["user_id"])
+            if uid != current_user:
+                if current_user is not None and current_items:
+                    _accumulate(current_items)
+                    user_products[current_user] = current_items
+                current_user = uid
+                current_items = OrderedDict()
+            current_items[int(row["product_id"])] = int(row["event_count"] or 0)
+            if len(current_items) > self.max_products_per_user:
+                current_items.popitem(last=False)
+        if current_user is not None and current_items:
+            _accumulate(current_items)
+            user_products[current_user] = current_items
+
+        neighbors = {pid: self._top_neighbors(row) for pid, row in counts.items()}
+        for pid, row in counts.items():
+            self._prune_row(row)
+
+        elapsed_ms = int((time.perf_counter() - started) * 1000)
+        with self._lock:
+            self._counts = counts
+            self._neighbors = neighbors
+            self._user_products = user_products
+            self._watermark = watermark
+            self._included_ids = included_ids
+            self._ready = True
+            self._built_at = datetime.utcnow().isoformat()
+            self._built_monotonic = time.monotonic()
+            self._build_ms = elapsed_ms
+            # Events observed while the snapshot was being built were applied to the discarded counts.
+            pending, self._pending = self._pending, []
+            self._building = False
+            replayed = 0
+            for event in pending:
+                if self._apply_locked(event):
+                    replayed += 1
+        return {
+            "products": len(neighbors),
+            "users": len(user_products),
+            "watermark": watermark,
+            "replayed": replayed,
+            "build_ms": elapsed_ms,
+        }
+
+    def observe_event(self, event: Dict[str, Any]) -> None:
+        if event.get("user_id") is None or event.get("product_id") is None:
+            return
+        if event.get("event_type") not in COOCCURRENCE_EVENT_TYPES:
+            return
+        with self._lock:
+            if self._building:
+                self._pending.append(event)
+            if self._ready:
+                self._apply_locked(event)
+
+    def _apply_locked(self, event: Dict[str, Any]) -> bool:
+        event_id = event.get("id")
+        if event_id is not None:
+            eid = int(event_id)
+            if eid <= self._watermark:
+                if eid <= self._watermark - self.reread_ids or eid in self._included_ids:
+                    return False
+                self._included_ids.add(eid)
+
+        pid = int(event["product_id"])
+        items = self._user_products.setdefault(int(event["user_id"]), OrderedDict())
+        touched = [pid]
+        row_p = self._counts.setdefault(pid, {})
+        for q, cq in items.items():
+            if q == pid:
+                continue
+            row_p[q] = row_p.get(q, 0.0) + float(cq)
+            row_q = self._counts.setdefault(q, {})
+            row_q[pid] = row_q.get(pid, 0.0) + float(cq)
+            touched.append(q)
+        items[pid] = items.get(pid, 0) + 1
+        items.move_to_end(pid)
+        if len(items) > self.max_products_per_user:
+            items.popitem(last=False)
+        for t in touched:
+            row = self._counts.get(t)
+            if row is None:
+                continue
+            if len(row) > self.max_row_entries:
+                self._prune_row(row)
+            self._neighbors[t] = self._top_neighbors(row)
+        self._incremental_updates += 1
+        return True
+
+    def _top_neighbors(self, row: Dict[int, float]) -> List[Tuple[int, float]]:
+        return heapq.nlargest(self.top_n, row.items(), key=lambda kv: kv[1])
+
+    def _prune_row(self, row: Dict[int, float]) -> None:
+        keep = self.top_n * 4
+        if len(row) <= keep:
+            return
+        kept = dict(heapq.nlargest(keep, row.items(), key=lambda kv: kv[1]))
+        row.clear()
+        row.update(kept)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ready": self._ready,
+                "products": len(self._neighbors),
+                "users": len(self._user_products),
+                "watermark": self._watermark,
+                "built_at": self._built_at,
+                "published_at": self._published_at,
+                "build_ms": self._build_ms,
+                "incremental_updates": self._incremental_updates,
+                "adopted": self._adopted,
+                "sync_errors": self._sync_errors,
+            }
+
+
+_cooccurrence_model = CooccurrenceModel()
+
+
+def get_cooccurrence_model() -> CooccurrenceModel:
+    return _cooccurrence_model
@@ -0,0 +1,429 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.util.concurrency import await_only, in_greenlet
+except Exception:
+    create_async_engine = None
+    await_only = None
+    in_greenlet = None
+
+
+ASYNC_DRIVER_DIALECTS = {"asyncmy": "mysql+asyncmy", "aiomysql": "mysql+aiomysql"}
+PRE_PING_STRATEGIES = {"always", "idle", "never"}
+CHECKOUT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+CONNECTION_AGE_BUCKETS_SECONDS = (60, 300, 900, 1800, 3600, 7200)
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+def on_async_connection() -> bool:
+    """True inside AsyncConnection.run_sync, i.e. in a greenlet on the event-loop thread."""
+    return in_greenlet is not None and bool(in_greenlet())
+
+
+def await_async(awaitable: Any) -> Any:
+    return await_only(awaitable)
+
+
+def offload(func, *args, **kwargs):
+    """Runs blocking or CPU-bound work that does not touch the connection.
+
+    Under AsyncConnection.run_sync the caller shares the event-loop thread, so the work is awaited in the
+    thread pool instead; on sync connections it runs inline.
+    """
+    if not on_async_connection():
+        return func(*args, **kwargs)
+    return await_only(run_in_threadpool(func, *args, **kwargs))
+
+
+def database_url(dialect: str) -> str:
+    host = os.environ.get("DB_HOST", "127.0.0.1")
+    port = _safe_env_int("DB_PORT", 3306)
+    database = os.environ.get("DB_DATABASE", "XiaoWu")
+    username = os.environ.get("DB_USERNAME", "root")
+    password = os.environ.get("DB_PASSWORD", "")
+    return f"{dialect}://{username}:{password}@{host}:{port}/{database}"
+
+
+class PoolSettings:
+    def __init__(self) -> None:
+        self.size = max(1, _safe_env_int("DB_POOL_SIZE", 5))
+        self.max_overflow = max(0, _safe_env_int("DB_MAX_OVERFLOW", 10))
+        self.timeout_seconds = max(1, _safe_env_int("DB_POOL_TIMEOUT", 30))
+        self.recycle_seconds = _safe_env_int("DB_POOL_RECYCLE", 3600)
+        pre_ping = (os.environ.get("DB_POOL_PRE_PING") or "idle").strip().lower()
+        self.pre_ping = pre_ping if pre_ping in PRE_PING_STRATEGIES else "idle"
+        self.ping_idle_seconds = max(0, _safe_env_int("DB_POOL_PING_IDLE_SECONDS", 30))
+        self.warmup = max(0, min(self.size, _safe_env_int("DB_POOL_WARMUP", 0)))
+
+    def engine_options(self) -> Dict[str, Any]:
+        return {
+            "pool_size": self.size,
+            "max_overflow": self.max_overflow,
+            "pool_timeout": self.timeout_seconds,
+            "pool_recycle": self.recycle_seconds,
+            "pool_pre_ping": self.pre_ping == "always",
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "max_overflow": self.max_overflow,
+            "timeout_seconds": self.timeout_seconds,
+            "recycle_seconds": self.recycle_seconds,
+            "pre_ping": self.pre_ping,
+            "ping_idle_seconds": self.ping_idle_seconds,
+            "warmup": self.warmup,
+        }
+
+
+class _Histogram:
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self) -> Dict[str, Any]:
+        buckets: Dict[str, int] = {}
+        running = 0
+        for bound, count in zip(list(self.bounds) + ["inf"], self.counts):
+            running += count
+            buckets[f"le_{bound}"] = running
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "avg": round(self.total / self.count, 3) if self.count else None,
+            "max": round(self.max, 3),
+            "buckets": buckets,
+        }
+
+
+class PoolTelemetry:
+    def __init__(self, name: str, settings: PoolSettings) -> None:
+        self.name = name
+        self.settings = settings
+        self.engine: Optional[Engine] = None
+        self._lock = threading.Lock()
+        self._checkout_ms = _Histogram(CHECKOUT_BUCKETS_MS)
+        self._connection_age_seconds = _Histogram(CONNECTION_AGE_BUCKETS_SECONDS)
+        self._peak_checked_out = 0
+        self._peak_overflow = 0
+        self._counters = {
+            "connects": 0,
+            "checkouts": 0,
+            "checkins": 0,
+            "timeouts": 0,
+            "invalidations": 0,
+            "idle_pings": 0,
+            "idle_ping_failures": 0,
+        }
+
+    def attach(self, engine: Engine) -> None:
+        self.engine = engine
+        engine.pool._telemetry = self
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        event.listen(engine, "invalidate", self._on_invalidate)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def observe_checkout(self, elapsed_ms: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self._counters["timeouts"] += 1
+            else:
+                self._checkout_ms.observe(elapsed_ms)
+
+    def _on_connect(self, dbapi_connection, connection_record) -> None:
+        connection_record.info["connected_at"] = time.time()
+        self._count("connects")
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        checked_in_at = connection_record.info.get("checked_in_at")
+        if (
+            self.settings.pre_ping == "idle"
+            and checked_in_at is not None
+            and time.monotonic() - checked_in_at >= self.settings.ping_idle_seconds
+        ):
+            self._count("idle_pings")
+            cursor = dbapi_connection.cursor()
+            try:
+                cursor.execute("SELECT 1")
+            except Exception:
+                self._count("idle_ping_failures")
+                raise exc.DisconnectionError()
+            finally:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+
+        pool = self.engine.pool if self.engine is not None else None
+        connected_at = connection_record.info.get("connected_at")
+        with self._lock:
+            self._counters["checkouts"] += 1
+            if connected_at is not None:
+                self._connection_age_seconds.observe(max(0.0, time.time() - connected_at))
+            if pool is not None:
+                self._peak_checked_out = max(self._peak_checked_out, pool.checkedout())
+                self._peak_overflow = max(self._peak_overflow, pool.overflow())
+
+    def _on_checkin(self, dbapi_connection, connection_record) -> None:
+        connection_record.info["checked_in_at"] = time.monotonic()
+        self._count("checkins")
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception) -> None:
+        self._count("invalidations")
+
+    def snapshot(self) -> Dict[str, Any]:
+        pool = self.engine.pool if self.engine is not None else None
+        gauges: Dict[str, Any] = {}
+        if pool is not None:
+            gauges = {
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(0, pool.overflow()),
+                "capacity": self.settings.size + self.settings.max_overflow,
+            }
+        with self._lock:
+            return {
+                "name": self.name,
+                "settings": self.settings.to_dict(),
+                "gauges": {
+                    **gauges,
+                    "peak_checked_out": self._peak_checked_out,
+                    "peak_overflow": max(0, self._peak_overflow),
+                },
+                "checkout_ms": self._checkout_ms.snapshot(),
+                "connection_age_seconds": self._connection_age_seconds.snapshot(),
+                **self._counters,
+            }
+
+
+class _TimedCheckout:
+    def connect(self):
+        telemetry = getattr(self, "_telemetry", None)
+        if telemetry is None:
+            return super().connect()
+        started = time.perf_counter()
+        try:
+            conn = super().connect()
+        except exc.TimeoutError:
+            telemetry.observe_checkout(0.0, timed_out=True)
+            raise
+        telemetry.observe_checkout((time.perf_counter() - started) * 1000)
+        return conn
+
+    def recreate(self):
+        pool = super().recreate()
+        pool._telemetry = getattr(self, "_telemetry", None)
+        return pool
+
+
+class InstrumentedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+_pool_telemetry: Dict[str, PoolTelemetry] = {}
+
+_statement_route: ContextVar[str] = ContextVar("statement_route", default="background")
+
+
+def compiled_cache_size() -> int:
+    return max(0, _safe_env_int("DB_COMPILED_CACHE_SIZE", 1000))
+
+
+class StatementShapeTracker:
+    """Counts distinct statement texts per route; expanding IN lists keep one shape per query."""
+
+    def __init__(self) -> None:
+        self.max_shapes = max(10, _safe_env_int("DB_STATEMENT_SHAPES_PER_ROUTE", 200))
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Dict[str, Any]] = {}
+
+    def set_route(self, route: str) -> None:
+        _statement_route.set(route)
+
+    def attach(self, engine: Engine) -> None:
+        event.listen(engine, "before_execute", self._on_before_execute)
+
+    def _on_before_execute(self, conn, clauseelement, multiparams, params, execution_options) -> None:
+        statement = getattr(clauseelement, "text", None)
+        shape = hash(statement if isinstance(statement, str) else str(clauseelement))
+        route = _statement_route.get()
+        with self._lock:
+            entry = self._routes.get(route)
+            if entry is None:
+                entry = self._routes[route] = {"executions": 0, "shapes": set(), "overflowed": False}
+            entry["executions"] += 1
+            if shape not in entry["shapes"]:
+                if len(entry["shapes"]) < self.max_shapes:
+                    entry["shapes"].add(shape)
+                else:
+                    entry["overflowed"] = True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                route: {
+                    "executions": entry["executions"],
+                    "distinct_shapes": len(entry["shapes"]),
+                    "overflowed": entry["overflowed"],
+                }
+                for route, entry in sorted(self._routes.items())
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._routes.clear()
+
+
+_statement_shapes = StatementShapeTracker()
+
+
+def get_statement_shapes() -> StatementShapeTracker:
+    return _statement_shapes
+
+
+def create_database_engine(dialect: str = "mysql+pymysql") -> Engine:
+    settings = PoolSettings()
+    engine = create_engine(
+        database_url(dialect),
+        poolclass=InstrumentedQueuePool,
+        query_cache_size=compiled_cache_size(),
+        future=True,
+        **settings.engine_options(),
+    )
+    telemetry = PoolTelemetry("sync", settings)
+    telemetry.attach(engine)
+    _pool_telemetry["sync"] = telemetry
+    _statement_shapes.attach(engine)
+    return engine
+
+
+def warm_up_pool(engine: Engine) -> int:
+    telemetry = getattr(engine.pool, "_telemetry", None)
+    count = telemetry.settings.warmup if telemetry is not None else 0
+    conns: List[Any] = []
+    try:
+        for _ in range(count):
+            conns.append(engine.connect())
+    except Exception:
+        pass
+    finally:
+        for conn in conns:
+            conn.close()
+    return len(conns)
+
+
+def pool_metrics() -> Dict[str, Any]:
+    return {name: telemetry.snapshot() for name, telemetry in _pool_telemetry.items()}
+
+
+class AsyncDatabase:
+    def __init__(self) -> None:
+        self.enabled = _safe_env_int("DB_ASYNC_ENABLED", 0) == 1
+        self.driver = (os.environ.get("DB_ASYNC_DRIVER") or "asyncmy").strip().lower()
+        self._lock = threading.Lock()
+        self._engine = None
+        self._error: Optional[str] = None
+
+    def engine(self):
+        if not self.enabled or self._error is not None:
+            return None
+        if self._engine is not None:
+            return self._engine
+        with self._lock:
+            if self._engine is None and self._error is None:
+                dialect = ASYNC_DRIVER_DIALECTS.get(self.driver)
+                if create_async_engine is None:
+                    self._error = "Missing dependency: greenlet (install sqlalchemy[asyncio])"
+                elif dialect is None:
+                    self._error = f"Unsupported DB_ASYNC_DRIVER: {self.driver}"
+                else:
+                    try:
+                        settings = PoolSettings()
+                        engine = create_async_engine(
+                            database_url(dialect),
+                            poolclass=InstrumentedAsyncAdaptedQueuePool,
+                            query_cache_size=compiled_cache_size(),
+                            **settings.engine_options(),
+                        )
+                        telemetry = PoolTelemetry("async", settings)
+                        telemetry.attach(engine.sync_engine)
+                        _pool_telemetry["async"] = telemetry
+                        _statement_shapes.attach(engine.sync_engine)
+                        self._engine = engine
+                    except Exception as e:
+                        self._error = f"{type(e).__name__}: {e}"
+        return self._engine
+
+    async def warm_up(self) -> int:
+        engine = self.engine()
+        if engine is None:
+            return 0
+        conns: List[Any] = []
+        try:
+            for _ in range(PoolSettings().warmup):
+                conns.append(await engine.connect().start())
+        except Exception:
+            pass
+        finally:
+            for conn in conns:
+                await conn.close()
+        return len(conns)
+
+    async def dispose(self) -> None:
+        if self._engine is not None:
+            await self._engine.dispose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "driver": self.driver,
+            "active": self._engine is not None,
+            "error": self._error,
+        }
+
+
+_async_database = AsyncDatabase()
+
+
+def get_async_database() -> AsyncDatabase:
+    return _async_database
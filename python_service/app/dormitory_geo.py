@@ -0,0 +1,286 @@
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+def parse_lat_lng_from_location(location: Any) -> Optional[Tuple[float, float]]:
+    if not isinstance(location, str) or not location:
+        return None
+
+    s = location.strip()
+    at = s.find("@")
+    if at != -1:
+        after = s[at + 1 :]
+        parts = after.split(",")
+        if len(parts) >= 2:
+            try:
+                return float(parts[0]), float(parts[1])
+            except Exception:
+                pass
+
+    markers = ["q=", "query=", "ll="]
+    for m in markers:
+        idx = s.find(m)
+        if idx != -1:
+            after = s[idx + len(m) :]
+            after = after.split("&", 1)[0]
+            parts = after.split(",")
+            if len(parts) >= 2:
+                try:
+                    return float(parts[0]), float(parts[1])
+                except Exception:
+                    pass
+
+    return None
+
+
+def parse_lat_lng(lat: Any, lng: Any, location: Any = None) -> Optional[Tuple[float, float]]:
+    if lat is not None and lng is not None:
+        try:
+            return float(lat), float(lng)
+        except Exception:
+            pass
+    if location is not None:
+        return parse_lat_lng_from_location(location)
+    return None
+
+
+def _to_ids(values: Sequence[Any]) -> Any:
+    if np is not None and isinstance(values, np.ndarray):
+        return values.astype(np.int64, copy=False)
+    return np.fromiter((int(v) if v is not None else -1 for v in values), dtype=np.int64, count=len(values))
+
+
+def _haversine_rows(lat1: Any, lng1: Any, lat2: Any, lng2: Any) -> Any:
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = np.radians(lat2 - lat1)
+    dlambda = np.radians(lng2 - lng1)
+    x = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * 6371.0 * np.arctan2(np.sqrt(x), np.sqrt(1 - x))
+
+
+@dataclass
+class DormitoryGeoSnapshot:
+    dormitory_ids: Any
+    university_ids: Any
+    latitudes: Any
+    longitudes: Any
+    has_coords: Any
+    distances: Any
+    marker: str
+    built_at: str
+
+    @property
+    def size(self) -> int:
+        return int(self.dormitory_ids.shape[0])
+
+    def positions(self, dormitory_ids: Sequence[Any]) -> Any:
+        wanted = _to_ids(dormitory_ids)
+        if wanted.size == 0 or self.size == 0:
+            return np.full(wanted.shape[0], -1, dtype=np.int64)
+        pos = np.clip(np.searchsorted(self.dormitory_ids, wanted), 0, self.size - 1)
+        return np.where((self.dormitory_ids[pos] == wanted) & (wanted >= 0), pos, -1)
+
+    def position(self, dormitory_id: Optional[int]) -> int:
+        if dormitory_id is None:
+            return -1
+        return int(self.positions([int(dormitory_id)])[0])
+
+    def contains(self, dormitory_id: Optional[int]) -> bool:
+        return self.position(dormitory_id) >= 0
+
+    def coords(self, dormitory_id: Optional[int]) -> Optional[Tuple[float, float]]:
+        pos = self.position(dormitory_id)
+        if pos < 0 or not self.has_coords[pos]:
+            return None
+        return float(self.latitudes[pos]), float(self.longitudes[pos])
+
+    def university_id(self, dormitory_id: Optional[int]) -> Optional[int]:
+        pos = self.position(dormitory_id)
+        if pos < 0 or self.university_ids[pos] < 0:
+            return None
+        return int(self.university_ids[pos])
+
+    def _distance_row(self, pos: int) -> Any:
+        if self.distances is not None:
+            return self.distances[pos]
+        row = np.full(self.size, np.nan, dtype=np.float32)
+        if self.has_coords[pos]:
+            row[self.has_coords] = _haversine_rows(
+                self.latitudes[pos],
+                self.longitudes[pos],
+                self.latitudes[self.has_coords],
+                self.longitudes[self.has_coords],
+            )
+        return row
+
+    def distance_km(self, dormitory_a: Optional[int], dormitory_b: Optional[int]) -> Optional[float]:
+        pos_a = self.position(dormitory_a)
+        pos_b = self.position(dormitory_b)
+        if pos_a < 0 or pos_b < 0:
+            return None
+        value = float(self._distance_row(pos_a)[pos_b])
+        return None if math.isnan(value) else value
+
+    def effective_positions(self, seller_dormitory_ids: Sequence[Any], dormitory_ids: Sequence[Any]) -> Any:
+        seller_pos = self.positions(seller_dormitory_ids)
+        product_pos = self.positions(dormitory_ids)
+        seller_has_coords = (seller_pos >= 0) & self.has_coords[np.maximum(seller_pos, 0)]
+        return np.where(seller_has_coords, seller_pos, product_pos)
+
+    def candidate_distances(
+        self,
+        buyer_dormitory_id: Optional[int],
+        seller_dormitory_ids: Sequence[Any],
+        dormitory_ids: Sequence[Any],
+    ) -> Any:
+        out = np.full(len(dormitory_ids), np.nan, dtype=np.float64)
+        buyer_pos = self.position(buyer_dormitory_id)
+        if buyer_pos < 0 or not self.has_coords[buyer_pos] or out.shape[0] == 0:
+            return out
+        positions = self.effective_positions(seller_dormitory_ids, dormitory_ids)
+        known = positions >= 0
+        out[known] = self._distance_row(buyer_pos)[positions[known]]
+        return out
+
+    def nearby_dormitories(self, dormitory_id: Optional[int], radius_km: float) -> List[int]:
+        pos = self.position(dormitory_id)
+        if pos < 0 or not self.has_coords[pos]:
+            return []
+        row = self._distance_row(pos)
+        with np.errstate(invalid="ignore"):
+            within = np.flatnonzero(row <= float(radius_km))
+        within = within[np.argsort(row[within], kind="stable")]
+        return self.dormitory_ids[within].tolist()
+
+    def university_dormitories(self, university_id: Optional[int]) -> List[int]:
+        if university_id is None:
+            return []
+        return self.dormitory_ids[self.university_ids == int(university_id)].tolist()
+
+
+class DormitoryGeoRegistry:
+    def __init__(self) -> None:
+        # float32 pairwise matrix: 1000 dormitories is 4 MB. Larger sets compute one vectorised row per lookup.
+        self.matrix_max_dormitories = max(1, _safe_env_int("DORMITORY_GEO_MATRIX_MAX", 1000))
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._snapshot: Optional[DormitoryGeoSnapshot] = None
+        self._stats = {"builds": 0, "checks": 0, "last_build_ms": None}
+
+    @property
+    def ready(self) -> bool:
+        return np is not None and self._snapshot is not None
+
+    def snapshot(self) -> Optional[DormitoryGeoSnapshot]:
+        return self._snapshot
+
+    def _read_marker(self, conn) -> str:
+        row = conn.execute(
+            text("SELECT COUNT(*) AS row_count, MAX(id) AS max_id, MAX(updated_at) AS max_updated_at FROM dormitories")
+        ).mappings().first() or {}
+        max_updated_at = row.get("max_updated_at")
+        updated_raw = max_updated_at.isoformat() if isinstance(max_updated_at, datetime) else str(max_updated_at or "")
+        return f"{int(row.get('row_count') or 0)}:{int(row.get('max_id') or 0)}:{updated_raw}"
+
+    def refresh(self, conn, force: bool = False) -> Dict[str, Any]:
+        if np is None:
+            raise RuntimeError("Missing dependency: numpy")
+        with self._refresh_lock:
+            marker = self._read_marker(conn)
+            with self._lock:
+                self._stats["checks"] += 1
+            current = self._snapshot
+            if not force and current is not None and current.marker == marker:
+                return {"changed": False, "dormitories": current.size}
+            snapshot = self._build(conn, marker)
+            return {"changed": True, "dormitories": snapshot.size, "build_ms": self._stats["last_build_ms"]}
+
+    def _build(self, conn, marker: str) -> DormitoryGeoSnapshot:
+        started = time.perf_counter()
+        rows = conn.execute(
+            text("SELECT id, university_id, latitude, longitude, location FROM dormitories ORDER BY id ASC")
+        ).mappings().all()
+        count = len(rows)
+        latitudes = np.full(count, np.nan, dtype=np.float64)
+        longitudes = np.full(count, np.nan, dtype=np.float64)
+        for idx, r in enumerate(rows):
+            coords = parse_lat_lng(r.get("latitude"), r.get("longitude"), r.get("location"))
+            if coords is not None:
+                latitudes[idx], longitudes[idx] = coords
+        has_coords = ~np.isnan(latitudes) & ~np.isnan(longitudes)
+
+        distances = None
+        if count <= self.matrix_max_dormitories:
+            distances = np.full((count, count), np.nan, dtype=np.float32)
+            located = np.flatnonzero(has_coords)
+            if located.size:
+                distances[np.ix_(located, located)] = _haversine_rows(
+                    latitudes[located][:, None],
+                    longitudes[located][:, None],
+                    latitudes[located][None, :],
+                    longitudes[located][None, :],
+                )
+
+        snapshot = DormitoryGeoSnapshot(
+            dormitory_ids=np.fromiter((int(r["id"]) for r in rows), dtype=np.int64, count=count),
+            university_ids=np.fromiter(
+                (int(r["university_id"]) if r.get("university_id") is not None else -1 for r in rows),
+                dtype=np.int64,
+                count=count,
+            ),
+            latitudes=latitudes,
+            longitudes=longitudes,
+            has_coords=has_coords,
+            distances=distances,
+            marker=marker,
+            built_at=datetime.utcnow().isoformat(),
+        )
+        elapsed_ms = int((time.perf_counter() - started) * 1000)
+        with self._lock:
+            self._snapshot = snapshot
+            self._stats["builds"] += 1
+            self._stats["last_build_ms"] = elapsed_ms
+        return snapshot
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        with self._lock:
+            return {
+                "ready": snapshot is not None,
+                "dormitories": snapshot.size if snapshot is not None else 0,
+                "located": int(snapshot.has_coords.sum()) if snapshot is not None else 0,
+                "matrix": snapshot is not None and snapshot.distances is not None,
+                "matrix_bytes": int(snapshot.distances.nbytes) if snapshot is not None and snapshot.distances is not None else 0,
+                "built_at": snapshot.built_at if snapshot is not None else None,
+                **self._stats,
+            }
+
+
+_dormitory_geo_registry = DormitoryGeoRegistry()
+
+
+def get_dormitory_geo_registry() -> DormitoryGeoRegistry:
+    return _dormitory_geo_registry
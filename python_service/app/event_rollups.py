@@ -0,0 +1,346 @@
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import ProgrammingError
+
+from app.event_stream import normalize_event
+from app.user_profiles import event_weight
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+def _is_missing_table(e: ProgrammingError) -> bool:
+    return bool(getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146)
+
+
+def _to_day(value: Any) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")[:10]).date()
+        except Exception:
+            return None
+    return None
+
+
+def _to_datetime(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+        except Exception:
+            return None
+    return None
+
+
+def _day_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, value.day)
+
+
+ROLLUP_STATE_NAME = "behavioral_events"
+
+# Missing category / seller ids are stored as 0 so per-user totals stay exact.
+_USER_CATEGORY_UPSERT_SQL = text(
+    """
+    INSERT INTO behavior_rollup_user_category
+        (user_id, category_id, day, event_count, weighted_count, last_event_id, last_event_at)
+    VALUES (:user_id, :category_id, :day, :event_count, :weighted_count, :last_event_id, :last_event_at)
+    ON DUPLICATE KEY UPDATE
+        event_count = event_count + VALUES(event_count),
+        weighted_count = weighted_count + VALUES(weighted_count),
+        last_event_id = GREATEST(last_event_id, VALUES(last_event_id)),
+        last_event_at = GREATEST(last_event_at, VALUES(last_event_at))
+    """
+)
+
+_USER_SELLER_UPSERT_SQL = text(
+    """
+    INSERT INTO behavior_rollup_user_seller (user_id, seller_id, day, event_count, weighted_count)
+    VALUES (:user_id, :seller_id, :day, :event_count, :weighted_count)
+    ON DUPLICATE KEY UPDATE
+        event_count = event_count + VALUES(event_count),
+        weighted_count = weighted_count + VALUES(weighted_count)
+    """
+)
+
+_PRODUCT_UPSERT_SQL = text(
+    """
+    INSERT INTO behavior_rollup_product (product_id, day, event_count, weighted_count)
+    VALUES (:product_id, :day, :event_count, :weighted_count)
+    ON DUPLICATE KEY UPDATE
+        event_count = event_count + VALUES(event_count),
+        weighted_count = weighted_count + VALUES(weighted_count)
+    """
+)
+
+_STATE_UPSERT_SQL = text(
+    """
+    INSERT INTO behavior_rollup_state (name, watermark_id, compacted_at)
+    VALUES (:name, :watermark_id, :compacted_at)
+    ON DUPLICATE KEY UPDATE
+        watermark_id = VALUES(watermark_id),
+        compacted_at = VALUES(compacted_at)
+    """
+)
+
+
+class BehaviorRollups:
+    def __init__(self) -> None:
+        self.batch_size = max(100, _safe_env_int("EVENT_ROLLUP_BATCH_SIZE", 5000))
+        self.max_batches = max(1, _safe_env_int("EVENT_ROLLUP_MAX_BATCHES", 20))
+        # Rollups are additive, so an id skipped by the watermark is lost for good. Only rows inserted before
+        # this margin are compacted, giving transactions that took a lower id time to commit.
+        self.commit_lag_seconds = max(0, _safe_env_int("EVENT_ROLLUP_COMMIT_LAG_SECONDS", 60))
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "events_compacted": 0, "last_run_ms": None, "last_watermark_id": None}
+
+    def state(self, conn) -> Optional[Dict[str, Any]]:
+        try:
+            row = conn.execute(
+                text("SELECT watermark_id, compacted_at FROM behavior_rollup_state WHERE name = :name"),
+                {"name": ROLLUP_STATE_NAME},
+            ).mappings().first()
+        except ProgrammingError as e:
+            if not _is_missing_table(e):
+                raise
+            return None
+        if row is None:
+            return None
+        return {"watermark_id": int(row.get("watermark_id") or 0), "compacted_at": _to_datetime(row.get("compacted_at"))}
+
+    def compact(self, conn) -> Dict[str, Any]:
+        try:
+            return self._compact(conn)
+        except ProgrammingError as e:
+            if not _is_missing_table(e):
+                raise
+            return {"events": 0, "missing_table": True}
+
+    def _compact(self, conn) -> Dict[str, Any]:
+        started = time.perf_counter()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.commit_lag_seconds)
+        state = self.state(conn) or {"watermark_id": 0, "compacted_at": None}
+        watermark = state["watermark_id"]
+        compacted = 0
+        drained = False
+        pending_at: Optional[datetime] = None
+
+        for _ in range(self.max_batches):
+            rows = conn.execute(
+                text(
+                    """
+                    SELECT id, user_id, event_type, product_id, category_id, seller_id, occurred_at,
+                           COALESCE(created_at, occurred_at) AS inserted_at
+                    FROM behavioral_events
+                    WHERE id > :watermark
+                    ORDER BY id ASC
+                    LIMIT :limit_value
+                    """
+                ),
+                {"watermark": watermark, "limit_value": self.batch_size},
+            ).mappings().all()
+            settled = []
+            for r in rows:
+                inserted_at = _to_datetime(r.get("inserted_at"))
+                if inserted_at is not None and inserted_at >= cutoff:
+                    pending_at = inserted_at
+                    break
+                settled.append(r)
+            if settled:
+                self._apply(conn, [normalize_event(dict(r)) for r in settled])
+                watermark = max(int(r["id"]) for r in settled)
+                compacted += len(settled)
+            if len(settled) < self.batch_size:
+                drained = True
+                break
+
+        # Rows behind the first unsettled one may still have been inserted up to one margin earlier.
+        compacted_at = state["compacted_at"]
+        if drained:
+            compacted_at = cutoff
+            if pending_at is not None:
+                compacted_at = min(cutoff, pending_at - timedelta(seconds=self.commit_lag_seconds))
+        conn.execute(
+            _STATE_UPSERT_SQL,
+            {"name": ROLLUP_STATE_NAME, "watermark_id": watermark, "compacted_at": compacted_at},
+        )
+        elapsed_ms = int((time.perf_counter() - started) * 1000)
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["events_compacted"] += compacted
+            self._stats["last_run_ms"] = elapsed_ms
+            self._stats["last_watermark_id"] = watermark
+        return {"events": compacted, "watermark_id": watermark, "drained": drained, "run_ms": elapsed_ms}
+
+    def _apply(self, conn, events: List[Dict[str, Any]]) -> None:
+        user_category: Dict[Tuple[int, int, date], List[Any]] = {}
+        user_seller: Dict[Tuple[int, int, date], List[float]] = {}
+        product: Dict[Tuple[int, date], List[float]] = {}
+        for e in events:
+            occurred_at = _to_datetime(e.get("occurred_at"))
+            if occurred_at is None or e.get("user_id") is None:
+                continue
+            day = occurred_at.date()
+            user_id = int(e["user_id"])
+            w = event_weight(str(e.get("event_type") or ""))
+            event_id = int(e["id"])
+
+            uc = user_category.setdefault((user_id, int(e.get("category_id") or 0), day), [0, 0.0, 0, None])
+            uc[0] += 1
+            uc[1] += w
+            if event_id > uc[2]:
+                uc[2] = event_id
+            if uc[3] is None or occurred_at > uc[3]:
+                uc[3] = occurred_at
+
+            us = user_seller.setdefault((user_id, int(e.get("seller_id") or 0), day), [0, 0.0])
+            us[0] += 1
+            us[1] += w
+
+            if e.get("product_id") is not None:
+                pr = product.setdefault((int(e["product_id"]), day), [0, 0.0])
+                pr[0] += 1
+                pr[1] += w
+
+        if user_category:
+            conn.execute(
+                _USER_CATEGORY_UPSERT_SQL,
+                [
+                    {
+                        "user_id": user_id,
+                        "category_id": category_id,
+                        "day": day,
+                        "event_count": v[0],
+                        "weighted_count": v[1],
+                        "last_event_id": v[2],
+                        "last_event_at": v[3],
+                    }
+                    for (user_id, category_id, day), v in user_category.items()
+                ],
+            )
+        if user_seller:
+            conn.execute(
+                _USER_SELLER_UPSERT_SQL,
+                [
+                    {"user_id": user_id, "seller_id": seller_id, "day": day, "event_count": v[0], "weighted_count": v[1]}
+                    for (user_id, seller_id, day), v in user_seller.items()
+                ],
+            )
+        if product:
+            conn.execute(
+                _PRODUCT_UPSERT_SQL,
+                [
+                    {"product_id": product_id, "day": day, "event_count": v[0], "weighted_count": v[1]}
+                    for (product_id, day), v in product.items()
+                ],
+            )
+
+    def boundary(self, state: Dict[str, Any], now: datetime) -> datetime:
+        today = _day_start(now)
+        compacted_at = state.get("compacted_at")
+        if compacted_at is None:
+            return today - timedelta(days=36500)
+        return min(today, _day_start(compacted_at))
+
+    def user_history(self, conn, user_id: int, since: datetime, now: datetime) -> Optional[Dict[str, Any]]:
+        state = self.state(conn)
+        if state is None:
+            return None
+        boundary = self.boundary(state, now)
+        params = {"user_id": int(user_id), "since_day": since.date(), "boundary_day": boundary.date()}
+        category_rows = conn.execute(
+            text(
+                """
+                SELECT category_id, day, event_count, weighted_count, last_event_id, last_event_at
+                FROM behavior_rollup_user_category
+                WHERE user_id = :user_id AND day >= :since_day AND day < :boundary_day
+                """
+            ),
+            params,
+        ).mappings().all()
+        seller_rows = conn.execute(
+            text(
+                """
+                SELECT seller_id, day, weighted_count
+                FROM behavior_rollup_user_seller
+                WHERE user_id = :user_id AND day >= :since_day AND day < :boundary_day AND seller_id <> 0
+                """
+            ),
+            params,
+        ).mappings().all()
+
+        history: Dict[str, Any] = {
+            "boundary": boundary,
+            "category_weights": [],
+            "seller_weights": [],
+            "event_count": 0,
+            "last_event_id": 0,
+            "last_event_at": None,
+        }
+        for r in category_rows:
+            day = _to_day(r.get("day"))
+            history["event_count"] += int(r.get("event_count") or 0)
+            last_event_id = int(r.get("last_event_id") or 0)
+            if last_event_id > history["last_event_id"]:
+                history["last_event_id"] = last_event_id
+                history["last_event_at"] = _to_datetime(r.get("last_event_at"))
+            category_id = int(r.get("category_id") or 0)
+            if day is not None and category_id != 0:
+                history["category_weights"].append((category_id, day, float(r.get("weighted_count") or 0.0)))
+        for r in seller_rows:
+            day = _to_day(r.get("day"))
+            if day is not None:
+                history["seller_weights"].append((int(r["seller_id"]), day, float(r.get("weighted_count") or 0.0)))
+        return history
+
+    def product_activity(self, conn, product_ids: Iterable[int], since_day: date) -> Dict[int, Tuple[int, float]]:
+        ids = sorted({int(pid) for pid in product_ids})
+        if not ids:
+            return {}
+        rows = conn.execute(
+            text(
+                """
+                SELECT product_id, SUM(event_count) AS event_count, SUM(weighted_count) AS weighted_count
+                FROM behavior_rollup_product
+                WHERE product_id IN :product_ids AND day >= :since_day
+                GROUP BY product_id
+                """
+            ).bindparams(bindparam("product_ids", expanding=True)),
+            {"product_ids": ids, "since_day": since_day},
+        ).mappings().all()
+        return {
+            int(r["product_id"]): (int(r.get("event_count") or 0), float(r.get("weighted_count") or 0.0))
+            for r in rows
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "batch_size": self.batch_size,
+                "max_batches": self.max_batches,
+                "commit_lag_seconds": self.commit_lag_seconds,
+                **self._stats,
+            }
+
+
+_behavior_rollups = BehaviorRollups()
+
+
+def get_behavior_rollups() -> BehaviorRollups:
+    return _behavior_rollups
@@ -0,0 +1,162 @@
+import os
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+from sqlalchemy import text
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+def _optional_int(value: Any) -> Any:
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except Exception:
+        return None
+
+
+def normalize_event(row: Dict[str, Any]) -> Dict[str, Any]:
+    occurred_at = row.get("occurred_at")
+    if isinstance(occurred_at, str):
+        try:
+            occurred_at = datetime.fromisoformat(occurred_at.replace("Z", "+00:00")).replace(tzinfo=None)
+        except Exception:
+            occurred_at = None
+    if not isinstance(occurred_at, datetime):
+        occurred_at = datetime.utcnow()
+    return {
+        "id": _optional_int(row.get("id")),
+        "user_id": _optional_int(row.get("user_id")),
+        "product_id": _optional_int(row.get("product_id")),
+        "category_id": _optional_int(row.get("category_id")),
+        "seller_id": _optional_int(row.get("seller_id")),
+        "event_type": str(row.get("event_type") or "").strip().lower(),
+        "occurred_at": occurred_at,
+    }
+
+
+class BehaviorEventStream:
+    def __init__(self) -> None:
+        self.poll_batch_size = max(100, _safe_env_int("EVENT_STREAM_POLL_BATCH_SIZE", 2000))
+        # Ids are assigned at insert but become visible at commit, so a lower id can appear after a higher
+        # one was read. Each poll re-reads this many ids below the watermark; _mark_seen drops repeats.
+        self.reread_ids = max(0, _safe_env_int("EVENT_STREAM_REREAD_IDS", 500))
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._watermark = 0
+        self._initialized = False
+        self._recent_ids: Deque[int] = deque()
+        self._recent_id_set: Set[int] = set()
+        self._recent_ids_max = max(1000, (self.poll_batch_size + self.reread_ids) * 2)
+        self._user_heads: "OrderedDict[int, int]" = OrderedDict()
+        self._user_heads_max = max(1000, _safe_env_int("EVENT_STREAM_USER_HEADS_MAX", 100000))
+        self._dispatched = 0
+
+    def subscribe(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        with self._lock:
+            if listener not in self._listeners:
+                self._listeners.append(listener)
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        self._dispatch(normalize_event(event))
+
+    def _mark_seen(self, event_id: int) -> bool:
+        with self._lock:
+            if event_id in self._recent_id_set:
+                return False
+            self._recent_ids.append(event_id)
+            self._recent_id_set.add(event_id)
+            while len(self._recent_ids) > self._recent_ids_max:
+                self._recent_id_set.discard(self._recent_ids.popleft())
+            return True
+
+    def _dispatch(self, event: Dict[str, Any]) -> bool:
+        event_id = event.get("id")
+        if event_id is not None and not self._mark_seen(int(event_id)):
+            return False
+        with self._lock:
+            listeners = list(self._listeners)
+            self._dispatched += 1
+            user_id = event.get("user_id")
+            if user_id is not None and event_id is not None:
+                uid = int(user_id)
+                self._user_heads[uid] = max(self._user_heads.get(uid, 0), int(event_id))
+                self._user_heads.move_to_end(uid)
+                while len(self._user_heads) > self._user_heads_max:
+                    self._user_heads.popitem(last=False)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception:
+                continue
+        return True
+
+    def user_head(self, user_id: int) -> Optional[int]:
+        """Highest event id dispatched for the user; ids are global, so workers agree once both have polled."""
+        with self._lock:
+            return self._user_heads.get(int(user_id))
+
+    def poll(self, conn) -> int:
+        with self._poll_lock:
+            if not self._initialized:
+                row = conn.execute(text("SELECT MAX(id) AS max_id FROM behavioral_events")).mappings().first()
+                self._watermark = int((row or {}).get("max_id") or 0)
+                for existing in conn.execute(
+                    text("SELECT id FROM behavioral_events WHERE id > :low_id AND id <= :watermark"),
+                    {"low_id": max(0, self._watermark - self.reread_ids), "watermark": self._watermark},
+                ).all():
+                    self._mark_seen(int(existing[0]))
+                self._initialized = True
+                return 0
+
+            rows = conn.execute(
+                text(
+                    """
+                    SELECT id, user_id, product_id, category_id, seller_id, event_type, occurred_at
+                    FROM behavioral_events
+                    WHERE id > :low_id
+                    ORDER BY id ASC
+                    LIMIT :limit_value
+                    """
+                ),
+                {
+                    "low_id": max(0, self._watermark - self.reread_ids),
+                    "limit_value": self.poll_batch_size + self.reread_ids,
+                },
+            ).mappings().all()
+            dispatched = 0
+            for row in rows:
+                event = normalize_event(dict(row))
+                if self._dispatch(event):
+                    dispatched += 1
+                if event["id"] is not None and event["id"] > self._watermark:
+                    self._watermark = event["id"]
+            return dispatched
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "watermark": self._watermark,
+                "reread_ids": self.reread_ids,
+                "listeners": len(self._listeners),
+                "dispatched": self._dispatched,
+            }
+
+
+_behavior_event_stream = BehaviorEventStream()
+
+
+def get_behavior_event_stream() -> BehaviorEventStream:
+    return _behavior_event_stream
@@ -0,0 +1,368 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from app.catalogue import CatalogueSnapshot, get_catalogue_store
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+def _to_id(value: Any) -> int:
+    if value is None:
+        return -1
+    try:
+        return int(value)
+    except Exception:
+        return -1
+
+
+def _to_datetime(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+        except Exception:
+            return None
+    return None
+
+
+def _to_ts(value: Any) -> float:
+    dt = _to_datetime(value)
+    if dt is None:
+        return float("nan")
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+_EXCHANGE_LISTING_SQL = """
+    SELECT
+        ep.id,
+        ep.product_id,
+        ep.exchange_type,
+        ep.exchange_status,
+        ep.expiration_date,
+        ep.target_product_category_id,
+        ep.target_product_condition_id,
+        ep.created_at,
+        ep.updated_at,
+        p.seller_id,
+        p.category_id,
+        p.condition_level_id,
+        p.status,
+        p.deleted_at,
+        p.updated_at AS product_updated_at
+    FROM exchange_products ep
+    JOIN products p ON p.id = ep.product_id
+"""
+
+WANTS_MINE_BONUS = 25.0
+WANTED_BY_ME_BONUS = 25.0
+MUTUAL_MATCH_BONUS = 25.0
+
+
+@dataclass
+class ExchangeListing:
+    listing_id: int
+    product_id: int
+    seller_id: int
+    category_id: int
+    condition_id: int
+    target_category_id: int
+    target_condition_id: int
+    exchange_type: str
+    expiration_ts: float
+    created_at: Any
+
+
+@dataclass
+class ExchangeMatches:
+    product_ids: Any
+    positions: Any
+    boosts: Any
+    wants_mine: Dict[int, List[int]]
+    wanted_by_me: Set[int]
+
+
+def _match_keys(category_id: int, condition_id: int) -> Set[Tuple[int, int]]:
+    keys = {(category_id, condition_id), (category_id, -1), (-1, condition_id)}
+    keys.discard((-1, -1))
+    return keys
+
+
+class ExchangeMatchIndex:
+    def __init__(self) -> None:
+        self.full_refresh_seconds = max(60, _safe_env_int("EXCHANGE_INDEX_FULL_REFRESH_SECONDS", 3600))
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._listings: Dict[int, ExchangeListing] = {}
+        self._by_target: Dict[Tuple[int, int], Set[int]] = {}
+        self._by_offer: Dict[Tuple[int, int], Set[int]] = {}
+        self._by_seller: Dict[int, Set[int]] = {}
+        self._columns: Optional[Dict[str, Any]] = None
+        self._owners: Optional[Tuple[str, Any, Any]] = None
+        self._latest: Tuple[int, Optional[datetime]] = (0, None)
+        self._watermark_updated_at: Optional[datetime] = None
+        self._watermark_id = 0
+        self._last_full_refresh = 0.0
+        self._version = 0
+        self._built_at: Optional[str] = None
+        self._stats = {"full_builds": 0, "incremental_refreshes": 0, "rows_applied": 0, "expired_pruned": 0, "last_build_ms": None}
+
+    @property
+    def ready(self) -> bool:
+        return np is not None and self._built_at is not None
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def marker(self) -> Optional[str]:
+        # Derived from row watermarks rather than the local version counter, so it matches across workers.
+        if not self.ready:
+            return None
+        return f"{self._watermark_id}:{self._watermark_updated_at}"
+
+    def latest_listing(self) -> Tuple[int, Optional[datetime]]:
+        return self._latest
+
+    def _index(self, listing: ExchangeListing) -> None:
+        pid = listing.product_id
+        target = (listing.target_category_id, listing.target_condition_id)
+        if target != (-1, -1):
+            self._by_target.setdefault(target, set()).add(pid)
+        for key in _match_keys(listing.category_id, listing.condition_id):
+            self._by_offer.setdefault(key, set()).add(pid)
+        self._by_seller.setdefault(listing.seller_id, set()).add(pid)
+        self._listings[pid] = listing
+
+    def _unindex(self, product_id: int) -> None:
+        listing = self._listings.pop(product_id, None)
+        if listing is None:
+            return
+        self._by_target.get((listing.target_category_id, listing.target_condition_id), set()).discard(product_id)
+        for key in _match_keys(listing.category_id, listing.condition_id):
+            self._by_offer.get(key, set()).discard(product_id)
+        self._by_seller.get(listing.seller_id, set()).discard(product_id)
+
+    def _rebuild_columns(self) -> None:
+        listings = sorted(self._listings.values(), key=lambda x: x.product_id)
+        count = len(listings)
+        self._columns = {
+            "product_ids": np.fromiter((x.product_id for x in listings), dtype=np.int64, count=count),
+            "seller_ids": np.fromiter((x.seller_id for x in listings), dtype=np.int64, count=count),
+            "expiration_ts": np.fromiter((x.expiration_ts for x in listings), dtype=np.float64, count=count),
+            "exchange_types": np.array([x.exchange_type for x in listings], dtype=object),
+        }
+        created = [c for c in (_to_datetime(x.created_at) for x in listings) if c is not None]
+        self._latest = (
+            max((x.listing_id for x in listings), default=0),
+            max(created) if created else None,
+        )
+
+    def _advance_watermark(self, rows: List[Dict[str, Any]]) -> None:
+        for r in rows:
+            for column in ("updated_at", "product_updated_at"):
+                updated_at = _to_datetime(r.get(column))
+                if updated_at is not None and (self._watermark_updated_at is None or updated_at > self._watermark_updated_at):
+                    self._watermark_updated_at = updated_at
+            self._watermark_id = max(self._watermark_id, int(r["id"]))
+
+    @staticmethod
+    def _listing_from_row(r: Dict[str, Any]) -> ExchangeListing:
+        return ExchangeListing(
+            listing_id=int(r["id"]),
+            product_id=int(r["product_id"]),
+            seller_id=_to_id(r.get("seller_id")),
+            category_id=_to_id(r.get("category_id")),
+            condition_id=_to_id(r.get("condition_level_id")),
+            target_category_id=_to_id(r.get("target_product_category_id")),
+            target_condition_id=_to_id(r.get("target_product_condition_id")),
+            exchange_type=str(r.get("exchange_type") or ""),
+            expiration_ts=_to_ts(r.get("expiration_date")),
+            created_at=r.get("created_at"),
+        )
+
+    @staticmethod
+    def _is_live(r: Dict[str, Any]) -> bool:
+        return r.get("exchange_status") == "open" and r.get("status") == "available" and r.get("deleted_at") is None
+
+    def refresh(self, conn, force: bool = False) -> Dict[str, Any]:
+        if np is None:
+            raise RuntimeError("Missing dependency: numpy")
+        with self._refresh_lock:
+            started = time.perf_counter()
+            store = get_catalogue_store()
+            if store.snapshot() is None:
+                store.refresh(conn)
+            catalogue = store.snapshot()
+            db_now = time.time() + catalogue.db_clock_offset
+
+            stale = time.monotonic() - self._last_full_refresh >= self.full_refresh_seconds
+            full = force or not self.ready or stale
+            if full:
+                rows = [
+                    dict(r)
+                    for r in conn.execute(
+                        text(
+                            _EXCHANGE_LISTING_SQL
+                            + " WHERE ep.exchange_status = 'open' AND p.status = 'available' AND p.deleted_at IS NULL"
+                        )
+                    ).mappings().all()
+                ]
+            else:
+                params: Dict[str, Any] = {"after_id": self._watermark_id}
+                where_sql = " WHERE ep.id > :after_id"
+                if self._watermark_updated_at is not None:
+                    where_sql = " WHERE (ep.updated_at >= :since OR p.updated_at >= :since OR ep.id > :after_id)"
+                    params["since"] = self._watermark_updated_at
+                rows = [dict(r) for r in conn.execute(text(_EXCHANGE_LISTING_SQL + where_sql), params).mappings().all()]
+
+            with self._lock:
+                if full:
+                    self._listings = {}
+                    self._by_target = {}
+                    self._by_offer = {}
+                    self._by_seller = {}
+                    self._watermark_updated_at = None
+                    self._watermark_id = 0
+                self._advance_watermark(rows)
+                for r in sorted(rows, key=lambda x: int(x["id"])):
+                    listing = self._listing_from_row(r)
+                    current = self._listings.get(listing.product_id)
+                    if current is not None and current.listing_id > listing.listing_id:
+                        continue
+                    self._unindex(listing.product_id)
+                    if self._is_live(r):
+                        self._index(listing)
+                expired = [pid for pid, x in self._listings.items() if x.expiration_ts <= db_now]
+                for pid in expired:
+                    self._unindex(pid)
+                if full or rows or expired:
+                    self._rebuild_columns()
+                    self._version += 1
+                elapsed_ms = int((time.perf_counter() - started) * 1000)
+                self._built_at = datetime.utcnow().isoformat()
+                self._stats["full_builds" if full else "incremental_refreshes"] += 1
+                self._stats["rows_applied"] += len(rows)
+                self._stats["expired_pruned"] += len(expired)
+                self._stats["last_build_ms"] = elapsed_ms
+            if full:
+                self._last_full_refresh = time.monotonic()
+            return {
+                "mode": "full" if full else "incremental",
+                "rows": len(rows),
+                "expired": len(expired),
+                "listings": len(self._listings),
+                "build_ms": elapsed_ms,
+            }
+
+    def owned_products(self, catalogue: CatalogueSnapshot, seller_id: int) -> Dict[Tuple[int, int], List[int]]:
+        owners = self._owners
+        if owners is None or owners[0] != catalogue.built_at:
+            order = np.argsort(catalogue.seller_ids, kind="stable")
+            owners = (catalogue.built_at, order, catalogue.seller_ids[order])
+            self._owners = owners
+        _, order, sorted_sellers = owners
+        start = int(np.searchsorted(sorted_sellers, int(seller_id), side="left"))
+        end = int(np.searchsorted(sorted_sellers, int(seller_id), side="right"))
+        out: Dict[Tuple[int, int], List[int]] = {}
+        for pos in order[start:end].tolist():
+            key = (int(catalogue.category_ids[pos]), int(catalogue.condition_ids[pos]))
+            out.setdefault(key, []).append(int(catalogue.ids[pos]))
+        return out
+
+    def match(
+        self,
+        user_id: int,
+        catalogue: CatalogueSnapshot,
+        now_ts: Optional[float] = None,
+        exchange_type: Optional[str] = None,
+    ) -> ExchangeMatches:
+        owned = self.owned_products(catalogue, user_id)
+        with self._lock:
+            columns = self._columns
+            wants_mine: Dict[int, List[int]] = {}
+            for (category_id, condition_id), own_ids in owned.items():
+                for key in _match_keys(category_id, condition_id):
+                    for pid in self._by_target.get(key, ()):
+                        wants_mine.setdefault(pid, []).extend(own_ids)
+
+            own_listings = self._by_seller.get(int(user_id), set())
+            wanted_by_me: Set[int] = set()
+            for own_pid in own_listings:
+                own = self._listings[own_pid]
+                if own.target_category_id < 0 and own.target_condition_id < 0:
+                    continue
+                wanted_by_me |= self._by_offer.get((own.target_category_id, own.target_condition_id), set())
+            wanted_by_me -= own_listings
+            for own_pid in own_listings:
+                wants_mine.pop(own_pid, None)
+
+        if columns is None or columns["product_ids"].shape[0] == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return ExchangeMatches(empty, empty, np.empty(0, dtype=np.float64), {}, set())
+
+        db_now = (time.time() if now_ts is None else now_ts) + catalogue.db_clock_offset
+        live = columns["seller_ids"] != int(user_id)
+        with np.errstate(invalid="ignore"):
+            live &= ~(columns["expiration_ts"] <= db_now)
+        if exchange_type is not None:
+            live &= columns["exchange_types"] == exchange_type
+        live &= np.isin(columns["product_ids"], catalogue.ids)
+        product_ids = columns["product_ids"][live]
+
+        boosts = np.zeros(product_ids.shape[0], dtype=np.float64)
+        if wants_mine or wanted_by_me:
+            wants = np.isin(product_ids, np.fromiter(wants_mine.keys(), dtype=np.int64, count=len(wants_mine)))
+            wanted = np.isin(product_ids, np.fromiter(wanted_by_me, dtype=np.int64, count=len(wanted_by_me)))
+            boosts += np.where(wants, WANTS_MINE_BONUS, 0.0)
+            boosts += np.where(wanted, WANTED_BY_ME_BONUS, 0.0)
+            boosts += np.where(wants & wanted, MUTUAL_MATCH_BONUS, 0.0)
+
+        return ExchangeMatches(
+            product_ids=product_ids,
+            positions=catalogue.positions_for_ids(product_ids),
+            boosts=boosts,
+            wants_mine={pid: sorted(set(ids)) for pid, ids in wants_mine.items()},
+            wanted_by_me=wanted_by_me,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ready": self._built_at is not None,
+                "listings": len(self._listings),
+                "target_keys": len(self._by_target),
+                "offer_keys": len(self._by_offer),
+                "version": self._version,
+                "built_at": self._built_at,
+                "watermark_id": self._watermark_id,
+                "watermark_updated_at": self._watermark_updated_at.isoformat() if self._watermark_updated_at else None,
+                **self._stats,
+            }
+
+
+_exchange_match_index = ExchangeMatchIndex()
+
+
+def get_exchange_match_index() -> ExchangeMatchIndex:
+    return _exchange_match_index
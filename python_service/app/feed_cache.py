@@ -0,0 +1,230 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+FeedKey = Tuple[int, Optional[int], int]
+
+
+@dataclass
+class _FeedEntry:
+    value: Dict[str, Any]
+    stored_at: float
+    user_version: int
+    catalogue_version: int
+
+
+class HybridFeedCache:
+    def __init__(self) -> None:
+        self.enabled = (os.environ.get("FEED_CACHE_ENABLED") or "1").strip().lower() not in {"0", "false", "no", "off"}
+        self.ttl_seconds = max(1, _safe_env_int("FEED_CACHE_TTL_SECONDS", 60))
+        self.stale_seconds = max(0, _safe_env_int("FEED_CACHE_STALE_SECONDS", 300))
+        self.max_entries = max(100, _safe_env_int("FEED_CACHE_MAX_ENTRIES", 5000))
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[FeedKey, _FeedEntry]" = OrderedDict()
+        self._user_versions: Dict[int, int] = {}
+        self._catalogue_version = 0
+        self._catalogue_marker: Optional[str] = None
+        self._refreshing: Set[FeedKey] = set()
+        self._stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "user_invalidations": 0,
+            "catalogue_invalidations": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "evictions": 0,
+        }
+
+    @property
+    def catalogue_marker(self) -> Optional[str]:
+        return self._catalogue_marker
+
+    def _versions(self, user_id: int) -> Tuple[int, int]:
+        return self._user_versions.get(user_id, 0), self._catalogue_version
+
+    def _store(self, key: FeedKey, value: Dict[str, Any], user_version: int, catalogue_version: int) -> None:
+        with self._lock:
+            if self._user_versions.get(key[0], 0) != user_version:
+                return
+            self._entries[key] = _FeedEntry(value, time.monotonic(), user_version, catalogue_version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _build(self, engine: Engine, build: Callable[[Any], Dict[str, Any]], conn=None) -> Dict[str, Any]:
+        if conn is not None:
+            return build(conn)
+        with engine.connect() as own_conn:
+            return build(own_conn)
+
+    def _refresh(self, engine: Engine, key: FeedKey, build: Callable[[Any], Dict[str, Any]]) -> None:
+        try:
+            with self._lock:
+                user_version, catalogue_version = self._versions(key[0])
+            value = self._build(engine, build)
+            self._store(key, value, user_version, catalogue_version)
+            with self._lock:
+                self._stats["refreshes"] += 1
+        except Exception:
+            with self._lock:
+                self._stats["refresh_errors"] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _key(self, user_id: int, last_interacted_product_id: Optional[int], limit: int) -> FeedKey:
+        return (int(user_id), int(last_interacted_product_id) if last_interacted_product_id else None, int(limit))
+
+    def peek(self, user_id: int, last_interacted_product_id: Optional[int], limit: int) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        key = self._key(user_id, last_interacted_product_id, limit)
+        with self._lock:
+            user_version, catalogue_version = self._versions(key[0])
+            entry = self._entries.get(key)
+            if entry is None or entry.user_version != user_version or entry.catalogue_version != catalogue_version:
+                return None
+            if time.monotonic() - entry.stored_at >= self.ttl_seconds:
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry.value
+
+    def get_or_build(
+        self,
+        engine: Engine,
+        user_id: int,
+        last_interacted_product_id: Optional[int],
+        limit: int,
+        build: Callable[[Any], Dict[str, Any]],
+        conn=None,
+    ) -> Dict[str, Any]:
+        if not self.enabled:
+            return self._build(engine, build, conn)
+
+        key = self._key(user_id, last_interacted_product_id, limit)
+        now_mono = time.monotonic()
+        start_refresh = False
+        with self._lock:
+            user_version, catalogue_version = self._versions(key[0])
+            entry = self._entries.get(key)
+            if entry is not None and entry.user_version != user_version:
+                self._entries.pop(key, None)
+                self._stats["user_invalidations"] += 1
+                entry = None
+            if entry is not None:
+                age = now_mono - entry.stored_at
+                fresh = age < self.ttl_seconds and entry.catalogue_version == catalogue_version
+                if fresh:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry.value
+                if age < self.ttl_seconds + self.stale_seconds:
+                    self._entries.move_to_end(key)
+                    self._stats["stale_hits"] += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        start_refresh = True
+                    stale_value = entry.value
+                else:
+                    self._entries.pop(key, None)
+                    entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+
+        if entry is not None:
+            if start_refresh:
+                threading.Thread(
+                    target=self._refresh,
+                    args=(engine, key, build),
+                    name=f"feed-refresh-{key[0]}",
+                    daemon=True,
+                ).start()
+            return stale_value
+
+        value = self._build(engine, build, conn)
+        self._store(key, value, user_version, catalogue_version)
+        return value
+
+    def observe_event(self, event: Dict[str, Any]) -> None:
+        user_id = event.get("user_id")
+        if user_id is None:
+            return
+        with self._lock:
+            uid = int(user_id)
+            self._user_versions[uid] = self._user_versions.get(uid, 0) + 1
+            if len(self._user_versions) > self.max_entries * 4:
+                live_users = {k[0] for k in self._entries.keys()}
+                self._user_versions = {k: v for k, v in self._user_versions.items() if k in live_users}
+
+    def poll_catalogue(self, conn) -> Dict[str, Any]:
+        row = conn.execute(
+            text(
+                """
+                SELECT COUNT(*) AS row_count, MAX(id) AS max_id, MAX(updated_at) AS max_updated_at
+                FROM products
+                WHERE status = 'available' AND deleted_at IS NULL
+                """
+            )
+        ).mappings().first() or {}
+        max_updated_at = row.get("max_updated_at")
+        updated_raw = max_updated_at.isoformat() if isinstance(max_updated_at, datetime) else str(max_updated_at or "")
+        marker = f"{int(row.get('row_count') or 0)}:{int(row.get('max_id') or 0)}:{updated_raw}"
+        with self._lock:
+            changed = self._catalogue_marker is not None and self._catalogue_marker != marker
+            self._catalogue_marker = marker
+            if changed:
+                self._catalogue_version += 1
+                self._stats["catalogue_invalidations"] += 1
+            return {"changed": changed, "marker": marker, "catalogue_version": self._catalogue_version}
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            uid = int(user_id)
+            self._user_versions[uid] = self._user_versions.get(uid, 0) + 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["stale_hits"] + self._stats["misses"]
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "stale_seconds": self.stale_seconds,
+                "catalogue_version": self._catalogue_version,
+                "refreshing": len(self._refreshing),
+                "hit_ratio": round((self._stats["hits"] + self._stats["stale_hits"]) / lookups, 4) if lookups else None,
+                **self._stats,
+            }
+
+
+_hybrid_feed_cache = HybridFeedCache()
+
+
+def get_hybrid_feed_cache() -> HybridFeedCache:
+    return _hybrid_feed_cache
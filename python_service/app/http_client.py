@@ -0,0 +1,346 @@
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+def _safe_env_float(name: str, default: float) -> float:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return float(raw)
+    except Exception:
+        return default
+
+
+_RETRYABLE_ON_REUSE = (http.client.RemoteDisconnected, http.client.BadStatusLine, BrokenPipeError, ConnectionResetError)
+_REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+
+
+class UpstreamUnavailable(Exception):
+    pass
+
+
+class HttpStatusError(Exception):
+    def __init__(self, status: int, body: bytes) -> None:
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.body = body
+
+
+class HttpResponse:
+    def __init__(self, url: str, status: int, headers: Dict[str, str], body: bytes) -> None:
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self) -> Any:
+        return json.loads(self.body.decode("utf-8")) if self.body else {}
+
+    def raise_for_status(self) -> None:
+        if self.status >= 400:
+            raise HttpStatusError(self.status, self.body)
+
+
+class StreamingResponse:
+    def __init__(self, url: str, resp: http.client.HTTPResponse) -> None:
+        self.url = url
+        self.status = resp.status
+        self.headers = {k.lower(): v for k, v in resp.getheaders()}
+        self._resp = resp
+
+    def read(self) -> bytes:
+        return self._resp.read()
+
+    def iter_lines(self) -> Iterator[str]:
+        while True:
+            line = self._resp.readline()
+            if not line:
+                return
+            yield line.decode("utf-8", errors="replace").rstrip("\r\n")
+
+
+class CircuitBreaker:
+    """Opens after consecutive transport failures; after a cool-down lets one probe through."""
+
+    def __init__(self, failure_threshold: int, open_seconds: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.opened_count = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if self._state == "open" and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._state = "half_open"
+                self._probing = False
+            if self._state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                if self._state != "open":
+                    self.opened_count += 1
+                self._state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self._state, "consecutive_failures": self._failures, "opened": self.opened_count}
+
+
+class _Origin:
+    def __init__(self, scheme: str, netloc: str, max_idle: int, breaker: CircuitBreaker) -> None:
+        self.scheme = scheme
+        self.netloc = netloc
+        self.max_idle = max_idle
+        self.breaker = breaker
+        self.lock = threading.Lock()
+        self.idle: List[http.client.HTTPConnection] = []
+        self.stats = {"requests": 0, "reused": 0, "connects": 0, "failures": 0, "rejected": 0}
+
+    def acquire(self, connect_timeout: float) -> Tuple[http.client.HTTPConnection, bool]:
+        with self.lock:
+            if self.idle:
+                self.stats["reused"] += 1
+                return self.idle.pop(), True
+            self.stats["connects"] += 1
+        conn_cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        conn = conn_cls(self.netloc, timeout=connect_timeout)
+        conn.connect()
+        return conn, False
+
+    def release(self, conn: http.client.HTTPConnection) -> None:
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.stats[name] += 1
+
+
+class HttpClient:
+    def __init__(self) -> None:
+        self.connect_timeout = max(0.05, _safe_env_float("HTTP_CLIENT_CONNECT_TIMEOUT_SECONDS", 1.0))
+        self.read_timeout = max(0.1, _safe_env_float("HTTP_CLIENT_READ_TIMEOUT_SECONDS", 8.0))
+        self.max_idle_per_origin = max(1, _safe_env_int("HTTP_CLIENT_POOL_SIZE", 8))
+        self.max_redirects = max(0, _safe_env_int("HTTP_CLIENT_MAX_REDIRECTS", 3))
+        self.breaker_failures = max(1, _safe_env_int("HTTP_CLIENT_BREAKER_FAILURES", 5))
+        self.breaker_open_seconds = max(0.1, _safe_env_float("HTTP_CLIENT_BREAKER_OPEN_SECONDS", 30.0))
+        self._lock = threading.Lock()
+        self._origins: Dict[Tuple[str, str], _Origin] = {}
+        self._laravel_healthy: Optional[str] = None
+
+    def _origin(self, scheme: str, netloc: str) -> _Origin:
+        key = (scheme, netloc)
+        with self._lock:
+            origin = self._origins.get(key)
+            if origin is None:
+                origin = self._origins[key] = _Origin(
+                    scheme,
+                    netloc,
+                    self.max_idle_per_origin,
+                    CircuitBreaker(self.breaker_failures, self.breaker_open_seconds),
+                )
+            return origin
+
+    def _open(
+        self,
+        origin: _Origin,
+        method: str,
+        target: str,
+        headers: Dict[str, str],
+        body: Optional[bytes],
+        connect_timeout: float,
+        read_timeout: float,
+    ) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        for attempt in range(2):
+            conn, reused = origin.acquire(connect_timeout)
+            try:
+                conn.sock.settimeout(read_timeout)
+                conn.request(method, target, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except _RETRYABLE_ON_REUSE:
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+        raise UpstreamUnavailable(f"{origin.netloc}: connection dropped")
+
+    def _finish(self, origin: _Origin, conn: http.client.HTTPConnection, resp: http.client.HTTPResponse) -> None:
+        if resp.will_close or not resp.isclosed():
+            conn.close()
+        else:
+            origin.release(conn)
+
+    def _prepare(self, url: str, headers: Optional[Dict[str, str]]) -> Tuple[_Origin, str, Dict[str, str]]:
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in {"http", "https"} or not parsed.netloc:
+            raise ValueError(f"Unsupported URL: {url}")
+        origin = self._origin(parsed.scheme, parsed.netloc)
+        if not origin.breaker.allow():
+            origin.count("rejected")
+            raise UpstreamUnavailable(f"{parsed.netloc}: circuit open")
+        target = parsed.path or "/"
+        if parsed.query:
+            target = f"{target}?{parsed.query}"
+        origin.count("requests")
+        return origin, target, {"Host": parsed.netloc, "Connection": "keep-alive", **(headers or {})}
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        body: Optional[bytes] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+    ) -> HttpResponse:
+        for _ in range(self.max_redirects + 1):
+            origin, target, request_headers = self._prepare(url, headers)
+            try:
+                conn, resp = self._open(
+                    origin,
+                    method,
+                    target,
+                    request_headers,
+                    body,
+                    connect_timeout if connect_timeout is not None else self.connect_timeout,
+                    read_timeout if read_timeout is not None else self.read_timeout,
+                )
+                try:
+                    payload = resp.read()
+                except BaseException:
+                    conn.close()
+                    raise
+            except (OSError, http.client.HTTPException) as e:
+                origin.count("failures")
+                origin.breaker.record_failure()
+                raise UpstreamUnavailable(f"{origin.netloc}: {type(e).__name__}") from e
+            origin.breaker.record_success()
+            self._finish(origin, conn, resp)
+            location = resp.getheader("location")
+            if resp.status in _REDIRECT_STATUSES and location and method in {"GET", "HEAD"}:
+                url = urllib.parse.urljoin(url, location)
+                continue
+            return HttpResponse(url, resp.status, {k.lower(): v for k, v in resp.getheaders()}, payload)
+        raise UpstreamUnavailable(f"Too many redirects: {url}")
+
+    @contextmanager
+    def stream(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        body: Optional[bytes] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+    ) -> Iterator["StreamingResponse"]:
+        origin, target, request_headers = self._prepare(url, headers)
+        try:
+            conn, resp = self._open(
+                origin,
+                method,
+                target,
+                request_headers,
+                body,
+                connect_timeout if connect_timeout is not None else self.connect_timeout,
+                read_timeout if read_timeout is not None else self.read_timeout,
+            )
+        except (OSError, http.client.HTTPException) as e:
+            origin.count("failures")
+            origin.breaker.record_failure()
+            raise UpstreamUnavailable(f"{origin.netloc}: {type(e).__name__}") from e
+        origin.breaker.record_success()
+        streaming = StreamingResponse(url, resp)
+        try:
+            yield streaming
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            origin.count("failures")
+            origin.breaker.record_failure()
+            raise UpstreamUnavailable(f"{origin.netloc}: {type(e).__name__}") from e
+        except BaseException:
+            conn.close()
+            raise
+        self._finish(origin, conn, resp)
+
+    def laravel_base_urls(self) -> List[str]:
+        configured = (os.environ.get("LARAVEL_BASE_URL") or "").strip().rstrip("/")
+        candidates = [self._laravel_healthy, configured, "http://127.0.0.1:8000", "http://localhost:8000"]
+        return [url for i, url in enumerate(candidates) if url and url not in candidates[:i]]
+
+    def laravel_request(self, method: str, path: str, headers: Optional[Dict[str, str]] = None, body: Optional[bytes] = None) -> HttpResponse:
+        last_error: Optional[Exception] = None
+        for base_url in self.laravel_base_urls():
+            try:
+                resp = self.request(method, f"{base_url}{path}", headers=headers, body=body)
+            except UpstreamUnavailable as e:
+                last_error = e
+                continue
+            self._laravel_healthy = base_url
+            return resp
+        raise UpstreamUnavailable(str(last_error) if last_error is not None else "No Laravel base URL configured")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            origins = list(self._origins.values())
+        return {
+            "connect_timeout_seconds": self.connect_timeout,
+            "read_timeout_seconds": self.read_timeout,
+            "laravel_healthy_base_url": self._laravel_healthy,
+            "origins": {
+                f"{o.scheme}://{o.netloc}": {**o.stats, "idle": len(o.idle), "breaker": o.breaker.snapshot()} for o in origins
+            },
+        }
+
+
+_http_client = HttpClient()
+
+
+def get_http_client() -> HttpClient:
+    return _http_client
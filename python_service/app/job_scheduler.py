@@ -0,0 +1,407 @@
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+
+def _safe_env_float(name: str, default: float) -> float:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return float(raw)
+    except Exception:
+        return default
+
+
+def _safe_env_bool(name: str, default: bool) -> bool:
+    raw = (os.environ.get(name) or "").strip().lower()
+    if raw == "":
+        return default
+    return raw in {"1", "true", "yes", "on"}
+
+
+def _now_iso() -> str:
+    return datetime.utcnow().isoformat()
+
+
+@dataclass
+class ScheduledJob:
+    name: str
+    func: Callable[[], Any]
+    interval_seconds: float
+    jitter_ratio: float
+    timeout_seconds: float
+    cluster_wide: bool
+    enabled: bool = True
+    next_run_at: float = 0.0
+    running: bool = False
+    run_count: int = 0
+    last_trigger: Optional[str] = None
+    last_status: Optional[str] = None
+    last_error: Optional[str] = None
+    last_result: Any = None
+    last_started_at: Optional[str] = None
+    last_finished_at: Optional[str] = None
+    last_duration_ms: Optional[int] = None
+    last_skipped_at: Optional[str] = None
+    done_event: Optional[threading.Event] = None
+
+    def to_dict(self, now_monotonic: float) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "enabled": self.enabled,
+            "scope": "cluster" if self.cluster_wide else "worker",
+            "interval_seconds": self.interval_seconds,
+            "jitter_ratio": self.jitter_ratio,
+            "timeout_seconds": self.timeout_seconds,
+            "running": self.running,
+            "run_count": self.run_count,
+            "next_run_in_seconds": round(max(0.0, self.next_run_at - now_monotonic), 3) if self.enabled else None,
+            "last_trigger": self.last_trigger,
+            "last_status": self.last_status,
+            "last_error": self.last_error,
+            "last_result": self.last_result,
+            "last_started_at": self.last_started_at,
+            "last_finished_at": self.last_finished_at,
+            "last_duration_ms": self.last_duration_ms,
+            "last_skipped_at": self.last_skipped_at,
+        }
+
+
+class _MySQLLeaderLock:
+    backend = "mysql"
+
+    def __init__(self, engine: Engine, name: str) -> None:
+        self._engine = engine
+        self._name = name
+        self._conn = None
+
+    def acquire_or_renew(self) -> bool:
+        if self._conn is not None:
+            try:
+                held = self._conn.execute(
+                    text("SELECT IS_USED_LOCK(:name) = CONNECTION_ID() AS held"),
+                    {"name": self._name},
+                ).scalar()
+                self._conn.commit()
+                if int(held or 0) == 1:
+                    return True
+            except Exception:
+                pass
+            self._close()
+
+        conn = None
+        try:
+            conn = self._engine.connect()
+            acquired = conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": self._name}).scalar()
+            conn.commit()
+        except Exception:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            return False
+        if int(acquired or 0) != 1:
+            conn.close()
+            return False
+        self._conn = conn
+        return True
+
+    def release(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": self._name})
+            self._conn.commit()
+        except Exception:
+            pass
+        self._close()
+
+    def _close(self) -> None:
+        conn = self._conn
+        self._conn = None
+        if conn is not None:
+            try:
+                conn.invalidate()
+            except Exception:
+                pass
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+class _RedisLeaderLock:
+    backend = "redis"
+
+    _RENEW_SCRIPT = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then "
+        "return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+    )
+    _RELEASE_SCRIPT = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then "
+        "return redis.call('del', KEYS[1]) else return 0 end"
+    )
+
+    def __init__(self, client, name: str, lease_seconds: float) -> None:
+        self._client = client
+        self._key = name
+        self._token = uuid.uuid4().hex
+        self._lease_ms = max(1000, int(lease_seconds * 1000))
+
+    def acquire_or_renew(self) -> bool:
+        try:
+            if int(self._client.eval(self._RENEW_SCRIPT, 1, self._key, self._token, self._lease_ms) or 0) == 1:
+                return True
+            return bool(self._client.set(self._key, self._token, nx=True, px=self._lease_ms))
+        except Exception:
+            return False
+
+    def release(self) -> None:
+        try:
+            self._client.eval(self._RELEASE_SCRIPT, 1, self._key, self._token)
+        except Exception:
+            pass
+
+
+class _LocalLeaderLock:
+    backend = "none"
+
+    def acquire_or_renew(self) -> bool:
+        return True
+
+    def release(self) -> None:
+        return None
+
+
+class JobScheduler:
+    def __init__(self) -> None:
+        self.enabled = _safe_env_bool("JOB_SCHEDULER_ENABLED", True)
+        self.tick_seconds = max(0.2, _safe_env_float("JOB_SCHEDULER_TICK_SECONDS", 1.0))
+        self.leader_lease_seconds = max(5.0, _safe_env_float("JOB_LEADER_LEASE_SECONDS", 30.0))
+        self.leader_lock_name = (os.environ.get("JOB_LEADER_LOCK_NAME") or "xiaowu:python_service:scheduler").strip()
+        self.default_jitter_ratio = min(0.5, max(0.0, _safe_env_float("JOB_DEFAULT_JITTER_RATIO", 0.1)))
+        self.default_timeout_seconds = max(1.0, _safe_env_float("JOB_DEFAULT_TIMEOUT_SECONDS", 300.0))
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._jobs: Dict[str, ScheduledJob] = {}
+        self._lock = threading.Lock()
+        self._leader_lock = None
+        self._is_leader = False
+        self._leader_since: Optional[str] = None
+        self._started = False
+
+    @property
+    def is_leader(self) -> bool:
+        return self._is_leader
+
+    def register(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        interval_seconds: float,
+        jitter_ratio: Optional[float] = None,
+        timeout_seconds: Optional[float] = None,
+        cluster_wide: bool = True,
+        run_on_start: bool = True,
+    ) -> ScheduledJob:
+        env_prefix = "JOB_" + "".join(ch if ch.isalnum() else "_" for ch in name).upper()
+        interval = max(1.0, _safe_env_float(f"{env_prefix}_INTERVAL_SECONDS", float(interval_seconds)))
+        jitter = jitter_ratio if jitter_ratio is not None else self.default_jitter_ratio
+        jitter = min(0.5, max(0.0, _safe_env_float(f"{env_prefix}_JITTER_RATIO", jitter)))
+        timeout = timeout_seconds if timeout_seconds is not None else self.default_timeout_seconds
+        timeout = max(1.0, _safe_env_float(f"{env_prefix}_TIMEOUT_SECONDS", timeout))
+        job = ScheduledJob(
+            name=name,
+            func=func,
+            interval_seconds=interval,
+            jitter_ratio=jitter,
+            timeout_seconds=timeout,
+            cluster_wide=cluster_wide,
+            enabled=_safe_env_bool(f"{env_prefix}_ENABLED", True),
+        )
+        now_monotonic = time.monotonic()
+        if run_on_start:
+            job.next_run_at = now_monotonic + random.uniform(0.0, max(self.tick_seconds, interval * jitter))
+        else:
+            job.next_run_at = now_monotonic + self._jittered_interval(job)
+        with self._lock:
+            self._jobs[name] = job
+        return job
+
+    def start(self, engine: Engine) -> None:
+        with self._lock:
+            if self._started or not self.enabled:
+                return
+            self._started = True
+        self._leader_lock = self._build_leader_lock(engine)
+        thread = threading.Thread(target=self._loop, daemon=True, name="job-scheduler")
+        thread.start()
+
+    def _build_leader_lock(self, engine: Engine):
+        backend = (os.environ.get("JOB_LEADER_BACKEND") or "auto").strip().lower()
+        if backend == "none":
+            return _LocalLeaderLock()
+        url = (os.environ.get("REDIS_URL") or "").strip()
+        if backend in {"auto", "redis"} and url and redis is not None:
+            try:
+                client = redis.Redis.from_url(url, decode_responses=True)
+                client.ping()
+                return _RedisLeaderLock(client, self.leader_lock_name, self.leader_lease_seconds)
+            except Exception:
+                pass
+        return _MySQLLeaderLock(engine, self.leader_lock_name)
+
+    def _jittered_interval(self, job: ScheduledJob) -> float:
+        spread = job.interval_seconds * job.jitter_ratio
+        return max(1.0, job.interval_seconds + random.uniform(-spread, spread))
+
+    def _refresh_leadership(self) -> bool:
+        lock = self._leader_lock
+        is_leader = bool(lock is not None and lock.acquire_or_renew())
+        with self._lock:
+            if is_leader and not self._is_leader:
+                self._leader_since = _now_iso()
+            if not is_leader:
+                self._leader_since = None
+            self._is_leader = is_leader
+        return is_leader
+
+    def _loop(self) -> None:
+        last_leader_check = 0.0
+        leader_check_every = max(self.tick_seconds, self.leader_lease_seconds / 3.0)
+        is_leader = False
+        while True:
+            now_monotonic = time.monotonic()
+            if now_monotonic - last_leader_check >= leader_check_every:
+                is_leader = self._refresh_leadership()
+                last_leader_check = now_monotonic
+
+            with self._lock:
+                due = [job for job in self._jobs.values() if job.enabled and job.next_run_at <= now_monotonic]
+            for job in due:
+                if job.cluster_wide and not is_leader:
+                    with self._lock:
+                        job.next_run_at = now_monotonic + self._jittered_interval(job)
+                        job.last_skipped_at = _now_iso()
+                    continue
+                self._launch(job, trigger="schedule")
+            time.sleep(self.tick_seconds)
+
+    def _launch(self, job: ScheduledJob, trigger: str) -> bool:
+        with self._lock:
+            job.next_run_at = time.monotonic() + self._jittered_interval(job)
+            if job.running:
+                job.last_skipped_at = _now_iso()
+                return False
+            job.running = True
+            job.last_trigger = trigger
+            job.last_started_at = _now_iso()
+            job.last_finished_at = None
+            job.last_status = "running"
+            job.last_error = None
+
+        done = threading.Event()
+        job.done_event = done
+        holder: Dict[str, Any] = {}
+        started = time.perf_counter()
+
+        def _work() -> None:
+            try:
+                holder["result"] = job.func()
+            except Exception as e:
+                holder["error"] = f"{type(e).__name__}: {e}"
+            finally:
+                elapsed_ms = int((time.perf_counter() - started) * 1000)
+                with self._lock:
+                    job.run_count += 1
+                    job.running = False
+                    job.last_finished_at = _now_iso()
+                    job.last_duration_ms = elapsed_ms
+                    if job.last_status == "timeout":
+                        job.last_error = f"{job.last_error} (finished after {elapsed_ms} ms)"
+                    elif "error" in holder:
+                        job.last_status = "error"
+                        job.last_error = holder["error"]
+                    else:
+                        job.last_status = "ok"
+                        job.last_result = _summarize_result(holder.get("result"))
+                done.set()
+
+        def _supervise() -> None:
+            if done.wait(job.timeout_seconds):
+                return
+            with self._lock:
+                if job.running:
+                    job.last_status = "timeout"
+                    job.last_error = f"Job exceeded {job.timeout_seconds:g}s timeout"
+
+        threading.Thread(target=_work, daemon=True, name=f"job-{job.name}").start()
+        threading.Thread(target=_supervise, daemon=True, name=f"job-{job.name}-watchdog").start()
+        return True
+
+    def trigger(self, name: str) -> Dict[str, Any]:
+        with self._lock:
+            job = self._jobs.get(name)
+        if job is None:
+            raise KeyError(name)
+        launched = self._launch(job, trigger="manual")
+        payload = self.job_status(name)
+        payload["launched"] = launched
+        return payload
+
+    def job_status(self, name: str) -> Dict[str, Any]:
+        with self._lock:
+            job = self._jobs.get(name)
+            if job is None:
+                raise KeyError(name)
+            return job.to_dict(time.monotonic())
+
+    def list_jobs(self) -> List[Dict[str, Any]]:
+        now_monotonic = time.monotonic()
+        with self._lock:
+            return [job.to_dict(now_monotonic) for job in sorted(self._jobs.values(), key=lambda j: j.name)]
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            is_leader = self._is_leader
+            leader_since = self._leader_since
+            started = self._started
+        return {
+            "enabled": self.enabled,
+            "started": started,
+            "worker_id": self.worker_id,
+            "leader_backend": getattr(self._leader_lock, "backend", None),
+            "is_leader": is_leader,
+            "leader_since": leader_since,
+            "jobs": self.list_jobs(),
+        }
+
+
+def _summarize_result(result: Any) -> Any:
+    if result is None or isinstance(result, (bool, int, float, str)):
+        return result
+    if isinstance(result, dict):
+        return {str(k): v for k, v in list(result.items())[:20] if v is None or isinstance(v, (bool, int, float, str))}
+    return str(type(result).__name__)
+
+
+_job_scheduler = JobScheduler()
+
+
+def get_job_scheduler() -> JobScheduler:
+    return _job_scheduler
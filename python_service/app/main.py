@@ -27,15 +27,38 @@ def _load_local_env() -> None:
 _load_local_env()
 
 from app.api.router import py_router, router as api_router
-from app.api.router import _get_db_engine
-from app.recommendation_engine import start_trending_batch_updater
+from app.api.router import _get_db_engine, _register_visual_search_jobs
+from app.database import get_async_database, warm_up_pool
+from app.job_scheduler import get_job_scheduler
+from app.recommendation_engine import register_recommendation_jobs
+from app.user_profiles import get_user_profile_store
 
 app = FastAPI(title="XiaoWu Python Service")
 
 
 @app.on_event("startup")
-def _startup_trending_updater() -> None:
-    start_trending_batch_updater(_get_db_engine())
+def _startup_job_scheduler() -> None:
+    engine = _get_db_engine()
+    warm_up_pool(engine)
+    scheduler = get_job_scheduler()
+    register_recommendation_jobs(scheduler, engine)
+    _register_visual_search_jobs(scheduler, engine)
+    scheduler.start(engine)
+
+
+@app.on_event("startup")
+async def _startup_async_database() -> None:
+    await get_async_database().warm_up()
+
+
+@app.on_event("shutdown")
+async def _shutdown_async_database() -> None:
+    await get_async_database().dispose()
+
+
+@app.on_event("shutdown")
+def _flush_user_profiles() -> None:
+    get_user_profile_store().flush()
 
 
 @app.get("/health")
@@ -0,0 +1,263 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Tuple
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import ProgrammingError
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+def _is_missing_table(e: ProgrammingError) -> bool:
+    return bool(getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146)
+
+
+_PROMOTED_SQL = """
+        CASE WHEN EXISTS (
+            SELECT 1 FROM promoted_listings pl
+            WHERE pl.product_id = p.id AND pl.promoted_until > NOW()
+        ) THEN 1 ELSE 0 END AS is_promoted"""
+
+_AVAILABLE_SQL = """
+    WHERE p.id IN :product_ids
+      AND p.status = 'available'
+      AND p.deleted_at IS NULL"""
+
+# Image and tag edits do not touch products.updated_at, so their counts and newest timestamps are part of the
+# card version; deleting a row changes the count even when the newest timestamp stays the same.
+_PRODUCT_VERSIONS_SQL = text(
+    f"""
+    SELECT
+        p.id,
+        p.updated_at,
+        pim.image_count,
+        pim.images_updated_at,
+        ptm.tag_count,
+        ptm.tags_updated_at,
+        ptm.tag_names_updated_at,{_PROMOTED_SQL}
+    FROM products p
+    LEFT JOIN (
+        SELECT product_id, COUNT(*) AS image_count, MAX(updated_at) AS images_updated_at
+        FROM product_images
+        WHERE product_id IN :product_ids
+        GROUP BY product_id
+    ) pim ON pim.product_id = p.id
+    LEFT JOIN (
+        SELECT pt.product_id, COUNT(*) AS tag_count, MAX(pt.updated_at) AS tags_updated_at,
+            MAX(t.updated_at) AS tag_names_updated_at
+        FROM product_tags pt
+        JOIN tags t ON t.id = pt.tag_id
+        WHERE pt.product_id IN :product_ids
+        GROUP BY pt.product_id
+    ) ptm ON ptm.product_id = p.id{_AVAILABLE_SQL}
+    """
+).bindparams(bindparam("product_ids", expanding=True))
+
+_PRODUCT_ONLY_VERSIONS_SQL = text(
+    f"""
+    SELECT p.id, p.updated_at,{_PROMOTED_SQL}
+    FROM products p{_AVAILABLE_SQL}
+    """
+).bindparams(bindparam("product_ids", expanding=True))
+
+_CARD_COLUMNS_SQL = """
+        p.id, p.updated_at, p.title, p.description, p.price, p.currency, p.status, p.created_at,
+        p.category_id, p.condition_level_id,
+        c.name AS category_name,
+        COALESCE(d_user.latitude, d_product.latitude) AS dormitory__latitude,
+        COALESCE(d_user.longitude, d_product.longitude) AS dormitory__longitude,
+        cl.id AS condition_level__id, cl.name AS condition_level__name,
+        cl.level AS condition_level__level,
+        u.id AS seller__id, u.username AS seller__username, u.profile_picture AS seller__profile_picture,"""
+
+_CARD_JOINS_SQL = """
+    LEFT JOIN users u ON u.id = p.seller_id
+    LEFT JOIN dormitories d_user ON d_user.id = u.dormitory_id
+    LEFT JOIN dormitories d_product ON d_product.id = p.dormitory_id
+    LEFT JOIN categories c ON c.id = p.category_id
+    LEFT JOIN condition_levels cl ON cl.id = p.condition_level_id"""
+
+# One round trip per miss batch: every image and tag becomes its own row next to the product columns
+# (a product with no media still yields one row), and the same rows carry the version markers.
+_PRODUCT_CARD_ROWS_SQL = text(
+    f"""
+    SELECT{_CARD_COLUMNS_SQL}{_PROMOTED_SQL},
+        m.kind AS media__kind, m.media_id AS media__id, m.value AS media__value,
+        m.thumbnail AS media__thumbnail, m.is_primary AS media__is_primary,
+        m.updated_at AS media__updated_at, m.name_updated_at AS media__name_updated_at
+    FROM products p{_CARD_JOINS_SQL}
+    LEFT JOIN (
+        SELECT 'image' AS kind, pi.product_id, pi.id AS media_id, pi.image_url AS value,
+            pi.image_thumbnail_url AS thumbnail, pi.is_primary, pi.updated_at, NULL AS name_updated_at
+        FROM product_images pi
+        WHERE pi.product_id IN :product_ids
+        UNION ALL
+        SELECT 'tag' AS kind, pt.product_id, t.id AS media_id, t.name AS value,
+            NULL AS thumbnail, 0 AS is_primary, pt.updated_at, t.updated_at AS name_updated_at
+        FROM product_tags pt
+        JOIN tags t ON t.id = pt.tag_id
+        WHERE pt.product_id IN :product_ids
+    ) m ON m.product_id = p.id{_AVAILABLE_SQL}
+    """
+).bindparams(bindparam("product_ids", expanding=True))
+
+_PRODUCT_ONLY_CARD_ROWS_SQL = text(
+    f"""
+    SELECT{_CARD_COLUMNS_SQL}{_PROMOTED_SQL}
+    FROM products p{_CARD_JOINS_SQL}{_AVAILABLE_SQL}
+    """
+).bindparams(bindparam("product_ids", expanding=True))
+
+
+def _newest(values: Iterable[Any]) -> Any:
+    present = [v for v in values if v is not None]
+    return max(present) if present else None
+
+
+class ProductHydrator:
+    """Builds product cards (row, seller, condition, images, tags) for a list of ids.
+
+    Cards are cached per worker under a version made of products.updated_at plus the image and tag
+    markers. Cached ids are re-checked with one versions query per call (which also re-reads
+    availability and the promotion flag); uncached or outdated ids are loaded with one joined query.
+    """
+
+    def __init__(self) -> None:
+        self.max_items = max(100, _safe_env_int("PRODUCT_CARD_CACHE_SIZE", 5000))
+        self.ttl_seconds = max(1, _safe_env_int("PRODUCT_CARD_TTL_SECONDS", 300))
+        self._lock = threading.Lock()
+        self._cards: "OrderedDict[int, Tuple[Any, float, Dict[str, Any]]]" = OrderedDict()
+        self._media_tables = True
+        self._stats = {"hits": 0, "misses": 0, "batches": 0, "version_checks": 0}
+
+    def _rows(self, conn, statement, product_only, product_ids: List[int]) -> List[Dict[str, Any]]:
+        if self._media_tables:
+            try:
+                return [dict(r) for r in conn.execute(statement, {"product_ids": product_ids}).mappings().all()]
+            except ProgrammingError as e:
+                if not _is_missing_table(e):
+                    raise
+                self._media_tables = False
+        return [dict(r) for r in conn.execute(product_only, {"product_ids": product_ids}).mappings().all()]
+
+    def _version(self, row: Dict[str, Any]) -> Tuple[Any, ...]:
+        if not self._media_tables:
+            return (row.get("updated_at"),)
+        return (
+            row.get("updated_at"),
+            int(row.get("image_count") or 0),
+            row.get("images_updated_at"),
+            int(row.get("tag_count") or 0),
+            row.get("tags_updated_at"),
+            row.get("tag_names_updated_at"),
+        )
+
+    def _fetch(self, conn, product_ids: List[int]) -> Dict[int, Tuple[Any, int, Dict[str, Any]]]:
+        grouped: Dict[int, List[Dict[str, Any]]] = {}
+        for row in self._rows(conn, _PRODUCT_CARD_ROWS_SQL, _PRODUCT_ONLY_CARD_ROWS_SQL, product_ids):
+            grouped.setdefault(int(row["id"]), []).append(row)
+        fetched: Dict[int, Tuple[Any, int, Dict[str, Any]]] = {}
+        for pid, rows in grouped.items():
+            card = {k: v for k, v in rows[0].items() if not k.startswith("media__") and k != "is_promoted"}
+            media = [r for r in rows if r.get("media__kind") is not None]
+            images = sorted(
+                (r for r in media if r["media__kind"] == "image"),
+                key=lambda r: (-int(r.get("media__is_primary") or 0), int(r["media__id"])),
+            )
+            tags = sorted((r for r in media if r["media__kind"] == "tag"), key=lambda r: int(r["media__id"]))
+            card["images"] = [
+                {
+                    "image_url": r.get("media__value"),
+                    "image_thumbnail_url": r.get("media__thumbnail"),
+                    "is_primary": bool(r.get("media__is_primary")),
+                }
+                for r in images
+            ]
+            card["tags"] = [{"id": r.get("media__id"), "name": r.get("media__value")} for r in tags]
+            version = self._version(
+                {
+                    "updated_at": card.get("updated_at"),
+                    "image_count": len(images),
+                    "images_updated_at": _newest(r.get("media__updated_at") for r in images),
+                    "tag_count": len(tags),
+                    "tags_updated_at": _newest(r.get("media__updated_at") for r in tags),
+                    "tag_names_updated_at": _newest(r.get("media__name_updated_at") for r in tags),
+                }
+            )
+            fetched[pid] = (version, int(rows[0].get("is_promoted") or 0), card)
+        return fetched
+
+    def cards(self, conn, product_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        ids = list(dict.fromkeys(int(pid) for pid in product_ids))
+        if not ids:
+            return {}
+
+        now = time.monotonic()
+        with self._lock:
+            cached = {
+                pid: entry
+                for pid, entry in ((pid, self._cards.get(pid)) for pid in ids)
+                if entry is not None and now - entry[1] < self.ttl_seconds
+            }
+        out: Dict[int, Dict[str, Any]] = {}
+        promoted: Dict[int, int] = {}
+        missing = [pid for pid in ids if pid not in cached]
+        if cached:
+            for row in self._rows(conn, _PRODUCT_VERSIONS_SQL, _PRODUCT_ONLY_VERSIONS_SQL, list(cached)):
+                pid = int(row["id"])
+                promoted[pid] = int(row.get("is_promoted") or 0)
+                if cached[pid][0] == self._version(row):
+                    out[pid] = cached[pid][2]
+                else:
+                    missing.append(pid)
+        with self._lock:
+            for pid in out:
+                self._cards.move_to_end(pid)
+            self._stats["version_checks"] += 1 if cached else 0
+            self._stats["hits"] += len(out)
+            self._stats["misses"] += len(missing)
+
+        if missing:
+            fetched = self._fetch(conn, missing)
+            with self._lock:
+                self._stats["batches"] += 1
+                for pid, (version, is_promoted, card) in fetched.items():
+                    self._cards[pid] = (version, now, card)
+                    self._cards.move_to_end(pid)
+                while len(self._cards) > self.max_items:
+                    self._cards.popitem(last=False)
+            for pid, (_, is_promoted, card) in fetched.items():
+                out[pid] = card
+                promoted[pid] = is_promoted
+
+        return {pid: {**out[pid], "is_promoted": promoted[pid]} for pid in ids if pid in out}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cards.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "items": len(self._cards),
+                "max_items": self.max_items,
+                "ttl_seconds": self.ttl_seconds,
+                **self._stats,
+            }
+
+
+_product_hydrator = ProductHydrator()
+
+
+def get_product_hydrator() -> ProductHydrator:
+    return _product_hydrator
@@ -1,17 +1,29 @@
+import asyncio
 import os
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
 
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
 from sqlalchemy.engine import Engine
 from sqlalchemy.exc import ProgrammingError
 
-try:
-    import redis
-except Exception:
-    redis = None
+from app.cache import cached, get_cache
+from app.catalogue import get_catalogue_store
+from app.cooccurrence import get_cooccurrence_model
+from app.database import await_async, get_async_database, offload, on_async_connection
+from app.dormitory_geo import get_dormitory_geo_registry
+from app.event_rollups import get_behavior_rollups
+from app.event_stream import get_behavior_event_stream
+from app.exchange_index import get_exchange_match_index
+from app.feed_cache import get_hybrid_feed_cache
+from app.seen_filters import get_seen_item_filters
+from app.similarity_index import get_similarity_index
+from app.tag_index import get_tag_index
+from app.trending_scopes import get_scoped_trending_lists
+from app.user_profiles import get_user_profile_store
 
 
 EVENT_TYPES = {"view", "click", "like", "search", "add_to_cart", "favorite", "purchase"}
@@ -35,67 +47,15 @@ def _now_utc() -> datetime:
     return datetime.utcnow()
 
 
-class TrendingCache:
-    def __init__(self) -> None:
-        self._fallback: Dict[str, Tuple[float, Any]] = {}
-        self._lock = threading.Lock()
-        self._redis = None
-        self._ttl_seconds = max(10, _safe_int(os.environ.get("TRENDING_CACHE_TTL_SECONDS"), 120))
-        url = (os.environ.get("REDIS_URL") or "").strip()
-        if url and redis is not None:
-            try:
-                self._redis = redis.Redis.from_url(url, decode_responses=True)
-                self._redis.ping()
-            except Exception:
-                self._redis = None
-
-    def get_json(self, key: str) -> Optional[Any]:
-        if self._redis is not None:
-            try:
-                raw = self._redis.get(key)
-                if raw:
-                    import json
+TRENDING_CACHE_TTL_SECONDS = max(10, _safe_int(os.environ.get("TRENDING_CACHE_TTL_SECONDS"), 120))
+RELATED_CACHE_TTL_SECONDS = max(10, _safe_int(os.environ.get("RELATED_CACHE_TTL_SECONDS"), 300))
+TRENDING_CACHE_SIZE = 100
+HYBRID_SOURCE_TIMEOUT_MS = max(0, _safe_int(os.environ.get("HYBRID_SOURCE_TIMEOUT_MS"), 300))
+HYBRID_SOURCE_WORKERS = max(1, _safe_int(os.environ.get("HYBRID_SOURCE_WORKERS"), 8))
 
-                    return json.loads(raw)
-            except Exception:
-                pass
-
-        now_mono = time.monotonic()
-        with self._lock:
-            cached = self._fallback.get(key)
-            if cached is None:
-                return None
-            if cached[0] < now_mono:
-                self._fallback.pop(key, None)
-                return None
-            return cached[1]
-
-    def set_json(self, key: str, value: Any) -> None:
-        if self._redis is not None:
-            try:
-                import json
-
-                self._redis.setex(key, self._ttl_seconds, json.dumps(value))
-                return
-            except Exception:
-                pass
-
-        with self._lock:
-            self._fallback[key] = (time.monotonic() + self._ttl_seconds, value)
-
-    def invalidate(self, key: str) -> None:
-        if self._redis is not None:
-            try:
-                self._redis.delete(key)
-            except Exception:
-                pass
-        with self._lock:
-            self._fallback.pop(key, None)
-
-
-_trending_cache = TrendingCache()
-_trending_updater_started = False
-_trending_updater_lock = threading.Lock()
+_hybrid_executor: Optional[ThreadPoolExecutor] = None
+_hybrid_executor_lock = threading.Lock()
+_hybrid_inflight = 0
 
 
 def _serialize_product(row: Dict[str, Any]) -> Dict[str, Any]:
@@ -168,7 +128,8 @@ def update_all_trending_scores(conn) -> int:
             """
         )
     )
-    _trending_cache.invalidate("trending_products")
+    get_cache().invalidate_tags("trending")
+    get_scoped_trending_lists().publish(conn)
     return 1
 
 
@@ -178,7 +139,11 @@ def track_behavior_event(
     product_id: Optional[int],
     event_type: str,
     event_at: Optional[datetime] = None,
-) -> Dict[str, Any]:
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Writes the event inside the caller's transaction.
+
+    Returns (response payload, stream event); publish the event only after the transaction commits.
+    """
     normalized_event = (event_type or "").strip().lower()
     if normalized_event not in EVENT_TYPES:
         normalized_event = "view"
@@ -203,7 +168,7 @@ def track_behavior_event(
         category_id = product_row.get("category_id")
         seller_id = product_row.get("seller_id")
 
-    conn.execute(
+    insert_result = conn.execute(
         text(
             """
             INSERT INTO behavioral_events (
@@ -223,6 +188,16 @@ def track_behavior_event(
         },
     )
 
+    stream_event = {
+        "id": getattr(insert_result, "lastrowid", None),
+        "user_id": int(user_id),
+        "product_id": int(product_id) if product_id is not None else None,
+        "category_id": category_id,
+        "seller_id": seller_id,
+        "event_type": normalized_event,
+        "occurred_at": event_at,
+    }
+
     if product_id is not None:
         if normalized_event == "view":
             conn.execute(text("UPDATE products SET views_count = COALESCE(views_count, 0) + 1 WHERE id = :id"), {"id": int(product_id)})
@@ -231,23 +206,18 @@ def track_behavior_event(
         elif normalized_event in {"like", "favorite"}:
             conn.execute(text("UPDATE products SET likes_count = COALESCE(likes_count, 0) + 1 WHERE id = :id"), {"id": int(product_id)})
         _update_single_product_trending(conn, int(product_id))
-        _trending_cache.invalidate("trending_products")
+        get_cache().invalidate_tags("trending")
 
     return {
         "user_id": int(user_id),
         "product_id": int(product_id) if product_id is not None else None,
         "event_type": normalized_event,
         "timestamp": event_at.isoformat(),
-    }
-
+    }, stream_event
 
-def get_trending_products(conn, limit: int = 20) -> List[Dict[str, Any]]:
-    limit = max(1, min(100, int(limit)))
-    cache_key = "trending_products"
-    cached = _trending_cache.get_json(cache_key)
-    if isinstance(cached, list):
-        return cached[:limit]
 
+@cached("trending", ttl_seconds=TRENDING_CACHE_TTL_SECONDS, tags=("trending",), key=lambda: "top")
+def _load_trending_products(conn) -> List[Dict[str, Any]]:
     rows = conn.execute(
         text(
             """
@@ -268,36 +238,76 @@ def get_trending_products(conn, limit: int = 20) -> List[Dict[str, Any]]:
             LIMIT :limit_value
             """
         ),
-        {"limit_value": limit},
+        {"limit_value": TRENDING_CACHE_SIZE},
     ).mappings().all()
-    payload = [_serialize_product(dict(row)) for row in rows]
-    _trending_cache.set_json(cache_key, payload)
-    return payload
+    return [_serialize_product(dict(row)) for row in rows]
 
 
-def get_related_products(conn, product_id: int, limit: int = 20) -> List[Dict[str, Any]]:
-    limit = max(1, min(100, int(limit)))
-    target = conn.execute(
-        text(
-            """
-            SELECT p.id, p.category_id, p.price
-            FROM products p
-            WHERE p.id = :product_id
-              AND p.deleted_at IS NULL
-            LIMIT 1
-            """
-        ),
-        {"product_id": int(product_id)},
-    ).mappings().first()
-    if target is None:
+def get_trending_products(conn, limit: int = 20) -> List[Dict[str, Any]]:
+    limit = max(1, min(TRENDING_CACHE_SIZE, int(limit)))
+    return _load_trending_products(conn)[:limit]
+
+
+def get_scoped_trending_products(conn, scope: str, scope_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+    limit = max(1, min(TRENDING_CACHE_SIZE, int(limit)))
+    lists = get_scoped_trending_lists()
+    if not lists.ready:
+        lists.sync(conn)
+    scored_ids = lists.top(scope, scope_id, limit) or []
+    return [_serialize_product(row) for row in _load_scored_rows(conn, scored_ids, "trending_score", limit)]
+
+
+_PRODUCT_ROWS_BY_ID_SQL = text(
+    """
+    SELECT
+        p.id,
+        p.title,
+        p.category_id,
+        p.price,
+        COALESCE(p.views_count, 0) AS views_count,
+        COALESCE(p.likes_count, 0) AS likes_count,
+        COALESCE(p.clicks_count, 0) AS clicks_count,
+        COALESCE(p.trending_score, 0) AS trending_score,
+        p.created_at
+    FROM products p
+    WHERE p.id IN :product_ids
+      AND p.status = 'available'
+      AND p.deleted_at IS NULL
+    """
+).bindparams(bindparam("product_ids", expanding=True))
+
+
+def _load_scored_rows(
+    conn,
+    scored_ids: List[Tuple[int, float]],
+    score_key: str,
+    limit: int,
+) -> List[Dict[str, Any]]:
+    if not scored_ids:
         return []
-
-    target_category_id = target.get("category_id")
-    target_price = _safe_float(target.get("price"), 0.0)
-    min_price = target_price * 0.8
-    max_price = target_price * 1.2
-
-    content_rows = conn.execute(
+    scores = {int(pid): float(score) for pid, score in scored_ids}
+    rows = conn.execute(_PRODUCT_ROWS_BY_ID_SQL, {"product_ids": list(scores.keys())}).mappings().all()
+    by_id = {_safe_int(row.get("id")): dict(row) for row in rows}
+    out: List[Dict[str, Any]] = []
+    for pid, _ in scored_ids:
+        item = by_id.get(int(pid))
+        if item is None:
+            continue
+        item[score_key] = scores[int(pid)]
+        out.append(item)
+    return out[:limit]
+
+
+def _query_related_content_rows(
+    conn,
+    product_id: int,
+    target_category_id: Any,
+    target_price: float,
+    min_price: float,
+    max_price: float,
+    limit: int,
+) -> List[Dict[str, Any]]:
+    return conn.execute(
         text(
             """
             SELECT
@@ -332,7 +342,7 @@ def get_related_products(conn, product_id: int, limit: int = 20) -> List[Dict[st
             """
         ),
         {
-            "target_product_id": int(product_id),
+            "target_product_id": product_id,
             "target_category_id": target_category_id,
             "target_price": target_price,
             "min_price": min_price,
@@ -341,38 +351,84 @@ def get_related_products(conn, product_id: int, limit: int = 20) -> List[Dict[st
         },
     ).mappings().all()
 
-    collab_rows = conn.execute(
+
+@cached("related", ttl_seconds=RELATED_CACHE_TTL_SECONDS, tags=("catalogue",))
+def get_related_products(conn, product_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+    limit = max(1, min(100, int(limit)))
+    target = conn.execute(
         text(
             """
-            SELECT
-                p.id,
-                p.title,
-                p.category_id,
-                p.price,
-                COALESCE(p.views_count, 0) AS views_count,
-                COALESCE(p.likes_count, 0) AS likes_count,
-                COALESCE(p.clicks_count, 0) AS clicks_count,
-                COALESCE(p.trending_score, 0) AS trending_score,
-                p.created_at,
-                COUNT(*) AS collab_score
-            FROM behavioral_events e_target
-            JOIN behavioral_events e_other
-              ON e_other.user_id = e_target.user_id
-             AND e_other.product_id <> e_target.product_id
-            JOIN products p
-              ON p.id = e_other.product_id
-            WHERE e_target.product_id = :target_product_id
-              AND e_target.event_type IN ('view', 'click', 'like', 'add_to_cart')
-              AND e_other.event_type IN ('view', 'click', 'like', 'add_to_cart')
-              AND p.status = 'available'
+            SELECT p.id, p.category_id, p.price
+            FROM products p
+            WHERE p.id = :product_id
               AND p.deleted_at IS NULL
-            GROUP BY p.id, p.title, p.category_id, p.price, p.views_count, p.likes_count, p.clicks_count, p.trending_score, p.created_at
-            ORDER BY collab_score DESC, p.trending_score DESC
-            LIMIT :limit_value
+            LIMIT 1
             """
         ),
-        {"target_product_id": int(product_id), "limit_value": limit},
-    ).mappings().all()
+        {"product_id": int(product_id)},
+    ).mappings().first()
+    if target is None:
+        return []
+
+    target_category_id = target.get("category_id")
+    target_price = _safe_float(target.get("price"), 0.0)
+    min_price = target_price * 0.8
+    max_price = target_price * 1.2
+
+    related_ids = offload(
+        get_tag_index().related_content,
+        int(product_id),
+        _safe_int(target_category_id) if target_category_id is not None else None,
+        target_price,
+        limit,
+    )
+    if related_ids is not None:
+        content_rows = _load_scored_rows(conn, related_ids, "related_score", limit)
+    else:
+        content_rows = _query_related_content_rows(
+            conn, int(product_id), target_category_id, target_price, min_price, max_price, limit
+        )
+
+    neighbors = get_cooccurrence_model().neighbors(int(product_id), limit * 2)
+    if neighbors is None:
+        collab_rows = conn.execute(
+            text(
+                """
+                SELECT
+                    p.id,
+                    p.title,
+                    p.category_id,
+                    p.price,
+                    COALESCE(p.views_count, 0) AS views_count,
+                    COALESCE(p.likes_count, 0) AS likes_count,
+                    COALESCE(p.clicks_count, 0) AS clicks_count,
+                    COALESCE(p.trending_score, 0) AS trending_score,
+                    p.created_at,
+                    COUNT(*) AS collab_score
+                FROM behavioral_events e_target
+                JOIN behavioral_events e_other
+                  ON e_other.user_id = e_target.user_id
+                 AND e_other.product_id <> e_target.product_id
+                JOIN products p
+                  ON p.id = e_other.product_id
+                WHERE e_target.product_id = :target_product_id
+                  AND e_target.event_type IN ('view', 'click', 'like', 'add_to_cart')
+                  AND e_other.event_type IN ('view', 'click', 'like', 'add_to_cart')
+                  AND p.status = 'available'
+                  AND p.deleted_at IS NULL
+                GROUP BY p.id, p.title, p.category_id, p.price, p.views_count, p.likes_count, p.clicks_count, p.trending_score, p.created_at
+                ORDER BY collab_score DESC, p.trending_score DESC
+                LIMIT :limit_value
+                """
+            ),
+            {"target_product_id": int(product_id), "limit_value": limit},
+        ).mappings().all()
+    else:
+        collab_rows = sorted(
+            _load_scored_rows(conn, neighbors, "collab_score", len(neighbors)),
+            key=lambda x: (_safe_float(x.get("collab_score"), 0.0), _safe_float(x.get("trending_score"), 0.0)),
+            reverse=True,
+        )[:limit]
 
     merged: Dict[int, Dict[str, Any]] = {}
     for row in content_rows:
@@ -398,51 +454,215 @@ def get_related_products(conn, product_id: int, limit: int = 20) -> List[Dict[st
     return [_serialize_product(row) for row in ranked]
 
 
+_PERSONALIZED_CATEGORY_ROWS_SQL = text(
+    """
+    SELECT id, title, category_id, price, views_count, likes_count, clicks_count, trending_score, created_at
+    FROM (
+        SELECT
+            p.id,
+            p.title,
+            p.category_id,
+            p.price,
+            COALESCE(p.views_count, 0) AS views_count,
+            COALESCE(p.likes_count, 0) AS likes_count,
+            COALESCE(p.clicks_count, 0) AS clicks_count,
+            COALESCE(p.trending_score, 0) AS trending_score,
+            p.created_at,
+            ROW_NUMBER() OVER (
+                PARTITION BY p.category_id
+                ORDER BY COALESCE(p.trending_score, 0) DESC, p.created_at DESC
+            ) AS category_rank
+        FROM products p
+        WHERE p.category_id IN :category_ids
+          AND p.status = 'available'
+          AND p.deleted_at IS NULL
+    ) ranked
+    WHERE ranked.category_rank <= :limit_value
+    """
+).bindparams(bindparam("category_ids", expanding=True))
+
+_PERSONALIZED_FILL_ROWS_SQL = text(
+    """
+    SELECT
+        p.id,
+        p.title,
+        p.category_id,
+        p.price,
+        COALESCE(p.views_count, 0) AS views_count,
+        COALESCE(p.likes_count, 0) AS likes_count,
+        COALESCE(p.clicks_count, 0) AS clicks_count,
+        COALESCE(p.trending_score, 0) AS trending_score,
+        p.created_at
+    FROM products p
+    WHERE (p.category_id IS NULL OR p.category_id NOT IN :category_ids)
+      AND p.status = 'available'
+      AND p.deleted_at IS NULL
+    ORDER BY p.trending_score DESC, p.created_at DESC
+    LIMIT :limit_value
+    """
+).bindparams(bindparam("category_ids", expanding=True))
+
+
 def get_personalized_products(conn, user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
     limit = max(1, min(100, int(limit)))
-    rows = conn.execute(
+    category_weights = get_user_profile_store().category_weights(conn, int(user_id))
+    category_ids = sorted(category_weights.keys())
+
+    picked: List[Dict[str, Any]] = []
+    if category_ids:
+        rows = conn.execute(
+            _PERSONALIZED_CATEGORY_ROWS_SQL,
+            {"category_ids": category_ids, "limit_value": limit},
+        ).mappings().all()
+        for row in rows:
+            item = dict(row)
+            item["personalized_score"] = category_weights.get(_safe_int(item.get("category_id"), 0), 0.0)
+            picked.append(item)
+        picked.sort(
+            key=lambda x: (
+                _safe_float(x.get("personalized_score"), 0.0),
+                _safe_float(x.get("trending_score"), 0.0),
+                x.get("created_at") or datetime.min,
+            ),
+            reverse=True,
+        )
+        picked = picked[:limit]
+
+    if len(picked) < limit:
+        rows = conn.execute(
+            _PERSONALIZED_FILL_ROWS_SQL,
+            {"category_ids": category_ids or [-1], "limit_value": limit - len(picked)},
+        ).mappings().all()
+        for row in rows:
+            item = dict(row)
+            item["personalized_score"] = 0
+            picked.append(item)
+    return [_serialize_product(row) for row in picked]
+
+
+def _get_hybrid_executor() -> ThreadPoolExecutor:
+    global _hybrid_executor
+    if _hybrid_executor is not None:
+        return _hybrid_executor
+    with _hybrid_executor_lock:
+        if _hybrid_executor is None:
+            _hybrid_executor = ThreadPoolExecutor(max_workers=HYBRID_SOURCE_WORKERS, thread_name_prefix="hybrid-source")
+    return _hybrid_executor
+
+
+def _load_base_product(conn, product_id: int) -> List[Dict[str, Any]]:
+    row = conn.execute(
         text(
             """
-            WITH user_pref AS (
-                SELECT
-                    e.category_id,
-                    SUM(
-                        CASE e.event_type
-                            WHEN 'like' THEN 4
-                            WHEN 'add_to_cart' THEN 5
-                            WHEN 'click' THEN 2
-                            WHEN 'view' THEN 1
-                            ELSE 0.5
-                        END
-                    ) AS category_weight
-                FROM behavioral_events e
-                WHERE e.user_id = :user_id
-                  AND e.category_id IS NOT NULL
-                  AND e.occurred_at >= DATE_SUB(UTC_TIMESTAMP(), INTERVAL 30 DAY)
-                GROUP BY e.category_id
-            )
             SELECT
-                p.id,
-                p.title,
-                p.category_id,
-                p.price,
+                p.id, p.title, p.category_id, p.price,
                 COALESCE(p.views_count, 0) AS views_count,
                 COALESCE(p.likes_count, 0) AS likes_count,
                 COALESCE(p.clicks_count, 0) AS clicks_count,
                 COALESCE(p.trending_score, 0) AS trending_score,
-                p.created_at,
-                COALESCE(up.category_weight, 0) AS personalized_score
+                p.created_at
             FROM products p
-            LEFT JOIN user_pref up ON up.category_id = p.category_id
-            WHERE p.status = 'available'
+            WHERE p.id = :product_id
+              AND p.status = 'available'
               AND p.deleted_at IS NULL
-            ORDER BY personalized_score DESC, p.trending_score DESC, p.created_at DESC
-            LIMIT :limit_value
+            LIMIT 1
             """
         ),
-        {"user_id": int(user_id), "limit_value": limit},
-    ).mappings().all()
-    return [_serialize_product(dict(row)) for row in rows]
+        {"product_id": int(product_id)},
+    ).mappings().first()
+    return [_serialize_product(dict(row))] if row is not None else []
+
+
+def _run_source(engine: Engine, func, kwargs: Dict[str, Any]) -> List[Dict[str, Any]]:
+    with engine.connect() as source_conn:
+        if engine.dialect.name != "mysql":
+            return func(source_conn, **kwargs)
+        # A late result is discarded anyway, so let MySQL abort the SELECTs instead of holding a worker.
+        source_conn.exec_driver_sql(f"SET SESSION max_execution_time = {int(HYBRID_SOURCE_TIMEOUT_MS)}")
+        try:
+            return func(source_conn, **kwargs)
+        finally:
+            try:
+                source_conn.exec_driver_sql("SET SESSION max_execution_time = 0")
+            except Exception:
+                source_conn.invalidate()
+
+
+async def _run_async_source(async_engine, func, kwargs: Dict[str, Any]) -> List[Dict[str, Any]]:
+    async with async_engine.connect() as source_conn:
+        if async_engine.dialect.name != "mysql":
+            return await source_conn.run_sync(lambda c: func(c, **kwargs))
+        await source_conn.exec_driver_sql(f"SET SESSION max_execution_time = {int(HYBRID_SOURCE_TIMEOUT_MS)}")
+        try:
+            return await source_conn.run_sync(lambda c: func(c, **kwargs))
+        finally:
+            try:
+                await source_conn.exec_driver_sql("SET SESSION max_execution_time = 0")
+            except Exception:
+                await source_conn.invalidate()
+
+
+async def _gather_async_sources(
+    async_engine, sources: Dict[str, Tuple[Any, Dict[str, Any]]]
+) -> Tuple[Dict[str, List[Dict[str, Any]]], List[str]]:
+    tasks = {
+        name: asyncio.ensure_future(_run_async_source(async_engine, func, kwargs))
+        for name, (func, kwargs) in sources.items()
+    }
+    done, pending = await asyncio.wait(list(tasks.values()), timeout=HYBRID_SOURCE_TIMEOUT_MS / 1000.0)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    degraded: List[str] = []
+    for name, task in tasks.items():
+        if task in done and task.exception() is None:
+            results[name] = task.result()
+        else:
+            results[name] = []
+            degraded.append(name)
+    return results, degraded
+
+
+def _release_hybrid_slot(_future) -> None:
+    global _hybrid_inflight
+    with _hybrid_executor_lock:
+        _hybrid_inflight -= 1
+
+
+def _fetch_hybrid_sources(conn, sources: Dict[str, Tuple[Any, Dict[str, Any]]]) -> Tuple[Dict[str, List[Dict[str, Any]]], List[str]]:
+    global _hybrid_inflight
+    engine = getattr(conn, "engine", None)
+    if engine is None or HYBRID_SOURCE_TIMEOUT_MS <= 0 or len(sources) <= 1:
+        return {name: func(conn, **kwargs) for name, (func, kwargs) in sources.items()}, []
+    if on_async_connection():
+        # Each source awaits its own AsyncConnection on the event loop; no worker threads are involved.
+        return await_async(_gather_async_sources(get_async_database().engine(), sources))
+
+    executor = _get_hybrid_executor()
+    with _hybrid_executor_lock:
+        saturated = _hybrid_inflight + len(sources) > HYBRID_SOURCE_WORKERS
+        if not saturated:
+            _hybrid_inflight += len(sources)
+    if saturated:
+        # Queued sources would only start after the deadline; run them inline rather than pile up work.
+        return {name: func(conn, **kwargs) for name, (func, kwargs) in sources.items()}, []
+
+    futures = {name: executor.submit(_run_source, engine, func, kwargs) for name, (func, kwargs) in sources.items()}
+    for future in futures.values():
+        future.add_done_callback(_release_hybrid_slot)
+    deadline = time.monotonic() + HYBRID_SOURCE_TIMEOUT_MS / 1000.0
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    degraded: List[str] = []
+    for name, future in futures.items():
+        try:
+            results[name] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except Exception:
+            future.cancel()
+            results[name] = []
+            degraded.append(name)
+    return results, degraded
 
 
 def build_hybrid_recommendations(
@@ -473,43 +693,32 @@ def build_hybrid_recommendations(
         if last_row is not None:
             last_interacted_product_id = _safe_int(last_row.get("product_id"), 0) or None
 
-    personalized = get_personalized_products(conn, user_id=user_id, limit=personalized_count * 2)
-    related = get_related_products(conn, product_id=last_interacted_product_id, limit=related_count * 2) if last_interacted_product_id else []
-    trending = get_trending_products(conn, limit=trending_count * 2)
+    sources: Dict[str, Tuple[Any, Dict[str, Any]]] = {
+        "personalized": (get_personalized_products, {"user_id": user_id, "limit": personalized_count * 2}),
+        "trending": (get_trending_products, {"limit": trending_count * 2}),
+    }
+    if last_interacted_product_id is not None:
+        sources["related"] = (get_related_products, {"product_id": last_interacted_product_id, "limit": related_count * 2})
+        sources["base"] = (_load_base_product, {"product_id": last_interacted_product_id})
+    pools, degraded_sources = _fetch_hybrid_sources(conn, sources)
+    personalized = pools.get("personalized", [])
+    related = pools.get("related", [])
+    trending = pools.get("trending", [])
 
     picked: List[Dict[str, Any]] = []
     seen: set = set()
+    # Products the user already interacted with only back-fill the feed once fresh items run out.
+    viewed = get_seen_item_filters().view(conn, user_id)
 
-    if last_interacted_product_id is not None:
-        base_product_row = conn.execute(
-            text(
-                """
-                SELECT
-                    p.id, p.title, p.category_id, p.price,
-                    COALESCE(p.views_count, 0) AS views_count,
-                    COALESCE(p.likes_count, 0) AS likes_count,
-                    COALESCE(p.clicks_count, 0) AS clicks_count,
-                    COALESCE(p.trending_score, 0) AS trending_score,
-                    p.created_at
-                FROM products p
-                WHERE p.id = :product_id
-                  AND p.status = 'available'
-                  AND p.deleted_at IS NULL
-                LIMIT 1
-                """
-            ),
-            {"product_id": int(last_interacted_product_id)},
-        ).mappings().first()
-        if base_product_row is not None:
-            base_product = _serialize_product(dict(base_product_row))
-            base_product["source"] = "last_interaction"
-            picked.append(base_product)
-            seen.add(_safe_int(base_product.get("id")))
+    for base_product in pools.get("base", [])[:1]:
+        base_product["source"] = "last_interaction"
+        picked.append(base_product)
+        seen.add(_safe_int(base_product.get("id")))
 
     def _append_from_pool(pool: List[Dict[str, Any]], count: int, source: str) -> None:
         for item in pool:
             pid = _safe_int(item.get("id"))
-            if pid <= 0 or pid in seen:
+            if pid <= 0 or pid in seen or pid in viewed:
                 continue
             copy_item = dict(item)
             copy_item["source"] = source
@@ -538,43 +747,50 @@ def build_hybrid_recommendations(
                 break
 
     # Final top-up from globally available products to keep response size stable.
-    if len(picked) < limit:
-        fallback_rows = conn.execute(
-            text(
-                """
-                SELECT
-                    p.id,
-                    p.title,
-                    p.category_id,
-                    p.price,
-                    COALESCE(p.views_count, 0) AS views_count,
-                    COALESCE(p.likes_count, 0) AS likes_count,
-                    COALESCE(p.clicks_count, 0) AS clicks_count,
-                    COALESCE(p.trending_score, 0) AS trending_score,
-                    p.created_at
-                FROM products p
-                WHERE p.status = 'available'
-                  AND p.deleted_at IS NULL
-                ORDER BY p.trending_score DESC, p.created_at DESC, p.id DESC
-                LIMIT 500
-                """
-            )
-        ).mappings().all()
-        for row in fallback_rows:
-            item = _serialize_product(dict(row))
+    def _append_fallback(pool: List[Dict[str, Any]]) -> None:
+        for item in pool:
             pid = _safe_int(item.get("id"))
             if pid <= 0 or pid in seen:
                 continue
-            item["source"] = "fallback"
-            picked.append(item)
+            copy_item = dict(item)
+            copy_item["source"] = "fallback"
+            picked.append(copy_item)
             seen.add(pid)
             if len(picked) >= limit:
                 break
 
+    if len(picked) < limit:
+        cached_trending = get_trending_products(conn, limit=TRENDING_CACHE_SIZE)
+        _append_fallback(cached_trending)
+        if len(picked) < limit and len(cached_trending) >= TRENDING_CACHE_SIZE:
+            fallback_rows = conn.execute(
+                text(
+                    """
+                    SELECT
+                        p.id,
+                        p.title,
+                        p.category_id,
+                        p.price,
+                        COALESCE(p.views_count, 0) AS views_count,
+                        COALESCE(p.likes_count, 0) AS likes_count,
+                        COALESCE(p.clicks_count, 0) AS clicks_count,
+                        COALESCE(p.trending_score, 0) AS trending_score,
+                        p.created_at
+                    FROM products p
+                    WHERE p.status = 'available'
+                      AND p.deleted_at IS NULL
+                    ORDER BY p.trending_score DESC, p.created_at DESC, p.id DESC
+                    LIMIT 500
+                    """
+                )
+            ).mappings().all()
+            _append_fallback([_serialize_product(dict(row)) for row in fallback_rows])
+
     return {
         "user_id": int(user_id),
         "last_interacted_product_id": last_interacted_product_id,
         "strategy": {"personalized": 0.4, "related": 0.3, "trending": 0.3},
+        "degraded_sources": degraded_sources,
         "products": picked[:limit],
     }
 
@@ -587,22 +803,199 @@ def run_trending_batch_update(engine: Engine) -> None:
         return
 
 
-def start_trending_batch_updater(engine: Engine) -> None:
-    global _trending_updater_started
-    with _trending_updater_lock:
-        if _trending_updater_started:
-            return
-        _trending_updater_started = True
+def _trending_recompute_job(engine: Engine) -> Dict[str, Any]:
+    with engine.begin() as conn:
+        update_all_trending_scores(conn)
+    return {"recomputed": True}
+
+
+def _trending_cache_warm_job(engine: Engine) -> Dict[str, Any]:
+    with engine.connect() as conn:
+        products = get_trending_products(conn, limit=TRENDING_CACHE_SIZE)
+        scopes = get_scoped_trending_lists().sync(conn)
+    return {"cached_products": len(products), "scoped_lists": scopes["scopes"]}
+
+
+def _behavior_event_poll_job(engine: Engine) -> Dict[str, Any]:
+    with engine.connect() as conn:
+        dispatched = get_behavior_event_stream().poll(conn)
+    return {"events": dispatched}
+
+
+def _behavior_rollup_job(engine: Engine) -> Dict[str, Any]:
+    with engine.begin() as conn:
+        return get_behavior_rollups().compact(conn)
+
+
+def _cooccurrence_rebuild_job(engine: Engine) -> Dict[str, Any]:
+    model = get_cooccurrence_model()
+    with engine.connect() as conn:
+        result = model.rebuild(conn)
+    return {**result, "published": model.publish()}
+
+
+def _cooccurrence_sync_job(engine: Engine) -> Dict[str, Any]:
+    with engine.connect() as conn:
+        return get_cooccurrence_model().sync(conn)
+
+
+def _user_profile_flush_job() -> Dict[str, Any]:
+    return get_user_profile_store().flush()
 
-    interval_minutes = max(1, _safe_int(os.environ.get("TRENDING_BATCH_UPDATE_MINUTES"), 10))
 
-    def _loop() -> None:
-        while True:
-            run_trending_batch_update(engine)
-            time.sleep(interval_minutes * 60)
+def _tag_index_refresh_job(engine: Engine) -> Dict[str, Any]:
+    with engine.connect() as conn:
+        return get_tag_index().refresh(conn)
 
-    thread = threading.Thread(target=_loop, daemon=True, name="trending-score-updater")
-    thread.start()
+
+def _catalogue_refresh_job(engine: Engine) -> Dict[str, Any]:
+    with engine.connect() as conn:
+        return get_catalogue_store().refresh(conn)
+
+
+def _dormitory_geo_refresh_job(engine: Engine) -> Dict[str, Any]:
+    with engine.connect() as conn:
+        return get_dormitory_geo_registry().refresh(conn)
+
+
+def _similarity_index_refresh_job(engine: Engine) -> Dict[str, Any]:
+    with engine.connect() as conn:
+        return get_similarity_index().refresh(conn)
+
+
+def _similarity_index_rebuild_job(engine: Engine) -> Dict[str, Any]:
+    with engine.connect() as conn:
+        return get_similarity_index().rebuild(conn)
+
+
+def _exchange_index_refresh_job(engine: Engine) -> Dict[str, Any]:
+    with engine.connect() as conn:
+        return get_exchange_match_index().refresh(conn)
+
+
+def _feed_catalogue_poll_job(engine: Engine) -> Dict[str, Any]:
+    with engine.connect() as conn:
+        result = get_hybrid_feed_cache().poll_catalogue(conn)
+    if result.get("changed"):
+        get_cache().invalidate_tags("catalogue")
+    return result
+
+
+def register_recommendation_jobs(scheduler, engine: Engine) -> None:
+    event_stream = get_behavior_event_stream()
+    event_stream.subscribe(get_cooccurrence_model().observe_event)
+    event_stream.subscribe(get_user_profile_store().observe_event)
+    event_stream.subscribe(get_hybrid_feed_cache().observe_event)
+    event_stream.subscribe(get_seen_item_filters().observe_event)
+    interval_minutes = max(1, _safe_int(os.environ.get("TRENDING_BATCH_UPDATE_MINUTES"), 10))
+    scheduler.register(
+        "trending_recompute",
+        lambda: _trending_recompute_job(engine),
+        interval_seconds=interval_minutes * 60,
+        timeout_seconds=max(60, interval_minutes * 30),
+        cluster_wide=True,
+    )
+    scheduler.register(
+        "trending_cache_warm",
+        lambda: _trending_cache_warm_job(engine),
+        interval_seconds=max(10, TRENDING_CACHE_TTL_SECONDS // 2),
+        timeout_seconds=30,
+        cluster_wide=False,
+    )
+    scheduler.register(
+        "behavior_event_poll",
+        lambda: _behavior_event_poll_job(engine),
+        interval_seconds=max(1, _safe_int(os.environ.get("EVENT_STREAM_POLL_SECONDS"), 5)),
+        timeout_seconds=60,
+        cluster_wide=False,
+    )
+    scheduler.register(
+        "behavior_rollup_compact",
+        lambda: _behavior_rollup_job(engine),
+        interval_seconds=max(10, _safe_int(os.environ.get("EVENT_ROLLUP_INTERVAL_SECONDS"), 300)),
+        timeout_seconds=600,
+        cluster_wide=True,
+    )
+    # Writes streamed profile updates that have not reached a full batch back to Redis.
+    scheduler.register(
+        "user_profile_flush",
+        _user_profile_flush_job,
+        interval_seconds=max(5, _safe_int(os.environ.get("USER_PROFILE_PERSIST_SECONDS"), 30)),
+        timeout_seconds=60,
+        cluster_wide=False,
+        run_on_start=False,
+    )
+    # The snapshot jobs below keep in-process numpy read models, so every worker needs its own copy.
+    # Each one is marker-gated or incremental (an indexed range read) between occasional full reloads;
+    # the full builds that scan the event history run cluster-wide and are shared through the cache.
+    scheduler.register(
+        "tag_index_refresh",
+        lambda: _tag_index_refresh_job(engine),
+        interval_seconds=max(10, _safe_int(os.environ.get("TAG_INDEX_REFRESH_SECONDS"), 60)),
+        timeout_seconds=300,
+        cluster_wide=False,
+    )
+    scheduler.register(
+        "catalogue_refresh",
+        lambda: _catalogue_refresh_job(engine),
+        interval_seconds=max(5, _safe_int(os.environ.get("CATALOGUE_REFRESH_SECONDS"), 15)),
+        timeout_seconds=300,
+        cluster_wide=False,
+    )
+    scheduler.register(
+        "dormitory_geo_refresh",
+        lambda: _dormitory_geo_refresh_job(engine),
+        interval_seconds=max(10, _safe_int(os.environ.get("DORMITORY_GEO_REFRESH_SECONDS"), 300)),
+        timeout_seconds=120,
+        cluster_wide=False,
+    )
+    # Bumps the catalogue version of this worker's in-process feed cache.
+    scheduler.register(
+        "feed_catalogue_poll",
+        lambda: _feed_catalogue_poll_job(engine),
+        interval_seconds=max(5, _safe_int(os.environ.get("FEED_CACHE_CATALOGUE_POLL_SECONDS"), 30)),
+        timeout_seconds=60,
+        cluster_wide=False,
+    )
+    # Adopts the published similarity lists, then merges this worker's catalogue changes into them.
+    scheduler.register(
+        "similarity_index_refresh",
+        lambda: _similarity_index_refresh_job(engine),
+        interval_seconds=max(30, _safe_int(os.environ.get("SIMILARITY_REFRESH_SECONDS"), 120)),
+        timeout_seconds=900,
+        cluster_wide=False,
+    )
+    scheduler.register(
+        "similarity_index_rebuild",
+        lambda: _similarity_index_rebuild_job(engine),
+        interval_seconds=get_similarity_index().full_rebuild_seconds,
+        timeout_seconds=1800,
+        cluster_wide=True,
+        run_on_start=False,
+    )
+    scheduler.register(
+        "exchange_index_refresh",
+        lambda: _exchange_index_refresh_job(engine),
+        interval_seconds=max(5, _safe_int(os.environ.get("EXCHANGE_INDEX_REFRESH_SECONDS"), 30)),
+        timeout_seconds=120,
+        cluster_wide=False,
+    )
+    scheduler.register(
+        "cooccurrence_rebuild",
+        lambda: _cooccurrence_rebuild_job(engine),
+        interval_seconds=get_cooccurrence_model().rebuild_seconds,
+        timeout_seconds=600,
+        cluster_wide=True,
+        run_on_start=False,
+    )
+    # Adopts the published co-occurrence snapshot; builds locally until one exists.
+    scheduler.register(
+        "cooccurrence_sync",
+        lambda: _cooccurrence_sync_job(engine),
+        interval_seconds=max(10, _safe_int(os.environ.get("COOCCURRENCE_SYNC_SECONDS"), 60)),
+        timeout_seconds=600,
+        cluster_wide=False,
+    )
 
 
 def safe_recommendation_call(func, *args, **kwargs):
@@ -0,0 +1,227 @@
+import math
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+
+def vectorized_scoring_available() -> bool:
+    return np is not None
+
+
+def _to_ts(value: Any) -> float:
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+        except Exception:
+            return float("nan")
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=timezone.utc).timestamp()
+    return float("nan")
+
+
+def _to_id(value: Any) -> int:
+    if value is None:
+        return -1
+    try:
+        return int(value)
+    except Exception:
+        return -1
+
+
+def _to_float(value: Any) -> float:
+    if value is None:
+        return float("nan")
+    try:
+        return float(value)
+    except Exception:
+        return float("nan")
+
+
+def columns_from_rows(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    count = len(rows)
+    latitudes = np.fromiter((_to_float(r.get("dormitory__latitude")) for r in rows), dtype=np.float64, count=count)
+    longitudes = np.fromiter((_to_float(r.get("dormitory__longitude")) for r in rows), dtype=np.float64, count=count)
+    missing = np.isnan(latitudes) | np.isnan(longitudes)
+    latitudes[missing] = np.nan
+    longitudes[missing] = np.nan
+    return {
+        "ids": np.fromiter((_to_id(r.get("id")) for r in rows), dtype=np.int64, count=count),
+        "category_ids": np.fromiter((_to_id(r.get("category_id")) for r in rows), dtype=np.int64, count=count),
+        "seller_ids": np.fromiter((_to_id(r.get("seller_id")) for r in rows), dtype=np.int64, count=count),
+        "seller_dormitory_ids": np.fromiter((_to_id(r.get("seller__dormitory_id")) for r in rows), dtype=np.int64, count=count),
+        "dormitory_ids": np.fromiter((_to_id(r.get("dormitory_id")) for r in rows), dtype=np.int64, count=count),
+        "university_ids": np.fromiter((_to_id(r.get("dormitory__university_id")) for r in rows), dtype=np.int64, count=count),
+        "created_ts": np.fromiter((_to_ts(r.get("created_at")) for r in rows), dtype=np.float64, count=count),
+        "latitudes": latitudes,
+        "longitudes": longitudes,
+        "promoted": np.fromiter((int(r.get("is_promoted") or 0) == 1 for r in rows), dtype=bool, count=count),
+    }
+
+
+def columns_from_catalogue(catalogue, positions: Any, now_ts: Optional[float] = None) -> Dict[str, Any]:
+    return {
+        "ids": catalogue.ids[positions],
+        "category_ids": catalogue.category_ids[positions],
+        "seller_ids": catalogue.seller_ids[positions],
+        "seller_dormitory_ids": catalogue.seller_dormitory_ids[positions],
+        "dormitory_ids": catalogue.dormitory_ids[positions],
+        "university_ids": catalogue.university_ids[positions],
+        "created_ts": catalogue.created_ts[positions],
+        "latitudes": catalogue.latitudes[positions],
+        "longitudes": catalogue.longitudes[positions],
+        "promoted": catalogue.promoted_mask(now_ts)[positions],
+    }
+
+
+def _lookup(keys: Any, mapping: Dict[int, float]) -> Any:
+    out = np.zeros(keys.shape[0], dtype=np.float64)
+    if not mapping or keys.shape[0] == 0:
+        return out
+    map_keys = np.fromiter(mapping.keys(), dtype=np.int64, count=len(mapping))
+    map_values = np.fromiter(mapping.values(), dtype=np.float64, count=len(mapping))
+    order = np.argsort(map_keys)
+    map_keys = map_keys[order]
+    map_values = map_values[order]
+    idx = np.clip(np.searchsorted(map_keys, keys), 0, map_keys.shape[0] - 1)
+    hit = (map_keys[idx] == keys) & (keys >= 0)
+    out[hit] = map_values[idx[hit]]
+    return out
+
+
+def haversine_km(lat: float, lng: float, latitudes: Any, longitudes: Any) -> Any:
+    phi1 = math.radians(lat)
+    phi2 = np.radians(latitudes)
+    dphi = np.radians(latitudes - lat)
+    dlambda = np.radians(longitudes - lng)
+    x = np.sin(dphi / 2) ** 2 + math.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * 6371.0 * np.arctan2(np.sqrt(x), np.sqrt(1 - x))
+
+
+def seen_weight(seen: Any, product_id: Any) -> float:
+    if hasattr(seen, "weight"):
+        return seen.weight(product_id)
+    try:
+        return 1.0 if int(product_id or 0) in seen else 0.0
+    except Exception:
+        return 0.0
+
+
+def _seen_weights(ids: Any, seen: Any) -> Any:
+    if hasattr(seen, "weights"):
+        return np.asarray(seen.weights(ids), dtype=np.float64)
+    seen_ids = np.fromiter(seen, dtype=np.int64, count=len(seen))
+    return np.isin(ids, seen_ids).astype(np.float64)
+
+
+def score_candidates(
+    columns: Dict[str, Any],
+    category_scores: Dict[int, float],
+    seller_scores: Dict[int, float],
+    seen_product_ids: Any,
+    now: datetime,
+    buyer_dormitory_id: Optional[int],
+    buyer_university_id: Optional[int],
+    buyer_coords: Optional[Tuple[float, float]],
+    distances: Any = None,
+) -> Tuple[Any, Any]:
+    ids = columns["ids"]
+    count = ids.shape[0]
+    scores = 1.5 * _lookup(columns["category_ids"], category_scores)
+    scores += 1.0 * _lookup(columns["seller_ids"], seller_scores)
+
+    if seen_product_ids:
+        scores += 6.0 * _seen_weights(ids, seen_product_ids)
+
+    scores += np.where(columns["promoted"], 3.0, 0.0)
+
+    created_ts = columns["created_ts"]
+    has_created = ~np.isnan(created_ts)
+    age_days = np.maximum(0.0, (_to_ts(now) - np.where(has_created, created_ts, 0.0)) / 86400.0)
+    scores += np.where(has_created, 5.0 * np.exp(-age_days / 7.0), 0.0)
+
+    if buyer_dormitory_id is not None:
+        same_dorm = columns["dormitory_ids"] == int(buyer_dormitory_id)
+        scores += np.where(same_dorm, 50.0, 0.0)
+        if buyer_university_id is not None:
+            same_uni = ~same_dorm & (columns["university_ids"] == int(buyer_university_id))
+            scores += np.where(same_uni, 20.0, 0.0)
+
+    if distances is not None:
+        distance = np.asarray(distances, dtype=np.float64)
+    else:
+        distance = np.full(count, np.nan, dtype=np.float64)
+        if buyer_coords is not None and count:
+            has_coords = ~np.isnan(columns["latitudes"]) & ~np.isnan(columns["longitudes"])
+            if has_coords.any():
+                distance[has_coords] = haversine_km(
+                    buyer_coords[0],
+                    buyer_coords[1],
+                    columns["latitudes"][has_coords],
+                    columns["longitudes"][has_coords],
+                )
+    has_distance = ~np.isnan(distance)
+    scores += np.where(has_distance, 30.0 * np.exp(-np.where(has_distance, distance, 0.0) / 2.0), 0.0)
+    return scores, distance
+
+
+def rank_candidates(
+    columns: Dict[str, Any],
+    scores: Any,
+    distance: Any,
+    low_behavior: bool,
+    buyer_dormitory_id: Optional[int],
+    buyer_university_id: Optional[int],
+    boosts: Any = None,
+) -> Any:
+    created_ts = columns["created_ts"]
+    if low_behavior:
+        priority = np.full(scores.shape[0], 2, dtype=np.int64)
+        if buyer_university_id is not None:
+            priority[columns["university_ids"] == int(buyer_university_id)] = 1
+        if buyer_dormitory_id is not None:
+            priority[columns["dormitory_ids"] == int(buyer_dormitory_id)] = 0
+        distance_sort = np.where(np.isnan(distance), 1.0e9, distance)
+        created_sort = np.where(np.isnan(created_ts), 0.0, created_ts)
+        if boosts is not None:
+            return np.lexsort((-created_sort, distance_sort, priority, -boosts))
+        return np.lexsort((-created_sort, distance_sort, priority))
+    if boosts is not None:
+        scores = scores + boosts
+    created_sort = np.where(np.isnan(created_ts), -np.inf, created_ts)
+    return np.lexsort((-created_sort, -scores))
+
+
+def rank_candidate_ids(
+    columns: Dict[str, Any],
+    category_scores: Dict[int, float],
+    seller_scores: Dict[int, float],
+    seen_product_ids: Any,
+    now: datetime,
+    low_behavior: bool,
+    buyer_dormitory_id: Optional[int],
+    buyer_university_id: Optional[int],
+    buyer_coords: Optional[Tuple[float, float]],
+    distances: Any = None,
+    max_distance_km: Optional[float] = None,
+    boosts: Any = None,
+) -> List[int]:
+    scores, distance = score_candidates(
+        columns,
+        category_scores,
+        seller_scores,
+        seen_product_ids,
+        now,
+        buyer_dormitory_id,
+        buyer_university_id,
+        buyer_coords,
+        distances,
+    )
+    order = rank_candidates(columns, scores, distance, low_behavior, buyer_dormitory_id, buyer_university_id, boosts)
+    if max_distance_km is not None:
+        with np.errstate(invalid="ignore"):
+            order = order[distance[order] <= float(max_distance_km)]
+    return columns["ids"][order].tolist()
@@ -0,0 +1,189 @@
+import hashlib
+import hmac
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.cache import get_cache
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+def _to_datetime(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+        except Exception:
+            return None
+    return None
+
+
+AUTH_MODES = {"local", "laravel"}
+USER_FIELDS = ("id", "full_name", "username", "email", "profile_picture", "dormitory_id", "role")
+
+_TOKEN_BY_ID_SQL = text(
+    """
+    SELECT
+        pat.token, pat.abilities, pat.expires_at, pat.created_at,
+        u.id, u.full_name, u.username, u.email, u.profile_picture, u.dormitory_id, u.role
+    FROM personal_access_tokens pat
+    JOIN users u ON u.id = pat.tokenable_id
+    WHERE pat.id = :token_id AND pat.tokenable_type = :tokenable_type
+    LIMIT 1
+    """
+)
+
+_TOKEN_BY_HASH_SQL = text(
+    """
+    SELECT
+        pat.token, pat.abilities, pat.expires_at, pat.created_at,
+        u.id, u.full_name, u.username, u.email, u.profile_picture, u.dormitory_id, u.role
+    FROM personal_access_tokens pat
+    JOIN users u ON u.id = pat.tokenable_id
+    WHERE pat.token = :token_hash AND pat.tokenable_type = :tokenable_type
+    LIMIT 1
+    """
+)
+
+_UNAUTHENTICATED = {"message": "Unauthenticated."}
+_USERS_ONLY = {"message": "Unauthorized: Only users can access this endpoint."}
+
+
+class TokenRejected(Exception):
+    def __init__(self, status_code: int, detail: Any) -> None:
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class SanctumTokenValidator:
+    """Validates Laravel Sanctum bearer tokens against personal_access_tokens, mirroring /api/user/me."""
+
+    def __init__(self) -> None:
+        mode = (os.environ.get("PY_AUTH_MODE") or "local").strip().lower()
+        self.mode = mode if mode in AUTH_MODES else "local"
+        self.laravel_fallback = _safe_env_int("PY_AUTH_LARAVEL_FALLBACK", 1) == 1
+        self.ttl_seconds = max(1, _safe_env_int("PY_USER_CACHE_TTL_SECONDS", 5))
+        self.expiration_minutes = max(0, _safe_env_int("SANCTUM_EXPIRATION", 0))
+        self.tokenable_type = os.environ.get("SANCTUM_TOKENABLE_TYPE") or "App\\Models\\User"
+        self.required_abilities = [
+            a.strip() for a in (os.environ.get("PY_AUTH_REQUIRED_ABILITIES") or "").split(",") if a.strip()
+        ]
+        self._lock = threading.Lock()
+        self._stats = {"local": 0, "laravel": 0, "fallbacks": 0, "rejected": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def _plain_token(self, authorization: str) -> str:
+        scheme, _, value = authorization.strip().partition(" ")
+        return value.strip() if scheme.lower() == "bearer" and value.strip() else authorization.strip()
+
+    def _has_abilities(self, raw: Any) -> bool:
+        if not self.required_abilities:
+            return True
+        try:
+            abilities = json.loads(raw) if isinstance(raw, str) else raw
+        except Exception:
+            return False
+        if not isinstance(abilities, list):
+            return False
+        return "*" in abilities or all(a in abilities for a in self.required_abilities)
+
+    def _lookup(self, conn, authorization: str) -> Dict[str, Any]:
+        token = self._plain_token(authorization)
+        token_id, sep, secret = token.partition("|")
+        if sep:
+            if not token_id.isdigit():
+                return {"status_code": 401, "detail": _UNAUTHENTICATED}
+            row = conn.execute(
+                _TOKEN_BY_ID_SQL, {"token_id": int(token_id), "tokenable_type": self.tokenable_type}
+            ).mappings().first()
+        else:
+            secret = token
+            row = conn.execute(
+                _TOKEN_BY_HASH_SQL,
+                {"token_hash": hashlib.sha256(secret.encode("utf-8")).hexdigest(), "tokenable_type": self.tokenable_type},
+            ).mappings().first()
+
+        digest = hashlib.sha256(secret.encode("utf-8")).hexdigest()
+        if row is None or not hmac.compare_digest(str(row["token"] or ""), digest):
+            return {"status_code": 401, "detail": _UNAUTHENTICATED}
+
+        now = datetime.utcnow()
+        expires_at = _to_datetime(row["expires_at"])
+        created_at = _to_datetime(row["created_at"])
+        if expires_at is not None and expires_at <= now:
+            return {"status_code": 401, "detail": _UNAUTHENTICATED}
+        if self.expiration_minutes and created_at is not None and created_at <= now - timedelta(minutes=self.expiration_minutes):
+            return {"status_code": 401, "detail": _UNAUTHENTICATED}
+        if not self._has_abilities(row["abilities"]):
+            return {"status_code": 403, "detail": {"message": "Invalid ability provided."}}
+        if (row["role"] or "user") != "user":
+            return {"status_code": 403, "detail": _USERS_ONLY}
+        return {"user": {field: row[field] for field in USER_FIELDS}}
+
+    def _resolve(self, authorization: str, engine_getter: Callable[[], Any], laravel_lookup: Callable[[str], Dict[str, Any]]) -> Dict[str, Any]:
+        if self.mode == "laravel":
+            self._count("laravel")
+            return {"user": laravel_lookup(authorization)}
+        try:
+            with engine_getter().connect() as conn:
+                result = self._lookup(conn, authorization)
+        except SQLAlchemyError:
+            if not self.laravel_fallback:
+                return {"status_code": 503, "detail": "Database unavailable"}
+            self._count("fallbacks")
+            return {"user": laravel_lookup(authorization)}
+        self._count("local")
+        return result
+
+    def authenticate(
+        self,
+        authorization: str,
+        engine_getter: Callable[[], Any],
+        laravel_lookup: Callable[[str], Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        key = hashlib.sha256(authorization.strip().encode("utf-8")).hexdigest()
+        result = get_cache().get_or_load(
+            "auth_user",
+            key,
+            lambda: self._resolve(authorization, engine_getter, laravel_lookup),
+            self.ttl_seconds,
+        )
+        if "user" not in result:
+            self._count("rejected")
+            raise TokenRejected(int(result["status_code"]), result["detail"])
+        return dict(result["user"])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "laravel_fallback": self.laravel_fallback,
+                "ttl_seconds": self.ttl_seconds,
+                **self._stats,
+            }
+
+
+_sanctum_validator = SanctumTokenValidator()
+
+
+def get_sanctum_validator() -> SanctumTokenValidator:
+    return _sanctum_validator
@@ -0,0 +1,355 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from app.database import offload
+from app.job_scheduler import get_job_scheduler
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+def _to_ts(value: Any) -> float:
+    if isinstance(value, str) and value:
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+        except Exception:
+            return time.time()
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=timezone.utc).timestamp()
+    return time.time()
+
+
+_MASK64 = (1 << 64) - 1
+_HASH_MUL_1 = 0x9E3779B97F4A7C15
+_HASH_MUL_2 = 0xC2B2AE3D27D4EB4F
+
+
+def _bit_positions(product_id: int, hashes: int, shift: int) -> List[int]:
+    h1 = (int(product_id) * _HASH_MUL_1) & _MASK64
+    h2 = ((int(product_id) * _HASH_MUL_2) & _MASK64) | 1
+    return [((h1 + i * h2) & _MASK64) >> shift for i in range(hashes)]
+
+
+def _bit_positions_array(ids: Any, hashes: int, shift: int) -> Any:
+    ids = np.asarray(ids, dtype=np.int64).astype(np.uint64)
+    h1 = ids * np.uint64(_HASH_MUL_1)
+    h2 = (ids * np.uint64(_HASH_MUL_2)) | np.uint64(1)
+    steps = np.arange(hashes, dtype=np.uint64)
+    return (h1[:, None] + steps[None, :] * h2[:, None]) >> np.uint64(shift)
+
+
+class SeenItems:
+    """Read-only view over one user's seen items.
+
+    weight()/weights() drive the ranking boost and only use the exact set of recent product ids, so a
+    Bloom false positive never boosts an unseen product. Membership (`in`) also checks the Bloom
+    generations, newest first; it is only used to suppress items, where a false positive is harmless.
+    """
+
+    def __init__(
+        self,
+        generations: List[Tuple[int, bytes]],
+        recent: Dict[int, int],
+        current_generation: int,
+        window: int,
+        hashes: int,
+        shift: int,
+    ) -> None:
+        self._generations = [(gen, bits) for gen, bits in generations if any(bits)]
+        self._recent = recent
+        self._current = current_generation
+        self._window = window
+        self._hashes = hashes
+        self._shift = shift
+
+    def __bool__(self) -> bool:
+        return bool(self._generations) or bool(self._recent)
+
+    def _generation_weight(self, gen: int) -> float:
+        return max(0.0, 1.0 - (self._current - gen) / float(self._window))
+
+    def weight(self, product_id: Any) -> float:
+        try:
+            gen = self._recent.get(int(product_id))
+        except Exception:
+            return 0.0
+        return self._generation_weight(gen) if gen is not None else 0.0
+
+    def __contains__(self, product_id: Any) -> bool:
+        if self.weight(product_id) > 0.0:
+            return True
+        try:
+            positions = _bit_positions(int(product_id), self._hashes, self._shift)
+        except Exception:
+            return False
+        return any(all(bits[p >> 3] & (0x80 >> (p & 7)) for p in positions) for _, bits in self._generations)
+
+    def weights(self, ids: Any) -> Any:
+        if np is None:
+            return [self.weight(pid) for pid in ids]
+        out = np.zeros(len(ids), dtype=np.float64)
+        if not self._recent or len(ids) == 0:
+            return out
+        count = len(self._recent)
+        keys = np.fromiter(self._recent.keys(), dtype=np.int64, count=count)
+        values = np.fromiter((self._generation_weight(g) for g in self._recent.values()), dtype=np.float64, count=count)
+        order = np.argsort(keys)
+        keys, values = keys[order], values[order]
+        ids = np.asarray(ids, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(keys, ids), count - 1)
+        hit = keys[pos] == ids
+        out[hit] = values[pos[hit]]
+        return out
+
+
+@dataclass
+class _UserSeen:
+    bits: Dict[int, bytearray] = field(default_factory=dict)
+    recent: "OrderedDict[int, float]" = field(default_factory=OrderedDict)
+
+
+class SeenItemFilters:
+    def __init__(self) -> None:
+        self.window_days = max(1, _safe_env_int("SEEN_FILTER_WINDOW_DAYS", 30))
+        self.generations = max(1, _safe_env_int("SEEN_FILTER_GENERATIONS", 6))
+        self.rotation_seconds = max(3600.0, self.window_days * 86400.0 / self.generations)
+        bits = max(1024, _safe_env_int("SEEN_FILTER_BITS", 8192))
+        self.bits = 1 << (bits - 1).bit_length()
+        self.hashes = max(1, min(16, _safe_env_int("SEEN_FILTER_HASHES", 4)))
+        self.recent_items = max(50, _safe_env_int("SEEN_FILTER_RECENT_ITEMS", 500))
+        self.backfill_limit = max(100, _safe_env_int("SEEN_FILTER_BACKFILL_LIMIT", 2000))
+        self.max_users = max(100, _safe_env_int("SEEN_FILTER_CACHE_SIZE", 20000))
+        self._shift = 64 - (self.bits.bit_length() - 1)
+        self._lock = threading.Lock()
+        self._users: "OrderedDict[int, _UserSeen]" = OrderedDict()
+        self._stats = {"views": 0, "backfills": 0, "ingested": 0}
+        self._redis = None
+        url = (os.environ.get("REDIS_URL") or "").strip()
+        if url and redis is not None:
+            try:
+                self._redis = redis.Redis.from_url(url)
+                self._redis.ping()
+            except Exception:
+                self._redis = None
+
+    def _generation(self, ts: float) -> int:
+        return int(ts // self.rotation_seconds)
+
+    def _redis_key(self, user_id: int, gen: int) -> str:
+        return f"seen_filter:{int(user_id)}:{gen}"
+
+    def _ready_key(self, user_id: int) -> str:
+        return f"seen_filter:{int(user_id)}:ready"
+
+    def _recent_key(self, user_id: int) -> str:
+        return f"seen_filter:{int(user_id)}:recent"
+
+    def _live_generations(self, now_ts: float) -> range:
+        current = self._generation(now_ts)
+        return range(current, current - self.generations, -1)
+
+    def _add_memory(self, seen: _UserSeen, items: Iterable[Tuple[int, float]], oldest: int) -> int:
+        added = 0
+        for product_id, ts in sorted(items, key=lambda item: item[1]):
+            gen = self._generation(ts)
+            if gen < oldest:
+                continue
+            bits = seen.bits.get(gen)
+            if bits is None:
+                bits = seen.bits[gen] = bytearray(self.bits // 8)
+            for p in _bit_positions(product_id, self.hashes, self._shift):
+                bits[p >> 3] |= 0x80 >> (p & 7)
+            if ts >= seen.recent.get(product_id, ts):
+                seen.recent[product_id] = ts
+                seen.recent.move_to_end(product_id)
+            added += 1
+        for gen in [g for g in seen.bits if g < oldest]:
+            seen.bits.pop(gen, None)
+        while len(seen.recent) > self.recent_items:
+            seen.recent.popitem(last=False)
+        return added
+
+    def _add_redis(self, user_id: int, items: Iterable[Tuple[int, float]], oldest: int) -> int:
+        ttl = int(self.rotation_seconds * (self.generations + 1))
+        pipe = self._redis.pipeline(transaction=False)
+        added = 0
+        touched = set()
+        recent: Dict[int, float] = {}
+        for product_id, ts in items:
+            gen = self._generation(ts)
+            if gen < oldest:
+                continue
+            key = self._redis_key(user_id, gen)
+            for p in _bit_positions(product_id, self.hashes, self._shift):
+                pipe.setbit(key, p, 1)
+            touched.add(key)
+            recent[product_id] = max(ts, recent.get(product_id, ts))
+            added += 1
+        if recent:
+            recent_key = self._recent_key(user_id)
+            pipe.zadd(recent_key, recent)
+            pipe.zremrangebyrank(recent_key, 0, -(self.recent_items + 1))
+            touched.add(recent_key)
+        for key in touched:
+            pipe.expire(key, ttl)
+        if added:
+            offload(pipe.execute)
+        return added
+
+    def _fetch_redis(self, user_id: int, live: range) -> List[Any]:
+        pipe = self._redis.pipeline(transaction=False)
+        for gen in live:
+            pipe.get(self._redis_key(user_id, gen))
+        pipe.zrangebyscore(self._recent_key(user_id), live[-1] * self.rotation_seconds, "+inf", withscores=True)
+        pipe.get(self._ready_key(user_id))
+        return offload(pipe.execute)
+
+    def _view(self, generations: List[Tuple[int, bytes]], recent: Iterable[Tuple[Any, float]], live: range) -> SeenItems:
+        recent_gens = {int(product_id): self._generation(ts) for product_id, ts in recent}
+        return SeenItems(
+            generations,
+            {pid: gen for pid, gen in recent_gens.items() if gen >= live[-1]},
+            live[0],
+            self.generations,
+            self.hashes,
+            self._shift,
+        )
+
+    def _backfill(self, conn, user_id: int) -> List[Tuple[int, float]]:
+        since = datetime.utcnow() - timedelta(seconds=self.rotation_seconds * self.generations)
+        try:
+            rows = conn.execute(
+                text(
+                    """
+                    SELECT product_id, occurred_at
+                    FROM behavioral_events
+                    WHERE user_id = :user_id AND occurred_at >= :since AND product_id IS NOT NULL
+                    ORDER BY occurred_at DESC, id DESC
+                    LIMIT :limit_value
+                    """
+                ),
+                {"user_id": int(user_id), "since": since, "limit_value": self.backfill_limit},
+            ).all()
+        except ProgrammingError as e:
+            if not (getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146):
+                raise
+            return []
+        with self._lock:
+            self._stats["backfills"] += 1
+        return [(int(r[0]), _to_ts(r[1])) for r in rows]
+
+    def view(self, conn, user_id: int, now: Optional[datetime] = None) -> SeenItems:
+        uid = int(user_id)
+        now_ts = _to_ts(now) if now is not None else time.time()
+        live = self._live_generations(now_ts)
+        oldest = live[-1]
+        with self._lock:
+            self._stats["views"] += 1
+
+        if self._redis is not None:
+            try:
+                fetched = self._fetch_redis(uid, live)
+                if fetched[-1] is None:
+                    self._add_redis(uid, self._backfill(conn, uid), oldest)
+                    offload(self._redis.setex, self._ready_key(uid), int(self.rotation_seconds), 1)
+                    fetched = self._fetch_redis(uid, live)
+                blobs, recent = fetched[: len(live)], fetched[len(live)]
+                generations = [(gen, bytes(blob).ljust(self.bits // 8, b"\0")) for gen, blob in zip(live, blobs) if blob]
+                return self._view(generations, recent, live)
+            except Exception:
+                pass
+
+        with self._lock:
+            seen = self._users.get(uid)
+            if seen is not None:
+                self._users.move_to_end(uid)
+        if seen is None:
+            seen = _UserSeen()
+            self._add_memory(seen, self._backfill(conn, uid), oldest)
+            with self._lock:
+                seen = self._users.setdefault(uid, seen)
+                self._users.move_to_end(uid)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+        with self._lock:
+            generations = [(gen, bytes(seen.bits[gen])) for gen in live if gen in seen.bits]
+            recent = list(seen.recent.items())
+        return self._view(generations, recent, live)
+
+    def observe_event(self, event: Dict[str, Any]) -> None:
+        user_id = event.get("user_id")
+        product_id = event.get("product_id")
+        if user_id is None or product_id is None:
+            return
+        item = (int(product_id), _to_ts(event.get("occurred_at")))
+        oldest = self._live_generations(time.time())[-1]
+        added = 0
+        if self._redis is not None:
+            # Every worker sees every event; only the scheduler leader writes the shared bits.
+            if get_job_scheduler().is_leader:
+                try:
+                    added = self._add_redis(int(user_id), [item], oldest)
+                except Exception:
+                    added = 0
+        else:
+            with self._lock:
+                seen = self._users.get(int(user_id))
+                if seen is not None:
+                    added = self._add_memory(seen, [item], oldest)
+        if added:
+            with self._lock:
+                self._stats["ingested"] += added
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._users.pop(int(user_id), None)
+        if self._redis is not None:
+            try:
+                self._redis.delete(self._ready_key(user_id))
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "redis": self._redis is not None,
+                "bits": self.bits,
+                "hashes": self.hashes,
+                "recent_items": self.recent_items,
+                "generations": self.generations,
+                "rotation_seconds": int(self.rotation_seconds),
+                **self._stats,
+            }
+
+
+_seen_item_filters = SeenItemFilters()
+
+
+def get_seen_item_filters() -> SeenItemFilters:
+    return _seen_item_filters
@@ -0,0 +1,462 @@
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from app.cache import get_cache
+from app.catalogue import CatalogueSnapshot, get_catalogue_store
+from app.visual_search import _json_to_vector
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+def _safe_env_float(name: str, default: float) -> float:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return float(raw)
+    except Exception:
+        return default
+
+
+_CRITERIA = (
+    ("category_ids", 3.0),
+    ("condition_ids", 1.0),
+    ("dormitory_ids", 1.0),
+    ("seller_ids", 1.0),
+)
+
+PRICE_MATCH_WEIGHT = 2.0
+PRICE_MATCH_RATIO = 0.3
+
+
+class _CriterionGroups:
+    def __init__(self, values: Any, recency_order: Any) -> None:
+        grouped = recency_order[np.argsort(values[recency_order], kind="stable")]
+        self.positions = grouped
+        self.sorted_values = values[grouped]
+
+    def recent(self, value: int, limit: int) -> Any:
+        if value < 0:
+            return self.positions[:0]
+        start = int(np.searchsorted(self.sorted_values, value, side="left"))
+        end = int(np.searchsorted(self.sorted_values, value, side="right"))
+        return self.positions[start : min(end, start + limit)]
+
+
+class _EmbeddingMatrix:
+    def __init__(self, product_ids: Any, vectors: Any, stamps: Dict[int, str]) -> None:
+        self.product_ids = product_ids
+        self.vectors = vectors
+        self.stamps = stamps
+        self.row_by_id = {int(pid): idx for idx, pid in enumerate(product_ids.tolist())}
+
+    def neighbours(self, rows: Any, k: int) -> Tuple[Any, Any]:
+        sims = self.vectors[rows] @ self.vectors.T
+        sims[np.arange(rows.shape[0]), rows] = -np.inf
+        k = min(k, self.vectors.shape[0] - 1)
+        if k <= 0:
+            empty = np.empty((rows.shape[0], 0))
+            return empty.astype(np.int64), empty
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        return self.product_ids[top], np.take_along_axis(sims, top, axis=1)
+
+
+class SimilarityIndex:
+    def __init__(self) -> None:
+        self.top_n = max(1, _safe_env_int("SIMILARITY_TOP_N", 100))
+        self.candidates_per_criterion = max(10, _safe_env_int("SIMILARITY_CANDIDATES_PER_CRITERION", 200))
+        self.embedding_neighbours = max(0, _safe_env_int("SIMILARITY_EMBEDDING_NEIGHBOURS", 30))
+        self.embedding_weight = _safe_env_float("SIMILARITY_EMBEDDING_WEIGHT", 4.0)
+        self.embedding_max_rows = max(1, _safe_env_int("SIMILARITY_EMBEDDING_MAX_ROWS", 20000))
+        self.full_rebuild_seconds = max(60, _safe_env_int("SIMILARITY_FULL_REBUILD_SECONDS", 3600))
+        self.model_name = (os.environ.get("VISUAL_SEARCH_CLIP_MODEL") or "ViT-B-32").strip()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._neighbours: Dict[int, List[int]] = {}
+        self._scores: Dict[int, List[float]] = {}
+        self._reverse: Dict[int, Set[int]] = {}
+        self._signatures: Dict[int, Tuple[int, int, int, int, float]] = {}
+        self._embeddings: Optional[_EmbeddingMatrix] = None
+        self._embedding_marker: Optional[str] = None
+        self._last_full_build = 0.0
+        self._built_at: Optional[str] = None
+        self._published_at: Optional[str] = None
+        self._stats = {
+            "full_builds": 0,
+            "incremental_refreshes": 0,
+            "products_recomputed": 0,
+            "lists_extended": 0,
+            "published": 0,
+            "adopted": 0,
+            "last_build_ms": None,
+        }
+
+    @property
+    def ready(self) -> bool:
+        return self._built_at is not None
+
+    def neighbours(self, product_id: int, limit: Optional[int] = None) -> Optional[List[int]]:
+        with self._lock:
+            ids = self._neighbours.get(int(product_id))
+        if ids is None:
+            return None
+        return ids[:limit] if limit is not None else list(ids)
+
+    def _read_embedding_marker(self, conn) -> str:
+        row = conn.execute(
+            text(
+                """
+                SELECT COUNT(*) AS row_count, MAX(id) AS max_id, MAX(updated_at) AS max_updated_at
+                FROM product_image_embeddings
+                WHERE model_name = :model_name AND embedding_vector IS NOT NULL
+                """
+            ),
+            {"model_name": self.model_name},
+        ).mappings().first() or {}
+        return f"{int(row.get('row_count') or 0)}:{int(row.get('max_id') or 0)}:{row.get('max_updated_at')}"
+
+    def _load_embeddings(self, conn) -> Optional[_EmbeddingMatrix]:
+        rows = conn.execute(
+            text(
+                """
+                SELECT pie.product_id, pie.embedding_vector, pie.updated_at
+                FROM product_image_embeddings pie
+                JOIN products p ON p.id = pie.product_id
+                WHERE p.status = 'available'
+                  AND p.deleted_at IS NULL
+                  AND pie.embedding_vector IS NOT NULL
+                  AND pie.model_name = :model_name
+                ORDER BY pie.updated_at DESC, pie.id DESC
+                LIMIT :limit_rows
+                """
+            ),
+            {"model_name": self.model_name, "limit_rows": self.embedding_max_rows},
+        ).mappings().all()
+
+        sums: Dict[int, Any] = {}
+        stamps: Dict[int, str] = {}
+        for row in rows:
+            raw_vector = row.get("embedding_vector")
+            if not isinstance(raw_vector, str) or raw_vector.strip() == "":
+                continue
+            vec = _json_to_vector(raw_vector)
+            norm = float(np.linalg.norm(vec)) if vec.ndim == 1 and vec.size else 0.0
+            if norm == 0:
+                continue
+            pid = int(row["product_id"])
+            if pid in sums and sums[pid].shape != vec.shape:
+                continue
+            sums[pid] = sums[pid] + vec / norm if pid in sums else vec / norm
+            stamp = str(row.get("updated_at"))
+            if stamp > stamps.get(pid, ""):
+                stamps[pid] = stamp
+        if not sums:
+            return None
+
+        dims = {v.shape[0] for v in sums.values()}
+        dim = max(dims, key=lambda d: sum(1 for v in sums.values() if v.shape[0] == d))
+        product_ids = [pid for pid, v in sums.items() if v.shape[0] == dim]
+        matrix = np.stack([sums[pid] for pid in product_ids]).astype(np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        return _EmbeddingMatrix(np.asarray(product_ids, dtype=np.int64), matrix, {pid: stamps[pid] for pid in product_ids})
+
+    def _signatures_for(self, catalogue: CatalogueSnapshot) -> Dict[int, Tuple[int, int, int, int, float]]:
+        prices = np.where(np.isnan(catalogue.prices), -1.0, catalogue.prices)
+        return {
+            pid: (cat, cond, dorm, seller, price)
+            for pid, cat, cond, dorm, seller, price in zip(
+                catalogue.ids.tolist(),
+                catalogue.category_ids.tolist(),
+                catalogue.condition_ids.tolist(),
+                catalogue.dormitory_ids.tolist(),
+                catalogue.seller_ids.tolist(),
+                prices.tolist(),
+            )
+        }
+
+    def rebuild(self, conn) -> Dict[str, Any]:
+        """Cluster-wide full build; other workers adopt the published lists on their next refresh."""
+        result = self.refresh(conn, force=True)
+        with self._lock:
+            payload = {
+                "built_at": self._built_at,
+                "lists": {
+                    str(pid): [ids, self._scores.get(pid, []), list(self._signatures.get(pid, ()))]
+                    for pid, ids in self._neighbours.items()
+                },
+            }
+            self._published_at = payload["built_at"]
+            self._stats["published"] += 1
+        get_cache().set("similarity_index", "lists", payload, self.full_rebuild_seconds * 2)
+        return {**result, "published": True}
+
+    def _adopt_published(self) -> bool:
+        found, payload = get_cache().get("similarity_index", "lists")
+        if not found or not isinstance(payload, dict) or payload.get("built_at") == self._published_at:
+            return False
+        neighbours: Dict[int, List[int]] = {}
+        scores: Dict[int, List[float]] = {}
+        signatures: Dict[int, Tuple[int, int, int, int, float]] = {}
+        reverse: Dict[int, Set[int]] = {}
+        for raw_pid, (ids, list_scores, signature) in (payload.get("lists") or {}).items():
+            pid = int(raw_pid)
+            neighbours[pid] = [int(v) for v in ids]
+            scores[pid] = [float(v) for v in list_scores]
+            signatures[pid] = tuple(signature)
+            for neighbour in neighbours[pid]:
+                reverse.setdefault(neighbour, set()).add(pid)
+        with self._lock:
+            self._neighbours = neighbours
+            self._scores = scores
+            self._reverse = reverse
+            self._signatures = signatures
+            self._published_at = payload.get("built_at")
+            self._built_at = payload.get("built_at")
+            self._last_full_build = time.monotonic()
+            self._stats["adopted"] += 1
+        return True
+
+    def refresh(self, conn, force: bool = False) -> Dict[str, Any]:
+        if np is None:
+            raise RuntimeError("Missing dependency: numpy")
+        with self._refresh_lock:
+            started = time.perf_counter()
+            store = get_catalogue_store()
+            if store.snapshot() is None:
+                store.refresh(conn)
+            catalogue = store.snapshot()
+            if not force:
+                self._adopt_published()
+
+            previous_embeddings = self._embeddings
+            changed_embeddings: Set[int] = set()
+            try:
+                marker = self._read_embedding_marker(conn)
+                if marker != self._embedding_marker:
+                    embeddings = self._load_embeddings(conn) if self.embedding_neighbours > 0 else None
+                    old_stamps = previous_embeddings.stamps if previous_embeddings is not None else {}
+                    new_stamps = embeddings.stamps if embeddings is not None else {}
+                    changed_embeddings = {
+                        pid for pid in set(old_stamps) | set(new_stamps) if old_stamps.get(pid) != new_stamps.get(pid)
+                    }
+                    self._embeddings = embeddings
+                    self._embedding_marker = marker
+            except ProgrammingError as e:
+                if not (getattr(e.orig, "args", None) and len(e.orig.args) >= 1 and int(e.orig.args[0]) == 1146):
+                    raise
+                self._embeddings = None
+
+            signatures = self._signatures_for(catalogue)
+            # Without a shared cache the cluster-wide rebuild is invisible here, so fall back to a local one.
+            stale = time.monotonic() - self._last_full_build >= self.full_rebuild_seconds * 2
+            full = force or not self.ready or stale
+            extended: Dict[int, Tuple[List[int], List[float]]] = {}
+            if full:
+                affected = list(signatures.keys())
+            else:
+                removed = set(self._signatures) - set(signatures)
+                changed = {pid for pid, sig in signatures.items() if self._signatures.get(pid) != sig}
+                changed |= changed_embeddings & set(signatures)
+                with self._lock:
+                    referencing: Set[int] = set()
+                    for pid in changed | removed:
+                        referencing |= self._reverse.get(pid, set())
+                affected = [pid for pid in (changed | referencing) if pid in signatures]
+                extended = self._extend_lists(catalogue, changed, set(affected))
+
+            lists = self._compute(catalogue, affected)
+            lists.update({pid: v for pid, v in extended.items() if pid not in lists})
+
+            with self._lock:
+                if full:
+                    self._neighbours = {}
+                    self._scores = {}
+                    self._reverse = {}
+                for pid in set(self._signatures) - set(signatures):
+                    for neighbour in self._neighbours.pop(pid, []):
+                        self._reverse.get(neighbour, set()).discard(pid)
+                    self._scores.pop(pid, None)
+                    self._reverse.pop(pid, None)
+                for pid, (ids, list_scores) in lists.items():
+                    for neighbour in self._neighbours.get(pid, []):
+                        self._reverse.get(neighbour, set()).discard(pid)
+                    self._neighbours[pid] = ids
+                    self._scores[pid] = list_scores
+                    for neighbour in ids:
+                        self._reverse.setdefault(neighbour, set()).add(pid)
+                self._signatures = signatures
+                self._built_at = datetime.utcnow().isoformat()
+                elapsed_ms = int((time.perf_counter() - started) * 1000)
+                self._stats["last_build_ms"] = elapsed_ms
+                self._stats["products_recomputed"] += len(lists) - len(extended)
+                self._stats["lists_extended"] += len(extended)
+                if full:
+                    self._last_full_build = time.monotonic()
+                    self._stats["full_builds"] += 1
+                else:
+                    self._stats["incremental_refreshes"] += 1
+            return {
+                "mode": "full" if full else "incremental",
+                "recomputed": len(lists) - len(extended),
+                "extended": len(extended),
+                "products": len(signatures),
+                "build_ms": elapsed_ms,
+            }
+
+    def _extend_lists(
+        self, catalogue: CatalogueSnapshot, changed: Set[int], skip: Set[int]
+    ) -> Dict[int, Tuple[List[int], List[float]]]:
+        """Scores changed products against every other listing and merges them into top-k lists they now beat."""
+        positions = catalogue.positions_for_ids(sorted(changed))
+        if positions.size == 0:
+            return {}
+        created = np.where(np.isnan(catalogue.created_ts), -np.inf, catalogue.created_ts)
+        embedding_candidates = self._embedding_candidates(catalogue.ids[positions].tolist())
+
+        out: Dict[int, Tuple[List[int], List[float]]] = {}
+        for pos in positions.tolist():
+            pid = int(catalogue.ids[pos])
+            matched = np.zeros(catalogue.size, dtype=bool)
+            scores = np.zeros(catalogue.size, dtype=np.float64)
+            for column, weight in _CRITERIA:
+                values = getattr(catalogue, column)
+                if values[pos] >= 0:
+                    same = values == values[pos]
+                    matched |= same
+                    scores += np.where(same, weight, 0.0)
+            if not np.isnan(catalogue.prices[pos]):
+                with np.errstate(invalid="ignore"):
+                    near_price = np.abs(catalogue.prices[pos] - catalogue.prices) <= catalogue.prices * PRICE_MATCH_RATIO
+                scores += np.where(near_price, PRICE_MATCH_WEIGHT, 0.0)
+            embedded = embedding_candidates.get(pid)
+            if embedded is not None and embedded[0].size:
+                embed_positions = catalogue.positions_for_ids(embedded[0].tolist())
+                sim_by_id = dict(zip(embedded[0].tolist(), embedded[1].tolist()))
+                embed_sims = np.asarray([sim_by_id[int(catalogue.ids[p])] for p in embed_positions.tolist()], dtype=np.float64)
+                matched[embed_positions] = True
+                scores[embed_positions] += self.embedding_weight * np.maximum(embed_sims, 0.0)
+            matched[pos] = False
+
+            key = (created[pos], pid)
+            for target_pos in np.flatnonzero(matched).tolist():
+                target = int(catalogue.ids[target_pos])
+                if target in skip:
+                    continue
+                # Only refresh() writes the lists and it holds _refresh_lock, so reading them here is safe.
+                ids, list_scores = out.get(target) or (self._neighbours.get(target), self._scores.get(target, []))
+                if ids is None:
+                    continue
+                score = float(scores[target_pos])
+                if pid in ids or (len(ids) >= self.top_n and list_scores and score < list_scores[-1]):
+                    continue
+                ranked = list(zip(list_scores, ids))
+                member_created = created[catalogue.positions_for_ids(ids)] if ids else []
+                insert_at = len(ranked)
+                for idx, (member_score, member_id) in enumerate(ranked):
+                    if (score, key[0], key[1]) > (member_score, member_created[idx], member_id):
+                        insert_at = idx
+                        break
+                if insert_at >= self.top_n:
+                    continue
+                ids = (ids[:insert_at] + [pid] + ids[insert_at:])[: self.top_n]
+                list_scores = (list_scores[:insert_at] + [score] + list_scores[insert_at:])[: self.top_n]
+                out[target] = (ids, list_scores)
+        return out
+
+    def _embedding_candidates(self, product_ids: Iterable[int]) -> Dict[int, Tuple[Any, Any]]:
+        embeddings = self._embeddings
+        if embeddings is None or self.embedding_neighbours <= 0:
+            return {}
+        rows = [embeddings.row_by_id[pid] for pid in product_ids if pid in embeddings.row_by_id]
+        out: Dict[int, Tuple[Any, Any]] = {}
+        block = 1024
+        for start in range(0, len(rows), block):
+            chunk = np.asarray(rows[start : start + block], dtype=np.int64)
+            ids, sims = embeddings.neighbours(chunk, self.embedding_neighbours)
+            for idx, row in enumerate(chunk.tolist()):
+                out[int(embeddings.product_ids[row])] = (ids[idx], sims[idx])
+        return out
+
+    def _compute(self, catalogue: CatalogueSnapshot, product_ids: List[int]) -> Dict[int, Tuple[List[int], List[float]]]:
+        if not product_ids or catalogue.size == 0:
+            return {}
+        groups = {column: _CriterionGroups(getattr(catalogue, column), catalogue.recency_order) for column, _ in _CRITERIA}
+        created = np.where(np.isnan(catalogue.created_ts), -np.inf, catalogue.created_ts)
+        target_positions = catalogue.positions_for_ids(product_ids)
+        embedding_candidates = self._embedding_candidates(catalogue.ids[target_positions].tolist())
+
+        out: Dict[int, Tuple[List[int], List[float]]] = {}
+        for pos in target_positions.tolist():
+            pid = int(catalogue.ids[pos])
+            parts = [groups[column].recent(int(getattr(catalogue, column)[pos]), self.candidates_per_criterion) for column, _ in _CRITERIA]
+            embedded = embedding_candidates.get(pid)
+            embed_positions = np.empty(0, dtype=np.int64)
+            embed_sims = np.empty(0, dtype=np.float64)
+            if embedded is not None and embedded[0].size:
+                embed_positions = catalogue.positions_for_ids(embedded[0].tolist())
+                sim_by_id = dict(zip(embedded[0].tolist(), embedded[1].tolist()))
+                embed_sims = np.asarray([sim_by_id[int(catalogue.ids[p])] for p in embed_positions.tolist()], dtype=np.float64)
+                parts.append(embed_positions)
+            candidates = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+            candidates = candidates[candidates != pos]
+            if candidates.size == 0:
+                out[pid] = ([], [])
+                continue
+
+            scores = np.zeros(candidates.shape[0], dtype=np.float64)
+            for column, weight in _CRITERIA:
+                values = getattr(catalogue, column)
+                target_value = values[pos]
+                if target_value >= 0:
+                    scores += np.where(values[candidates] == target_value, weight, 0.0)
+            target_price = catalogue.prices[pos]
+            if not np.isnan(target_price):
+                with np.errstate(invalid="ignore"):
+                    near_price = np.abs(catalogue.prices[candidates] - target_price) <= target_price * PRICE_MATCH_RATIO
+                scores += np.where(near_price, PRICE_MATCH_WEIGHT, 0.0)
+            if embed_positions.size:
+                lookup = np.searchsorted(candidates, embed_positions)
+                scores[lookup] += self.embedding_weight * np.maximum(embed_sims, 0.0)
+
+            order = np.lexsort((-catalogue.ids[candidates], -created[candidates], -scores))[: self.top_n]
+            out[pid] = (catalogue.ids[candidates[order]].tolist(), scores[order].tolist())
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        embeddings = self._embeddings
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "products": len(self._neighbours),
+                "top_n": self.top_n,
+                "embedded_products": int(embeddings.product_ids.shape[0]) if embeddings is not None else 0,
+                "built_at": self._built_at,
+                "published_at": self._published_at,
+                **self._stats,
+            }
+
+
+_similarity_index = SimilarityIndex()
+
+
+def get_similarity_index() -> SimilarityIndex:
+    return _similarity_index
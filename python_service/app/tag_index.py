@@ -0,0 +1,249 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from sqlalchemy import text
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+@dataclass
+class _TagIndexSnapshot:
+    marker: str
+    product_ids: Any
+    category_ids: Any
+    prices: Any
+    trending_scores: Any
+    created_ts: Any
+    position_by_id: Dict[int, int]
+    price_order: Any
+    sorted_prices: Any
+    category_positions: Dict[int, Tuple[Any, Any]]
+    tag_bitmaps: Dict[int, Any]
+    product_tags: Dict[int, FrozenSet[int]]
+    built_at: str
+    build_ms: int
+
+
+class TagIndex:
+    def __init__(self) -> None:
+        self.max_age_seconds = max(60, _safe_env_int("TAG_INDEX_MAX_AGE_SECONDS", 900))
+        self._lock = threading.Lock()
+        self._snapshot: Optional[_TagIndexSnapshot] = None
+        self._snapshot_loaded_at = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return np is not None and self._snapshot is not None
+
+    def _read_marker(self, conn) -> str:
+        products = conn.execute(
+            text(
+                """
+                SELECT COUNT(*) AS row_count, MAX(id) AS max_id, MAX(updated_at) AS max_updated_at
+                FROM products
+                WHERE status = 'available' AND deleted_at IS NULL
+                """
+            )
+        ).mappings().first() or {}
+        tags = conn.execute(
+            text("SELECT COUNT(*) AS row_count, MAX(id) AS max_id FROM product_tags")
+        ).mappings().first() or {}
+        max_updated_at = products.get("max_updated_at")
+        updated_raw = max_updated_at.isoformat() if isinstance(max_updated_at, datetime) else str(max_updated_at or "")
+        return (
+            f"{int(products.get('row_count') or 0)}:{int(products.get('max_id') or 0)}:{updated_raw}:"
+            f"{int(tags.get('row_count') or 0)}:{int(tags.get('max_id') or 0)}"
+        )
+
+    def refresh(self, conn, force: bool = False) -> Dict[str, Any]:
+        if np is None:
+            raise RuntimeError("Missing dependency: numpy")
+        marker = self._read_marker(conn)
+        with self._lock:
+            current = self._snapshot
+            age = time.monotonic() - self._snapshot_loaded_at
+        if not force and current is not None and current.marker == marker and age < self.max_age_seconds:
+            return {"rebuilt": False, "products": int(current.product_ids.shape[0]), "marker": marker}
+
+        fresh = self._build(conn, marker)
+        with self._lock:
+            self._snapshot = fresh
+            self._snapshot_loaded_at = time.monotonic()
+        return {
+            "rebuilt": True,
+            "products": int(fresh.product_ids.shape[0]),
+            "tags": len(fresh.tag_bitmaps),
+            "marker": marker,
+            "build_ms": fresh.build_ms,
+        }
+
+    def _build(self, conn, marker: str) -> _TagIndexSnapshot:
+        started = time.perf_counter()
+        rows = conn.execute(
+            text(
+                """
+                SELECT
+                    p.id,
+                    p.category_id,
+                    p.price,
+                    COALESCE(p.trending_score, 0) AS trending_score,
+                    p.created_at
+                FROM products p
+                WHERE p.status = 'available'
+                  AND p.deleted_at IS NULL
+                ORDER BY p.id ASC
+                """
+            )
+        ).all()
+        count = len(rows)
+        product_ids = np.fromiter((int(r[0]) for r in rows), dtype=np.int64, count=count)
+        category_ids = np.fromiter((int(r[1]) if r[1] is not None else -1 for r in rows), dtype=np.int64, count=count)
+        prices = np.fromiter((float(r[2]) if r[2] is not None else 0.0 for r in rows), dtype=np.float64, count=count)
+        trending_scores = np.fromiter((float(r[3] or 0) for r in rows), dtype=np.float64, count=count)
+        created_ts = np.fromiter(
+            (r[4].timestamp() if isinstance(r[4], datetime) else 0.0 for r in rows),
+            dtype=np.float64,
+            count=count,
+        )
+        position_by_id = {int(pid): i for i, pid in enumerate(product_ids.tolist())}
+
+        price_order = np.argsort(prices, kind="stable")
+        sorted_prices = prices[price_order]
+
+        category_positions: Dict[int, Tuple[Any, Any]] = {}
+        if count:
+            cat_order = np.lexsort((prices, category_ids))
+            sorted_cats = category_ids[cat_order]
+            boundaries = np.flatnonzero(np.diff(sorted_cats)) + 1
+            for chunk in np.split(cat_order, boundaries):
+                if chunk.size == 0:
+                    continue
+                category_positions[int(category_ids[chunk[0]])] = (chunk, prices[chunk])
+
+        tag_rows = conn.execute(
+            text(
+                """
+                SELECT pt.product_id, pt.tag_id
+                FROM product_tags pt
+                JOIN products p ON p.id = pt.product_id
+                WHERE p.deleted_at IS NULL
+                """
+            )
+        ).all()
+        product_tag_lists: Dict[int, List[int]] = {}
+        tag_positions: Dict[int, List[int]] = {}
+        for product_id, tag_id in tag_rows:
+            pid = int(product_id)
+            tid = int(tag_id)
+            product_tag_lists.setdefault(pid, []).append(tid)
+            pos = position_by_id.get(pid)
+            if pos is not None:
+                tag_positions.setdefault(tid, []).append(pos)
+
+        tag_bitmaps: Dict[int, Any] = {}
+        for tid, positions in tag_positions.items():
+            bits = np.zeros(count, dtype=np.uint8)
+            bits[np.asarray(positions, dtype=np.int64)] = 1
+            tag_bitmaps[tid] = np.packbits(bits)
+
+        return _TagIndexSnapshot(
+            marker=marker,
+            product_ids=product_ids,
+            category_ids=category_ids,
+            prices=prices,
+            trending_scores=trending_scores,
+            created_ts=created_ts,
+            position_by_id=position_by_id,
+            price_order=price_order,
+            sorted_prices=sorted_prices,
+            category_positions=category_positions,
+            tag_bitmaps=tag_bitmaps,
+            product_tags={pid: frozenset(tids) for pid, tids in product_tag_lists.items()},
+            built_at=datetime.utcnow().isoformat(),
+            build_ms=int((time.perf_counter() - started) * 1000),
+        )
+
+    def related_content(
+        self,
+        product_id: int,
+        category_id: Optional[int],
+        price: float,
+        limit: int,
+    ) -> Optional[List[Tuple[int, float]]]:
+        snapshot = self._snapshot
+        if np is None or snapshot is None:
+            return None
+        count = int(snapshot.product_ids.shape[0])
+        if count == 0:
+            return []
+
+        scores = np.zeros(count, dtype=np.float64)
+        if category_id is not None:
+            entry = snapshot.category_positions.get(int(category_id))
+            if entry is not None:
+                scores[entry[0]] += 2.0
+        if price > 0:
+            lo = int(np.searchsorted(snapshot.sorted_prices, price * 0.8, side="left"))
+            hi = int(np.searchsorted(snapshot.sorted_prices, price * 1.2, side="right"))
+            scores[snapshot.price_order[lo:hi]] += 1.5
+        for tid in snapshot.product_tags.get(int(product_id), frozenset()):
+            bitmap = snapshot.tag_bitmaps.get(tid)
+            if bitmap is not None:
+                scores += 0.8 * np.unpackbits(bitmap, count=count)
+
+        target_pos = snapshot.position_by_id.get(int(product_id))
+        eligible = np.ones(count, dtype=bool)
+        if target_pos is not None:
+            eligible[target_pos] = False
+        candidates = np.flatnonzero(eligible)
+        if candidates.size == 0:
+            return []
+
+        limit = max(1, int(limit))
+        candidate_scores = scores[candidates]
+        if candidates.size > limit:
+            threshold = np.partition(candidate_scores, candidates.size - limit)[candidates.size - limit]
+            keep = candidate_scores >= threshold
+            candidates = candidates[keep]
+            candidate_scores = candidate_scores[keep]
+        order = np.lexsort((-snapshot.created_ts[candidates], -snapshot.trending_scores[candidates], -candidate_scores))
+        top = candidates[order[:limit]]
+        return [(int(pid), float(score)) for pid, score in zip(snapshot.product_ids[top].tolist(), scores[top].tolist())]
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"ready": False}
+        return {
+            "ready": True,
+            "products": int(snapshot.product_ids.shape[0]),
+            "tags": len(snapshot.tag_bitmaps),
+            "categories": len(snapshot.category_positions),
+            "marker": snapshot.marker,
+            "built_at": snapshot.built_at,
+            "build_ms": snapshot.build_ms,
+        }
+
+
+_tag_index = TagIndex()
+
+
+def get_tag_index() -> TagIndex:
+    return _tag_index
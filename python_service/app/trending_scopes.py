@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.cache import get_cache
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+def _to_ts(value: Any) -> float:
+    if isinstance(value, str) and value:
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+        except Exception:
+            return 0.0
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=timezone.utc).timestamp()
+    return 0.0
+
+
+def _to_id(value: Any) -> int:
+    if value is None:
+        return -1
+    try:
+        return int(value)
+    except Exception:
+        return -1
+
+
+TRENDING_SCOPE_KINDS = ("dormitory", "university", "category")
+
+_TRENDING_SCOPE_ROWS_SQL = """
+    SELECT
+        p.id,
+        p.dormitory_id,
+        COALESCE(d_user.university_id, d_product.university_id) AS university_id,
+        p.category_id,
+        COALESCE(p.trending_score, 0) AS trending_score,
+        p.created_at
+    FROM products p
+    JOIN users u ON u.id = p.seller_id
+    LEFT JOIN dormitories d_user ON d_user.id = u.dormitory_id
+    LEFT JOIN dormitories d_product ON d_product.id = p.dormitory_id
+    WHERE p.status = 'available'
+      AND p.deleted_at IS NULL
+"""
+
+
+class ScopedTrendingLists:
+    def __init__(self) -> None:
+        self.list_size = max(10, _safe_env_int("TRENDING_SCOPE_SIZE", 100))
+        self.ttl_seconds = max(60, _safe_env_int("TRENDING_SCOPE_TTL_SECONDS", 1200))
+        self._lock = threading.Lock()
+        self._lists: Dict[Tuple[str, int], Tuple[Any, Any]] = {}
+        self._built_at: Optional[str] = None
+        self._loaded_monotonic = 0.0
+        self._stats = {"builds": 0, "syncs": 0, "adopted": 0, "last_build_ms": None}
+
+    @property
+    def ready(self) -> bool:
+        return self._built_at is not None
+
+    def top(self, kind: str, scope_id: int, limit: int) -> Optional[List[Tuple[int, float]]]:
+        if not self.ready:
+            return None
+        with self._lock:
+            entry = self._lists.get((kind, int(scope_id)))
+        if entry is None:
+            return []
+        ids, scores = entry
+        return list(zip(ids[:limit].tolist(), scores[:limit].tolist()))
+
+    def _build_payload(self, conn) -> Dict[str, Any]:
+        if np is None:
+            raise RuntimeError("Missing dependency: numpy")
+        started = time.perf_counter()
+        rows = conn.execute(text(_TRENDING_SCOPE_ROWS_SQL)).all()
+        count = len(rows)
+        ids = np.fromiter((int(r[0]) for r in rows), dtype=np.int64, count=count)
+        scores = np.fromiter((float(r[4] or 0) for r in rows), dtype=np.float64, count=count)
+        created = np.fromiter((_to_ts(r[5]) for r in rows), dtype=np.float64, count=count)
+        order = np.lexsort((-ids, -created, -scores))
+
+        scopes: Dict[str, Dict[str, List[List[Any]]]] = {}
+        for kind, column in zip(TRENDING_SCOPE_KINDS, (1, 2, 3)):
+            keys = np.fromiter((_to_id(r[column]) for r in rows), dtype=np.int64, count=count)[order]
+            perm = np.argsort(keys, kind="stable")
+            grouped = order[perm]
+            group_keys, starts = np.unique(keys[perm], return_index=True)
+            lists: Dict[str, List[List[Any]]] = {}
+            for key, start, end in zip(group_keys.tolist(), starts.tolist(), starts[1:].tolist() + [count]):
+                if key < 0:
+                    continue
+                top = grouped[start : min(end, start + self.list_size)]
+                lists[str(key)] = [ids[top].tolist(), np.round(scores[top], 4).tolist()]
+            scopes[kind] = lists
+        with self._lock:
+            self._stats["builds"] += 1
+            self._stats["last_build_ms"] = int((time.perf_counter() - started) * 1000)
+        return {"built_at": datetime.utcnow().isoformat(), "scopes": scopes}
+
+    def _load(self, payload: Dict[str, Any]) -> None:
+        lists: Dict[Tuple[str, int], Tuple[Any, Any]] = {}
+        for kind, entries in (payload.get("scopes") or {}).items():
+            for key, (ids, scores) in entries.items():
+                lists[(kind, int(key))] = (np.asarray(ids, dtype=np.int64), np.asarray(scores, dtype=np.float32))
+        with self._lock:
+            self._lists = lists
+            self._built_at = payload.get("built_at")
+            self._loaded_monotonic = time.monotonic()
+
+    def publish(self, conn) -> Dict[str, Any]:
+        payload = self._build_payload(conn)
+        # Untagged: per-event "trending" invalidation must not evict the published lists; they are
+        # replaced wholesale by the next batch recompute and identified by built_at.
+        get_cache().set("trending_scopes", "lists", payload, self.ttl_seconds)
+        self._load(payload)
+        return {"built_at": payload["built_at"], "scopes": len(self._lists)}
+
+    def sync(self, conn) -> Dict[str, Any]:
+        found, payload = get_cache().get("trending_scopes", "lists")
+        if found:
+            if payload.get("built_at") != self._built_at:
+                self._load(payload)
+                with self._lock:
+                    self._stats["adopted"] += 1
+        elif not self.ready or time.monotonic() - self._loaded_monotonic >= self.ttl_seconds:
+            return self.publish(conn)
+        with self._lock:
+            self._stats["syncs"] += 1
+        return {"built_at": self._built_at, "scopes": len(self._lists)}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ready": self._built_at is not None,
+                "scopes": len(self._lists),
+                "list_size": self.list_size,
+                "built_at": self._built_at,
+                **self._stats,
+            }
+
+
+_scoped_trending_lists = ScopedTrendingLists()
+
+
+def get_scoped_trending_lists() -> ScopedTrendingLists:
+    return _scoped_trending_lists
@@ -0,0 +1,446 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from app.database import offload
+from app.event_stream import normalize_event
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+
+AFFINITY_DECAY_DAYS = 14.0
+PERSONALIZED_EVENT_WEIGHTS = {"like": 4.0, "add_to_cart": 5.0, "click": 2.0, "view": 1.0}
+_OVERFLOW_BUCKET_SECONDS = 3600
+
+
+def _safe_env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        return default
+
+
+def _to_ts(value: datetime) -> float:
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _from_ts(value: float) -> datetime:
+    return datetime.fromtimestamp(value, tz=timezone.utc).replace(tzinfo=None)
+
+
+def event_weight(event_type: str) -> float:
+    t = (event_type or "").strip().lower()
+    if t in {"favorite", "favourite"}:
+        return 3.0
+    if t in {"offer", "make_offer"}:
+        return 4.0
+    if t in {"message", "chat"}:
+        return 2.0
+    if t in {"purchase", "buy", "transaction"}:
+        return 5.0
+    if t in {"view", "click", "search"}:
+        return 1.0
+    return 0.5
+
+
+def time_decay(occurred_at: datetime, now: datetime) -> float:
+    age_days = max(0.0, (now - occurred_at).total_seconds() / 86400.0)
+    return math.exp(-age_days / AFFINITY_DECAY_DAYS)
+
+
+def recency_multiplier(idx: int) -> float:
+    if idx == 0:
+        return 6.0
+    if idx < 3:
+        return 4.0
+    if idx < 10:
+        return 2.0
+    return 1.0
+
+
+# (event_id, product_id, category_id, seller_id, event_type, occurred_ts)
+_ProfileEvent = Tuple[Optional[int], Optional[int], Optional[int], Optional[int], str, float]
+
+
+class UserProfile:
+    def __init__(self, user_id: int, window_days: int, max_events: int) -> None:
+        self.user_id = int(user_id)
+        self.window_seconds = window_days * 86400.0
+        self.max_events = max_events
+        self.events: Deque[_ProfileEvent] = deque()
+        self.event_ids: Set[int] = set()
+        self.max_event_id = 0
+        self.ref_ts = time.time()
+        self.category_affinity: Dict[int, float] = {}
+        self.seller_affinity: Dict[int, float] = {}
+        self.category_counts: Dict[int, float] = {}
+        # Category weights of window events that no longer fit in the ring, per hour, so category_counts
+        # still covers the whole window. A bucket is dropped once all of its hour is past the window.
+        self.overflow_counts: Dict[int, Dict[int, float]] = {}
+        self.lock = threading.Lock()
+
+    def _rebase(self, ts: float) -> None:
+        if ts <= self.ref_ts:
+            return
+        factor = math.exp(-(ts - self.ref_ts) / (AFFINITY_DECAY_DAYS * 86400.0))
+        for mapping in (self.category_affinity, self.seller_affinity):
+            for key in list(mapping.keys()):
+                value = mapping[key] * factor
+                if value <= 1e-12:
+                    mapping.pop(key, None)
+                else:
+                    mapping[key] = value
+        self.ref_ts = ts
+
+    def _contribution(self, event: _ProfileEvent) -> float:
+        return event_weight(event[4]) * math.exp(-(self.ref_ts - event[5]) / (AFFINITY_DECAY_DAYS * 86400.0))
+
+    def _add_count(self, category_id: int, delta: float) -> None:
+        count = self.category_counts.get(category_id, 0.0) + delta
+        if count <= 1e-9:
+            self.category_counts.pop(category_id, None)
+        else:
+            self.category_counts[category_id] = count
+
+    def _apply(self, event: _ProfileEvent, sign: float) -> None:
+        _, _, category_id, seller_id, event_type, _ = event
+        w = sign * self._contribution(event)
+        if category_id is not None:
+            value = self.category_affinity.get(category_id, 0.0) + w
+            if value <= 1e-12:
+                self.category_affinity.pop(category_id, None)
+            else:
+                self.category_affinity[category_id] = value
+            self._add_count(category_id, sign * PERSONALIZED_EVENT_WEIGHTS.get(event_type, 0.5))
+        if seller_id is not None:
+            value = self.seller_affinity.get(seller_id, 0.0) + w
+            if value <= 1e-12:
+                self.seller_affinity.pop(seller_id, None)
+            else:
+                self.seller_affinity[seller_id] = value
+
+    def _evict_oldest(self, overflow: bool = False) -> None:
+        oldest = self.events.pop()
+        self._apply(oldest, -1.0)
+        if oldest[0] is not None:
+            self.event_ids.discard(oldest[0])
+        if overflow:
+            self.add_overflow(oldest[2], oldest[4], oldest[5])
+
+    def add_overflow(self, category_id: Optional[int], event_type: str, occurred_ts: float) -> None:
+        if category_id is None or occurred_ts < time.time() - self.window_seconds:
+            return
+        weight = PERSONALIZED_EVENT_WEIGHTS.get(event_type, 0.5)
+        bucket = self.overflow_counts.setdefault(int(occurred_ts // _OVERFLOW_BUCKET_SECONDS), {})
+        bucket[category_id] = bucket.get(category_id, 0.0) + weight
+        self._add_count(category_id, weight)
+
+    def add(self, event: _ProfileEvent) -> bool:
+        event_id = event[0]
+        if event_id is not None and event_id in self.event_ids:
+            return False
+        if event[5] < time.time() - self.window_seconds:
+            return False
+        self._rebase(event[5])
+
+        key = (event[5], event_id or 0)
+        if not self.events or key >= (self.events[0][5], self.events[0][0] or 0):
+            self.events.appendleft(event)
+        else:
+            idx = 0
+            for idx, existing in enumerate(self.events):
+                if key >= (existing[5], existing[0] or 0):
+                    break
+            else:
+                idx = len(self.events)
+            if idx >= self.max_events:
+                return False
+            self.events.insert(idx, event)
+
+        self._apply(event, 1.0)
+        if event_id is not None:
+            self.event_ids.add(event_id)
+            self.max_event_id = max(self.max_event_id, event_id)
+        while len(self.events) > self.max_events:
+            self._evict_oldest(overflow=True)
+        return True
+
+    def expire(self, now_ts: float) -> None:
+        cutoff = now_ts - self.window_seconds
+        while self.events and self.events[-1][5] < cutoff:
+            self._evict_oldest()
+        for hour in [h for h in self.overflow_counts if (h + 1) * _OVERFLOW_BUCKET_SECONDS <= cutoff]:
+            for category_id, weight in self.overflow_counts.pop(hour).items():
+                self._add_count(category_id, -weight)
+
+    def affinities(self, now: datetime) -> Tuple[Dict[int, float], Dict[int, float]]:
+        now_ts = _to_ts(now)
+        factor = math.exp(-(now_ts - self.ref_ts) / (AFFINITY_DECAY_DAYS * 86400.0))
+        category_scores = {k: v * factor for k, v in self.category_affinity.items()}
+        seller_scores = {k: v * factor for k, v in self.seller_affinity.items()}
+        for idx, event in enumerate(self.events):
+            if idx >= 10:
+                break
+            age_days = max(0.0, (now_ts - event[5]) / 86400.0)
+            extra = (recency_multiplier(idx) - 1.0) * event_weight(event[4]) * math.exp(-age_days / AFFINITY_DECAY_DAYS)
+            if event[2] is not None:
+                category_scores[event[2]] = category_scores.get(event[2], 0.0) + extra
+            if event[3] is not None:
+                seller_scores[event[3]] = seller_scores.get(event[3], 0.0) + extra
+        return category_scores, seller_scores
+
+    def to_payload(self) -> Dict[str, Any]:
+        return {
+            "user_id": self.user_id,
+            "events": [list(e) for e in self.events],
+            "overflow": {str(h): {str(k): v for k, v in b.items()} for h, b in self.overflow_counts.items()},
+        }
+
+
+class UserProfileStore:
+    def __init__(self) -> None:
+        self.window_days = max(1, _safe_env_int("USER_PROFILE_WINDOW_DAYS", 30))
+        self.max_events = max(10, _safe_env_int("USER_PROFILE_MAX_EVENTS", 500))
+        self.max_profiles = max(100, _safe_env_int("USER_PROFILE_CACHE_SIZE", 10000))
+        self.redis_ttl_seconds = max(60, _safe_env_int("USER_PROFILE_REDIS_TTL_SECONDS", 86400))
+        # Streamed events are written back to Redis once a profile has this many unsaved ones; flush()
+        # writes the rest on a timer, so a restarted worker only replays a short tail from the database.
+        self.persist_batch_events = max(1, _safe_env_int("USER_PROFILE_PERSIST_BATCH_EVENTS", 20))
+        self._lock = threading.Lock()
+        self._profiles: "OrderedDict[int, UserProfile]" = OrderedDict()
+        self._dirty: Dict[int, int] = {}
+        self._stats = {"memory_hits": 0, "redis_hits": 0, "db_rebuilds": 0, "ingested": 0, "persisted": 0}
+        self._redis = None
+        url = (os.environ.get("REDIS_URL") or "").strip()
+        if url and redis is not None:
+            try:
+                self._redis = redis.Redis.from_url(url, decode_responses=True)
+                self._redis.ping()
+            except Exception:
+                self._redis = None
+
+    def _redis_key(self, user_id: int) -> str:
+        return f"user_profile:{int(user_id)}"
+
+    def _remember(self, profile: UserProfile) -> None:
+        with self._lock:
+            self._profiles[profile.user_id] = profile
+            self._profiles.move_to_end(profile.user_id)
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def _persist(self, profile: UserProfile) -> None:
+        if self._redis is None:
+            return
+        with self._lock:
+            self._dirty.pop(profile.user_id, None)
+        try:
+            with profile.lock:
+                payload = json.dumps(profile.to_payload())
+            offload(self._redis.setex, self._redis_key(profile.user_id), self.redis_ttl_seconds, payload)
+        except Exception:
+            return
+        with self._lock:
+            self._stats["persisted"] += 1
+
+    def _load_from_redis(self, user_id: int) -> Optional[UserProfile]:
+        if self._redis is None:
+            return None
+        try:
+            raw = offload(self._redis.get, self._redis_key(user_id))
+        except Exception:
+            return None
+        if not raw:
+            return None
+        try:
+            data = json.loads(raw)
+        except Exception:
+            return None
+        if "overflow" not in data and len(data.get("events") or []) >= self.max_events:
+            return None
+        profile = UserProfile(user_id, self.window_days, self.max_events)
+        try:
+            for hour, bucket in (data.get("overflow") or {}).items():
+                for category_id, weight in bucket.items():
+                    profile.overflow_counts.setdefault(int(hour), {})[int(category_id)] = float(weight)
+                    profile._add_count(int(category_id), float(weight))
+        except Exception:
+            return None
+        for item in reversed(data.get("events") or []):
+            if not isinstance(item, list) or len(item) != 6:
+                continue
+            profile.add((item[0], item[1], item[2], item[3], str(item[4]), float(item[5])))
+        return profile
+
+    def _fetch_events(self, conn, user_id: int, after_id: int = 0) -> List[_ProfileEvent]:
+        since = datetime.utcnow() - timedelta(days=self.window_days)
+        rows = conn.execute(
+            text(
+                """
+                SELECT id, user_id, event_type, product_id, category_id, seller_id, occurred_at
+                FROM behavioral_events
+                WHERE user_id = :user_id AND occurred_at >= :since AND id > :after_id
+                ORDER BY occurred_at DESC, id DESC
+                LIMIT :limit_value
+                """
+            ),
+            {"user_id": int(user_id), "since": since, "after_id": int(after_id), "limit_value": self.max_events},
+        ).mappings().all()
+        return [_compact_event(normalize_event(dict(row))) for row in rows]
+
+    def _load_overflow(self, conn, profile: UserProfile) -> None:
+        if len(profile.events) < self.max_events:
+            return
+        since = datetime.utcnow() - timedelta(days=self.window_days)
+        rows = conn.execute(
+            text(
+                """
+                SELECT id, category_id, event_type, occurred_at
+                FROM behavioral_events
+                WHERE user_id = :user_id AND category_id IS NOT NULL
+                  AND occurred_at >= :since AND occurred_at <= :until
+                """
+            ),
+            {"user_id": profile.user_id, "since": since, "until": _from_ts(profile.events[-1][5] + 1.0)},
+        ).mappings()
+        for row in rows:
+            if row["id"] in profile.event_ids:
+                continue
+            event = normalize_event(dict(row))
+            profile.add_overflow(event["category_id"], event["event_type"], _to_ts(event["occurred_at"]))
+
+    def get(self, conn, user_id: int) -> UserProfile:
+        uid = int(user_id)
+        with self._lock:
+            profile = self._profiles.get(uid)
+            if profile is not None:
+                self._profiles.move_to_end(uid)
+                self._stats["memory_hits"] += 1
+        if profile is None:
+            profile = self._load_from_redis(uid)
+            if profile is not None:
+                catch_up = self._fetch_events(conn, uid, after_id=profile.max_event_id)
+                if len(catch_up) >= self.max_events:
+                    profile = None
+            if profile is not None:
+                with profile.lock:
+                    for event in reversed(catch_up):
+                        profile.add(event)
+                with self._lock:
+                    self._stats["redis_hits"] += 1
+                if catch_up:
+                    self._persist(profile)
+            else:
+                profile = UserProfile(uid, self.window_days, self.max_events)
+                for event in reversed(self._fetch_events(conn, uid)):
+                    profile.add(event)
+                self._load_overflow(conn, profile)
+                with self._lock:
+                    self._stats["db_rebuilds"] += 1
+                self._persist(profile)
+            self._remember(profile)
+        with profile.lock:
+            profile.expire(time.time())
+        return profile
+
+    def snapshot(self, conn, user_id: int, now: datetime) -> Dict[str, Any]:
+        profile = self.get(conn, user_id)
+        with profile.lock:
+            category_scores, seller_scores = profile.affinities(now)
+            head = profile.events[0] if profile.events else None
+            return {
+                "category_scores": category_scores,
+                "seller_scores": seller_scores,
+                "category_counts": dict(profile.category_counts),
+                "event_count": len(profile.events),
+                "last_event_id": int(head[0] or 0) if head else 0,
+                "last_event_at": _from_ts(head[5]).isoformat() if head else None,
+            }
+
+    def category_weights(self, conn, user_id: int) -> Dict[int, float]:
+        profile = self.get(conn, user_id)
+        with profile.lock:
+            return dict(profile.category_counts)
+
+    def observe_event(self, event: Dict[str, Any]) -> None:
+        user_id = event.get("user_id")
+        if user_id is None:
+            return
+        with self._lock:
+            profile = self._profiles.get(int(user_id))
+        if profile is None:
+            return
+        with profile.lock:
+            added = profile.add(_compact_event(event))
+        if not added:
+            return
+        with self._lock:
+            self._stats["ingested"] += 1
+            if self._redis is None:
+                return
+            unsaved = self._dirty.get(profile.user_id, 0) + 1
+            self._dirty[profile.user_id] = unsaved
+        if unsaved >= self.persist_batch_events:
+            self._persist(profile)
+
+    def flush(self) -> Dict[str, Any]:
+        with self._lock:
+            dirty = list(self._dirty)
+            self._dirty.clear()
+            profiles = [self._profiles[uid] for uid in dirty if uid in self._profiles]
+        for profile in profiles:
+            self._persist(profile)
+        return {"profiles": len(profiles)}
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._profiles.pop(int(user_id), None)
+            self._dirty.pop(int(user_id), None)
+        if self._redis is not None:
+            try:
+                self._redis.delete(self._redis_key(user_id))
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "profiles": len(self._profiles),
+                "redis": self._redis is not None,
+                "window_days": self.window_days,
+                "unsaved_profiles": len(self._dirty),
+                **self._stats,
+            }
+
+
+def _compact_event(event: Dict[str, Any]) -> _ProfileEvent:
+    occurred_at = event.get("occurred_at")
+    occurred_ts = _to_ts(occurred_at) if isinstance(occurred_at, datetime) else time.time()
+    return (
+        event.get("id"),
+        event.get("product_id"),
+        event.get("category_id"),
+        event.get("seller_id"),
+        str(event.get("event_type") or ""),
+        occurred_ts,
+    )
+
+
+_user_profile_store = UserProfileStore()
+
+
+def get_user_profile_store() -> UserProfileStore:
+    return _user_profile_store
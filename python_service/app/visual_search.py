@@ -8,10 +8,11 @@ import time
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
-import urllib.request
 from sqlalchemy import text
 from sqlalchemy.exc import ProgrammingError
 
+from app.http_client import get_http_client
+
 try:
     import cv2
 except ModuleNotFoundError:
@@ -74,10 +75,9 @@ def _resolve_image_url(image_url: str) -> str:
 
 
 def _download_image_bytes(image_url: str, timeout_seconds: int) -> bytes:
-    url = _resolve_image_url(image_url)
-    req = urllib.request.Request(url, method="GET")
-    with urllib.request.urlopen(req, timeout=timeout_seconds) as resp:
-        return resp.read()
+    resp = get_http_client().request("GET", _resolve_image_url(image_url), read_timeout=timeout_seconds)
+    resp.raise_for_status()
+    return resp.body
 
 
 def _decode_rgb_image(image_bytes: bytes) -> Image.Image:
@@ -11,6 +11,12 @@ CREATE INDEX IF NOT EXISTS idx_products_trending_score ON products (trending_sco
 CREATE INDEX IF NOT EXISTS idx_products_category_price ON products (category_id, price);
 CREATE INDEX IF NOT EXISTS idx_products_created_at ON products (created_at);
 
+-- Keyset lookups for similar products: one (criterion, status, deleted_at, created_at, id) range per criterion
+CREATE INDEX IF NOT EXISTS idx_products_category_recent ON products (category_id, status, deleted_at, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_products_condition_recent ON products (condition_level_id, status, deleted_at, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_products_dormitory_recent ON products (dormitory_id, status, deleted_at, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_products_seller_recent ON products (seller_id, status, deleted_at, created_at, id);
+
 CREATE TABLE IF NOT EXISTS behavioral_events (
     id BIGINT PRIMARY KEY AUTO_INCREMENT,
     user_id BIGINT NOT NULL,
@@ -29,3 +35,42 @@ CREATE TABLE IF NOT EXISTS behavioral_events (
 -- Optional: collaborative filtering speedup for "users also viewed"
 CREATE INDEX IF NOT EXISTS idx_behavioral_user_product ON behavioral_events (user_id, product_id);
 CREATE INDEX IF NOT EXISTS idx_behavioral_product_user ON behavioral_events (product_id, user_id);
+
+-- Daily behavioral-event rollups, compacted from behavior_rollup_state.watermark_id once rows are
+-- older than EVENT_ROLLUP_COMMIT_LAG_SECONDS.
+-- Lookback profiles read these for whole days and raw behavioral_events for the current day.
+-- category_id / seller_id 0 means the event carried none.
+CREATE TABLE IF NOT EXISTS behavior_rollup_user_category (
+    user_id BIGINT NOT NULL,
+    category_id BIGINT NOT NULL,
+    day DATE NOT NULL,
+    event_count INT NOT NULL DEFAULT 0,
+    weighted_count DOUBLE NOT NULL DEFAULT 0,
+    last_event_id BIGINT NOT NULL DEFAULT 0,
+    last_event_at DATETIME NULL,
+    PRIMARY KEY (user_id, day, category_id)
+);
+
+CREATE TABLE IF NOT EXISTS behavior_rollup_user_seller (
+    user_id BIGINT NOT NULL,
+    seller_id BIGINT NOT NULL,
+    day DATE NOT NULL,
+    event_count INT NOT NULL DEFAULT 0,
+    weighted_count DOUBLE NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day, seller_id)
+);
+
+CREATE TABLE IF NOT EXISTS behavior_rollup_product (
+    product_id BIGINT NOT NULL,
+    day DATE NOT NULL,
+    event_count INT NOT NULL DEFAULT 0,
+    weighted_count DOUBLE NOT NULL DEFAULT 0,
+    PRIMARY KEY (product_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS behavior_rollup_state (
+    name VARCHAR(64) PRIMARY KEY,
+    watermark_id BIGINT NOT NULL DEFAULT 0,
+    compacted_at DATETIME NULL,
+    updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Tests import the service as `app.*` and the local helpers (e.g. mock_llm_server) by module name.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,163 @@
+import argparse
+import json
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+# OpenAI-compatible /v1/chat/completions stub for local runs and benchmarks, e.g.
+#   python tests/mock_llm_server.py --port 8099 --ttft-ms 300 --token-delay-ms 20
+#   AI_API_KEY=test AI_BASE_URL=http://127.0.0.1:8099/v1 uvicorn app.main:app
+DEFAULT_REPLY = "Here are a few listings near your dormitory that match what you asked for."
+
+
+def reply_tokens(text: str) -> list[str]:
+    words = text.split(" ")
+    return [w if i == 0 else f" {w}" for i, w in enumerate(words)]
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockLLM/1.0"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, payload: Any) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") in {"/health", "/v1/models"}:
+            self._send_json(200, {"object": "list", "data": [{"id": self.server.model, "object": "model"}]})
+            return
+        self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if self.path.rstrip("/") not in {"/v1/chat/completions", "/chat/completions"}:
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        if not (self.headers.get("Authorization") or "").startswith("Bearer "):
+            self._send_json(401, {"error": {"message": "Missing bearer token"}})
+            return
+        try:
+            payload = json.loads(raw.decode("utf-8") or "{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON"}})
+            return
+
+        model = payload.get("model") or self.server.model
+        tokens = reply_tokens(self.server.reply)
+        created = int(time.time())
+        completion_id = f"chatcmpl-mock-{created}"
+        time.sleep(self.server.ttft_ms / 1000)
+
+        if not payload.get("stream"):
+            time.sleep(self.server.token_delay_ms * max(0, len(tokens) - 1) / 1000)
+            self._send_json(
+                200,
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}
+                    ],
+                },
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, token in enumerate(tokens):
+                if self.server.truncate_after is not None and i >= self.server.truncate_after:
+                    # Simulate an upstream that gives up mid-answer: the body ends without [DONE].
+                    self._write_chunk(b"")
+                    return
+                if i:
+                    time.sleep(self.server.token_delay_ms / 1000)
+                delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                }
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            final = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            self._write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+def make_server(
+    host: str = "127.0.0.1",
+    port: int = 8099,
+    ttft_ms: float = 200.0,
+    token_delay_ms: float = 20.0,
+    reply: str = DEFAULT_REPLY,
+    model: str = "mock-gpt",
+    verbose: bool = False,
+    truncate_after: Optional[int] = None,
+) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), MockLLMHandler)
+    server.daemon_threads = True
+    server.ttft_ms = ttft_ms
+    server.token_delay_ms = token_delay_ms
+    server.reply = reply
+    server.model = model
+    server.verbose = verbose
+    server.truncate_after = truncate_after
+    return server
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--ttft-ms", type=float, default=200.0, help="delay before the first token")
+    parser.add_argument("--token-delay-ms", type=float, default=20.0, help="delay between streamed tokens")
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    parser.add_argument("--model", default="mock-gpt")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--truncate-after", type=int, default=None, help="end streams after N tokens without [DONE]")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.ttft_ms, args.token_delay_ms, args.reply, args.model, args.verbose, args.truncate_after)
+    print(f"Mock LLM listening on http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import threading
+import time
+
+import pytest
+
+from app.ai_manager import AIModelManager
+from app.http_client import get_http_client
+from mock_llm_server import DEFAULT_REPLY, make_server
+
+
+def _serve(**kwargs):
+    server = make_server(port=0, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _manager(server) -> AIModelManager:
+    manager = AIModelManager()
+    manager.api_key = "test"
+    manager.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    return manager
+
+
+def _origin_stats(server):
+    return get_http_client().stats()["origins"].get(f"http://127.0.0.1:{server.server_address[1]}", {})
+
+
+@pytest.fixture
+def server():
+    server = _serve(ttft_ms=50, token_delay_ms=20)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_stream_yields_chunks_incrementally(server):
+    manager = _manager(server)
+    started = time.perf_counter()
+    arrivals = []
+    events = []
+    for event in manager.stream("hello"):
+        arrivals.append(time.perf_counter() - started)
+        events.append(event)
+
+    deltas = [e["content"] for e in events if e["type"] == "delta"]
+    done = events[-1]
+    assert len(deltas) == len(DEFAULT_REPLY.split(" "))
+    assert "".join(deltas) == DEFAULT_REPLY
+    assert done["type"] == "done" and done["content"] == DEFAULT_REPLY
+    assert done["truncated"] is False
+    # Tokens are paced by the server, so the first one must arrive well before the last.
+    assert arrivals[-2] - arrivals[0] >= 0.02 * (len(deltas) - 1) * 0.5
+    assert done["ttft_ms"] < done["response_ms"]
+
+
+def test_streams_reuse_pooled_connection(server):
+    manager = _manager(server)
+    for _ in range(3):
+        assert list(manager.stream("hello"))[-1]["truncated"] is False
+    stats = _origin_stats(server)
+    assert stats["connects"] == 1
+    assert stats["reused"] >= 2
+
+
+def test_stream_without_done_is_marked_truncated():
+    server = _serve(ttft_ms=10, token_delay_ms=5, truncate_after=3)
+    try:
+        manager = _manager(server)
+        events = list(manager.stream("hello"))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    deltas = [e["content"] for e in events if e["type"] == "delta"]
+    done = events[-1]
+    assert len(deltas) == 3
+    assert done["type"] == "done" and done["truncated"] is True
+    assert done["content"] == "".join(deltas)
+    assert manager.stats()["truncated"] == 1
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import pytest
+
+from app.cache import TieredCache
+
+
+class FakeRedis:
+    def __init__(self) -> None:
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, px=None):
+        self.data[key] = value
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis) -> None:
+        self.redis = redis
+        self.keys = []
+
+    def incr(self, key):
+        self.keys.append(key)
+
+    def execute(self):
+        out = []
+        for key in self.keys:
+            self.redis.data[key] = int(self.redis.data.get(key) or 0) + 1
+            out.append(self.redis.data[key])
+        return out
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    return TieredCache()
+
+
+def test_l1_hits_share_one_read_only_decoded_value(cache):
+    loaded = cache.get_or_load("ns", "k", lambda: [{"id": 1, "at": datetime(2026, 1, 1)}], 60)
+    assert loaded[0]["at"] == datetime(2026, 1, 1)
+
+    found, first = cache.get("ns", "k")
+    found_again, second = cache.get("ns", "k")
+    assert found and found_again and first is second
+    assert first == [{"id": 1, "at": "2026-01-01T00:00:00"}]
+    with pytest.raises(TypeError):
+        first[0]["id"] = 2
+    with pytest.raises(TypeError):
+        first.append({})
+    copy = dict(first[0])
+    copy["id"] = 2
+    assert first[0]["id"] == 1
+
+
+def test_tag_invalidation_on_another_worker_reaches_l1_within_the_check_interval(monkeypatch):
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    redis = FakeRedis()
+    reader, writer = TieredCache(), TieredCache()
+    for worker in (reader, writer):
+        worker._redis = redis
+    reader.tag_check_seconds = 0.0
+
+    reader.set("ns", "k", {"v": 1}, 60, tags=("catalogue",))
+    assert reader.get("ns", "k") == (True, {"v": 1})
+    writer.invalidate_tags("catalogue")
+    assert reader.get("ns", "k") == (False, None)
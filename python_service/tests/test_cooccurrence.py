@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from app.cache import get_cache
+from app.cooccurrence import CooccurrenceModel
+
+
+class FakeRedis:
+    def __init__(self) -> None:
+        self.data = {}
+        self.mgets = 0
+        self.down = False
+
+    def _check(self) -> None:
+        if self.down:
+            raise ConnectionError("redis down")
+
+    def set(self, key, value, px=None):
+        self._check()
+        self.data[key] = value
+
+    def get(self, key):
+        self._check()
+        return self.data.get(key)
+
+    def mget(self, keys):
+        self._check()
+        self.mgets += 1
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis) -> None:
+        self.redis = redis
+        self.ops = []
+
+    def set(self, key, value, px=None):
+        self.ops.append((key, value))
+
+    def execute(self):
+        self.redis._check()
+        for key, value in self.ops:
+            self.redis.data[key] = value
+        return [True] * len(self.ops)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(get_cache(), "_redis", fake)
+    monkeypatch.setattr(get_cache(), "blob_chunk_bytes", 64)
+    return fake
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE behavioral_events "
+                "(id INTEGER PRIMARY KEY, user_id INT, product_id INT, event_type TEXT, occurred_at TIMESTAMP)"
+            )
+        )
+        for event_id, (user_id, product_id) in enumerate([(1, 10), (1, 11), (2, 10), (2, 11), (2, 12)], start=1):
+            conn.execute(
+                text("INSERT INTO behavioral_events VALUES (:id, :user_id, :product_id, 'view', :occurred_at)"),
+                {"id": event_id, "user_id": user_id, "product_id": product_id, "occurred_at": now - timedelta(hours=1)},
+            )
+    return engine
+
+
+def test_followers_fetch_the_snapshot_only_when_its_version_changes(redis, engine):
+    leader, follower = CooccurrenceModel(), CooccurrenceModel()
+    with engine.connect() as conn:
+        leader.rebuild(conn)
+        assert leader.publish()["shared"] is True
+        assert follower.sync(conn)["adopted"] is True
+        assert redis.mgets == 1
+        assert follower.sync(conn)["adopted"] is False
+    assert redis.mgets == 1
+    assert follower.neighbors(10, 5) == leader.neighbors(10, 5)
+
+
+def test_redis_errors_keep_the_current_model_instead_of_rebuilding(redis, engine, monkeypatch):
+    leader, follower = CooccurrenceModel(), CooccurrenceModel()
+    with engine.connect() as conn:
+        leader.rebuild(conn)
+        leader.publish()
+        follower.sync(conn)
+        redis.down = True
+        monkeypatch.setattr(follower, "_built_monotonic", 0.0)
+        monkeypatch.setattr(follower, "rebuild", lambda conn: pytest.fail("rebuilt on a transport error"))
+        result = follower.sync(conn)
+    assert "error" in result
+    assert follower.stats()["sync_errors"] == 1
+    assert follower.ready
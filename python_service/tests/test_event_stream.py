@@ -0,0 +1,86 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from app.event_stream import BehaviorEventStream
+
+
+def _event(event_id, user_id=1, product_id=10):
+    return {"id": event_id, "user_id": user_id, "product_id": product_id, "event_type": "View", "occurred_at": datetime(2026, 1, 1)}
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE behavioral_events (id INTEGER PRIMARY KEY, user_id INT, product_id INT, "
+                "category_id INT, seller_id INT, event_type TEXT, occurred_at TIMESTAMP)"
+            )
+        )
+    return engine
+
+
+def _insert(engine, event_id, user_id=1):
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO behavioral_events (id, user_id, product_id, event_type, occurred_at) "
+                "VALUES (:id, :user_id, 10, 'view', '2026-01-01 00:00:00')"
+            ),
+            {"id": event_id, "user_id": user_id},
+        )
+
+
+def test_publish_dispatches_normalized_events_once():
+    stream = BehaviorEventStream()
+    received = []
+    stream.subscribe(received.append)
+    stream.subscribe(received.append)
+
+    stream.publish(_event(1))
+    stream.publish(_event(1))
+    stream.publish(_event(2, user_id=2))
+
+    assert [e["id"] for e in received] == [1, 2]
+    assert received[0]["event_type"] == "view"
+    assert stream.stats()["dispatched"] == 2
+    assert stream.user_head(1) == 1 and stream.user_head(2) == 2 and stream.user_head(3) is None
+
+
+def test_failing_listener_does_not_block_others():
+    stream = BehaviorEventStream()
+    received = []
+
+    def broken(event):
+        raise ValueError("boom")
+
+    stream.subscribe(broken)
+    stream.subscribe(received.append)
+    stream.publish(_event(1))
+    assert len(received) == 1
+
+
+def test_poll_starts_at_head_and_picks_up_late_commits(engine):
+    stream = BehaviorEventStream()
+    received = []
+    stream.subscribe(received.append)
+    _insert(engine, 1)
+    _insert(engine, 2)
+
+    with engine.connect() as conn:
+        assert stream.poll(conn) == 0
+    _insert(engine, 4)
+    with engine.connect() as conn:
+        assert stream.poll(conn) == 1
+    # id 3 commits after 4 was read; the reread window still delivers it, and 4 is not repeated.
+    _insert(engine, 3, user_id=7)
+    with engine.connect() as conn:
+        assert stream.poll(conn) == 1
+
+    assert [e["id"] for e in received] == [4, 3]
+    assert stream.stats()["watermark"] == 4
+    assert stream.user_head(7) == 3
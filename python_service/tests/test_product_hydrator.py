@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import StaticPool
+
+from app.product_hydrator import ProductHydrator
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _now(dbapi_connection, _record):
+        dbapi_connection.create_function("NOW", 0, lambda: datetime.utcnow().isoformat(" "))
+
+    created = datetime(2026, 1, 1)
+    with engine.begin() as conn:
+        for ddl in [
+            "CREATE TABLE users (id INTEGER PRIMARY KEY, dormitory_id INT, username TEXT, profile_picture TEXT)",
+            "CREATE TABLE dormitories (id INTEGER PRIMARY KEY, latitude REAL, longitude REAL)",
+            "CREATE TABLE categories (id INTEGER PRIMARY KEY, name TEXT)",
+            "CREATE TABLE condition_levels (id INTEGER PRIMARY KEY, name TEXT, level INT)",
+            "CREATE TABLE promoted_listings (id INTEGER PRIMARY KEY, product_id INT, promoted_until TIMESTAMP)",
+            "CREATE TABLE products (id INTEGER PRIMARY KEY, seller_id INT, dormitory_id INT, category_id INT, "
+            "condition_level_id INT, title TEXT, description TEXT, price REAL, currency TEXT, status TEXT, "
+            "created_at TIMESTAMP, updated_at TIMESTAMP, deleted_at TIMESTAMP)",
+            "CREATE TABLE product_images (id INTEGER PRIMARY KEY, product_id INT, image_url TEXT, "
+            "image_thumbnail_url TEXT, is_primary INT, updated_at TIMESTAMP)",
+            "CREATE TABLE tags (id INTEGER PRIMARY KEY, name TEXT, updated_at TIMESTAMP)",
+            "CREATE TABLE product_tags (id INTEGER PRIMARY KEY, product_id INT, tag_id INT, updated_at TIMESTAMP)",
+        ]:
+            conn.execute(text(ddl))
+        conn.execute(text("INSERT INTO users VALUES (1, NULL, 'seller', NULL)"))
+        conn.execute(text("INSERT INTO tags VALUES (1, 'lamp', :ts), (2, 'desk', :ts)"), {"ts": created})
+        for pid in (1, 2, 3):
+            conn.execute(
+                text(
+                    "INSERT INTO products VALUES (:id, 1, NULL, NULL, NULL, 't', 'd', 10, 'CNY', 'available', :ts, :ts, NULL)"
+                ),
+                {"id": pid, "ts": created},
+            )
+        conn.execute(
+            text("INSERT INTO product_images VALUES (1, 1, 'a.jpg', 'a_t.jpg', 0, :ts), (2, 1, 'b.jpg', 'b_t.jpg', 1, :ts)"),
+            {"ts": created},
+        )
+        conn.execute(text("INSERT INTO product_tags VALUES (1, 1, 2, :ts), (2, 1, 1, :ts)"), {"ts": created})
+        conn.execute(
+            text("INSERT INTO promoted_listings VALUES (1, 2, :until)"), {"until": datetime.utcnow() + timedelta(days=1)}
+        )
+    return engine
+
+
+def _count_statements(engine):
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+
+def test_cold_and_warm_pages_take_one_round_trip(engine):
+    hydrator = ProductHydrator()
+    statements = _count_statements(engine)
+    with engine.connect() as conn:
+        cards = hydrator.cards(conn, [2, 1, 3])
+        assert len(statements) == 1
+        assert list(cards) == [2, 1, 3]
+        assert [img["image_url"] for img in cards[1]["images"]] == ["b.jpg", "a.jpg"]
+        assert [tag["name"] for tag in cards[1]["tags"]] == ["lamp", "desk"]
+        assert cards[2]["is_promoted"] == 1 and cards[2]["images"] == []
+
+        assert hydrator.cards(conn, [2, 1, 3]) == cards
+        assert len(statements) == 2
+    assert hydrator.stats()["hits"] == 3
+
+
+def test_image_and_tag_edits_refresh_the_cached_card(engine):
+    hydrator = ProductHydrator()
+    with engine.connect() as conn:
+        hydrator.cards(conn, [1])
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM product_images WHERE id = 1"))
+    with engine.connect() as conn:
+        assert [img["image_url"] for img in hydrator.cards(conn, [1])[1]["images"]] == ["b.jpg"]
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE tags SET name = 'desk lamp', updated_at = :ts WHERE id = 1"), {"ts": datetime(2026, 2, 1)})
+    with engine.connect() as conn:
+        assert [tag["name"] for tag in hydrator.cards(conn, [1])[1]["tags"]] == ["desk lamp", "desk"]
+    assert hydrator.stats()["misses"] == 3
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.api.router import _rank_candidate_rows_reference
+from app.recommendation_scoring import columns_from_rows, rank_candidate_ids, score_candidates
+
+NOW = datetime(2026, 3, 1, 12, 0, 0)
+BUYER_DORM = 5
+BUYER_UNIVERSITY = 2
+BUYER_COORDS = (30.10, 120.10)
+
+
+def _row(pid, category_id, seller_id, dormitory_id, university_id, lat, lng, age_hours, promoted=0):
+    return {
+        "id": pid,
+        "category_id": category_id,
+        "seller_id": seller_id,
+        "seller__dormitory_id": dormitory_id,
+        "dormitory_id": dormitory_id,
+        "dormitory__university_id": university_id,
+        "dormitory__latitude": lat,
+        "dormitory__longitude": lng,
+        "created_at": NOW - timedelta(hours=age_hours) if age_hours is not None else None,
+        "is_promoted": promoted,
+    }
+
+
+ROWS = [
+    _row(1, 10, 100, 5, 2, 30.10, 120.10, 3),
+    _row(2, 11, 101, 6, 2, 30.12, 120.11, 30, promoted=1),
+    _row(3, 10, 102, 7, 3, 30.40, 120.50, 2),
+    _row(4, None, 100, None, None, None, None, 200),
+    _row(5, 12, None, 8, 2, 30.11, 120.09, None),
+    _row(6, 11, 103, 9, None, 31.00, 121.00, 700),
+    _row(7, 10, 104, 5, 2, None, None, 50, promoted=1),
+    _row(8, 13, 101, 10, 3, 30.20, 120.30, 12),
+]
+CATEGORY_SCORES = {10: 2.5, 11: 0.75, 13: 4.0}
+SELLER_SCORES = {100: 1.2, 101: 3.3}
+SEEN = {3, 6}
+
+
+@pytest.mark.parametrize("low_behavior", [False, True])
+def test_vectorised_ranking_matches_reference(low_behavior):
+    reference = _rank_candidate_rows_reference(
+        ROWS, CATEGORY_SCORES, SELLER_SCORES, SEEN, NOW, low_behavior, BUYER_DORM, BUYER_UNIVERSITY, BUYER_COORDS
+    )
+    ranked = rank_candidate_ids(
+        columns_from_rows(ROWS),
+        CATEGORY_SCORES,
+        SELLER_SCORES,
+        SEEN,
+        NOW,
+        low_behavior,
+        BUYER_DORM,
+        BUYER_UNIVERSITY,
+        BUYER_COORDS,
+    )
+    assert ranked == [r["id"] for r in reference]
+
+
+def test_vectorised_scores_match_reference():
+    reference = {
+        r["id"]: r
+        for r in _rank_candidate_rows_reference(
+            ROWS, CATEGORY_SCORES, SELLER_SCORES, SEEN, NOW, False, BUYER_DORM, BUYER_UNIVERSITY, BUYER_COORDS
+        )
+    }
+    columns = columns_from_rows(ROWS)
+    scores, distance = score_candidates(
+        columns, CATEGORY_SCORES, SELLER_SCORES, SEEN, NOW, BUYER_DORM, BUYER_UNIVERSITY, BUYER_COORDS
+    )
+    for pid, score, km in zip(columns["ids"].tolist(), scores.tolist(), distance.tolist()):
+        assert score == pytest.approx(reference[pid]["_score"], rel=1e-9)
+        expected_km = reference[pid]["_distance_km"]
+        if expected_km is None:
+            assert np.isnan(km)
+        else:
+            assert km == pytest.approx(expected_km, rel=1e-9)
+
+
+def test_max_distance_drops_far_and_unlocated_rows():
+    ranked = rank_candidate_ids(
+        columns_from_rows(ROWS),
+        CATEGORY_SCORES,
+        SELLER_SCORES,
+        SEEN,
+        NOW,
+        False,
+        BUYER_DORM,
+        BUYER_UNIVERSITY,
+        BUYER_COORDS,
+        max_distance_km=5.0,
+    )
+    assert sorted(ranked) == [1, 2, 5]
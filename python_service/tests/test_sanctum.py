@@ -0,0 +1,98 @@
+import hashlib
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import StaticPool
+
+from app.sanctum import SanctumTokenValidator, TokenRejected
+
+
+def _hash(secret):
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE users (id INTEGER PRIMARY KEY, full_name TEXT, username TEXT, email TEXT, "
+                "profile_picture TEXT, dormitory_id INT, role TEXT)"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TABLE personal_access_tokens (id INTEGER PRIMARY KEY, tokenable_type TEXT, tokenable_id INT, "
+                "token TEXT, abilities TEXT, expires_at TIMESTAMP, created_at TIMESTAMP)"
+            )
+        )
+        conn.execute(text("INSERT INTO users VALUES (1, 'Ada', 'ada', 'ada@example.com', NULL, 5, 'user')"))
+        conn.execute(text("INSERT INTO users VALUES (2, 'Root', 'root', 'root@example.com', NULL, NULL, 'admin')"))
+        tokens = [
+            (1, 1, "valid-secret", '["*"]', None),
+            (2, 1, "expired-secret", '["*"]', now - timedelta(minutes=1)),
+            (3, 2, "admin-secret", '["*"]', None),
+            (4, 1, "narrow-secret", '["read"]', None),
+        ]
+        for token_id, user_id, secret, abilities, expires_at in tokens:
+            conn.execute(
+                text("INSERT INTO personal_access_tokens VALUES (:id, :type, :user_id, :token, :abilities, :expires_at, :created_at)"),
+                {
+                    "id": token_id,
+                    "type": "App\\Models\\User",
+                    "user_id": user_id,
+                    "token": _hash(secret),
+                    "abilities": abilities,
+                    "expires_at": expires_at,
+                    "created_at": now,
+                },
+            )
+    return engine
+
+
+@pytest.fixture
+def validator(monkeypatch):
+    monkeypatch.setenv("PY_AUTH_MODE", "local")
+    monkeypatch.setenv("PY_AUTH_REQUIRED_ABILITIES", "write")
+    return SanctumTokenValidator()
+
+
+def _laravel_lookup(authorization):
+    raise AssertionError("unexpected Laravel lookup")
+
+
+def test_valid_token_returns_user(validator, engine):
+    user = validator.authenticate("Bearer 1|valid-secret", lambda: engine, _laravel_lookup)
+    assert user["id"] == 1 and user["username"] == "ada" and user["dormitory_id"] == 5
+    assert validator.authenticate("Bearer valid-secret", lambda: engine, _laravel_lookup)["id"] == 1
+
+
+@pytest.mark.parametrize(
+    "authorization, status_code",
+    [
+        ("Bearer 1|wrong-secret", 401),
+        ("Bearer 99|valid-secret", 401),
+        ("Bearer x|valid-secret", 401),
+        ("Bearer 2|expired-secret", 401),
+        ("Bearer 3|admin-secret", 403),
+        ("Bearer 4|narrow-secret", 403),
+    ],
+)
+def test_rejected_tokens(validator, engine, authorization, status_code):
+    with pytest.raises(TokenRejected) as excinfo:
+        validator.authenticate(authorization, lambda: engine, _laravel_lookup)
+    assert excinfo.value.status_code == status_code
+    assert validator.stats()["rejected"] == 1
+
+
+def test_database_errors_fall_back_to_laravel(validator):
+    def broken_engine():
+        raise OperationalError("SELECT 1", {}, Exception("down"))
+
+    user = validator.authenticate("Bearer 1|fallback-secret", broken_engine, lambda authorization: {"id": 42})
+    assert user == {"id": 42}
+    assert validator.stats()["fallbacks"] == 1
@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from app.job_scheduler import get_job_scheduler
+from app.seen_filters import SeenItemFilters
+
+
+class FakePipeline:
+    def __init__(self, writes) -> None:
+        self.writes = writes
+        self.ops = []
+
+    def setbit(self, key, offset, value):
+        self.ops.append(("setbit", key, offset))
+
+    def expire(self, key, ttl):
+        self.ops.append(("expire", key, ttl))
+
+    def zadd(self, key, mapping):
+        self.ops.append(("zadd", key, mapping))
+
+    def zremrangebyrank(self, key, start, end):
+        self.ops.append(("zremrangebyrank", key, start, end))
+
+    def execute(self):
+        self.writes.extend(self.ops)
+        return [0] * len(self.ops)
+
+
+class FakeRedis:
+    def __init__(self) -> None:
+        self.writes = []
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self.writes)
+
+
+@pytest.fixture
+def filters(monkeypatch):
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    return SeenItemFilters()
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(
+            text("CREATE TABLE behavioral_events (id INTEGER PRIMARY KEY, user_id INT, product_id INT, occurred_at TIMESTAMP)")
+        )
+        for event_id, product_id, age in [(1, 101, timedelta(hours=1)), (2, 102, timedelta(days=12)), (3, 103, timedelta(days=90))]:
+            conn.execute(
+                text("INSERT INTO behavioral_events VALUES (:id, 1, :product_id, :occurred_at)"),
+                {"id": event_id, "product_id": product_id, "occurred_at": now - age},
+            )
+    return engine
+
+
+def test_backfilled_items_are_seen_and_older_ones_weigh_less(filters, engine):
+    with engine.connect() as conn:
+        seen = filters.view(conn, 1)
+    assert seen
+    assert seen.weight(101) == 1.0
+    assert 0.0 < seen.weight(102) < 1.0
+    assert 103 not in seen
+    assert 999 not in seen
+    ids = np.array([101, 102, 103, 999], dtype=np.int64)
+    assert seen.weights(ids).tolist() == [seen.weight(pid) for pid in ids.tolist()]
+
+
+def test_streamed_events_reach_cached_filters(filters, engine):
+    with engine.connect() as conn:
+        assert 555 not in filters.view(conn, 1)
+        filters.observe_event({"user_id": 1, "product_id": 555, "occurred_at": datetime.utcnow()})
+        assert 555 in filters.view(conn, 1)
+    assert filters.stats()["ingested"] == 1
+
+
+def test_events_for_uncached_users_are_ignored(filters):
+    filters.observe_event({"user_id": 2, "product_id": 555, "occurred_at": datetime.utcnow()})
+    assert filters.stats()["ingested"] == 0
+
+
+def test_bloom_false_positives_suppress_but_never_boost(monkeypatch, engine):
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    monkeypatch.setenv("SEEN_FILTER_BITS", "1024")
+    filters = SeenItemFilters()
+    now = datetime.utcnow()
+    with engine.connect() as conn:
+        filters.view(conn, 1)
+        for product_id in range(1000, 3000):
+            filters.observe_event({"user_id": 1, "product_id": product_id, "occurred_at": now})
+        seen = filters.view(conn, 1)
+    assert 999999 in seen
+    assert seen.weight(999999) == 0.0
+    assert seen.weight(2999) == 1.0
+    assert seen.weight(1000) == 0.0
+    assert seen.weights(np.array([999999, 2999], dtype=np.int64)).tolist() == [0.0, 1.0]
+
+
+@pytest.mark.parametrize("leader", [False, True])
+def test_only_the_leader_writes_streamed_events_to_redis(filters, monkeypatch, leader):
+    redis = FakeRedis()
+    monkeypatch.setattr(filters, "_redis", redis)
+    monkeypatch.setattr(get_job_scheduler(), "_is_leader", leader)
+    filters.observe_event({"user_id": 1, "product_id": 555, "occurred_at": datetime.utcnow()})
+    assert bool(redis.writes) is leader
+    assert filters.stats()["ingested"] == (1 if leader else 0)
@@ -0,0 +1,85 @@
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from app.user_profiles import PERSONALIZED_EVENT_WEIGHTS, UserProfileStore
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    monkeypatch.setenv("USER_PROFILE_MAX_EVENTS", "10")
+    return UserProfileStore()
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    now = datetime.utcnow()
+    types = ["view", "click", "like", "add_to_cart", "search"]
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE behavioral_events (id INTEGER PRIMARY KEY, user_id INT, event_type TEXT, "
+                "product_id INT, category_id INT, seller_id INT, occurred_at TIMESTAMP)"
+            )
+        )
+        for event_id in range(1, 41):
+            conn.execute(
+                text("INSERT INTO behavioral_events VALUES (:id, 1, :type, :id, :category_id, 7, :occurred_at)"),
+                {
+                    "id": event_id,
+                    "type": types[event_id % len(types)],
+                    "category_id": 1 + event_id % 3,
+                    "occurred_at": now - timedelta(days=40 - event_id),
+                },
+            )
+    return engine
+
+
+def _window_weights(engine, days=30):
+    since = datetime.utcnow() - timedelta(days=days)
+    weights = {}
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("SELECT category_id, event_type FROM behavioral_events WHERE user_id = 1 AND occurred_at >= :since"),
+            {"since": since},
+        ).all()
+    for category_id, event_type in rows:
+        weights[category_id] = weights.get(category_id, 0.0) + PERSONALIZED_EVENT_WEIGHTS.get(event_type, 0.5)
+    return weights
+
+
+def test_category_weights_cover_the_whole_window_beyond_the_ring(store, engine):
+    with engine.connect() as conn:
+        weights = store.category_weights(conn, 1)
+        assert len(store.get(conn, 1).events) == 10
+    assert weights == pytest.approx(_window_weights(engine))
+
+
+def test_streamed_events_move_into_overflow_and_survive_a_redis_reload(store, engine):
+    with engine.connect() as conn:
+        profile = store.get(conn, 1)
+    with profile.lock:
+        for event_id in range(41, 61):
+            profile.add((event_id, event_id, 2, 7, "like", time.time()))
+        payload = json.loads(json.dumps(profile.to_payload()))
+        expected = dict(profile.category_counts)
+    assert expected[2] == pytest.approx(_window_weights(engine)[2] + 20 * PERSONALIZED_EVENT_WEIGHTS["like"])
+
+    class FakeRedis:
+        def get(self, key):
+            return json.dumps(payload)
+
+    store._redis = FakeRedis()
+    reloaded = store._load_from_redis(1)
+    assert reloaded.category_counts == pytest.approx(expected)
+
+    reloaded.expire(time.time() + 12.5 * 86400)
+    expected = _window_weights(engine, days=17.5)
+    expected[2] += 20 * PERSONALIZED_EVENT_WEIGHTS["like"]
+    assert reloaded.category_counts == pytest.approx(expected)
@@ -0,0 +1,181 @@
+import argparse
+import http.client
+import json
+import math
+import os
+import sys
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any
+
+# Run the service twice (DB_ASYNC_ENABLED=0 and DB_ASYNC_ENABLED=1) on different ports and pass both as targets,
+# e.g. --target sync=http://127.0.0.1:8001 --target async=http://127.0.0.1:8002
+# With DB_ASYNC_ENABLED=1 every route in DEFAULT_PATHS awaits its queries on the async engine and only the ranking
+# and Redis calls use the thread pool, so the gap shows up at high concurrency against a networked MySQL; an
+# in-process SQLite file is CPU-bound and gives no useful comparison.
+DEFAULT_PATHS = [
+    "/py/api/user/recommendations/products?page_size=10",
+    "/py/api/user/recommendations/exchange-products?page_size=10",
+    "/py/api/user/products/1/similar?page_size=10",
+    "/api/recommendations/1?limit=30",
+    "/api/trending-products?limit=20",
+]
+
+
+def ensure_dir(path: str) -> None:
+    os.makedirs(path, exist_ok=True)
+
+
+def write_json(path: str, payload: Any) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+
+
+def resolve_token_value(raw: str) -> str:
+    value = (raw or "").strip()
+    if value.startswith("@file:"):
+        file_path = value[len("@file:"):].strip()
+        if file_path and os.path.exists(file_path):
+            with open(file_path, "r", encoding="utf-8") as f:
+                return f.read().strip()
+        return ""
+    return value
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    idx = (len(values) - 1) * p
+    lo = math.floor(idx)
+    hi = math.ceil(idx)
+    if lo == hi:
+        return values[lo]
+    return values[lo] + (values[hi] - values[lo]) * (idx - lo)
+
+
+def parse_targets(raw_targets: list[str]) -> list[tuple[str, str]]:
+    targets = []
+    for raw in raw_targets:
+        name, sep, url = raw.partition("=")
+        if not sep:
+            name, url = raw, raw
+        targets.append((name.strip(), url.strip().rstrip("/")))
+    return targets
+
+
+def worker(base_url: str, paths: list[str], headers: dict[str, str], deadline: float, timeout: float, offset: int) -> dict[str, Any]:
+    parsed = urllib.parse.urlsplit(base_url)
+    conn_cls = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+    conn = None
+    latencies: list[float] = []
+    errors: dict[str, int] = {}
+    ok = 0
+    i = offset
+    while time.perf_counter() < deadline:
+        path = parsed.path.rstrip("/") + paths[i % len(paths)]
+        i += 1
+        if conn is None:
+            conn = conn_cls(parsed.netloc, timeout=timeout)
+        started = time.perf_counter()
+        try:
+            conn.request("GET", path, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+        except Exception as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            conn.close()
+            conn = None
+            time.sleep(0.05)
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+        if 200 <= resp.status < 400:
+            ok += 1
+        else:
+            errors[f"HTTP:{resp.status}"] = errors.get(f"HTTP:{resp.status}", 0) + 1
+    if conn is not None:
+        conn.close()
+    return {"latencies": latencies, "ok": ok, "errors": errors}
+
+
+def run_level(base_url: str, paths: list[str], headers: dict[str, str], concurrency: int, duration: float, timeout: float) -> dict[str, Any]:
+    started = time.perf_counter()
+    deadline = started + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(worker, base_url, paths, headers, deadline, timeout, n) for n in range(concurrency)]
+        results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - started
+    latencies = sorted(x for r in results for x in r["latencies"])
+    errors: dict[str, int] = {}
+    for r in results:
+        for k, v in r["errors"].items():
+            errors[k] = errors.get(k, 0) + v
+    ok = sum(r["ok"] for r in results)
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "ok_requests": ok,
+        "throughput_rps": round(ok / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "error_histogram": errors,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", action="append", default=[], help="name=base_url, repeatable")
+    parser.add_argument("--path", action="append", default=[], help="request path, repeatable")
+    parser.add_argument("--concurrency", default="8,32,128,256")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--token", default="@file:user_token.txt")
+    parser.add_argument("--output-dir", default="reports")
+    args = parser.parse_args()
+
+    targets = parse_targets(args.target or ["sync=http://127.0.0.1:8001"])
+    paths = args.path or DEFAULT_PATHS
+    levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+    headers = {"Accept": "application/json", "Connection": "keep-alive"}
+    token = resolve_token_value(args.token)
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+
+    results = []
+    for name, base_url in targets:
+        if args.warmup > 0:
+            run_level(base_url, paths, headers, min(levels), args.warmup, args.timeout)
+        for concurrency in levels:
+            level = run_level(base_url, paths, headers, concurrency, args.duration, args.timeout)
+            level["target"] = name
+            level["base_url"] = base_url
+            results.append(level)
+            print(
+                f"{name:<8} c={concurrency:>4} rps={level['throughput_rps']:>9} p50={level['p50_ms']}ms "
+                f"p95={level['p95_ms']}ms p99={level['p99_ms']}ms errors={sum(level['error_histogram'].values())}"
+            )
+
+    output_dir = os.path.abspath(args.output_dir)
+    ensure_dir(output_dir)
+    now_tag = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+    json_path = os.path.join(output_dir, f"concurrency_benchmark_{now_tag}.json")
+    write_json(
+        json_path,
+        {
+            "generated_at": datetime.now().isoformat(),
+            "duration_seconds": args.duration,
+            "paths": paths,
+            "results": results,
+        },
+    )
+    print(f"JSON report: {json_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
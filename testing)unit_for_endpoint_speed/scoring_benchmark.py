@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any
+
+SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "python_service"))
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+from app.api.router import _rank_candidate_rows_reference  # noqa: E402
+from app.recommendation_scoring import columns_from_rows, rank_candidates, score_candidates  # noqa: E402
+
+
+def ensure_dir(path: str) -> None:
+    os.makedirs(path, exist_ok=True)
+
+
+def write_json(path: str, payload: Any) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+
+
+def build_candidates(count: int, rng: random.Random, now: datetime) -> list[dict[str, Any]]:
+    rows = []
+    for i in range(count):
+        has_coords = rng.random() < 0.9
+        rows.append({
+            "id": i + 1,
+            "seller_id": rng.randint(1, max(10, count // 20)),
+            "dormitory_id": rng.choice([None] + list(range(1, 41))),
+            "category_id": rng.choice([None] + list(range(1, 31))),
+            "created_at": now - timedelta(seconds=rng.randint(0, 180 * 86400)),
+            "dormitory__latitude": 31.0 + rng.random() * 0.2 if has_coords else None,
+            "dormitory__longitude": 121.3 + rng.random() * 0.2 if has_coords else None,
+            "dormitory__university_id": rng.choice([None, 1, 2, 3, 4]),
+            "is_promoted": 1 if rng.random() < 0.05 else 0,
+        })
+    return rows
+
+
+def build_profile(rng: random.Random, count: int) -> dict[str, Any]:
+    return {
+        "category_scores": {c: rng.random() * 10 for c in rng.sample(range(1, 31), 10)},
+        "seller_scores": {s: rng.random() * 10 for s in rng.sample(range(1, max(10, count // 20) + 1), 10)},
+        "seen_product_ids": set(rng.sample(range(1, count + 1), min(count, 300))),
+    }
+
+
+def time_call(fn, repeats: int) -> list[float]:
+    samples = []
+    for _ in range(repeats):
+        started = time.process_time()
+        fn()
+        samples.append((time.process_time() - started) * 1000)
+    return samples
+
+
+def run_case(count: int, low_behavior: bool, repeats: int, seed: int) -> dict[str, Any]:
+    rng = random.Random(seed + count)
+    now = datetime.utcnow()
+    rows = build_candidates(count, rng, now)
+    profile = build_profile(rng, count)
+    context = {
+        "now": now,
+        "low_behavior": low_behavior,
+        "buyer_dormitory_id": 7,
+        "buyer_university_id": 2,
+        "buyer_coords": (31.1, 121.4),
+    }
+
+    def reference():
+        return _rank_candidate_rows_reference(
+            rows,
+            profile["category_scores"],
+            profile["seller_scores"],
+            profile["seen_product_ids"],
+            context["now"],
+            context["low_behavior"],
+            context["buyer_dormitory_id"],
+            context["buyer_university_id"],
+            context["buyer_coords"],
+        )
+
+    columns = columns_from_rows(rows)
+
+    def vectorized():
+        scores, distance = score_candidates(
+            columns,
+            profile["category_scores"],
+            profile["seller_scores"],
+            profile["seen_product_ids"],
+            context["now"],
+            context["buyer_dormitory_id"],
+            context["buyer_university_id"],
+            context["buyer_coords"],
+        )
+        order = rank_candidates(
+            columns,
+            scores,
+            distance,
+            context["low_behavior"],
+            context["buyer_dormitory_id"],
+            context["buyer_university_id"],
+        )
+        return scores, order
+
+    reference_rows = reference()
+    scores, order = vectorized()
+    reference_scores = {int(r["id"]): float(r["_score"]) for r in reference_rows}
+    max_abs_diff = max(
+        (abs(reference_scores[int(pid)] - float(score)) for pid, score in zip(columns["ids"].tolist(), scores.tolist())),
+        default=0.0,
+    )
+    same_order = [int(r["id"]) for r in reference_rows] == columns["ids"][order].tolist()
+
+    reference_ms = time_call(reference, repeats)
+    vectorized_ms = time_call(vectorized, repeats)
+    conversion_ms = time_call(lambda: columns_from_rows(rows), repeats)
+    reference_median = statistics.median(reference_ms)
+    vectorized_median = statistics.median(vectorized_ms)
+    return {
+        "candidates": count,
+        "low_behavior": low_behavior,
+        "same_order": same_order,
+        "max_abs_score_diff": max_abs_diff,
+        "reference_cpu_ms_p50": round(reference_median, 3),
+        "vectorized_cpu_ms_p50": round(vectorized_median, 3),
+        "row_to_column_cpu_ms_p50": round(statistics.median(conversion_ms), 3),
+        "speedup": round(reference_median / vectorized_median, 2) if vectorized_median > 0 else None,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="600,10000,100000")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=20260101)
+    parser.add_argument("--output-dir", default="reports")
+    args = parser.parse_args()
+
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    results = []
+    for count in sizes:
+        for low_behavior in (False, True):
+            result = run_case(count, low_behavior, max(1, args.repeats), args.seed)
+            results.append(result)
+            print(
+                f"n={count:>7} low_behavior={str(low_behavior):<5} same_order={result['same_order']} "
+                f"max_diff={result['max_abs_score_diff']:.2e} reference={result['reference_cpu_ms_p50']}ms "
+                f"vectorized={result['vectorized_cpu_ms_p50']}ms speedup={result['speedup']}x"
+            )
+
+    output_dir = os.path.abspath(args.output_dir)
+    ensure_dir(output_dir)
+    now_tag = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+    json_path = os.path.join(output_dir, f"scoring_benchmark_{now_tag}.json")
+    write_json(json_path, {"generated_at": datetime.now().isoformat(), "repeats": args.repeats, "results": results})
+    print(f"JSON report: {json_path}")
+    return 0 if all(r["same_order"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())